@@ -8,7 +8,10 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, ROLES
 from database import db
-from models.user import User
+from models.user import User, TokenPrincipal
+from principal_cache import principal_cache
+from token_revocation import token_versions
+import password_hashing
 
 # Security
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
@@ -25,6 +28,16 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Vérifie un mot de passe dans le pool de hachage (ne bloque pas la boucle)"""
+    return await password_hashing.verify_password_async(pwd_context, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash un mot de passe dans le pool de hachage (ne bloque pas la boucle)"""
+    return await password_hashing.hash_password_async(pwd_context, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Crée un token JWT"""
     to_encode = data.copy()
@@ -37,8 +50,18 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    """Récupère l'utilisateur courant depuis le token JWT"""
+def build_token_claims(user: dict) -> dict:
+    """Claims signés du token : rôle, centre actif et version de permissions"""
+    return {
+        "sub": user["id"],
+        "role": user.get("role"),
+        "centre_id": user.get("centre_actif_id") or user.get("centre_id"),
+        "ver": user.get("token_version", 0)
+    }
+
+
+async def get_token_principal(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenPrincipal:
+    """Décode le token JWT et vérifie sa version (table de révocation en cache)"""
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
@@ -49,12 +72,30 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Token invalide")
 
-    user = await db.users.find_one({"id": user_id})
+    token_version = payload.get("ver")
+    if token_version is not None and not await token_versions.is_current(db, user_id, token_version):
+        raise HTTPException(status_code=401, detail="Token révoqué")
+    return TokenPrincipal(
+        id=user_id,
+        role=payload.get("role"),
+        centre_actif_id=payload.get("centre_id"),
+        token_version=token_version
+    )
+
+
+async def get_current_user(token: TokenPrincipal = Depends(get_token_principal)) -> User:
+    """Récupère l'utilisateur courant depuis le token JWT"""
+    user_id = token.id
+    cached_user = principal_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="Utilisateur non trouvé")
-    if '_id' in user:
-        del user['_id']
-    return User(**user)
+    principal = User(**user)
+    principal_cache.set(user_id, principal)
+    return principal
 
 
 def require_role(allowed_roles: List[str]):
@@ -69,6 +110,28 @@ def require_role(allowed_roles: List[str]):
     return role_checker
 
 
+def require_role_claims(allowed_roles: List[str]):
+    """Vérifie le rôle à partir des claims signés du token, sans accès à la base"""
+    async def claims_checker(token: TokenPrincipal = Depends(get_token_principal)):
+        if token.role is None:
+            # Ancien token sans claims : on se rabat sur l'utilisateur complet
+            current_user = await get_current_user(token)
+            token = token.model_copy(update={"role": current_user.role, "centre_actif_id": current_user.centre_actif_id})
+        if token.role not in allowed_roles:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Accès refusé. Rôle requis: {allowed_roles}"
+            )
+        return token
+    return claims_checker
+
+
+async def revoke_user_tokens(user_id: str) -> None:
+    """Révoque les tokens existants d'un utilisateur (rôle, statut ou mot de passe modifiés)"""
+    await token_versions.bump(db, user_id)
+    principal_cache.invalidate(user_id)
+
+
 def require_super_admin():
     """Vérifie que l'utilisateur est Super-Admin ou Directeur"""
     async def super_admin_checker(current_user: User = Depends(get_current_user)):
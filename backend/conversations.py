@@ -0,0 +1,195 @@
+"""
+Liste matérialisée des conversations du chat (collection conversations).
+
+Un document par conversation privée (paire d'utilisateurs) ou par groupe, mis à
+jour à chaque message par un seul update_one (upsert) :
+- last_message : aperçu, expéditeur et date du dernier message
+- unread.<user_id> : messages non lus de chaque participant, incrémentés par $inc
+  (aucune lecture préalable, sans course entre deux envois simultanés)
+
+GET /api/conversations = une requête sur l'index (participants, updated_at) ;
+POST /api/conversations/{id}/read remet le compteur du lecteur à zéro atomiquement.
+Les messages GENERAL (fil commun à tous) n'ont pas de conversation.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+PREVIEW_LENGTH = 100
+MIGRATION_ID = "conversations_v1"
+
+
+def conversation_id(message: Dict[str, Any]) -> Optional[str]:
+    """Identifiant stable d'une conversation : paire triée (PRIVE) ou groupe"""
+    if message.get("type_message") == "PRIVE" and message.get("destinataire_id"):
+        a, b = sorted((message["expediteur_id"], message["destinataire_id"]))
+        return f"prive:{a}:{b}"
+    if message.get("type_message") == "GROUPE" and message.get("groupe_id"):
+        return f"groupe:{message['groupe_id']}"
+    return None
+
+
+CONVERSATION_INDEXES = [
+    {"keys": [("id", 1)], "name": "conversations_id", "unique": True},
+    {"keys": [("participants", 1), ("updated_at", -1)], "name": "conversations_participants_updated_at"},
+]
+
+
+async def ensure_conversation_indexes(database) -> None:
+    for spec in CONVERSATION_INDEXES:
+        await database.conversations.create_index(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"})
+
+
+def _last_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    contenu = message.get("contenu", "")
+    return {
+        "id": message["id"],
+        "expediteur_id": message["expediteur_id"],
+        "preview": contenu[:PREVIEW_LENGTH] + "..." if len(contenu) > PREVIEW_LENGTH else contenu,
+        "date_envoi": message["date_envoi"]
+    }
+
+
+async def record_message(database, message: Dict[str, Any], participants: Optional[Iterable[str]] = None,
+                         groupe_nom: Optional[str] = None) -> Optional[str]:
+    """
+    Met à jour la conversation d'un message (un update_one, upsert).
+    participants : membres du groupe (GROUPE) ; la paire est déduite du message (PRIVE).
+    Retourne l'identifiant de la conversation, None pour un message GENERAL.
+    """
+    cid = conversation_id(message)
+    if cid is None:
+        return None
+    if message["type_message"] == "PRIVE":
+        participants = sorted({message["expediteur_id"], message["destinataire_id"]})
+    else:
+        participants = list(dict.fromkeys(participants or []))
+
+    update: Dict[str, Any] = {"$set": {
+        "type": message["type_message"],
+        "participants": participants,
+        "last_message": _last_message(message),
+        "updated_at": message["date_envoi"]
+    }}
+    if message["type_message"] == "GROUPE":
+        update["$set"]["groupe_id"] = message["groupe_id"]
+        if groupe_nom:
+            update["$set"]["groupe_nom"] = groupe_nom
+    non_lus = {f"unread.{uid}": 1 for uid in participants if uid != message["expediteur_id"]}
+    if non_lus:
+        update["$inc"] = non_lus
+    await database.conversations.update_one({"id": cid}, update, upsert=True)
+    return cid
+
+
+async def set_group_participants(database, groupe_id: str, membres: List[str]) -> None:
+    """Membres d'un groupe modifiés : la conversation suit (anciens membres retirés de la liste)"""
+    await database.conversations.update_one(
+        {"id": f"groupe:{groupe_id}"}, {"$set": {"participants": list(dict.fromkeys(membres))}}
+    )
+
+
+async def list_conversations(database, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Conversations d'un utilisateur, la plus récente d'abord, avec son propre compteur de non lus"""
+    conversations = await database.conversations.find(
+        {"participants": user_id},
+        {"_id": 0, "id": 1, "type": 1, "groupe_id": 1, "groupe_nom": 1, "participants": 1,
+         "last_message": 1, "updated_at": 1, f"unread.{user_id}": 1}
+    ).sort("updated_at", -1).limit(limit).to_list(limit)
+    for conversation in conversations:
+        conversation["unread"] = (conversation.get("unread") or {}).get(user_id, 0)
+    return conversations
+
+
+async def mark_read(database, cid: str, user_id: str) -> Optional[int]:
+    """
+    Remet à zéro le compteur de non lus de user_id (atomique).
+    Retourne le nombre de messages qui étaient non lus, None si la conversation
+    n'existe pas ou si l'utilisateur n'y participe pas.
+    """
+    avant = await database.conversations.find_one_and_update(
+        {"id": cid, "participants": user_id},
+        {"$set": {f"unread.{user_id}": 0}},
+        projection={"_id": 0, "type": 1, "participants": 1, f"unread.{user_id}": 1},
+        return_document=False  # ReturnDocument.BEFORE
+    )
+    if avant is None:
+        return None
+    non_lus = (avant.get("unread") or {}).get(user_id, 0)
+    if non_lus and avant.get("type") == "PRIVE":
+        # Champ lu des messages privés reçus (uniquement s'il y en avait de non lus)
+        autre = next((p for p in avant["participants"] if p != user_id), user_id)
+        await database.messages.update_many(
+            {"expediteur_id": autre, "destinataire_id": user_id, "lu": False},
+            {"$set": {"lu": True}}
+        )
+    return non_lus
+
+
+async def rebuild_conversations(database, force: bool = False) -> int:
+    """
+    Construit les conversations à partir des messages existants (PRIVE et GROUPE).
+    Exécutée une fois (marqueur dans la collection migrations) sauf si force=True.
+    Les non lus des conversations privées reprennent le champ lu des messages.
+    """
+    from pymongo import UpdateOne
+
+    if not force and await database.migrations.find_one({"id": MIGRATION_ID}):
+        return 0
+
+    derniers = await database.messages.aggregate([
+        {"$match": {"type_message": {"$in": ["PRIVE", "GROUPE"]}}},
+        {"$sort": {"date_envoi": 1, "id": 1}},
+        {"$group": {
+            "_id": {"$cond": [
+                {"$eq": ["$type_message", "GROUPE"]},
+                {"groupe": "$groupe_id"},
+                {"paire": {"$cond": [
+                    {"$lt": ["$expediteur_id", "$destinataire_id"]},
+                    ["$expediteur_id", "$destinataire_id"],
+                    ["$destinataire_id", "$expediteur_id"]
+                ]}}
+            ]},
+            "message": {"$last": "$$ROOT"}
+        }}
+    ]).to_list(None)
+    non_lus = await database.messages.aggregate([
+        {"$match": {"type_message": "PRIVE", "lu": False}},
+        {"$group": {"_id": {"e": "$expediteur_id", "d": "$destinataire_id"}, "n": {"$sum": 1}}}
+    ]).to_list(None)
+    non_lus_map = {(r["_id"]["e"], r["_id"]["d"]): r["n"] for r in non_lus}
+
+    groupe_ids = [d["message"]["groupe_id"] for d in derniers if d["message"]["type_message"] == "GROUPE"]
+    groupes = await database.groupes_chat.find(
+        {"id": {"$in": groupe_ids}}, {"_id": 0, "id": 1, "nom": 1, "membres": 1}
+    ).to_list(None) if groupe_ids else []
+    groupes_map = {g["id"]: g for g in groupes}
+
+    operations = []
+    for dernier in derniers:
+        message = dernier["message"]
+        cid = conversation_id(message)
+        if cid is None:
+            continue
+        doc = {"id": cid, "type": message["type_message"], "last_message": _last_message(message),
+               "updated_at": message["date_envoi"]}
+        if message["type_message"] == "PRIVE":
+            a, b = sorted((message["expediteur_id"], message["destinataire_id"]))
+            doc["participants"] = [a, b]
+            doc["unread"] = {a: non_lus_map.get((b, a), 0), b: non_lus_map.get((a, b), 0)}
+        else:
+            groupe = groupes_map.get(message["groupe_id"])
+            if groupe is None:
+                continue
+            doc.update({"participants": groupe.get("membres", []), "groupe_id": groupe["id"],
+                        "groupe_nom": groupe.get("nom"), "unread": {}})
+        operations.append(UpdateOne({"id": cid}, {"$setOnInsert": doc}, upsert=True))
+
+    if operations:
+        await database.conversations.bulk_write(operations, ordered=False)
+    await database.migrations.update_one(
+        {"id": MIGRATION_ID},
+        {"$set": {"id": MIGRATION_ID, "done_at": datetime.now(timezone.utc), "conversations": len(operations)}},
+        upsert=True
+    )
+    print(f"💬 [MIGRATION] {len(operations)} conversation(s) construite(s)")
+    return len(operations)
@@ -4,6 +4,7 @@ from fastapi import HTTPException
 from datetime import datetime, timezone
 
 from config import MONGO_URL, DB_NAME
+from mongo_monitoring import command_monitor, pool_monitor
 
 # État de connexion lazy
 _mongo_client = None
@@ -20,7 +21,8 @@ def get_mongo_client():
             MONGO_URL,
             serverSelectionTimeoutMS=5000,
             connectTimeoutMS=5000,
-            socketTimeoutMS=10000
+            socketTimeoutMS=10000,
+            event_listeners=[command_monitor, pool_monitor]
         )
     return _mongo_client
 
@@ -0,0 +1,266 @@
+"""
+Registre déclaratif des index MongoDB, réconcilié au démarrage.
+
+INDEXES déclare les index de chaque collection : {"keys": [(champ, sens)], "name", options}.
+Les modules qui possèdent une collection déclarent leurs index à côté de leur
+code (OUTBOX_INDEXES, MESSAGE_INDEXES...) ; ce registre les regroupe avec ceux
+des collections de server.py.
+
+reconcile_indexes() (lancé en arrière-plan par le lifespan) :
+- crée les index déclarés absents de la base
+- signale la dérive sans rien supprimer : index de même nom mais de définition
+  différente (clés, unique, TTL, filtre partiel), index présents en base mais non
+  déclarés, créations en échec (doublons existants, conflit de nom)
+
+HOT_QUERY_SHAPES liste les formes de requête des endpoints fréquents ;
+tests/test_index_registry.py vérifie avec explain() qu'aucune ne fait de COLLSCAN,
+ni de SORT en mémoire pour les pages de l'historique du chat ("paginated").
+Ajouter une requête fréquente = ajouter sa forme ici et l'index qui la sert.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from conversations import CONVERSATION_INDEXES
+from message_pagination import MESSAGE_INDEXES, encode_cursor, page_query
+from notification_outbox import OUTBOX_INDEXES
+from planning_changes import PLANNING_CHANGES_INDEXES
+from planning_conflicts import PLANNING_UNIQUE_INDEXES
+from push_devices import PUSH_DEVICES_INDEXES
+from resource_versions import RESOURCE_VERSIONS_INDEXES
+
+# Options comparées pour détecter la dérive, avec leur valeur par défaut (les autres, comme "v", sont ignorées)
+COMPARED_OPTIONS = {"unique": False, "sparse": False, "expireAfterSeconds": None, "partialFilterExpression": None}
+
+
+def index_name(keys) -> str:
+    """Nom généré par MongoDB (champ_sens_...) : celui des index déjà créés par scripts/create_indexes.py"""
+    return "_".join(f"{champ}_{sens}" for champ, sens in keys)
+
+
+def _index(keys, **options) -> Dict[str, Any]:
+    keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+    return {"keys": keys, "name": options.pop("name", None) or index_name(keys), **options}
+
+
+INDEXES: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        _index("id", unique=True),
+        _index("email", unique=True),
+        _index("actif"),
+        _index("role"),
+        _index([("role", 1), ("actif", 1)]),
+        # GET /users (non admin) : $or centre_id / centre_ids
+        _index([("centre_id", 1), ("actif", 1)]),
+        _index([("centre_ids", 1), ("actif", 1)]),
+    ],
+    "centres": [
+        _index("id", unique=True),
+    ],
+    "planning": [
+        _index("id", unique=True),
+        _index("date"),
+        _index("employe_id"),
+        _index([("date", 1), ("creneau", 1)]),
+        _index([("date", 1), ("creneau", 1), ("employe_id", 1)]),
+        _index([("centre_id", 1), ("date", 1)]),
+        *[
+            _index(spec["keys"], name=spec["name"], unique=True,
+                   partialFilterExpression=spec["partialFilterExpression"])
+            for spec in PLANNING_UNIQUE_INDEXES
+        ],
+    ],
+    "demandes_conges": [
+        _index("id", unique=True),
+        _index("utilisateur_id"),
+        _index("statut"),
+        _index([("utilisateur_id", 1), ("statut", 1)]),
+        _index([("centre_id", 1), ("statut", 1)]),
+    ],
+    "demandes_travail": [
+        _index("id", unique=True),
+        _index([("medecin_id", 1), ("date_demandee", 1), ("statut", 1)]),
+        # Capacité du cabinet : demandes approuvées d'une date
+        _index([("date_demandee", 1), ("statut", 1), ("creneau", 1)]),
+    ],
+    "actualites": [
+        _index("id", unique=True),
+        _index([("centre_id", 1), ("actif", 1), ("priorite", -1)]),
+    ],
+    "notes_planning": [
+        _index([("date", 1), ("centre_id", 1)]),
+    ],
+    "groupes_chat": [
+        _index("id", unique=True),
+        _index([("membres", 1), ("actif", 1), ("date_creation", -1)]),
+    ],
+    "quotas_employes": [
+        _index("semaine_debut"),
+        _index([("employe_id", 1), ("semaine_debut", 1)]),
+    ],
+    "assignations": [
+        _index("actif"),
+        _index("medecin_id"),
+        _index("assistant_id"),
+    ],
+    "reservations_salles": [
+        _index("date"),
+        _index("salle_id"),
+        _index([("date", 1), ("creneau", 1), ("salle_id", 1)]),
+    ],
+    "notifications": [
+        _index([("employe_id", 1), ("date", 1)]),
+    ],
+    "salles": [
+        _index("actif"),
+        _index("nom"),
+        _index([("centre_id", 1), ("actif", 1), ("nom", 1)]),
+    ],
+    "outbox": OUTBOX_INDEXES,
+    "push_devices": PUSH_DEVICES_INDEXES,
+    "messages": MESSAGE_INDEXES,
+    "conversations": CONVERSATION_INDEXES,
+    "planning_changes": PLANNING_CHANGES_INDEXES,
+    "resource_versions": RESOURCE_VERSIONS_INDEXES,
+}
+
+
+_CURSEUR = encode_cursor({"date_envoi": datetime(2026, 3, 2, 8, 0), "id": "m1"})
+
+
+def _message_page(endpoint: str, query: Dict[str, Any], **curseur) -> Dict[str, Any]:
+    """Page de l'historique du chat telle que la construit paginate_messages (before / after=True : avec curseur)"""
+    filtre, sort = page_query(query, **{sens: _CURSEUR for sens, actif in curseur.items() if actif})
+    return {"endpoint": endpoint, "collection": "messages", "filter": filtre, "sort": sort, "paginated": True}
+
+
+_MESSAGES_GENERAL = {"type_message": "GENERAL", "groupe_id": None}
+_MESSAGES_PRIVES = {"$or": [{"expediteur_id": "u1", "type_message": "PRIVE"},
+                            {"destinataire_id": "u1", "type_message": "PRIVE"}]}
+_MESSAGES_GROUPE = {"type_message": "GROUPE", "groupe_id": "g1"}
+_CONVERSATION = {"$or": [{"expediteur_id": "u1", "destinataire_id": "u2"},
+                         {"expediteur_id": "u2", "destinataire_id": "u1"}], "type_message": "PRIVE"}
+
+# Formes de requête des endpoints fréquents (valeurs quelconques : seule la forme compte)
+HOT_QUERY_SHAPES: List[Dict[str, Any]] = [
+    {"endpoint": "get_current_user / UserLoader", "collection": "users", "filter": {"id": {"$in": ["u1", "u2"]}}},
+    {"endpoint": "POST /auth/login", "collection": "users", "filter": {"email": "a@b.fr"}},
+    {"endpoint": "GET /users", "collection": "users", "filter": {
+        "actif": True,
+        "$or": [{"centre_id": {"$in": ["c1"]}}, {"centre_ids": {"$elemMatch": {"$in": ["c1"]}}}]
+    }},
+    {"endpoint": "GET /users/by-role/{role}", "collection": "users", "filter": {"role": "Médecin", "actif": True}},
+    {"endpoint": "POST /centres/{id}/switch", "collection": "centres", "filter": {"id": "c1", "actif": True}},
+    {"endpoint": "PUT /planning/{id}", "collection": "planning", "filter": {"id": "p1"}},
+    {"endpoint": "GET /planning/semaine/{date}", "collection": "planning", "filter": {"$and": [
+        {"date": {"$in": ["2026-03-02", "2026-03-03"]}},
+        {"$or": [{"centre_id": "c1"}, {"centre_id": None}, {"centre_id": {"$exists": False}}]}
+    ]}, "sort": [("date", 1)]},
+    {"endpoint": "GET /planning/{date} (centre)", "collection": "planning",
+     "filter": {"centre_id": "c1", "date": "2026-03-02"}},
+    {"endpoint": "congé médecin (créneaux assistants)", "collection": "planning", "filter": {
+        "date": {"$gte": "2026-03-02", "$lte": "2026-03-06"}, "creneau": {"$in": ["MATIN"]},
+        "employe_role": "Assistant", "$or": [{"medecin_attribue_id": "m1"}, {"medecin_ids": "m1"}]
+    }},
+    {"endpoint": "GET /conges", "collection": "demandes_conges", "filter": {"centre_id": "c1"}},
+    {"endpoint": "GET /conges (employé)", "collection": "demandes_conges", "filter": {"utilisateur_id": "u1"}},
+    {"endpoint": "POST /demandes-travail", "collection": "demandes_travail", "filter": {
+        "medecin_id": "m1", "date_demandee": "2026-03-02", "statut": {"$nin": ["REJETE", "ANNULE"]}
+    }},
+    {"endpoint": "PUT /demandes-travail/{id}/approuver (capacité)", "collection": "demandes_travail", "filter": {
+        "date_demandee": "2026-03-02", "creneau": {"$in": ["MATIN", "JOURNEE_COMPLETE"]}, "statut": "APPROUVE"
+    }},
+    {"endpoint": "GET /actualites", "collection": "actualites", "filter": {"actif": True, "centre_id": "c1"},
+     "sort": [("priorite", -1)]},
+    {"endpoint": "GET /planning/notes", "collection": "notes_planning", "filter": {"$and": [
+        {"date": {"$gte": "2026-03-02", "$lte": "2026-03-08"}},
+        {"$or": [{"centre_id": "c1"}, {"centre_id": None}, {"centre_id": {"$exists": False}}]}
+    ]}},
+    {"endpoint": "GET /groupes-chat", "collection": "groupes_chat", "filter": {"actif": True, "membres": "u1"},
+     "sort": [("date_creation", -1)]},
+    _message_page("GET /messages (général)", _MESSAGES_GENERAL),
+    _message_page("GET /messages (général, before)", _MESSAGES_GENERAL, before=True),
+    _message_page("GET /messages (général, after)", _MESSAGES_GENERAL, after=True),
+    _message_page("GET /messages (privé)", _MESSAGES_PRIVES),
+    _message_page("GET /messages (privé, before)", _MESSAGES_PRIVES, before=True),
+    _message_page("GET /messages (groupe, before)", _MESSAGES_GROUPE, before=True),
+    _message_page("GET /messages/conversation/{id}", _CONVERSATION),
+    _message_page("GET /messages/conversation/{id} (before)", _CONVERSATION, before=True),
+    {"endpoint": "GET /conversations", "collection": "conversations", "filter": {"participants": "u1"},
+     "sort": [("updated_at", -1)]},
+    {"endpoint": "GET /quotas/{semaine}", "collection": "quotas_employes", "filter": {"semaine_debut": "2026-03-02"}},
+    {"endpoint": "GET /salles", "collection": "salles", "filter": {"centre_id": "c1", "actif": True},
+     "sort": [("nom", 1)]},
+    {"endpoint": "GET /planning/changes", "collection": "planning_changes",
+     "filter": {"centre_id": "c1", "seq": {"$gt": 10}}, "sort": [("seq", 1)]},
+    {"endpoint": "worker de l'outbox (réservation)", "collection": "outbox", "filter": {"$or": [
+        {"statut": "EN_ATTENTE", "prochain_essai": {"$lte": "2026-03-02"}},
+        {"statut": "EN_COURS", "claimed_at": {"$lt": "2026-03-02"}}
+    ]}},
+]
+
+
+def _differences(spec: Dict[str, Any], actuel: Dict[str, Any]) -> List[str]:
+    differences = []
+    if [(champ, int(sens)) for champ, sens in actuel.get("key", [])] != list(spec["keys"]):
+        differences.append("keys")
+    for option, defaut in COMPARED_OPTIONS.items():
+        if actuel.get(option, defaut) != spec.get(option, defaut):
+            differences.append(option)
+    return differences
+
+
+# Dernier rapport de réconciliation (GET /api/status)
+last_report: Optional[Dict[str, Any]] = None
+
+
+async def reconcile_indexes(database, create: bool = True) -> Dict[str, Any]:
+    """
+    Compare les index déclarés aux index de la base, crée les manquants (create=True)
+    et retourne le rapport de dérive. Aucun index n'est supprimé.
+    """
+    global last_report
+    rapport: Dict[str, List[Dict[str, Any]]] = {
+        "crees": [], "manquants": [], "differents": [], "non_declares": [], "erreurs": []
+    }
+    for collection, specs in INDEXES.items():
+        try:
+            existants = await database[collection].index_information()
+        except Exception:
+            existants = {}  # collection absente : tous les index sont à créer
+        for spec in specs:
+            entree = {"collection": collection, "name": spec["name"]}
+            actuel = existants.get(spec["name"])
+            if actuel is not None:
+                differences = _differences(spec, actuel)
+                if differences:
+                    rapport["differents"].append({**entree, "differences": differences})
+                continue
+            if not create:
+                rapport["manquants"].append(entree)
+                continue
+            try:
+                options = {k: v for k, v in spec.items() if k != "keys"}
+                await database[collection].create_index(spec["keys"], **options)
+                rapport["crees"].append(entree)
+            except Exception as e:
+                # Doublons en base (index unique) ou mêmes clés sous un autre nom
+                rapport["erreurs"].append({**entree, "erreur": str(e)[:200]})
+        declares = {spec["name"] for spec in specs}
+        for nom in existants:
+            if nom != "_id_" and nom not in declares:
+                rapport["non_declares"].append({"collection": collection, "name": nom})
+
+    last_report = rapport
+    derive = len(rapport["differents"]) + len(rapport["non_declares"]) + len(rapport["erreurs"])
+    print(f"🗂️ [INDEX] {len(rapport['crees'])} index créé(s), {derive} écart(s) avec le registre", flush=True)
+    for categorie in ("differents", "non_declares", "erreurs"):
+        for entree in rapport[categorie]:
+            print(f"⚠️ [INDEX] {categorie}: {entree}", flush=True)
+    return rapport
+
+
+def report_summary() -> Optional[Dict[str, int]]:
+    """Nombre d'entrées par catégorie du dernier rapport (None si pas encore réconcilié)"""
+    if last_report is None:
+        return None
+    return {categorie: len(entrees) for categorie, entrees in last_report.items()}
@@ -8,6 +8,8 @@ from passlib.context import CryptContext
 import uuid
 from datetime import datetime, timezone
 
+from resource_versions import invalidate_all
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -51,6 +53,8 @@ async def init_database():
     }
     
     await db.users.insert_one(director)
+    # ETags émis avant l'init (RESOURCE_VERSION_STORE=mongo)
+    await invalidate_all(db)
     
     print("✅ Base de données initialisée avec succès!")
     print("\n🔐 Identifiants du directeur:")
@@ -4,6 +4,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from passlib.context import CryptContext
 from datetime import datetime, timezone
 
+from resource_versions import invalidate_all
+
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 async def init_francis_complet():
@@ -29,6 +31,9 @@ async def init_francis_complet():
         ]
         await db.salles.insert_many(salles)
 
+    # ETags émis avant l'init (RESOURCE_VERSION_STORE=mongo)
+    await invalidate_all(db)
+
     print("✅ COMPTE FRANCIS CRÉÉ ET SALLES INSTALLÉES !")
     client.close()
 
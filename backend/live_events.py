@@ -0,0 +1,193 @@
+"""
+Canal temps réel (pub/sub en mémoire) pour le chat et le planning.
+
+Les endpoints publient des événements (publish) sur des topics ; les clients
+connectés à /api/live (WebSocket, repli SSE sur /api/live/sse) les reçoivent
+au lieu d'interroger l'API à intervalle régulier.
+
+Topics :
+- planning:<centre_id>  créneaux créés / modifiés / supprimés, congés approuvés
+- user:<user_id>        messages privés, statut des demandes de l'utilisateur
+- groupe:<groupe_id>    messages d'un groupe
+- general               messages GENERAL
+
+- publish() ne bloque jamais : chaque abonné a une file bornée (LIVE_QUEUE_SIZE).
+  Un abonné trop lent (file pleine) est marqué en débordement : il reçoit les
+  événements déjà en file puis un événement "resync" et la connexion est fermée ;
+  le client se reconnecte avec son dernier curseur.
+- Curseur de reconnexion : "<boot_id>-<seq>". Les LIVE_BUFFER_SIZE derniers
+  événements sont conservés et rejoués à la reconnexion ; curseur trop ancien
+  ou émis par un autre processus (redémarrage) -> "resync" (recharger l'état).
+- Processus unique (une instance Render) : pas de diffusion entre instances.
+"""
+import asyncio
+import json
+import os
+import uuid
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, Optional, Set
+
+LIVE_QUEUE_SIZE = max(1, int(os.environ.get('LIVE_QUEUE_SIZE', '256')))
+LIVE_BUFFER_SIZE = max(1, int(os.environ.get('LIVE_BUFFER_SIZE', '2000')))
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get('LIVE_HEARTBEAT_SECONDS', '25'))
+
+GENERAL_TOPIC = "general"
+
+RESYNC = "resync"
+
+
+def planning_topic(centre_id: Optional[str]) -> Optional[str]:
+    # Créneau sans centre : aucun topic (ignoré par publish)
+    return f"planning:{centre_id}" if centre_id else None
+
+
+def user_topic(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def groupe_topic(groupe_id: str) -> str:
+    return f"groupe:{groupe_id}"
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_event(event: Dict[str, Any]) -> str:
+    return json.dumps(event, default=_json_default, ensure_ascii=False)
+
+
+class Subscription:
+    """Abonnement d'une connexion : topics et file bornée d'événements"""
+
+    def __init__(self, topics: Iterable[str], maxsize: int):
+        self.topics: Set[str] = set(topics)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+        self.closed = False
+
+    def offer(self, event: Dict[str, Any]) -> bool:
+        """Ajoute l'événement sans attendre. False si l'abonné déborde."""
+        if self.overflowed or self.closed:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+
+    async def next_event(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Prochain événement, ou None après `timeout` secondes sans événement (heartbeat).
+        Un abonné en débordement reçoit un événement resync une fois sa file vidée.
+        """
+        if self.overflowed and self.queue.empty():
+            self.closed = True
+            return {"type": RESYNC, "reason": "overflow"}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LiveBroker:
+    """Pub/sub en mémoire avec historique borné pour la reprise après reconnexion"""
+
+    def __init__(self, queue_size: int = None, buffer_size: int = None):
+        self.queue_size = queue_size or LIVE_QUEUE_SIZE
+        self.boot_id = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=buffer_size or LIVE_BUFFER_SIZE)
+        self._subscriptions: Set[Subscription] = set()
+        self.compteurs = {"publies": 0, "livres": 0, "debordements": 0}
+
+    @property
+    def cursor(self) -> str:
+        return f"{self.boot_id}-{self._seq}"
+
+    def publish(self, topics: Iterable[str], event_type: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Publie un événement sur un ou plusieurs topics (sans attente, sans I/O)"""
+        topics = [t for t in dict.fromkeys(topics) if t]
+        if isinstance(data, dict) and "_id" in data:
+            data = {k: v for k, v in data.items() if k != "_id"}
+        self._seq += 1
+        event = {
+            "id": f"{self.boot_id}-{self._seq}",
+            "seq": self._seq,
+            "type": event_type,
+            "topics": topics,
+            "data": data or {},
+            "ts": datetime.now(timezone.utc).isoformat()
+        }
+        self._buffer.append(event)
+        self.compteurs["publies"] += 1
+        for subscription in list(self._subscriptions):
+            if subscription.topics.intersection(topics):
+                deja_en_debordement = subscription.overflowed
+                if subscription.offer(event):
+                    self.compteurs["livres"] += 1
+                elif not deja_en_debordement and subscription.overflowed:
+                    self.compteurs["debordements"] += 1
+        return event
+
+    def _replay(self, subscription: Subscription, cursor: str) -> None:
+        boot_id, _, seq = cursor.rpartition("-")
+        try:
+            depuis = int(seq)
+        except ValueError:
+            depuis = -1
+        plus_ancien = self._buffer[0]["seq"] if self._buffer else self._seq + 1
+        if boot_id != self.boot_id or depuis < 0 or depuis > self._seq or depuis < plus_ancien - 1:
+            # Événements perdus (redémarrage ou historique dépassé) : le client recharge son état
+            subscription.offer({"type": RESYNC, "reason": "cursor", "id": self.cursor})
+            return
+        for event in self._buffer:
+            if event["seq"] > depuis and subscription.topics.intersection(event["topics"]):
+                subscription.offer(event)
+
+    def subscribe(self, topics: Iterable[str], cursor: Optional[str] = None) -> Subscription:
+        """Abonne une connexion ; avec un curseur, les événements manqués sont rejoués d'abord"""
+        subscription = Subscription(topics, self.queue_size)
+        if cursor:
+            self._replay(subscription, cursor)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.closed = True
+        self._subscriptions.discard(subscription)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"abonnes": len(self._subscriptions), "curseur": self.cursor, **self.compteurs}
+
+
+broker = LiveBroker()
+
+
+def publish(topics: Iterable[str], event_type: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return broker.publish(topics, event_type, data)
+
+
+async def stream_events(subscription: Subscription, heartbeat: float = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """
+    Événements d'un abonnement pour une connexion (WebSocket ou SSE).
+    None = aucun événement depuis `heartbeat` secondes (envoyer un ping).
+    S'arrête après le resync d'un abonné en débordement : la connexion doit être fermée.
+    """
+    heartbeat = heartbeat if heartbeat is not None else LIVE_HEARTBEAT_SECONDS
+    while not subscription.closed:
+        yield await subscription.next_event(heartbeat)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Événement au format text/event-stream (id = curseur de reprise, renvoyé par Last-Event-ID)"""
+    lignes = []
+    if event.get("id"):
+        lignes.append(f"id: {event['id']}")
+    lignes.append(f"event: {event['type']}")
+    lignes.append(f"data: {encode_event(event)}")
+    return "\n".join(lignes) + "\n\n"
@@ -0,0 +1,193 @@
+"""
+Détection des blocages de la boucle asyncio (appels synchrones dans les handlers async).
+
+Activé par LOOP_WATCHDOG=1 (lifespan) :
+- un battement (loop.call_later) est planifié sur la boucle toutes les
+  threshold / 2 secondes
+- un thread de surveillance vérifie le battement ; s'il a plus de
+  LOOP_WATCHDOG_THRESHOLD_MS de retard, la pile du thread de la boucle est
+  capturée pendant le blocage (sys._current_frames) : c'est le code qui bloque
+- quand le battement reprend, la durée du blocage est connue : l'incident est
+  agrégé par emplacement (premier cadre du code de l'application en partant du
+  plus profond), journalisé et visible dans GET /api/admin/loop-blocking et /metrics
+
+En test / CI : `async with LoopWatchdog(threshold=0.05).watch() as watchdog:` puis
+`watchdog.offenders()` doit être vide.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+LOOP_WATCHDOG = os.environ.get('LOOP_WATCHDOG', '').lower() in ('1', 'true', 'yes')
+LOOP_WATCHDOG_THRESHOLD_MS = float(os.environ.get('LOOP_WATCHDOG_THRESHOLD_MS', '100'))
+
+BACKEND_DIR = str(Path(__file__).resolve().parent)
+# Cadres conservés par pile capturée
+STACK_DEPTH = 15
+
+
+def _is_app_frame(filename: str) -> bool:
+    return (filename.startswith(BACKEND_DIR) and filename != __file__
+            and "site-packages" not in filename and "dist-packages" not in filename)
+
+
+def blocking_location(stack: traceback.StackSummary) -> str:
+    """Emplacement du blocage : cadre de l'application le plus profond (sinon le plus profond tout court)"""
+    for frame in reversed(stack):
+        if _is_app_frame(frame.filename):
+            return f"{os.path.relpath(frame.filename, BACKEND_DIR)}:{frame.lineno} in {frame.name}"
+    if stack:
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+    return "inconnu"
+
+
+class LoopWatchdog:
+    """Battement sur la boucle + thread de surveillance qui capture la pile pendant un blocage"""
+
+    def __init__(self, threshold: float = None, max_offenders: int = 200):
+        self.threshold = threshold if threshold is not None else LOOP_WATCHDOG_THRESHOLD_MS / 1000
+        self.interval = self.threshold / 2
+        self.max_offenders = max_offenders
+        self._lock = threading.Lock()
+        self._offenders: Dict[str, Dict[str, Any]] = {}
+        self._incident: Optional[Dict[str, Any]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._beat = time.monotonic()
+        self.incidents = 0
+        self.blocked_seconds = 0.0
+
+    # --- côté boucle ---
+
+    def _tick(self) -> None:
+        self._beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def start(self) -> None:
+        """À appeler depuis la boucle surveillée"""
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._tick()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        print(f"🐢 [LOOP] Surveillance des blocages de la boucle (seuil {self.threshold * 1000:.0f} ms)", flush=True)
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._check()  # clôt un incident en cours
+
+    @asynccontextmanager
+    async def watch(self):
+        """Surveille la boucle le temps du bloc (tests, benchmarks)"""
+        self.start()
+        try:
+            yield self
+        finally:
+            # Un battement après un éventuel dernier blocage : l'incident est clos par stop()
+            await asyncio.sleep(self.interval * 2)
+            self.stop()
+
+    # --- côté thread de surveillance ---
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval / 2):
+            self._check()
+
+    def _check(self) -> None:
+        beat = self._beat
+        retard = time.monotonic() - beat - self.interval
+        incident = self._incident
+        if incident is not None and beat != incident["beat"]:
+            # La boucle a repris : durée réelle du blocage
+            self._incident = None
+            self._record(incident, beat - incident["beat"] - self.interval)
+            return
+        if incident is None and retard > self.threshold:
+            self._incident = self._capture(beat)
+
+    def _capture(self, beat: float) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.extract_stack(frame, limit=None)[-STACK_DEPTH:] if frame is not None else []
+        tache = None
+        try:
+            task = asyncio.current_task(self._loop)
+            tache = task.get_name() if task is not None else None
+        except RuntimeError:
+            pass
+        return {"beat": beat, "stack": stack, "task": tache}
+
+    def _record(self, incident: Dict[str, Any], duree: float) -> None:
+        duree = max(duree, self.threshold)
+        location = blocking_location(incident["stack"])
+        with self._lock:
+            self.incidents += 1
+            self.blocked_seconds += duree
+            entree = self._offenders.get(location)
+            if entree is None:
+                if len(self._offenders) >= self.max_offenders:
+                    location = "(autres)"
+                    entree = self._offenders.get(location)
+                if entree is None:
+                    entree = self._offenders[location] = {
+                        "location": location, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                        "last_task": None, "last_stack": []
+                    }
+            entree["count"] += 1
+            entree["total_ms"] += duree * 1000
+            entree["max_ms"] = max(entree["max_ms"], duree * 1000)
+            entree["last_task"] = incident["task"]
+            entree["last_stack"] = [
+                f"{os.path.relpath(f.filename, BACKEND_DIR) if _is_app_frame(f.filename) else f.filename}"
+                f":{f.lineno} in {f.name}" for f in incident["stack"]
+            ]
+        print(f"🐢 [LOOP] Boucle bloquée {duree * 1000:.0f} ms : {location} (tâche {incident['task']})", flush=True)
+
+    # --- lecture ---
+
+    def offenders(self) -> List[Dict[str, Any]]:
+        """Emplacements bloquants, du plus coûteux au moins coûteux"""
+        with self._lock:
+            entrees = [
+                {**e, "total_ms": round(e["total_ms"], 1), "max_ms": round(e["max_ms"], 1),
+                 "last_stack": list(e["last_stack"])}
+                for e in self._offenders.values()
+            ]
+        return sorted(entrees, key=lambda e: e["total_ms"], reverse=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "actif": self._thread is not None,
+            "seuil_ms": self.threshold * 1000,
+            "incidents": self.incidents,
+            "bloque_ms": round(self.blocked_seconds * 1000, 1),
+            "offenders": self.offenders(),
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._offenders.clear()
+            self.incidents = 0
+            self.blocked_seconds = 0.0
+
+
+loop_watchdog = LoopWatchdog()
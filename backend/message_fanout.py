@@ -0,0 +1,102 @@
+"""
+Diffusion des notifications de messages du chat (PRIVE, GROUPE, GENERAL).
+
+L'endpoint POST /messages enregistre le message puis un seul job dans l'outbox
+et répond aussitôt : aucune lecture des destinataires dans la requête HTTP.
+Le worker de l'outbox résout ensuite destinataires et tokens en une seule
+agrégation sur push_devices (index actif + user_id), puis envoie par lots
+multicast (push_notifications.send_push_batch).
+
+- GENERAL : tous les appareils actifs, sauf ceux de l'expéditeur
+- GROUPE / PRIVE : appareils actifs des membres (liste déjà lue par l'endpoint
+  pour vérifier l'appartenance au groupe, le groupe n'est pas relu)
+- Nouvel essai : uniquement les tokens en échec transitoire (TransientError)
+"""
+import functools
+import time
+from typing import Any, Dict, List, Optional
+
+from notification_outbox import TransientError, enqueue, register_handler
+from push_devices import TOKENS_ENVOYABLES
+
+FANOUT_MESSAGE = "fanout_message"
+
+PREVIEW_LENGTH = 100
+
+
+def build_message_notification(message: Dict[str, Any], sender_name: str, groupe_nom: Optional[str] = None):
+    """Titre, corps et données de la notification d'un message"""
+    contenu = message["contenu"]
+    preview = contenu[:PREVIEW_LENGTH] + "..." if len(contenu) > PREVIEW_LENGTH else contenu
+    type_message = message["type_message"]
+    data = {"type": "new_message", "message_type": type_message, "message_id": message["id"]}
+    if type_message == "PRIVE":
+        title = f"💬 Message de {sender_name}"
+        data["sender_id"] = message["expediteur_id"]
+    elif type_message == "GROUPE":
+        title = f"💬 {sender_name} dans {groupe_nom or 'Groupe'}"
+        data["groupe_id"] = message["groupe_id"]
+    else:
+        title = f"📢 Message général de {sender_name}"
+    return title, preview, data
+
+
+async def enqueue_message_fanout(database, message: Dict[str, Any], sender_name: str,
+                                 membres: Optional[List[str]] = None, groupe_nom: Optional[str] = None) -> Optional[str]:
+    """
+    Enregistre la diffusion d'un message : un seul job, quel que soit le nombre de destinataires.
+    membres=None -> message GENERAL (tous les utilisateurs actifs).
+    """
+    if membres is not None:
+        membres = list(dict.fromkeys(m for m in membres if m and m != message["expediteur_id"]))
+        if not membres:
+            return None
+    title, body, data = build_message_notification(message, sender_name, groupe_nom)
+    return await enqueue(database, FANOUT_MESSAGE, {
+        "exclude_user_id": message["expediteur_id"],
+        "membres": membres,
+        "title": title,
+        "body": body,
+        "data": data
+    })
+
+
+async def resolve_fanout(database, exclude_user_id: str, membres: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Destinataires et tokens en une agrégation sur push_devices"""
+    user_filter: Dict[str, Any] = {"$ne": exclude_user_id}
+    if membres is not None:
+        user_filter["$in"] = membres
+    resultat = await database.push_devices.aggregate([
+        {"$match": {"actif": True, **TOKENS_ENVOYABLES, "user_id": user_filter}},
+        {"$group": {"_id": None, "tokens": {"$addToSet": "$fcm_token"}, "destinataires": {"$addToSet": "$user_id"}}}
+    ]).to_list(1)
+    if not resultat:
+        return {"destinataires": 0, "tokens": []}
+    return {"destinataires": len(resultat[0]["destinataires"]), "tokens": resultat[0]["tokens"]}
+
+
+async def deliver_fanout(database, exclude_user_id: str, title: str, body: str, data: Optional[Dict] = None,
+                         membres: Optional[List[str]] = None, tokens: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Tâche de l'outbox : résolution des tokens puis envoi par lots multicast"""
+    from push_notifications import send_push_batch
+
+    debut = time.perf_counter()
+    destinataires = None
+    if not tokens:
+        resolu = await resolve_fanout(database, exclude_user_id, membres)
+        destinataires, tokens = resolu["destinataires"], resolu["tokens"]
+    if not tokens:
+        return {"tokens": 0, "success": 0, "failure": 0}
+
+    stats = await send_push_batch([{"tokens": tokens, "title": title, "body": body, "data": data}], database=database)
+    duree = (time.perf_counter() - debut) * 1000
+    print(f"📢 [FANOUT] {stats['success']}/{stats['tokens']} envois "
+          f"({destinataires if destinataires is not None else 'nouvel essai'} destinataires, {stats['batches']} lots) en {duree:.0f} ms")
+    if stats["retry_tokens"]:
+        raise TransientError(f"{len(stats['retry_tokens'])} envoi(s) en échec transitoire", tokens=stats["retry_tokens"])
+    return stats
+
+
+def register_fanout_handler(database) -> None:
+    """Rend les jobs fanout_message exécutables par les workers de l'outbox"""
+    register_handler(FANOUT_MESSAGE, functools.partial(deliver_fanout, database))
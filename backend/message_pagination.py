@@ -0,0 +1,116 @@
+"""
+Pagination par curseur de l'historique du chat (collection messages).
+
+Ordre stable sur (date_envoi, id) : deux messages envoyés dans la même
+milliseconde gardent toujours le même ordre, aucun n'est sauté ni répété.
+
+- before=<curseur> : messages plus anciens que le curseur (remonter l'historique)
+- after=<curseur>  : messages plus récents (nouveaux messages depuis le dernier chargement)
+- next_cursor : curseur de la page suivante dans le même sens, None en fin d'historique
+
+Chaque page est une requête indexée (index composés créés au démarrage par
+ensure_message_indexes) : le coût ne dépend pas de la profondeur dans l'historique,
+contrairement à skip/offset. Pour cela, chaque requête (ou chaque branche d'un $or)
+doit fixer par égalité tous les champs de l'index qui précèdent (date_envoi, id) :
+l'index fournit alors l'ordre (pas d'étape SORT) et le curseur borne le parcours.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+MAX_PAGE_SIZE = 200
+# En-tête de réponse portant le curseur de la page suivante (le corps reste une liste)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+SORT_DESC = [("date_envoi", -1), ("id", -1)]
+SORT_ASC = [("date_envoi", 1), ("id", 1)]
+
+
+MESSAGE_INDEXES = [
+    # Messages GENERAL (groupe_id null) / GROUPE : type_message + groupe_id puis ordre de pagination
+    {"keys": [("type_message", 1), ("groupe_id", 1), ("date_envoi", -1), ("id", -1)], "name": "messages_type_groupe_date"},
+    # Conversations privées : les deux sens de la paire expéditeur / destinataire
+    {"keys": [("expediteur_id", 1), ("destinataire_id", 1), ("date_envoi", -1), ("id", -1)], "name": "messages_paire_date"},
+    # Messages privés d'un utilisateur (GET /messages?type_message=PRIVE) : une branche du $or par index
+    {"keys": [("destinataire_id", 1), ("date_envoi", -1), ("id", -1)], "name": "messages_destinataire_date"},
+    {"keys": [("expediteur_id", 1), ("type_message", 1), ("date_envoi", -1), ("id", -1)],
+     "name": "messages_expediteur_type_date"},
+]
+
+
+async def ensure_message_indexes(database) -> None:
+    for spec in MESSAGE_INDEXES:
+        await database.messages.create_index(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"})
+
+
+def encode_cursor(message: Dict[str, Any]) -> str:
+    """Curseur opaque d'un message : base64url de (date_envoi, id)"""
+    date_envoi = message["date_envoi"]
+    if isinstance(date_envoi, datetime):
+        date_envoi = date_envoi.isoformat()
+    brut = json.dumps({"d": date_envoi, "i": message["id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(brut.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """(date_envoi, id) d'un curseur. ValueError si le curseur est invalide."""
+    try:
+        brut = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        contenu = json.loads(brut)
+        return datetime.fromisoformat(contenu["d"]), str(contenu["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Curseur invalide: {cursor!r}") from e
+
+
+def cursor_filter(cursor: str, older: bool) -> Dict[str, Any]:
+    """Messages strictement avant (older=True) ou après le curseur, selon (date_envoi, id)"""
+    date_envoi, message_id = decode_cursor(cursor)
+    op = "$lt" if older else "$gt"
+    return {
+        # Borne du parcours d'index ; le $or départage les messages de la même date
+        "date_envoi": {f"{op}e": date_envoi},
+        "$or": [
+            {"date_envoi": {op: date_envoi}},
+            {"date_envoi": date_envoi, "id": {op: message_id}}
+        ]
+    }
+
+
+def page_query(query: Dict[str, Any], before: Optional[str] = None,
+               after: Optional[str] = None) -> Tuple[Dict[str, Any], List[Tuple[str, int]]]:
+    """
+    Filtre et tri d'une page. Le curseur est ajouté à chaque branche d'un $or :
+    chaque branche reste un parcours d'index borné et ordonné (fusion sans SORT).
+    """
+    if before and after:
+        raise ValueError("before et after ne peuvent pas être utilisés ensemble")
+    sort = SORT_ASC if after else SORT_DESC
+    if not (before or after):
+        return query, sort
+    curseur = cursor_filter(before or after, older=bool(before))
+    if "$or" in query:
+        reste = {k: v for k, v in query.items() if k != "$or"}
+        conditions = [c for c in (reste, curseur) if c]
+        return {"$or": [{"$and": [branche, *conditions]} for branche in query["$or"]]}, sort
+    return {"$and": [query, curseur]}, sort
+
+
+async def paginate_messages(database, query: Dict[str, Any], limit: int, before: Optional[str] = None,
+                            after: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Une page de messages, du plus récent au plus ancien, et le curseur de la page suivante.
+    Sans curseur : les messages les plus récents. ValueError si before et after sont fournis
+    ensemble ou si un curseur est invalide.
+    """
+    query, sort = page_query(query, before, after)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # Un message de plus pour savoir s'il reste une page
+    messages = await database.messages.find(query, {"_id": 0}).sort(sort).limit(limit + 1).to_list(limit + 1)
+    suite = len(messages) > limit
+    messages = messages[:limit]
+    next_cursor = encode_cursor(messages[-1]) if suite else None
+    if after:
+        messages.reverse()
+    return messages, next_cursor
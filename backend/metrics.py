@@ -0,0 +1,252 @@
+"""
+Métriques au format texte Prometheus (GET /metrics), sans dépendance externe.
+
+Collectées au fil de l'eau (coût : une entrée de dictionnaire et un histogramme par événement) :
+- requêtes HTTP : latence par route (gabarit FastAPI) et nombre par code de statut,
+  enregistrées par le middleware de server.py
+- notifications push : envois réussis / en échec par code d'erreur FCM
+- tâches planifiées : durée et statut de chaque exécution (observe_job)
+- retard de la boucle asyncio : échantillonné toutes les METRICS_LOOP_LAG_INTERVAL secondes
+
+Lues au moment du scrape : pool de connexions MongoDB (mongo_monitoring.pool_monitor),
+commandes MongoDB par collection, profondeur de l'outbox, ratios des caches.
+render() ne fait que formater : l'endpoint lui passe les valeurs lues (voir server.py).
+"""
+import asyncio
+import os
+import re
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mongo_monitoring import Histogram
+
+# Bornes des histogrammes de durée (secondes)
+HTTP_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS_S = (0.1, 0.5, 1, 5, 10, 30, 60, 300)
+LOOP_LAG_BUCKETS_S = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+METRICS_LOOP_LAG_INTERVAL = float(os.environ.get('METRICS_LOOP_LAG_INTERVAL', '0.5'))
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_FCM_CODE = re.compile(r"^[A-Z][A-Z0-9_]*$")
+
+
+def push_error_code(error: Optional[str]) -> str:
+    """Code d'erreur borné pour les labels : code FCM, HTTP_<statut>, sinon RESEAU (exception, oauth...)"""
+    if not error:
+        return "INCONNU"
+    if _FCM_CODE.match(error):
+        return error
+    if error.startswith("HTTP ") and error[5:].isdigit():
+        return f"HTTP_{error[5:]}"
+    return "RESEAU"
+
+
+class MetricsRegistry:
+    """Compteurs et histogrammes du processus"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.http: Dict[Tuple[str, str], Histogram] = {}
+        self.http_status: Dict[Tuple[str, str, str], int] = {}
+        self.push: Dict[Tuple[str, str], int] = {}
+        self.jobs: Dict[str, Histogram] = {}
+        self.job_runs: Dict[Tuple[str, str], int] = {}
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS_S)
+        self.loop_lag_last = 0.0
+        self.loop_lag_max = 0.0
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float) -> None:
+        with self._lock:
+            histogramme = self.http.get((method, route))
+            if histogramme is None:
+                histogramme = self.http[(method, route)] = Histogram(HTTP_BUCKETS_S)
+            histogramme.observe(seconds)
+            cle = (method, route, str(status_code))
+            self.http_status[cle] = self.http_status.get(cle, 0) + 1
+
+    def record_push_results(self, results: Iterable) -> None:
+        """Un PushResult par token (push_notifications)"""
+        with self._lock:
+            for result in results:
+                cle = ("succes", "") if result.success else ("echec", push_error_code(result.error))
+                self.push[cle] = self.push.get(cle, 0) + 1
+
+    def observe_job(self, job: str, seconds: float, statut: str) -> None:
+        with self._lock:
+            histogramme = self.jobs.get(job)
+            if histogramme is None:
+                histogramme = self.jobs[job] = Histogram(JOB_BUCKETS_S)
+            histogramme.observe(seconds)
+            self.job_runs[(job, statut)] = self.job_runs.get((job, statut), 0) + 1
+
+    def observe_loop_lag(self, seconds: float) -> None:
+        with self._lock:
+            self.loop_lag.observe(seconds)
+            self.loop_lag_last = seconds
+            self.loop_lag_max = max(self.loop_lag_max, seconds)
+
+
+metrics = MetricsRegistry()
+
+
+async def sample_loop_lag(registry: MetricsRegistry = None, interval: float = None) -> None:
+    """Mesure le retard du réveil d'un sleep : temps pendant lequel la boucle était occupée ailleurs"""
+    registry = registry or metrics
+    interval = interval or METRICS_LOOP_LAG_INTERVAL
+    loop = asyncio.get_running_loop()
+    while True:
+        debut = loop.time()
+        await asyncio.sleep(interval)
+        registry.observe_loop_lag(max(0.0, loop.time() - debut - interval))
+
+
+_loop_lag_task: Optional[asyncio.Task] = None
+
+
+def start_loop_lag_monitor() -> None:
+    """Lance l'échantillonnage du retard de la boucle (lifespan)"""
+    global _loop_lag_task
+    if _loop_lag_task is None or _loop_lag_task.done():
+        _loop_lag_task = asyncio.create_task(sample_loop_lag())
+
+
+def stop_loop_lag_monitor() -> None:
+    global _loop_lag_task
+    if _loop_lag_task is not None:
+        _loop_lag_task.cancel()
+        _loop_lag_task = None
+
+
+# ===== Format texte =====
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Exposition:
+    """Lignes du format texte : en-têtes HELP / TYPE une seule fois par métrique"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self._declared = set()
+
+    def declare(self, name: str, kind: str, help_text: str) -> None:
+        if name not in self._declared:
+            self._declared.add(name)
+            self.lines.append(f"# HELP {name} {help_text}")
+            self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, labels: Dict[str, Any] = None) -> None:
+        self.lines.append(f"{name}{_labels(labels or {})} {_number(value)}")
+
+    def gauge(self, name: str, help_text: str, value: float, labels: Dict[str, Any] = None) -> None:
+        self.declare(name, "gauge", help_text)
+        self.sample(name, value, labels)
+
+    def counter(self, name: str, help_text: str, value: float, labels: Dict[str, Any] = None) -> None:
+        self.declare(name, "counter", help_text)
+        self.sample(name, value, labels)
+
+    def histogram(self, name: str, help_text: str, histogramme: Histogram,
+                  labels: Dict[str, Any] = None, scale: float = 1.0) -> None:
+        """scale convertit l'unité de l'histogramme (0.001 : millisecondes -> secondes)"""
+        self.declare(name, "histogram", help_text)
+        labels = labels or {}
+        for borne, cumul in histogramme.cumulative():
+            le = borne if borne == "+Inf" else _number(float(borne) * scale)
+            self.sample(f"{name}_bucket", cumul, {**labels, "le": le})
+        self.sample(f"{name}_sum", histogramme.sum * scale, labels)
+        self.sample(f"{name}_count", histogramme.count, labels)
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def render(registry: MetricsRegistry = None, pool: Dict[str, Any] = None, perf: Dict[Tuple[str, str], Histogram] = None,
+           outbox: Dict[str, Any] = None, caches: Dict[str, Dict[str, Any]] = None,
+           live: Dict[str, Any] = None, blocking: List[Dict[str, Any]] = None) -> str:
+    """
+    Page /metrics. Les sources lues au scrape sont optionnelles (None : métriques omises) :
+    pool = pool_monitor.stats(), perf = perf_registry.command_histograms(), outbox = outbox_stats(db),
+    caches = {nom: stats() avec hits / misses}, live = broker.stats(),
+    blocking = loop_watchdog.offenders()
+    """
+    registry = registry or metrics
+    out = Exposition()
+
+    with registry._lock:
+        for (method, route), histogramme in sorted(registry.http.items()):
+            out.histogram("http_request_duration_seconds", "Durée des requêtes HTTP par route",
+                          histogramme, {"method": method, "route": route})
+        for (method, route, code), n in sorted(registry.http_status.items()):
+            out.counter("http_requests_total", "Requêtes HTTP par route et code de statut", n,
+                        {"method": method, "route": route, "status": code})
+        for (resultat, code), n in sorted(registry.push.items()):
+            out.counter("push_sends_total", "Notifications push envoyées par token (résultat, code d'erreur FCM)", n,
+                        {"result": resultat, "code": code})
+        for job, histogramme in sorted(registry.jobs.items()):
+            out.histogram("scheduler_job_duration_seconds", "Durée des exécutions des tâches planifiées",
+                          histogramme, {"job": job})
+        for (job, statut), n in sorted(registry.job_runs.items()):
+            out.counter("scheduler_job_runs_total", "Exécutions des tâches planifiées par statut", n,
+                        {"job": job, "status": statut})
+        out.histogram("event_loop_lag_seconds", "Retard du réveil de la boucle asyncio", registry.loop_lag)
+        out.gauge("event_loop_lag_last_seconds", "Dernier retard mesuré de la boucle asyncio", registry.loop_lag_last)
+        out.gauge("event_loop_lag_max_seconds", "Retard maximal de la boucle asyncio depuis le démarrage",
+                  registry.loop_lag_max)
+
+    if pool is not None:
+        out.gauge("mongo_pool_max_size", "Taille maximale du pool de connexions MongoDB", pool["max_size"])
+        out.gauge("mongo_pool_connections", "Connexions MongoDB ouvertes", pool["connections"])
+        out.gauge("mongo_pool_checked_out", "Connexions MongoDB empruntées", pool["checked_out"])
+        out.gauge("mongo_pool_waiting", "Opérations en attente d'une connexion MongoDB", pool["waiting"])
+        out.counter("mongo_pool_cleared_total", "Réinitialisations du pool MongoDB", pool["cleared"])
+        for raison, n in sorted(pool["checkout_failures"].items()):
+            out.counter("mongo_pool_checkout_failures_total", "Échecs d'emprunt de connexion MongoDB", n,
+                        {"reason": raison})
+
+    if perf is not None:
+        for (collection, op), histogramme in sorted(perf.items()):
+            out.histogram("mongo_command_duration_seconds", "Durée des commandes MongoDB par collection et opération",
+                          histogramme, {"collection": collection, "op": op}, scale=0.001)
+
+    if outbox is not None:
+        for statut in ("en_attente", "en_cours", "echecs"):
+            out.gauge("outbox_jobs", "Jobs de l'outbox des notifications par statut", outbox[statut],
+                      {"status": statut})
+        out.gauge("outbox_delay_seconds", "Retard du plus ancien job prêt de l'outbox", outbox["retard_secondes"])
+
+    # Une boucle par famille : les échantillons d'une famille doivent être contigus
+    caches = sorted((caches or {}).items())
+    for nom, stats in caches:
+        out.counter("cache_hits_total", "Succès des caches", stats["hits"], {"cache": nom})
+    for nom, stats in caches:
+        out.counter("cache_misses_total", "Échecs des caches", stats["misses"], {"cache": nom})
+    for nom, stats in caches:
+        out.gauge("cache_hit_ratio", "Ratio de succès des caches", stats["hit_ratio"], {"cache": nom})
+
+    if live is not None:
+        out.gauge("live_subscribers", "Connexions temps réel ouvertes (/api/live)", live["abonnes"])
+
+    for entree in blocking or []:
+        out.counter("event_loop_blocked_total", "Blocages de la boucle asyncio par emplacement du code",
+                    entree["count"], {"location": entree["location"]})
+    for entree in blocking or []:
+        out.counter("event_loop_blocked_seconds_total", "Durée cumulée des blocages de la boucle par emplacement",
+                    entree["total_ms"] / 1000, {"location": entree["location"]})
+
+    return out.text()
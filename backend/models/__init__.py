@@ -1,6 +1,6 @@
 """Modèles de données Pydantic"""
 from models.user import (
-    UserBase, UserCreate, UserUpdate, User, UserLogin, Token,
+    UserBase, UserCreate, UserUpdate, User, UserLogin, Token, TokenPrincipal,
     ManagerPermissions, EmployeeVisibility
 )
 from models.centre import (
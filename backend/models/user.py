@@ -89,3 +89,11 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user: User
+
+
+class TokenPrincipal(BaseModel):
+    """Identité extraite du token signé, sans lecture de l'utilisateur en base"""
+    id: str
+    role: Optional[str] = None  # None pour les anciens tokens (sans claims)
+    centre_actif_id: Optional[str] = None
+    token_version: Optional[int] = None
@@ -0,0 +1,379 @@
+"""
+Suivi des commandes MongoDB par endpoint (CommandListener pymongo + contextvar de requête).
+
+- Le middleware HTTP ouvre un RequestStats dans la contextvar `current_request` ;
+  le listener (enregistré sur le client dans get_mongo_client) y ajoute chaque
+  commande : collection, opération, durée, documents retournés.
+- En fin de requête, les compteurs sont agrégés par route (gabarit FastAPI,
+  ex. /api/planning/semaine/{date_debut}) : requêtes HTTP, commandes par
+  collection / opération, histogrammes de latence (GET /api/admin/perf).
+- MONGO_SERVER_TIMING=1 : en-tête Server-Timing (mongo;dur=...) sur chaque réponse.
+- MONGO_DEV_CHECKS=1 : avertissement N+1 (NPlusOneWarning) quand une requête
+  exécute plus de MONGO_N_PLUS_ONE_THRESHOLD commandes sur la même collection.
+- PoolMonitor : occupation du pool de connexions (GET /metrics).
+
+Les commandes hors requête HTTP (workers, scheduler, démarrage) sont
+attribuées à la route "arriere-plan".
+"""
+import os
+import time
+import warnings
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from pymongo.monitoring import CommandListener, ConnectionPoolListener
+except ImportError:  # pymongo absent : le suivi reste utilisable avec des événements construits à la main
+    CommandListener = ConnectionPoolListener = object
+
+SERVER_TIMING = os.environ.get('MONGO_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+DEV_CHECKS = os.environ.get('MONGO_DEV_CHECKS', '').lower() in ('1', 'true', 'yes')
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('MONGO_N_PLUS_ONE_THRESHOLD', '10'))
+
+# Bornes des histogrammes (millisecondes)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+BACKGROUND_ROUTE = "arriere-plan"
+
+# Commandes de service non attribuées (connexion, sessions)
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue",
+                    "buildInfo", "getLastError", "killCursors"}
+
+
+class NPlusOneWarning(UserWarning):
+    """Trop de commandes sur une même collection pendant une requête"""
+
+
+class Histogram:
+    """Histogramme cumulatif (format Prometheus : compte par borne supérieure, somme, total)"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # dernière case : +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = len(self.buckets)
+        for i, borne in enumerate(self.buckets):
+            if value <= borne:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        resultat = []
+        for borne, n in zip([str(b) for b in self.buckets] + ["+Inf"], self.counts):
+            total += n
+            resultat.append((borne, total))
+        return resultat
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Borne supérieure du seau contenant le quantile q (approximation)"""
+        if not self.count:
+            return None
+        rang = q * self.count
+        for (borne, cumul) in self.cumulative():
+            if cumul >= rang:
+                return float("inf") if borne == "+Inf" else float(borne)
+        return None
+
+    def copy(self) -> "Histogram":
+        copie = Histogram(self.buckets)
+        copie.counts = list(self.counts)
+        copie.sum = self.sum
+        copie.count = self.count
+        return copie
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class RequestStats:
+    """Commandes MongoDB d'une requête HTTP"""
+
+    def __init__(self):
+        self.commands = 0
+        self.duration_ms = 0.0
+        self.par_collection: Dict[str, int] = {}
+        self.commandes: List[Tuple[str, str, float, int]] = []  # (collection, op, ms, docs)
+
+    def add(self, collection: str, op: str, duration_ms: float, docs: int) -> None:
+        self.commands += 1
+        self.duration_ms += duration_ms
+        self.par_collection[collection] = self.par_collection.get(collection, 0) + 1
+        self.commandes.append((collection, op, duration_ms, docs))
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("mongo_request_stats", default=None)
+
+
+def _collection(event) -> str:
+    commande = event.command or {}
+    if event.command_name == "getMore":
+        return str(commande.get("collection", "?"))
+    valeur = commande.get(event.command_name)
+    return valeur if isinstance(valeur, str) else "(base)"
+
+
+def _documents(event) -> int:
+    """Documents retournés (find, getMore, aggregate : taille du lot ; findAndModify : 0 ou 1 ; count : n)"""
+    reply = getattr(event, "reply", None) or {}
+    curseur = reply.get("cursor")
+    if isinstance(curseur, dict):
+        return len(curseur.get("firstBatch") or curseur.get("nextBatch") or [])
+    if event.command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    if event.command_name in ("count", "distinct"):
+        return len(reply.get("values", [])) if event.command_name == "distinct" else int(reply.get("n", 0))
+    return 0
+
+
+class PerfRegistry:
+    """Agrégats par route et par (collection, opération), en mémoire"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.routes: Dict[str, Dict[str, Any]] = {}
+        self.commandes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.n_plus_one = 0
+        self.since = time.time()
+
+    def _route(self, route: str) -> Dict[str, Any]:
+        entree = self.routes.get(route)
+        if entree is None:
+            entree = self.routes[route] = {
+                "requests": 0, "commands": 0, "docs": 0, "max_commands": 0,
+                "collections": {}, "mongo_ms": Histogram(), "request_ms": Histogram(),
+            }
+        return entree
+
+    def _add_to_route(self, route: str, collection: str, docs: int) -> None:
+        route_stats = self._route(route)
+        route_stats["commands"] += 1
+        route_stats["docs"] += docs
+        route_stats["collections"][collection] = route_stats["collections"].get(collection, 0) + 1
+
+    def record_command(self, collection: str, op: str, duration_ms: float, docs: int,
+                       route: Optional[str] = None) -> None:
+        """Agrégat par (collection, opération) ; route donnée seulement hors requête HTTP"""
+        with self._lock:
+            cle = (collection, op)
+            entree = self.commandes.get(cle)
+            if entree is None:
+                entree = self.commandes[cle] = {"count": 0, "docs": 0, "latency_ms": Histogram()}
+            entree["count"] += 1
+            entree["docs"] += docs
+            entree["latency_ms"].observe(duration_ms)
+            if route is not None:
+                self._add_to_route(route, collection, docs)
+
+    def record_request(self, route: str, stats: RequestStats, request_ms: float) -> None:
+        """La route n'est connue qu'après le routage : ses commandes sont reportées en fin de requête"""
+        with self._lock:
+            for collection, _, _, docs in stats.commandes:
+                self._add_to_route(route, collection, docs)
+            route_stats = self._route(route)
+            route_stats["requests"] += 1
+            route_stats["max_commands"] = max(route_stats["max_commands"], stats.commands)
+            route_stats["mongo_ms"].observe(stats.duration_ms)
+            route_stats["request_ms"].observe(request_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {
+                route: {
+                    "requests": s["requests"],
+                    "commands": s["commands"],
+                    "commands_per_request": round(s["commands"] / s["requests"], 2) if s["requests"] else None,
+                    "max_commands": s["max_commands"],
+                    "docs": s["docs"],
+                    "collections": dict(s["collections"]),
+                    "mongo_ms": s["mongo_ms"].to_dict(),
+                    "request_ms": s["request_ms"].to_dict(),
+                }
+                for route, s in self.routes.items()
+            }
+            commandes = {
+                f"{collection}.{op}": {"count": c["count"], "docs": c["docs"], "latency_ms": c["latency_ms"].to_dict()}
+                for (collection, op), c in self.commandes.items()
+            }
+            return {"since": self.since, "routes": routes, "commands": commandes, "n_plus_one": self.n_plus_one}
+
+    def command_histograms(self) -> Dict[Tuple[str, str], Histogram]:
+        """Latence (ms) par (collection, opération), copiée sous verrou (GET /metrics)"""
+        with self._lock:
+            return {cle: entree["latency_ms"].copy() for cle, entree in self.commandes.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.routes.clear()
+            self.commandes.clear()
+            self.n_plus_one = 0
+            self.since = time.time()
+
+
+perf_registry = PerfRegistry()
+
+
+class CommandMonitor(CommandListener):
+    """Attribue chaque commande MongoDB à la requête HTTP en cours (contextvar)"""
+
+    def __init__(self, registry: PerfRegistry = None):
+        self.registry = registry or perf_registry
+        self._pending: Dict[Tuple[Any, int], Tuple[Optional[RequestStats], str, str]] = {}
+        self._lock = Lock()
+
+    def started(self, event) -> None:
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        with self._lock:
+            # La contextvar est lue au démarrage : succeeded peut arriver hors du contexte de la requête
+            self._pending[(event.connection_id, event.request_id)] = (
+                current_request.get(), _collection(event), event.command_name
+            )
+
+    def _finish(self, event, docs: int) -> None:
+        with self._lock:
+            entree = self._pending.pop((event.connection_id, event.request_id), None)
+        if entree is None:
+            return
+        stats, collection, op = entree
+        duration_ms = event.duration_micros / 1000
+        if stats is not None:
+            stats.add(collection, op, duration_ms, docs)
+        self.registry.record_command(collection, op, duration_ms, docs,
+                                     route=BACKGROUND_ROUTE if stats is None else None)
+
+    def succeeded(self, event) -> None:
+        self._finish(event, _documents(event))
+
+    def failed(self, event) -> None:
+        self._finish(event, 0)
+
+
+command_monitor = CommandMonitor()
+
+
+class PoolMonitor(ConnectionPoolListener):
+    """Occupation du pool de connexions MongoDB (tous serveurs confondus)"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.max_size = 0
+        self.connections = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.cleared = 0
+        self.checkout_failures: Dict[str, int] = {}
+        self._max_par_serveur: Dict[Any, int] = {}
+
+    def _add(self, champ: str, delta: int) -> None:
+        with self._lock:
+            setattr(self, champ, getattr(self, champ) + delta)
+
+    def pool_created(self, event) -> None:
+        options = getattr(event, "options", None) or {}
+        with self._lock:
+            self._max_par_serveur[event.address] = int(options.get("maxPoolSize", 100))
+            self.max_size = sum(self._max_par_serveur.values())
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        self._add("cleared", 1)
+
+    def pool_closed(self, event) -> None:
+        with self._lock:
+            self._max_par_serveur.pop(event.address, None)
+            self.max_size = sum(self._max_par_serveur.values())
+
+    def connection_created(self, event) -> None:
+        self._add("connections", 1)
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self._add("connections", -1)
+
+    def connection_check_out_started(self, event) -> None:
+        self._add("waiting", 1)
+
+    def connection_check_out_failed(self, event) -> None:
+        raison = str(getattr(event, "reason", "inconnue"))
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures[raison] = self.checkout_failures.get(raison, 0) + 1
+
+    def connection_checked_out(self, event) -> None:
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+
+    def connection_checked_in(self, event) -> None:
+        self._add("checked_out", -1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "connections": self.connections,
+                "checked_out": self.checked_out,
+                "waiting": self.waiting,
+                "cleared": self.cleared,
+                "checkout_failures": dict(self.checkout_failures),
+            }
+
+
+pool_monitor = PoolMonitor()
+
+
+def begin_request() -> Tuple[RequestStats, Any]:
+    """Ouvre le suivi d'une requête ; retourne (stats, jeton pour end_request)"""
+    stats = RequestStats()
+    return stats, current_request.set(stats)
+
+
+def end_request(stats: RequestStats, token, route: str, request_ms: float,
+                registry: PerfRegistry = None) -> Optional[str]:
+    """
+    Ferme le suivi : agrégats de la route, vérification N+1 (MONGO_DEV_CHECKS).
+    Retourne la valeur de l'en-tête Server-Timing si MONGO_SERVER_TIMING est actif.
+    """
+    registry = registry or perf_registry
+    current_request.reset(token)
+    registry.record_request(route, stats, request_ms)
+    if DEV_CHECKS:
+        check_n_plus_one(route, stats, registry=registry)
+    if SERVER_TIMING:
+        return server_timing(stats)
+    return None
+
+
+def check_n_plus_one(route: str, stats: RequestStats, threshold: int = None,
+                     registry: PerfRegistry = None) -> List[str]:
+    """Collections interrogées plus de `threshold` fois par une même requête"""
+    threshold = threshold if threshold is not None else N_PLUS_ONE_THRESHOLD
+    suspectes = [c for c, n in stats.par_collection.items() if n > threshold]
+    for collection in suspectes:
+        (registry or perf_registry).n_plus_one += 1
+        message = f"{route} : {stats.par_collection[collection]} commandes sur {collection} (seuil {threshold})"
+        print(f"⚠️ [N+1] {message}", flush=True)
+        warnings.warn(message, NPlusOneWarning, stacklevel=2)
+    return suspectes
+
+
+def server_timing(stats: RequestStats) -> str:
+    return f'mongo;dur={stats.duration_ms:.1f};desc="{stats.commands} commande(s)"'
@@ -0,0 +1,326 @@
+"""
+File d'attente persistante des notifications (collection outbox).
+
+Les endpoints n'envoient plus les notifications dans le processus de la requête
+(BackgroundTasks, perdues au redémarrage ou à la mise en veille Render) :
+ils enregistrent un job dans `outbox`, traité par des workers démarrés dans le lifespan.
+
+- Un job = {"kind", "payload"} : "push_users" (même notification pour une liste
+  d'utilisateurs) ou une tâche enregistrée avec register_handler()
+- Réservation atomique (find_one_and_update), un job EN_COURS abandonné par un
+  worker arrêté redevient réservable après OUTBOX_CLAIM_TIMEOUT secondes
+- Les tokens des jobs push d'un lot sont lus en une requête sur la collection
+  push_devices (push_devices.tokens_by_user, appareils actifs, sans charger les
+  documents users) puis envoyés via push_notifications.send_push_batch
+- Erreurs transitoires (dont coupures MongoDB) : nouvel essai avec backoff exponentiel, ECHEC après
+  OUTBOX_MAX_ATTEMPTS tentatives
+- outbox_stats() : profondeur de la file et retard du plus ancien job prêt
+"""
+import asyncio
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+try:
+    # ConnectionFailure couvre AutoReconnect et ServerSelectionTimeoutError
+    from pymongo.errors import ConnectionFailure, NetworkTimeout
+    _ERREURS_MONGO = (ConnectionFailure, NetworkTimeout)
+except ImportError:  # pymongo absent : seules les erreurs réseau Python sont réessayées
+    _ERREURS_MONGO = ()
+
+logger = logging.getLogger(__name__)
+
+EN_ATTENTE = "EN_ATTENTE"
+EN_COURS = "EN_COURS"
+ENVOYE = "ENVOYE"
+ECHEC = "ECHEC"
+
+PUSH_USERS = "push_users"
+
+OUTBOX_WORKERS = max(1, int(os.environ.get('OUTBOX_WORKERS', '2')))
+OUTBOX_BATCH_SIZE = max(1, int(os.environ.get('OUTBOX_BATCH_SIZE', '50')))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '2'))
+OUTBOX_MAX_ATTEMPTS = max(1, int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '6')))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', '5'))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', '900'))
+OUTBOX_CLAIM_TIMEOUT = float(os.environ.get('OUTBOX_CLAIM_TIMEOUT', '300'))
+# Les jobs envoyés sont supprimés par un index TTL au bout de 7 jours
+OUTBOX_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Erreurs réessayées avec backoff (réseau, FCM ou MongoDB momentanément indisponibles)
+ERREURS_TRANSITOIRES = (ConnectionError, asyncio.TimeoutError, OSError) + _ERREURS_MONGO
+
+
+class TransientError(Exception):
+    """Erreur temporaire : le job sera réessayé (backoff exponentiel)"""
+
+    def __init__(self, message: str, tokens: Optional[List[str]] = None):
+        super().__init__(message)
+        # Jobs push : seuls ces tokens seront réessayés
+        self.tokens = tokens
+
+
+_handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+_wakeup: Optional[asyncio.Event] = None
+
+
+def register_handler(kind: str, handler: Callable[..., Awaitable[Any]]) -> None:
+    """
+    Enregistre une tâche exécutable par les workers : handler(**payload).
+    La tâche laisse remonter ses erreurs (sinon le job est marqué ENVOYE) et envoie
+    ses notifications par enqueue_push, pour profiter des nouveaux essais push.
+    """
+    _handlers[kind] = handler
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Motor retourne des datetimes naïfs (UTC)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def backoff_delay(tentatives: int) -> float:
+    """Délai avant le prochain essai : base * 2^(n-1), plafonné, avec ±20 % de gigue"""
+    delai = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(0, tentatives - 1)))
+    return delai * random.uniform(0.8, 1.2)
+
+
+# Index de la collection (déclarés aussi dans index_registry)
+OUTBOX_INDEXES = [
+    {"keys": [("statut", 1), ("prochain_essai", 1)], "name": "outbox_statut_prochain_essai"},
+    {"keys": [("id", 1)], "name": "outbox_id", "unique": True},
+    {"keys": [("sent_at", 1)], "name": "outbox_ttl_sent_at", "expireAfterSeconds": OUTBOX_RETENTION_SECONDS},
+]
+
+
+async def ensure_outbox_indexes(database) -> None:
+    for spec in OUTBOX_INDEXES:
+        await database.outbox.create_index(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"})
+
+
+async def enqueue(database, kind: str, payload: Dict[str, Any]) -> str:
+    """Enregistre un job dans l'outbox et réveille les workers. Retourne l'id du job."""
+    now = _now()
+    job = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "payload": payload,
+        "statut": EN_ATTENTE,
+        "tentatives": 0,
+        "prochain_essai": now,
+        "created_at": now
+    }
+    await database.outbox.insert_one(job)
+    if _wakeup is not None:
+        _wakeup.set()
+    return job["id"]
+
+
+async def enqueue_push(database, user_ids: Iterable[str], title: str, body: str, data: Optional[Dict] = None) -> Optional[str]:
+    """Même notification push pour plusieurs utilisateurs : un seul job"""
+    user_ids = list(dict.fromkeys(u for u in user_ids if u))
+    if not user_ids:
+        return None
+    return await enqueue(database, PUSH_USERS, {"user_ids": user_ids, "title": title, "body": body, "data": data or {}})
+
+
+async def claim_job(database, worker_id: str) -> Optional[Dict[str, Any]]:
+    """Réserve atomiquement le plus ancien job prêt (ou abandonné par un worker arrêté)"""
+    now = _now()
+    return await database.outbox.find_one_and_update(
+        {"$or": [
+            {"statut": EN_ATTENTE, "prochain_essai": {"$lte": now}},
+            {"statut": EN_COURS, "claimed_at": {"$lt": now - timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)}}
+        ]},
+        {"$set": {"statut": EN_COURS, "claimed_at": now, "worker_id": worker_id}, "$inc": {"tentatives": 1}},
+        sort=[("prochain_essai", 1)],
+        projection={"_id": 0},
+        return_document=True  # ReturnDocument.AFTER
+    )
+
+
+async def _send_push_jobs(database, jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Jobs push_users d'un lot : une requête push_devices, puis un envoi groupé par job"""
+    from push_devices import tokens_by_user
+    from push_notifications import send_push_batch
+
+    user_ids = list({uid for job in jobs if not job["payload"].get("tokens") for uid in job["payload"].get("user_ids", [])})
+    tokens_par_user = await tokens_by_user(database, user_ids)
+
+    async def envoyer(job):
+        payload = job["payload"]
+        # Nouvel essai : uniquement les tokens en échec transitoire au passage précédent
+        tokens = payload.get("tokens") or [t for uid in payload.get("user_ids", []) for t in tokens_par_user.get(uid, [])]
+        if not tokens:
+            return {"tokens": 0, "success": 0, "failure": 0}
+        stats = await send_push_batch(
+            [{"tokens": tokens, "title": payload["title"], "body": payload["body"], "data": payload.get("data")}],
+            database=database
+        )
+        if stats["retry_tokens"]:
+            raise TransientError(f"{len(stats['retry_tokens'])} envoi(s) en échec transitoire", tokens=stats["retry_tokens"])
+        return stats
+
+    resultats = await asyncio.gather(*[envoyer(job) for job in jobs], return_exceptions=True)
+    return {job["id"]: resultat for job, resultat in zip(jobs, resultats)}
+
+
+async def _run_task_job(job: Dict[str, Any]) -> Any:
+    handler = _handlers.get(job["kind"])
+    if handler is None:
+        raise ValueError(f"Type de job inconnu: {job['kind']}")
+    await handler(**job["payload"])
+    return None
+
+
+async def process_jobs(database, jobs: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Traite un lot de jobs réservés et enregistre leur résultat"""
+    push_jobs = [job for job in jobs if job["kind"] == PUSH_USERS]
+    autres = [job for job in jobs if job["kind"] != PUSH_USERS]
+
+    resultats = {}
+    if push_jobs:
+        try:
+            resultats.update(await _send_push_jobs(database, push_jobs))
+        except Exception as e:
+            resultats.update({job["id"]: TransientError(str(e)) for job in push_jobs})
+    if autres:
+        sorties = await asyncio.gather(*[_run_task_job(job) for job in autres], return_exceptions=True)
+        resultats.update({job["id"]: sortie for job, sortie in zip(autres, sorties)})
+
+    now = _now()
+    compteurs = {"envoyes": 0, "reessais": 0, "echecs": 0}
+    reussis = []
+    for job in jobs:
+        resultat = resultats[job["id"]]
+        if not isinstance(resultat, Exception):
+            reussis.append(job["id"])
+            continue
+        erreur = f"{type(resultat).__name__}: {resultat}"
+        # Seules les erreurs transitoires (réseau, FCM ou MongoDB indisponible) sont réessayées
+        reessai = isinstance(resultat, (TransientError,) + ERREURS_TRANSITOIRES)
+        if reessai and job.get("tentatives", 1) < OUTBOX_MAX_ATTEMPTS:
+            compteurs["reessais"] += 1
+            update = {"statut": EN_ATTENTE, "prochain_essai": now + timedelta(seconds=backoff_delay(job.get("tentatives", 1))),
+                      "derniere_erreur": erreur}
+            if getattr(resultat, "tokens", None):
+                update["payload.tokens"] = resultat.tokens
+        else:
+            compteurs["echecs"] += 1
+            update = {"statut": ECHEC, "derniere_erreur": erreur, "failed_at": now}
+            logger.error(f"❌ [OUTBOX] Job {job['kind']} {job['id']} abandonné: {erreur}")
+        await database.outbox.update_one({"id": job["id"]}, {"$set": update})
+
+    if reussis:
+        await database.outbox.update_many(
+            {"id": {"$in": reussis}},
+            {"$set": {"statut": ENVOYE, "sent_at": now}}
+        )
+        compteurs["envoyes"] = len(reussis)
+    return compteurs
+
+
+async def outbox_stats(database) -> Dict[str, Any]:
+    """Profondeur de la file (jobs en attente / en cours / en échec) et retard du plus ancien job prêt"""
+    now = _now()
+    en_attente = await database.outbox.count_documents({"statut": EN_ATTENTE})
+    en_cours = await database.outbox.count_documents({"statut": EN_COURS})
+    echecs = await database.outbox.count_documents({"statut": ECHEC})
+    plus_ancien = await database.outbox.find(
+        {"statut": EN_ATTENTE, "prochain_essai": {"$lte": now}},
+        {"_id": 0, "prochain_essai": 1}
+    ).sort("prochain_essai", 1).limit(1).to_list(1)
+    retard = (now - _as_utc(plus_ancien[0]["prochain_essai"])).total_seconds() if plus_ancien else 0.0
+    return {
+        "profondeur": en_attente + en_cours,
+        "en_attente": en_attente,
+        "en_cours": en_cours,
+        "echecs": echecs,
+        "retard_secondes": round(max(0.0, retard), 3),
+        "workers": _worker.stats() if _worker else None
+    }
+
+
+class OutboxWorker:
+    """Pool de workers asyncio qui vident l'outbox"""
+
+    def __init__(self, database, workers: int = None, batch_size: int = None, poll_interval: float = None):
+        self.database = database
+        self.workers = workers or OUTBOX_WORKERS
+        self.batch_size = batch_size or OUTBOX_BATCH_SIZE
+        self.poll_interval = poll_interval if poll_interval is not None else OUTBOX_POLL_INTERVAL
+        self.compteurs = {"envoyes": 0, "reessais": 0, "echecs": 0}
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"actifs": sum(1 for t in self._tasks if not t.done()), **self.compteurs}
+
+    async def run_once(self, worker_id: str) -> int:
+        """Réserve jusqu'à batch_size jobs et les traite. Retourne le nombre de jobs traités."""
+        jobs = []
+        while len(jobs) < self.batch_size:
+            job = await claim_job(self.database, worker_id)
+            if job is None:
+                break
+            jobs.append(job)
+        if jobs:
+            for cle, valeur in (await process_jobs(self.database, jobs)).items():
+                self.compteurs[cle] += valeur
+        return len(jobs)
+
+    async def _loop(self, worker_id: str) -> None:
+        while not self._stopping:
+            try:
+                traites = await self.run_once(worker_id)
+            except Exception as e:
+                print(f"⚠️ [OUTBOX] {worker_id}: {e}", flush=True)
+                traites = 0
+            if traites:
+                continue
+            # File vide : attendre un nouveau job (enqueue) ou le prochain passage
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+
+    def start(self) -> None:
+        global _wakeup
+        _wakeup = asyncio.Event()
+        self._stopping = False
+        prefixe = uuid.uuid4().hex[:6]
+        self._tasks = [asyncio.create_task(self._loop(f"worker-{prefixe}-{i}")) for i in range(self.workers)]
+        print(f"📮 [OUTBOX] {self.workers} worker(s) démarré(s)", flush=True)
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+_worker: Optional[OutboxWorker] = None
+
+
+def start_outbox_worker(database) -> OutboxWorker:
+    global _worker
+    if _worker is None:
+        _worker = OutboxWorker(database)
+        _worker.start()
+    return _worker
+
+
+async def stop_outbox_worker() -> None:
+    global _worker, _wakeup
+    if _worker is not None:
+        await _worker.stop()
+        _worker = None
+    _wakeup = None
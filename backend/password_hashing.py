@@ -0,0 +1,61 @@
+"""
+Hachage des mots de passe hors de la boucle asyncio.
+
+pbkdf2_sha256 (passlib) est volontairement coûteux (~50-100 ms par appel).
+Exécuté directement dans un endpoint async, il bloque toutes les autres
+requêtes du worker : un pic de connexions en début de service gèle l'API.
+
+Les fonctions de ce module exécutent le hachage dans un pool de threads
+dédié, borné par PASSWORD_HASH_CONCURRENCY (défaut : min(4, nb CPU)).
+hashlib.pbkdf2_hmac libère le GIL, les threads travaillent donc en parallèle
+sans bloquer la boucle d'événements.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+PASSWORD_HASH_CONCURRENCY = int(
+    os.environ.get("PASSWORD_HASH_CONCURRENCY", str(min(4, os.cpu_count() or 1)))
+)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_hash_executor() -> ThreadPoolExecutor:
+    """Lazy initialization du pool de threads de hachage"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, PASSWORD_HASH_CONCURRENCY),
+            thread_name_prefix="password-hash"
+        )
+    return _executor
+
+
+async def run_in_hash_pool(func: Callable[..., T], *args) -> T:
+    """Exécute une fonction de hachage synchrone dans le pool dédié"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), func, *args)
+
+
+async def verify_password_async(pwd_context, plain_password: str, hashed_password: Optional[str]) -> bool:
+    """Vérifie un mot de passe sans bloquer la boucle d'événements"""
+    if not hashed_password:
+        return False
+    return await run_in_hash_pool(pwd_context.verify, plain_password, hashed_password)
+
+
+async def hash_password_async(pwd_context, password: str) -> str:
+    """Hash un mot de passe sans bloquer la boucle d'événements"""
+    return await run_in_hash_pool(pwd_context.hash, password)
+
+
+def shutdown_hash_executor() -> None:
+    """Arrête le pool (appelé à l'arrêt de l'application)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
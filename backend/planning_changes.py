@@ -0,0 +1,183 @@
+"""
+Journal des modifications du planning (collection planning_changes) et synchronisation différentielle.
+
+Chaque mutation d'un créneau (création, modification, suppression, effets d'un
+congé, demandes de travail approuvées / annulées) ajoute une entrée compacte :
+{"centre_id", "seq", "action": "upsert" | "delete", "creneau_id", "date", "at"}
+
+- seq est monotone par centre : un compteur (collection counters) incrémenté
+  atomiquement de la taille du lot, puis un insert_many par centre
+- GET /api/planning/changes?since=<seq> retourne uniquement les créneaux modifiés
+  depuis seq (état actuel) et les identifiants supprimés
+- Réservation et insert_many sont deux écritures : un écrivain concurrent peut
+  publier N+2 avant N+1. La réponse s'arrête au premier trou (seq = dernière entrée
+  contiguë, has_more=True, retry_after_ms) ; un trou plus ancien que
+  PLANNING_CHANGES_GAP_GRACE_S (écrivain interrompu entre les deux) est sauté
+- Les entrées de plus de PLANNING_CHANGES_TTL_DAYS jours sont supprimées (index TTL) :
+  un client plus ancien reçoit reset=True et recharge le planning complet
+"""
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from resource_versions import PLANNING, resource_versions
+
+PLANNING_CHANGES_TTL_DAYS = int(os.environ.get('PLANNING_CHANGES_TTL_DAYS', '30'))
+PLANNING_CHANGES_MAX_PAGE = 1000
+# Délai au-delà duquel un numéro réservé mais jamais inséré est considéré comme perdu
+PLANNING_CHANGES_GAP_GRACE_S = float(os.environ.get('PLANNING_CHANGES_GAP_GRACE_S', '10'))
+# Délai conseillé au client avant de rappeler quand la page s'arrête sur un trou
+PLANNING_CHANGES_GAP_RETRY_MS = 250
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+# Créneaux sans centre (anciennes données)
+SANS_CENTRE = ""
+
+
+def _counter_id(centre_id: str) -> str:
+    return f"planning_changes:{centre_id}"
+
+
+PLANNING_CHANGES_INDEXES = [
+    {"keys": [("centre_id", 1), ("seq", 1)], "name": "planning_changes_centre_seq", "unique": True},
+    {"keys": [("at", 1)], "name": "planning_changes_ttl_at", "expireAfterSeconds": PLANNING_CHANGES_TTL_DAYS * 24 * 3600},
+]
+
+
+async def ensure_planning_changes_indexes(database) -> None:
+    for spec in PLANNING_CHANGES_INDEXES:
+        await database.planning_changes.create_index(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"})
+
+
+async def _reserve_seq(database, centre_id: str, count: int) -> int:
+    """Réserve `count` numéros consécutifs pour un centre. Retourne le dernier."""
+    compteur = await database.counters.find_one_and_update(
+        {"id": _counter_id(centre_id)},
+        {"$inc": {"seq": count}},
+        projection={"_id": 0, "seq": 1},
+        upsert=True,
+        return_document=True  # ReturnDocument.AFTER
+    )
+    return compteur["seq"]
+
+
+async def record_changes(database, slots: Iterable[Dict[str, Any]], action: str) -> Dict[str, int]:
+    """
+    Journalise une mutation de créneaux (dicts avec id, centre_id, date).
+    Une réservation de numéros et un insert_many par centre concerné.
+    Retourne le dernier seq attribué à chaque centre.
+    """
+    par_centre: Dict[str, List[Dict[str, Any]]] = {}
+    for slot in slots:
+        if slot and slot.get("id"):
+            par_centre.setdefault(slot.get("centre_id") or SANS_CENTRE, []).append(slot)
+
+    now = datetime.now(timezone.utc)
+    derniers = {}
+    for centre_id, centre_slots in par_centre.items():
+        dernier = await _reserve_seq(database, centre_id, len(centre_slots))
+        premier = dernier - len(centre_slots) + 1
+        await database.planning_changes.insert_many([
+            {"centre_id": centre_id, "seq": premier + i, "action": action,
+             "creneau_id": slot["id"], "date": slot.get("date"), "at": now}
+            for i, slot in enumerate(centre_slots)
+        ], ordered=False)
+        derniers[centre_id] = dernier
+    if par_centre:
+        # ETags des vues du planning (créneaux sans centre : tous les centres)
+        await resource_versions.bump(PLANNING, *par_centre)
+    return derniers
+
+
+async def record_slot_update(database, before: Dict[str, Any], after_centre_id: Optional[str], after_date: Optional[str]) -> None:
+    """Modification d'un créneau ; un changement de centre le retire du journal de l'ancien centre"""
+    apres = {"id": before["id"], "centre_id": after_centre_id, "date": after_date}
+    if (before.get("centre_id") or SANS_CENTRE) != (after_centre_id or SANS_CENTRE):
+        await record_changes(database, [before], DELETE)
+    await record_changes(database, [apres], UPSERT)
+
+
+async def _needs_reset(database, centre_id: str, since: int) -> Optional[int]:
+    """
+    Numéro courant du centre si des entrées postérieures à `since` ont expiré
+    (le client doit tout recharger), sinon None.
+    """
+    plus_ancien = await database.planning_changes.find(
+        {"centre_id": centre_id}, {"_id": 0, "seq": 1}
+    ).sort("seq", 1).limit(1).to_list(1)
+    compteur = await database.counters.find_one({"id": _counter_id(centre_id)}, {"_id": 0, "seq": 1})
+    courant = compteur["seq"] if compteur else 0
+    if since > courant:
+        return courant  # curseur d'une autre base ou d'un compteur réinitialisé
+    if plus_ancien:
+        return courant if since < plus_ancien[0]["seq"] - 1 else None
+    return courant if since < courant else None
+
+
+def _contiguous(entrees: List[Dict[str, Any]], since: int, now: datetime):
+    """
+    Entrées contiguës à partir de since + 1. Retourne (entrées, en_attente) :
+    en_attente est vrai si la lecture s'arrête sur un numéro pas encore inséré.
+    """
+    attendu = since + 1
+    for i, entree in enumerate(entrees):
+        if entree["seq"] != attendu:
+            at = entree.get("at")
+            if at is not None and at.tzinfo is None:
+                at = at.replace(tzinfo=timezone.utc)  # datetimes naïfs (UTC) de pymongo
+            if at is None or (now - at).total_seconds() < PLANNING_CHANGES_GAP_GRACE_S:
+                return entrees[:i], True
+            # Trou ancien : réservation abandonnée, jamais comblée
+        attendu = entree["seq"] + 1
+    return entrees, False
+
+
+async def get_changes(database, centre_id: Optional[str], since: int,
+                      limit: int = PLANNING_CHANGES_MAX_PAGE) -> Dict[str, Any]:
+    """
+    Créneaux modifiés d'un centre depuis `since` : une requête sur le journal, une sur le planning.
+    Le client rappelle avec since=seq tant que has_more est vrai (après retry_after_ms
+    millisecondes si la page s'arrête sur une écriture en cours).
+    """
+    centre_id = centre_id or SANS_CENTRE
+    since = max(0, since)
+    limit = max(1, min(limit, PLANNING_CHANGES_MAX_PAGE))
+    entrees = await database.planning_changes.find(
+        {"centre_id": centre_id, "seq": {"$gt": since}},
+        {"_id": 0, "seq": 1, "action": 1, "creneau_id": 1, "at": 1}
+    ).sort("seq", 1).limit(limit + 1).to_list(limit + 1)
+
+    # Journal contigu depuis since : pas besoin de vérifier l'expiration
+    if not entrees or entrees[0]["seq"] != since + 1:
+        courant = await _needs_reset(database, centre_id, since)
+        if courant is not None:
+            return {"centre_id": centre_id, "since": since, "seq": courant, "reset": True,
+                    "has_more": False, "retry_after_ms": None, "creneaux": [], "supprimes": []}
+
+    has_more = len(entrees) > limit
+    # Jamais au-delà d'un numéro manquant : le client le recevra au prochain appel
+    entrees, en_attente = _contiguous(entrees[:limit], since, datetime.now(timezone.utc))
+    # Dernière action de chaque créneau
+    dernieres = {}
+    for entree in entrees:
+        dernieres[entree["creneau_id"]] = entree["action"]
+    a_lire = [cid for cid, action in dernieres.items() if action == UPSERT]
+    creneaux = await database.planning.find(
+        {"id": {"$in": a_lire}}, {"_id": 0}
+    ).to_list(None) if a_lire else []
+    trouves = {c["id"] for c in creneaux}
+    # Créneau modifié puis supprimé par une écriture non journalisée : supprimé pour le client
+    supprimes = [cid for cid, action in dernieres.items() if action == DELETE or cid not in trouves]
+
+    return {
+        "centre_id": centre_id,
+        "since": since,
+        "seq": entrees[-1]["seq"] if entrees else since,
+        "reset": False,
+        "has_more": has_more or en_attente,
+        "retry_after_ms": PLANNING_CHANGES_GAP_RETRY_MS if en_attente else None,
+        "creneaux": creneaux,
+        "supprimes": supprimes
+    }
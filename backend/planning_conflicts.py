@@ -0,0 +1,232 @@
+"""
+Contrôle atomique des conflits du planning par index uniques MongoDB.
+
+Deux index uniques partiels garantissent qu'un créneau (centre, date, demi-journée)
+ne contient jamais deux fois le même employé ni deux fois la même salle :
+- uniq_planning_employe_creneau : (centre_id, date, creneau, employe_id)
+- uniq_planning_salle_creneau   : (centre_id, date, creneau, salle_attribuee)
+
+Les créations de créneaux passent par `insert_planning_slot` : l'insertion est
+tentée directement et une DuplicateKeyError est traduite en type de conflit.
+Plus de find_one préalable, et deux directeurs qui attribuent le même créneau
+en même temps ne peuvent plus créer de doublon.
+
+Les créations groupées (`insert_planning_slots`) détectent les conflits en mémoire
+via `PlanningOccupancy` (une seule requête sur la plage de dates), puis insèrent
+tout en un `insert_many(ordered=False)` : les index restent le garde-fou final.
+
+Les créneaux legacy sans centre_id (ou sans salle) sont hors du filtre partiel :
+pour eux, et tant que les index n'ont pas pu être créés (doublons historiques
+en base), on garde l'ancienne vérification par find_one.
+
+Si la création au démarrage n'a pas eu lieu ou a échoué (MongoDB injoignable au
+démarrage, doublons), les écritures revérifient les index (index_information,
+puis création) au plus une fois toutes les PLANNING_INDEX_RETRY_SECONDS secondes.
+"""
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+CONFLIT_EMPLOYE = "employe"
+CONFLIT_SALLE = "salle"
+
+PLANNING_UNIQUE_INDEXES = [
+    {
+        "name": "uniq_planning_employe_creneau",
+        "keys": [("centre_id", 1), ("date", 1), ("creneau", 1), ("employe_id", 1)],
+        "partialFilterExpression": {
+            "centre_id": {"$type": "string"},
+            "employe_id": {"$type": "string"},
+        },
+        "conflit": CONFLIT_EMPLOYE,
+    },
+    {
+        "name": "uniq_planning_salle_creneau",
+        "keys": [("centre_id", 1), ("date", 1), ("creneau", 1), ("salle_attribuee", 1)],
+        "partialFilterExpression": {
+            "centre_id": {"$type": "string"},
+            "salle_attribuee": {"$gt": ""},
+        },
+        "conflit": CONFLIT_SALLE,
+    },
+]
+
+PLANNING_INDEX_RETRY_SECONDS = float(os.environ.get('PLANNING_INDEX_RETRY_SECONDS', '60'))
+
+# Passe à True une fois les deux index créés ou trouvés en base
+_indexes_ready = False
+# Prochaine revérification par refresh_indexes_ready (time.monotonic)
+_next_check = 0.0
+
+
+def indexes_ready() -> bool:
+    return _indexes_ready
+
+
+async def ensure_planning_unique_indexes(database) -> bool:
+    """
+    Crée les index uniques du planning (idempotent, appelé au démarrage).
+    Lève RuntimeError si la création échoue : la vérification par requête est conservée.
+    """
+    global _indexes_ready
+    try:
+        for spec in PLANNING_UNIQUE_INDEXES:
+            await database.planning.create_index(
+                spec["keys"],
+                name=spec["name"],
+                unique=True,
+                partialFilterExpression=spec["partialFilterExpression"],
+            )
+    except Exception as e:
+        # Typiquement : doublons déjà présents en base. On reste sur les vérifications find_one.
+        _indexes_ready = False
+        raise RuntimeError(f"index uniques non créés ({e}) - vérification par requête conservée") from e
+    _indexes_ready = True
+    return True
+
+
+async def refresh_indexes_ready(database) -> bool:
+    """
+    Index non confirmés (démarrage sans MongoDB, création en échec) : vérifie s'ils
+    existent en base, sinon tente de les créer. Au plus une fois par PLANNING_INDEX_RETRY_SECONDS.
+    """
+    global _indexes_ready, _next_check
+    if _indexes_ready or time.monotonic() < _next_check:
+        return _indexes_ready
+    _next_check = time.monotonic() + PLANNING_INDEX_RETRY_SECONDS
+    try:
+        existants = await database.planning.index_information()
+        if all(spec["name"] in existants for spec in PLANNING_UNIQUE_INDEXES):
+            _indexes_ready = True
+        else:
+            await ensure_planning_unique_indexes(database)
+        print("✅ [PLANNING] Index uniques des créneaux actifs", flush=True)
+    except Exception as e:
+        print(f"⚠️ [PLANNING] {e}", flush=True)
+    return _indexes_ready
+
+
+def _conflict_from_key(key_pattern: Optional[Dict[str, Any]], message: str) -> str:
+    key_pattern = key_pattern or {}
+    if "salle_attribuee" in key_pattern:
+        return CONFLIT_SALLE
+    if "employe_id" in key_pattern:
+        return CONFLIT_EMPLOYE
+    for spec in PLANNING_UNIQUE_INDEXES:
+        if spec["name"] in message:
+            return spec["conflit"]
+    return CONFLIT_EMPLOYE
+
+
+def conflict_from_error(error: DuplicateKeyError) -> str:
+    """Type de conflit (employe/salle) correspondant à une erreur de clé dupliquée"""
+    details = getattr(error, "details", None) or {}
+    return _conflict_from_key(details.get("keyPattern"), str(error))
+
+
+def _covered_by_indexes(slot: Dict[str, Any]) -> bool:
+    return _indexes_ready and isinstance(slot.get("centre_id"), str)
+
+
+async def _legacy_conflict(database, slot: Dict[str, Any]) -> Optional[str]:
+    """Ancienne vérification par find_one (créneaux sans centre ou index absents)"""
+    existing = await database.planning.find_one({
+        "date": slot["date"],
+        "creneau": slot["creneau"],
+        "employe_id": slot["employe_id"]
+    }, {"_id": 0, "id": 1})
+    if existing:
+        return CONFLIT_EMPLOYE
+    if slot.get("salle_attribuee"):
+        salle_occupee = await database.planning.find_one({
+            "date": slot["date"],
+            "creneau": slot["creneau"],
+            "salle_attribuee": slot["salle_attribuee"]
+        }, {"_id": 0, "id": 1})
+        if salle_occupee:
+            return CONFLIT_SALLE
+    return None
+
+
+async def insert_planning_slot(database, slot: Dict[str, Any]) -> Optional[str]:
+    """
+    Insère un créneau de planning.
+    Retourne None si le créneau est créé, sinon le type de conflit (CONFLIT_EMPLOYE / CONFLIT_SALLE).
+    """
+    await refresh_indexes_ready(database)
+    if not _covered_by_indexes(slot):
+        conflit = await _legacy_conflict(database, slot)
+        if conflit:
+            return conflit
+    try:
+        await database.planning.insert_one(slot)
+    except DuplicateKeyError as e:
+        return conflict_from_error(e)
+    return None
+
+
+class PlanningOccupancy:
+    """Occupation employés/salles d'une plage de dates, chargée en une seule requête"""
+
+    def __init__(self):
+        self._par_centre = set()
+        self._global = set()
+
+    @classmethod
+    async def load(cls, database, dates: Iterable[str]) -> "PlanningOccupancy":
+        await refresh_indexes_ready(database)
+        occupancy = cls()
+        dates = [d for d in dates if d]
+        if dates:
+            existing = await database.planning.find(
+                {"date": {"$gte": min(dates), "$lte": max(dates)}},
+                {"_id": 0, "centre_id": 1, "date": 1, "creneau": 1, "employe_id": 1, "salle_attribuee": 1}
+            ).to_list(None)
+            for slot in existing:
+                occupancy.reserve(slot)
+        return occupancy
+
+    @staticmethod
+    def _keys(slot: Dict[str, Any]):
+        base = (slot.get("date"), slot.get("creneau"))
+        yield CONFLIT_EMPLOYE, base + (slot.get("employe_id"),)
+        if slot.get("salle_attribuee"):
+            yield CONFLIT_SALLE, base + (slot["salle_attribuee"],)
+
+    def conflict(self, slot: Dict[str, Any]) -> Optional[str]:
+        """Même règle que les index : par centre si couvert, sinon ancienne règle globale"""
+        par_centre = _covered_by_indexes(slot)
+        for conflit, key in self._keys(slot):
+            if par_centre and (conflit, slot["centre_id"]) + key in self._par_centre:
+                return conflit
+            if not par_centre and (conflit,) + key in self._global:
+                return conflit
+        return None
+
+    def reserve(self, slot: Dict[str, Any]) -> None:
+        for conflit, key in self._keys(slot):
+            self._global.add((conflit,) + key)
+            if isinstance(slot.get("centre_id"), str):
+                self._par_centre.add((conflit, slot["centre_id"]) + key)
+
+
+async def insert_planning_slots(database, slots: List[Dict[str, Any]]) -> Dict[int, str]:
+    """
+    Insère plusieurs créneaux en un seul insert_many non ordonné.
+    Retourne {position dans slots: type de conflit} pour les créneaux refusés par les index
+    (écriture concurrente entre la lecture de l'occupation et l'insertion).
+    """
+    if not slots:
+        return {}
+    try:
+        await database.planning.insert_many(slots, ordered=False)
+    except BulkWriteError as e:
+        conflicts = {}
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                raise
+            conflicts[error["index"]] = _conflict_from_key(error.get("keyPattern"), error.get("errmsg", ""))
+        return conflicts
+    return {}
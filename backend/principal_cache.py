@@ -0,0 +1,101 @@
+"""
+Cache en mémoire des utilisateurs authentifiés (principal).
+
+`get_current_user` est appelé par chaque requête authentifiée : sans cache,
+chaque appel fait un `db.users.find_one` puis construit un modèle `User`
+complet. Ce cache garde le `User` validé pendant quelques secondes
+(TTL court) avec une taille bornée (LRU).
+
+Toute modification d'un utilisateur doit appeler `principal_cache.invalidate(user_id)`
+pour que le changement (rôle, désactivation, centre actif...) soit pris en
+compte immédiatement.
+
+Configuration (variables d'environnement) :
+- PRINCIPAL_CACHE_TTL : durée de vie en secondes (défaut 30, 0 = désactivé)
+- PRINCIPAL_CACHE_SIZE : nombre maximum d'utilisateurs en cache (défaut 1000)
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional
+
+
+class PrincipalCache:
+    """Cache LRU avec expiration, indexé par user id"""
+
+    def __init__(self, ttl_seconds: float = 30, max_size: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_size > 0
+
+    def get(self, user_id: str) -> Optional[Any]:
+        """Retourne une copie du principal en cache, ou None (miss/expiré)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, principal = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+        # Copie profonde : les endpoints modifient parfois current_user (ex: centre_ids)
+        return principal.model_copy(deep=True)
+
+    def set(self, user_id: str, principal: Any) -> None:
+        if not self.enabled:
+            return
+        principal = principal.model_copy(deep=True)
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *user_ids: Optional[str]) -> None:
+        """Retire un ou plusieurs utilisateurs du cache (après une modification)"""
+        with self._lock:
+            for user_id in user_ids:
+                if user_id and self._entries.pop(user_id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        """Vide le cache (modifications en masse : migrations, init...)"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+principal_cache = PrincipalCache(
+    ttl_seconds=float(os.environ.get("PRINCIPAL_CACHE_TTL", "30")),
+    max_size=int(os.environ.get("PRINCIPAL_CACHE_SIZE", "1000")),
+)
@@ -0,0 +1,233 @@
+"""
+Appareils enregistrés pour les notifications push (collection push_devices).
+
+Un document par token FCM, identifié par le hash du token (token_hash, unique) :
+- enregistrement / mise à jour atomique par upsert (plus de réécriture du
+  tableau users.fcm_devices, sans course entre deux appareils)
+- index sur user_id et centre_id : les envois groupés lisent les tokens en une
+  requête indexée, sans charger les documents utilisateurs
+- `actif` recopie le statut de l'utilisateur (désactivé -> plus d'envoi)
+- last_used est rafraîchi à chaque enregistrement et après chaque envoi réussi
+  (touch_tokens, au plus une écriture par appareil et par LAST_USED_REFRESH_HOURS) ;
+  un index TTL supprime les appareils inutilisés depuis PUSH_DEVICE_TTL_DAYS jours
+- migrate_embedded_devices() reprend les anciens users.fcm_devices / fcm_token
+  (last_used = date de migration : l'ancien horodatage ne doit pas déclencher le TTL)
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+PUSH_DEVICE_TTL_DAYS = int(os.environ.get('PUSH_DEVICE_TTL_DAYS', '120'))
+# last_used n'est réécrit après un envoi réussi que s'il date de plus de N heures
+LAST_USED_REFRESH_HOURS = int(os.environ.get('PUSH_LAST_USED_REFRESH_HOURS', '24'))
+# Nombre maximum d'appareils par utilisateur (les plus anciens sont retirés)
+MAX_DEVICES_PER_USER = 5
+MIGRATION_ID = "push_devices_v1"
+
+# Tokens générés par le frontend quand Firebase est indisponible : jamais envoyés à FCM
+TOKENS_ENVOYABLES = {"local": {"$ne": True}}
+
+_PROJECTION_PUBLIQUE = {"_id": 0, "token_hash": 0}
+
+
+def token_hash(fcm_token: str) -> str:
+    return hashlib.sha256(fcm_token.encode()).hexdigest()
+
+
+def device_id_for(fcm_token: str) -> str:
+    """Identifiant court utilisé par l'API (DELETE /notifications/devices/{device_id})"""
+    return hashlib.md5(fcm_token.encode()).hexdigest()[:12]
+
+
+# Index de la collection (déclarés aussi dans index_registry)
+PUSH_DEVICES_INDEXES = [
+    {"keys": [("token_hash", 1)], "name": "push_devices_token_hash", "unique": True},
+    {"keys": [("user_id", 1), ("last_used", -1)], "name": "push_devices_user_id"},
+    {"keys": [("centre_id", 1), ("actif", 1)], "name": "push_devices_centre_id"},
+    {"keys": [("actif", 1), ("user_id", 1)], "name": "push_devices_actif_user_id"},
+    {"keys": [("last_used", 1)], "name": "push_devices_ttl_last_used",
+     "expireAfterSeconds": PUSH_DEVICE_TTL_DAYS * 24 * 3600},
+]
+
+
+async def ensure_push_devices_indexes(database) -> None:
+    for spec in PUSH_DEVICES_INDEXES:
+        await database.push_devices.create_index(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"})
+
+
+def _device_fields(fcm_token: str, device_info: Optional[Dict[str, Any]], centre_id: Optional[str]) -> Dict[str, Any]:
+    device_info = device_info or {}
+    return {
+        "device_id": device_id_for(fcm_token),
+        "fcm_token": fcm_token,
+        "local": fcm_token.startswith("local_"),
+        "user_agent": device_info.get("userAgent", device_info.get("user_agent", "Inconnu")),
+        "platform": device_info.get("platform", "Inconnu"),
+        "device_name": device_info.get("deviceName", device_info.get("device_name", "Appareil inconnu")),
+        "browser": device_info.get("browser", "Inconnu"),
+        "os": device_info.get("os", "Inconnu"),
+        "centre_id": centre_id,
+    }
+
+
+async def register_device(database, user_id: str, fcm_token: str, device_info: Optional[Dict[str, Any]] = None,
+                          centre_id: Optional[str] = None, actif: bool = True) -> Dict[str, Any]:
+    """
+    Enregistre (ou rattache à user_id) l'appareil de ce token : un upsert atomique.
+    Au-delà de MAX_DEVICES_PER_USER appareils, les moins récemment utilisés sont retirés.
+    """
+    now = datetime.now(timezone.utc)
+    fields = _device_fields(fcm_token, device_info, centre_id)
+    await database.push_devices.update_one(
+        {"token_hash": token_hash(fcm_token)},
+        {
+            "$set": {**fields, "user_id": user_id, "actif": actif, "last_used": now},
+            "$setOnInsert": {"registered_at": now}
+        },
+        upsert=True
+    )
+    devices = await list_user_devices(database, user_id)
+    if len(devices) > MAX_DEVICES_PER_USER:
+        anciens = [d["fcm_token"] for d in devices[MAX_DEVICES_PER_USER:]]
+        await remove_tokens(database, anciens)
+        devices = devices[:MAX_DEVICES_PER_USER]
+    return {"device": {**fields, "last_used": now}, "total_devices": len(devices)}
+
+
+async def list_user_devices(database, user_id: str) -> List[Dict[str, Any]]:
+    """Appareils d'un utilisateur, du plus récemment utilisé au plus ancien"""
+    return await database.push_devices.find(
+        {"user_id": user_id}, _PROJECTION_PUBLIQUE
+    ).sort("last_used", -1).to_list(None)
+
+
+async def remove_device(database, user_id: str, device_id: str) -> bool:
+    result = await database.push_devices.delete_one({"user_id": user_id, "device_id": device_id})
+    return result.deleted_count > 0
+
+
+async def remove_user_devices(database, user_id: str) -> int:
+    result = await database.push_devices.delete_many({"user_id": user_id})
+    return result.deleted_count
+
+
+async def remove_tokens(database, tokens: Iterable[str]) -> int:
+    """Supprime les appareils de ces tokens (une requête). Retourne le nombre supprimé."""
+    hashes = [token_hash(t) for t in dict.fromkeys(tokens) if t]
+    if not hashes:
+        return 0
+    result = await database.push_devices.delete_many({"token_hash": {"$in": hashes}})
+    return result.deleted_count
+
+
+async def touch_tokens(database, tokens: Iterable[str]) -> int:
+    """
+    Rafraîchit last_used des appareils de ces tokens (livraison réussie) : un update_many,
+    limité aux appareils non rafraîchis depuis LAST_USED_REFRESH_HOURS heures.
+    """
+    hashes = [token_hash(t) for t in dict.fromkeys(tokens) if t]
+    if not hashes:
+        return 0
+    now = datetime.now(timezone.utc)
+    result = await database.push_devices.update_many(
+        {"token_hash": {"$in": hashes}, "last_used": {"$lt": now - timedelta(hours=LAST_USED_REFRESH_HOURS)}},
+        {"$set": {"last_used": now}}
+    )
+    return result.modified_count
+
+
+async def set_user_devices_active(database, user_id: str, actif: bool) -> None:
+    """Recopie le statut actif de l'utilisateur sur ses appareils"""
+    await database.push_devices.update_many({"user_id": user_id}, {"$set": {"actif": actif}})
+
+
+async def tokens_by_user(database, user_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """Tokens envoyables de plusieurs utilisateurs actifs : une requête indexée (user_id)"""
+    user_ids = list(dict.fromkeys(u for u in user_ids if u))
+    if not user_ids:
+        return {}
+    devices = await database.push_devices.find(
+        {"user_id": {"$in": user_ids}, "actif": True, **TOKENS_ENVOYABLES},
+        {"_id": 0, "user_id": 1, "fcm_token": 1}
+    ).to_list(None)
+    tokens: Dict[str, List[str]] = {}
+    for device in devices:
+        tokens.setdefault(device["user_id"], []).append(device["fcm_token"])
+    return tokens
+
+
+async def tokens_for_users(database, user_ids: Iterable[str]) -> List[str]:
+    """Tokens envoyables (dédoublonnés) d'un ensemble d'utilisateurs"""
+    par_user = await tokens_by_user(database, user_ids)
+    return list(dict.fromkeys(t for tokens in par_user.values() for t in tokens))
+
+
+def _embedded_devices(user: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Appareils d'un ancien document utilisateur (fcm_devices, sinon fcm_token + device_info)"""
+    devices = [d for d in user.get("fcm_devices") or [] if d.get("fcm_token")]
+    if not devices and user.get("fcm_token"):
+        devices = [{**(user.get("device_info") or {}), "fcm_token": user["fcm_token"]}]
+    return devices
+
+
+def _as_datetime(value, defaut: datetime) -> datetime:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return defaut
+
+
+async def migrate_embedded_devices(database, force: bool = False) -> int:
+    """
+    Copie users.fcm_devices / fcm_token dans push_devices (upserts groupés, idempotent).
+    Exécutée une fois (marqueur dans la collection migrations) sauf si force=True.
+    Retourne le nombre d'appareils repris.
+    """
+    from pymongo import UpdateOne
+
+    if not force and await database.migrations.find_one({"id": MIGRATION_ID}):
+        return 0
+
+    users = await database.users.find(
+        {"$or": [{"fcm_devices.0": {"$exists": True}}, {"fcm_token": {"$exists": True, "$nin": [None, ""]}}]},
+        {"_id": 0, "id": 1, "actif": 1, "centre_id": 1, "fcm_token": 1, "fcm_devices": 1, "device_info": 1, "fcm_updated_at": 1}
+    ).to_list(None)
+
+    now = datetime.now(timezone.utc)
+    operations = []
+    for user in users:
+        for device in _embedded_devices(user):
+            fcm_token = device["fcm_token"]
+            # Horodatage d'origine conservé pour registered_at seulement : last_used = maintenant,
+            # sinon l'index TTL purgerait aussitôt les appareils enregistrés il y a longtemps
+            enregistre = _as_datetime(device.get("last_used") or user.get("fcm_updated_at"), now)
+            fields = _device_fields(fcm_token, device, device.get("centre_id") or user.get("centre_id"))
+            fields["device_id"] = device.get("device_id") or fields["device_id"]
+            operations.append(UpdateOne(
+                {"token_hash": token_hash(fcm_token)},
+                {"$setOnInsert": {
+                    **fields,
+                    "token_hash": token_hash(fcm_token),
+                    "user_id": user["id"],
+                    "actif": user.get("actif", True),
+                    "last_used": now,
+                    "registered_at": _as_datetime(device.get("registered_at"), enregistre)
+                }},
+                upsert=True
+            ))
+
+    if operations:
+        await database.push_devices.bulk_write(operations, ordered=False)
+    await database.migrations.update_one(
+        {"id": MIGRATION_ID},
+        {"$set": {"id": MIGRATION_ID, "done_at": now, "devices": len(operations)}},
+        upsert=True
+    )
+    print(f"📱 [MIGRATION] {len(operations)} appareil(s) repris dans push_devices ({len(users)} utilisateurs)")
+    return len(operations)
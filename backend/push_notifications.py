@@ -1,5 +1,5 @@
 """
-Module pour gérer les notifications push via Firebase Admin SDK
+Module pour gérer les notifications push Firebase (envoi via push_transport)
 Supporte les credentials via:
 1. Variable d'environnement FIREBASE_CREDENTIALS (JSON string) - recommandé pour Render
 2. Fichier firebase-credentials.json (fallback)
@@ -8,14 +8,20 @@ Inclut aussi Firebase Storage pour les uploads d'images
 
 IMPORTANT: Tous les imports Firebase sont LAZY pour permettre un démarrage rapide du serveur
 """
+import asyncio
 import os
 import json
 import logging
 import tempfile
-import time
 import uuid
 from datetime import datetime, timezone
 
+from metrics import metrics
+from push_transport import (
+    FCM_MULTICAST_LIMIT, TOKEN_INVALIDE, TRANSITOIRE, PushResult, build_push_message, chunks,
+    classify_results, get_push_transport
+)
+
 # IMPORTS FIREBASE LAZY - Ne pas importer au niveau module pour éviter de bloquer le démarrage
 _firebase_admin = None
 _credentials = None
@@ -54,6 +60,14 @@ logger = logging.getLogger(__name__)
 # Configuration Storage
 FIREBASE_STORAGE_BUCKET = os.environ.get('FIREBASE_STORAGE_BUCKET', 'cabinet-medical-ope.firebasestorage.app')
 
+# Envoi groupé (send_push_batch) : nombre de lots de FCM_MULTICAST_LIMIT (500) tokens au plus
+# traités en parallèle. Les requêtes HTTP/2 de chaque lot passent par le client httpx du
+# transport, dont la concurrence est bornée séparément par PUSH_HTTP_CONCURRENCY
+PUSH_SEND_CONCURRENCY = max(1, int(os.environ.get('PUSH_SEND_CONCURRENCY', '4')))
+
+# Compteurs cumulés depuis le démarrage (exposés par /notifications/firebase-status)
+_compteurs = {"envois_reussis": 0, "envois_echoues": 0, "a_reessayer": 0, "tokens_supprimes": 0}
+
 # Initialisation Firebase Admin SDK
 _firebase_app = None
 _storage_bucket = None
@@ -151,9 +165,9 @@ def get_firebase_status():
     }
 
 
-async def send_push_notification(fcm_token: str, title: str, body: str, data: dict = None):
+async def send_push_notification(fcm_token: str, title: str, body: str, data: dict = None, database=None):
     """
-    Envoie une notification push à un utilisateur via Firebase Admin SDK
+    Envoie une notification push à un utilisateur via le transport push (push_transport)
     avec support des actions (réponse rapide pour les messages de chat)
     
     Args:
@@ -163,207 +177,196 @@ async def send_push_notification(fcm_token: str, title: str, body: str, data: di
         data: Données supplémentaires (optionnel)
             - type: "chat_message" active les actions de réponse rapide
             - requires_reply: "true" pour afficher l'action de réponse
+        database: Si fourni, un token définitivement invalide est supprimé de l'utilisateur
     
     Returns:
         bool: True si envoyé avec succès, False sinon
     """
-    global _firebase_app
-    
-    # Initialiser Firebase si pas déjà fait (LAZY)
-    if _firebase_app is None:
-        initialize_firebase()
-    
-    if _firebase_app is None:
+    transport = get_push_transport()
+    if transport is None:
         logger.warning("Firebase non initialisé, notification push non envoyée")
         return False
     
-    # Import lazy pour avoir messaging
-    _, _, messaging = _lazy_import_firebase()
+    message = build_push_message(title, body, data)
+    
+    logger.debug("push: envoi", extra={
+        "transport": transport.name, "title": title, "token": fcm_token[:12], "data_keys": list(message["data"])
+    })
     
     try:
-        # Préparer les données
-        notification_data = {k: str(v) for k, v in (data or {}).items()}
-        
-        # Configurer les actions selon le type de notification
-        actions = []
-        if notification_data.get("type") == "chat_message" and notification_data.get("requires_reply") == "true":
-            # Ajouter l'action de réponse rapide pour les messages de chat
-            actions = [
-                {
-                    "action": "reply",
-                    "title": "Répondre",
-                    "type": "text",
-                    "placeholder": "Tapez votre réponse..."
-                },
-                {
-                    "action": "open",
-                    "title": "Ouvrir"
-                }
-            ]
-        
-        # Construire la configuration webpush
-        # IMPORTANT: Utiliser un tag UNIQUE pour chaque notification (sinon elles se remplacent)
-        unique_tag = f"notif-{int(time.time() * 1000)}-{notification_data.get('type', 'default')}"
-        
-        webpush_notification_config = {
-            "title": title,  # CRITIQUE: Inclure le titre dans webpush
-            "body": body,    # CRITIQUE: Inclure le corps dans webpush
-            "icon": "/icon-192.png",
-            "badge": "/icon-192.png",
-            "require_interaction": True,
-            "vibrate": [200, 100, 200],
-            "tag": unique_tag,  # Tag unique pour chaque notification
-            "renotify": True
-        }
-        
-        # Ajouter les actions si disponibles
-        if actions:
-            webpush_notification_config["actions"] = actions
-        
-        # Construire le message
-        # Récupérer l'URL frontend pour le lien de la notification
-        frontend_url = os.environ.get('FRONTEND_URL', '').strip()
-        
-        # IMPORTANT: Inclure title et body dans data pour que le SW puisse les lire
-        # même si Firebase gère automatiquement le notification payload
-        notification_data["title"] = title
-        notification_data["body"] = body
-        
-        # Construire la config webpush avec ou sans lien selon la disponibilité
-        webpush_config_args = {
-            "notification": messaging.WebpushNotification(**webpush_notification_config)
-        }
-        
-        # Ajouter le lien seulement si FRONTEND_URL est configuré avec HTTPS
-        if frontend_url and frontend_url.startswith('https://'):
-            webpush_config_args["fcm_options"] = messaging.WebpushFCMOptions(
-                link=frontend_url
-            )
-        elif frontend_url:
-            logger.warning(f"⚠️ FRONTEND_URL ({frontend_url}) n'utilise pas HTTPS, lien non inclus dans la notification")
-        
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body
-            ),
-            data=notification_data,
-            token=fcm_token,
-            webpush=messaging.WebpushConfig(**webpush_config_args)
-        )
-        
-        # Log détaillé pour debug
-        print("📤 [PUSH] Envoi notification:")
-        print(f"   - Title: {title}")
-        print(f"   - Body: {body[:50]}..." if len(body) > 50 else f"   - Body: {body}")
-        print(f"   - Token: {fcm_token[:40]}...")
-        print(f"   - Data keys: {list(notification_data.keys())}")
-        
-        # Envoyer la notification
-        response = messaging.send(message)
-        logger.info(f"✅ Push notification envoyée avec succès: {response}")
-        print(f"✅ [PUSH] Notification envoyée - Response ID: {response}")
-        return True
-        
+        result = (await transport.send([fcm_token], message))[0]
     except Exception as e:
-        # Gérer l'erreur Firebase avec import lazy
-        firebase_admin, _, _ = _lazy_import_firebase()
-        if hasattr(firebase_admin, 'exceptions') and isinstance(e, firebase_admin.exceptions.FirebaseError):
-            error_msg = str(e)
-            logger.error(f"❌ Erreur Firebase lors de l'envoi: {error_msg}")
-            print(f"❌ [PUSH] Erreur Firebase: {error_msg}")
-            return False
         logger.error(f"❌ Erreur lors de l'envoi de la notification push: {e}")
+        result = PushResult(fcm_token, False, str(e) or type(e).__name__)
+        metrics.record_push_results([result])
+        _compteurs["envois_echoues"] += 1
+        _compteurs["a_reessayer"] += len(classify_results([result])[TRANSITOIRE])
         return False
+    metrics.record_push_results([result])
+    
+    if not result.success:
+        logger.error("push: erreur FCM %s", result.error, extra={"token": fcm_token[:12]})
+        _compteurs["envois_echoues"] += 1
+        categories = classify_results([result])
+        _compteurs["a_reessayer"] += len(categories[TRANSITOIRE])
+        if categories[TOKEN_INVALIDE] and database is not None:
+            await prune_invalid_tokens(database, categories[TOKEN_INVALIDE])
+        return False
+    
+    _compteurs["envois_reussis"] += 1
+    logger.debug("push: envoyée", extra={"token": fcm_token[:12]})
+    return True
+
+
+async def _send_chunk(transport, fcm_tokens: list, title: str, body: str, data: dict = None) -> list:
+    """Envoie un lot (<= 500 tokens) via le transport. Retourne un PushResult par token."""
+    try:
+        results = await transport.send(fcm_tokens, build_push_message(title, body, data))
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'envoi groupé ({len(fcm_tokens)} tokens): {e}")
+        results = [PushResult(token, False, str(e) or type(e).__name__) for token in fcm_tokens]
+        metrics.record_push_results(results)
+        return results
+    metrics.record_push_results(results)
+    
+    # Gérer les erreurs individuelles
+    for result in results:
+        if not result.success:
+            logger.warning(f"⚠️ Échec pour token {result.token[:20]}...: {result.error}")
+    return results
+
+
+def get_push_counters() -> dict:
+    """Compteurs d'envoi depuis le démarrage (réussis, échoués, à réessayer, tokens supprimés)"""
+    return dict(_compteurs)
+
+
+async def prune_invalid_tokens(database, tokens: list) -> int:
+    """
+    Supprime les appareils dont le token FCM est définitivement invalide
+    (UNREGISTERED, SENDER_ID_MISMATCH, ...) : un delete_many sur push_devices
+    quel que soit le nombre de tokens. Retourne le nombre d'appareils supprimés.
+    """
+    from push_devices import remove_tokens
+
+    tokens = list(dict.fromkeys(t for t in tokens if t))
+    if not tokens:
+        return 0
+    supprimes = await remove_tokens(database, tokens)
+    # Appareils réellement supprimés : un token déjà retiré (autre worker, TTL) n'est pas compté
+    _compteurs["tokens_supprimes"] += supprimes
+    print(f"🧹 [PUSH] {len(tokens)} token(s) invalide(s), {supprimes} appareil(s) supprimé(s)")
+    return supprimes
+
+
+async def send_push_batch(payloads: list, concurrency: int = None, database=None) -> dict:
+    """
+    Envoie un ensemble de notifications push en un minimum d'appels FCM.
+    
+    Args:
+        payloads: Liste de dicts {"tokens": [...], "title": str, "body": str, "data": dict}
+        concurrency: Nombre maximum de lots envoyés en parallèle (défaut: PUSH_SEND_CONCURRENCY)
+        database: Si fourni, les appareils des tokens définitivement invalides sont supprimés
+                  et last_used des appareils livrés est rafraîchi (TTL de push_devices)
+    
+    Les payloads identiques (même titre, corps et données) sont regroupés, puis
+    découpés en lots de FCM_MULTICAST_LIMIT tokens.
+    
+    Returns:
+        dict: {"messages", "tokens", "batches", "success", "failure", "invalid", "pruned",
+               "retry_tokens"} - retry_tokens: tokens en échec transitoire, à réessayer
+    """
+    # Regrouper les payloads identiques
+    groupes = {}
+    for payload in payloads:
+        data = {k: str(v) for k, v in (payload.get("data") or {}).items()}
+        key = (payload["title"], payload["body"], tuple(sorted(data.items())))
+        tokens = groupes.setdefault(key, {})  # dict = ensemble ordonné (dédoublonnage)
+        tokens.update(dict.fromkeys(t for t in payload.get("tokens", []) if t))
+    groupes = {k: list(v) for k, v in groupes.items() if v}
+    
+    lots = [
+        (title, body, dict(data), chunk)
+        for (title, body, data), tokens in groupes.items()
+        for chunk in chunks(tokens, FCM_MULTICAST_LIMIT)
+    ]
+    stats = {
+        "messages": len(groupes),
+        "tokens": sum(len(chunk) for _, _, _, chunk in lots),
+        "batches": len(lots),
+        "success": 0,
+        "failure": 0,
+        "invalid": 0,
+        "pruned": 0,
+        "retry_tokens": []
+    }
+    if not lots:
+        return stats
+    
+    transport = get_push_transport()
+    if transport is None:
+        logger.warning("Firebase non initialisé, notifications push non envoyées")
+        stats["failure"] = stats["tokens"]
+        return stats
+    
+    semaphore = asyncio.Semaphore(concurrency or PUSH_SEND_CONCURRENCY)
+    
+    async def envoyer(title, body, data, chunk):
+        async with semaphore:
+            return await _send_chunk(transport, chunk, title, body, data)
+    
+    invalides = []
+    livres = []
+    for results in await asyncio.gather(*[envoyer(*lot) for lot in lots]):
+        succes = [result.token for result in results if result.success]
+        livres.extend(succes)
+        stats["success"] += len(succes)
+        stats["failure"] += len(results) - len(succes)
+        categories = classify_results(results)
+        invalides.extend(categories[TOKEN_INVALIDE])
+        stats["retry_tokens"].extend(categories[TRANSITOIRE])
+    stats["invalid"] = len(invalides)
+    
+    _compteurs["envois_reussis"] += stats["success"]
+    _compteurs["envois_echoues"] += stats["failure"]
+    _compteurs["a_reessayer"] += len(stats["retry_tokens"])
+    
+    if invalides and database is not None:
+        try:
+            stats["pruned"] = await prune_invalid_tokens(database, invalides)
+        except Exception as e:
+            logger.error(f"❌ Suppression des tokens invalides impossible: {e}")
+    if livres and database is not None:
+        from push_devices import touch_tokens
+        try:
+            await touch_tokens(database, livres)
+        except Exception as e:
+            logger.error(f"❌ Mise à jour de last_used impossible: {e}")
+    
+    logger.info(f"✅ Envoi groupé: {stats['success']}/{stats['tokens']} succès en {stats['batches']} lot(s)")
+    return stats
 
 
-async def send_push_to_multiple(fcm_tokens: list, title: str, body: str, data: dict = None):
+async def send_push_to_multiple(fcm_tokens: list, title: str, body: str, data: dict = None, database=None):
     """
-    Envoie une notification push à plusieurs utilisateurs via Firebase Admin SDK
+    Envoie une notification push à plusieurs utilisateurs via le transport push
+    (lots de 500 tokens)
     
     Args:
         fcm_tokens: Liste des tokens FCM
         title: Titre de la notification
         body: Corps de la notification
         data: Données supplémentaires (optionnel)
+        database: Si fourni, les tokens définitivement invalides sont supprimés
     
     Returns:
         int: Nombre de notifications envoyées avec succès
     """
-    global _firebase_app
-    
     if not fcm_tokens:
         return 0
     
-    # Initialiser Firebase si pas déjà fait
-    if _firebase_app is None:
-        initialize_firebase()
-    
-    if _firebase_app is None:
-        logger.warning("Firebase non initialisé, notifications push non envoyées")
-        return 0
-    
-    # Import lazy pour avoir messaging
-    _, _, messaging = _lazy_import_firebase()
-    
-    try:
-        # Récupérer l'URL frontend pour le lien de la notification
-        frontend_url = os.environ.get('FRONTEND_URL', '').strip()
-        
-        # Tag unique pour cette notification
-        unique_tag = f"multi-{int(time.time() * 1000)}"
-        
-        # Construire la config webpush avec title et body
-        webpush_notification_config = messaging.WebpushNotification(
-            title=title,
-            body=body,
-            icon='/icon-192.png',
-            badge='/icon-192.png',
-            tag=unique_tag,
-            renotify=True,
-            require_interaction=True,
-            vibrate=[200, 100, 200]
-        )
-        
-        webpush_config_args = {
-            "notification": webpush_notification_config
-        }
-        
-        # Ajouter le lien seulement si FRONTEND_URL est configuré avec HTTPS
-        if frontend_url and frontend_url.startswith('https://'):
-            webpush_config_args["fcm_options"] = messaging.WebpushFCMOptions(
-                link=frontend_url
-            )
-        
-        # Construire le message multicast
-        message = messaging.MulticastMessage(
-            notification=messaging.Notification(
-                title=title,
-                body=body
-            ),
-            data={k: str(v) for k, v in (data or {}).items()},
-            tokens=fcm_tokens,
-            webpush=messaging.WebpushConfig(**webpush_config_args)
-        )
-        
-        # Envoyer les notifications
-        response = messaging.send_multicast(message)
-        
-        logger.info(f"✅ Notifications envoyées: {response.success_count}/{len(fcm_tokens)} succès")
-        
-        # Gérer les erreurs individuelles
-        if response.failure_count > 0:
-            failed_tokens = []
-            for idx, resp in enumerate(response.responses):
-                if not resp.success:
-                    failed_tokens.append(fcm_tokens[idx])
-                    logger.warning(f"⚠️ Échec pour token {idx}: {resp.exception}")
-        
-        return response.success_count
-        
-    except Exception as e:
-        logger.error(f"❌ Erreur lors de l'envoi multicast: {e}")
-        return 0
+    stats = await send_push_batch([{"tokens": fcm_tokens, "title": title, "body": body, "data": data}], database=database)
+    return stats["success"]
 
 
 # NE PAS initialiser Firebase au démarrage du module
@@ -0,0 +1,404 @@
+"""
+Transport des notifications push FCM (envoi non bloquant).
+
+La construction d'un message (build_push_message) est séparée de son envoi :
+- FcmHttpTransport (défaut) : API HTTP v1 de FCM via un client httpx partagé
+  (keep-alive, HTTP/2 si le paquet h2 est installé), jeton OAuth mis en cache
+  jusqu'à son expiration, concurrence bornée par PUSH_HTTP_CONCURRENCY
+- AdminSdkTransport : repli sur firebase_admin (send_each_for_multicast),
+  appels bloquants exécutés dans le pool de threads
+- FakePushTransport : n'envoie rien (tests de charge locaux)
+
+Le transport est choisi par la variable PUSH_TRANSPORT (fcm_http, admin_sdk, fake).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# FCM accepte au plus 500 tokens par multicast (Admin SDK)
+FCM_MULTICAST_LIMIT = 500
+FCM_SCOPE = "https://www.googleapis.com/auth/firebase.messaging"
+FCM_SEND_URL = "https://fcm.googleapis.com/v1/projects/{project_id}/messages:send"
+# Requêtes HTTP v1 simultanées (une requête par token)
+PUSH_HTTP_CONCURRENCY = max(1, int(os.environ.get('PUSH_HTTP_CONCURRENCY', '50')))
+# Le jeton OAuth est renouvelé 5 minutes avant son expiration
+TOKEN_REFRESH_MARGIN = 300
+
+
+# Classement des erreurs FCM
+TOKEN_INVALIDE = "token_invalide"  # token à supprimer définitivement
+TRANSITOIRE = "transitoire"        # à réessayer plus tard
+CONFIGURATION = "configuration"    # credentials / projet : ni suppression ni nouvel essai
+
+ERREURS_TOKEN_INVALIDE = {"UNREGISTERED", "SENDER_ID_MISMATCH", "NOT_FOUND"}
+ERREURS_CONFIGURATION = {"THIRD_PARTY_AUTH_ERROR", "PERMISSION_DENIED", "UNAUTHENTICATED"}
+# INVALID_ARGUMENT désigne un token mal formé... ou un message invalide : le token n'est
+# supprimé que si le même message a été accepté pour un autre token (voir classify_results)
+INVALID_ARGUMENT = "INVALID_ARGUMENT"
+
+# Exceptions firebase_admin.messaging -> code FCM
+_ADMIN_SDK_CODES = {
+    "UnregisteredError": "UNREGISTERED",
+    "SenderIdMismatchError": "SENDER_ID_MISMATCH",
+    "QuotaExceededError": "QUOTA_EXCEEDED",
+    "ThirdPartyAuthError": "THIRD_PARTY_AUTH_ERROR",
+}
+
+
+class PushResult(NamedTuple):
+    token: str
+    success: bool
+    error: Optional[str] = None  # code FCM (UNREGISTERED, UNAVAILABLE, ...) ou message réseau
+
+
+def classify_error(error: Optional[str]) -> str:
+    """Catégorie d'une erreur d'envoi (hors INVALID_ARGUMENT, voir classify_results)"""
+    if error in ERREURS_TOKEN_INVALIDE:
+        return TOKEN_INVALIDE
+    if error in ERREURS_CONFIGURATION:
+        return CONFIGURATION
+    # UNAVAILABLE, INTERNAL, QUOTA_EXCEEDED, HTTP 5xx, erreurs réseau...
+    return TRANSITOIRE
+
+
+def classify_results(results: List[PushResult]) -> Dict[str, List[str]]:
+    """
+    Tokens en échec d'un même message, par catégorie :
+    {"token_invalide": [...], "transitoire": [...], "configuration": [...]}
+    """
+    categories = {TOKEN_INVALIDE: [], TRANSITOIRE: [], CONFIGURATION: []}
+    message_accepte = any(result.success for result in results)
+    for result in results:
+        if result.success:
+            continue
+        if result.error == INVALID_ARGUMENT:
+            categorie = TOKEN_INVALIDE if message_accepte else CONFIGURATION
+        else:
+            categorie = classify_error(result.error)
+        categories[categorie].append(result.token)
+    return categories
+
+
+def _admin_sdk_error(exception) -> str:
+    code = _ADMIN_SDK_CODES.get(type(exception).__name__) or getattr(exception, "code", None)
+    return str(code) if code else str(exception)
+
+
+def load_service_account_info() -> Optional[Dict[str, Any]]:
+    """Compte de service Firebase : FIREBASE_CREDENTIALS (JSON) puis firebase-credentials.json"""
+    firebase_creds_env = os.environ.get('FIREBASE_CREDENTIALS')
+    if firebase_creds_env:
+        try:
+            return json.loads(firebase_creds_env)
+        except json.JSONDecodeError as e:
+            logger.error(f"❌ Erreur parsing JSON FIREBASE_CREDENTIALS: {e}")
+    cred_path = os.path.join(os.path.dirname(__file__), 'firebase-credentials.json')
+    if os.path.exists(cred_path):
+        with open(cred_path) as f:
+            return json.load(f)
+    return None
+
+
+def build_push_message(title: str, body: str, data: dict = None) -> Dict[str, Any]:
+    """
+    Message indépendant du transport.
+    - title et body sont aussi copiés dans data pour que le service worker puisse les lire
+    - type "chat_message" + requires_reply "true" ajoute les actions de réponse rapide
+    """
+    notification_data = {k: str(v) for k, v in (data or {}).items()}
+    notification_data.setdefault("title", title)
+    notification_data.setdefault("body", body)
+
+    # IMPORTANT: tag UNIQUE pour chaque notification (sinon elles se remplacent)
+    webpush_notification = {
+        "title": title,
+        "body": body,
+        "icon": "/icon-192.png",
+        "badge": "/icon-192.png",
+        "require_interaction": True,
+        "vibrate": [200, 100, 200],
+        "tag": f"notif-{int(time.time() * 1000)}-{notification_data.get('type', 'default')}",
+        "renotify": True
+    }
+    if notification_data.get("type") == "chat_message" and notification_data.get("requires_reply") == "true":
+        webpush_notification["actions"] = [
+            {"action": "reply", "title": "Répondre", "type": "text", "placeholder": "Tapez votre réponse..."},
+            {"action": "open", "title": "Ouvrir"}
+        ]
+
+    # Lien seulement si FRONTEND_URL est configuré avec HTTPS
+    frontend_url = os.environ.get('FRONTEND_URL', '').strip()
+    return {
+        "title": title,
+        "body": body,
+        "data": notification_data,
+        "webpush_notification": webpush_notification,
+        "link": frontend_url if frontend_url.startswith('https://') else None
+    }
+
+
+def chunks(items: list, size: int):
+    """Découpe une liste en lots de `size` éléments au plus (multicast FCM : 500 tokens)"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _http2_disponible() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class PushTransport:
+    """Interface commune : send() retourne un PushResult par token, dans l'ordre"""
+    name = "base"
+
+    async def send(self, tokens: List[str], message: Dict[str, Any]) -> List[PushResult]:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+def fcm_v1_message(token: str, message: Dict[str, Any]) -> Dict[str, Any]:
+    """Corps JSON d'une requête messages:send (API HTTP v1)"""
+    notification = {
+        ("requireInteraction" if key == "require_interaction" else key): value
+        for key, value in message["webpush_notification"].items()
+    }
+    webpush = {"notification": notification}
+    if message.get("link"):
+        webpush["fcm_options"] = {"link": message["link"]}
+    return {
+        "token": token,
+        "notification": {"title": message["title"], "body": message["body"]},
+        "data": message["data"],
+        "webpush": webpush
+    }
+
+
+def _fcm_v1_error(response) -> str:
+    """Code d'erreur FCM (UNREGISTERED, INVALID_ARGUMENT, ...) ou statut HTTP"""
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        return f"HTTP {response.status_code}"
+    for detail in error.get("details", []):
+        if detail.get("errorCode"):
+            return detail["errorCode"]
+    return error.get("status") or f"HTTP {response.status_code}"
+
+
+class FcmHttpTransport(PushTransport):
+    """API HTTP v1 de FCM sur un client httpx partagé (connexions réutilisées)"""
+    name = "fcm_http"
+
+    def __init__(self, project_id: str, credentials, client=None, concurrency: int = None, auth_request=None):
+        self._url = FCM_SEND_URL.format(project_id=project_id)
+        self._credentials = credentials
+        self._auth_request = auth_request
+        concurrency = concurrency or PUSH_HTTP_CONCURRENCY
+        if client is None:
+            import httpx
+            client = httpx.AsyncClient(
+                http2=_http2_disponible(),
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            )
+        self._client = client
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._token_lock = asyncio.Lock()
+        self._access_token = None
+        self._expires_at = 0.0
+
+    @classmethod
+    def from_service_account_info(cls, info: Dict[str, Any], **kwargs) -> "FcmHttpTransport":
+        from google.oauth2 import service_account
+        credentials = service_account.Credentials.from_service_account_info(info, scopes=[FCM_SCOPE])
+        return cls(info["project_id"], credentials, **kwargs)
+
+    def _refresh(self) -> None:
+        """Appel bloquant (google-auth) : exécuté dans un thread"""
+        if self._auth_request is None:
+            from google.auth.transport.requests import Request
+            self._auth_request = Request()
+        self._credentials.refresh(self._auth_request)
+        expiry = self._credentials.expiry  # datetime UTC naïf
+        ttl = (expiry.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds() if expiry else 3600
+        self._access_token = self._credentials.token
+        self._expires_at = time.monotonic() + max(0.0, ttl - TOKEN_REFRESH_MARGIN)
+
+    async def _get_access_token(self) -> str:
+        if self._access_token and time.monotonic() < self._expires_at:
+            return self._access_token
+        async with self._token_lock:
+            if not self._access_token or time.monotonic() >= self._expires_at:
+                await asyncio.to_thread(self._refresh)
+        return self._access_token
+
+    async def _send_one(self, token: str, message: Dict[str, Any], access_token: str) -> PushResult:
+        async with self._semaphore:
+            try:
+                response = await self._client.post(
+                    self._url,
+                    json={"message": fcm_v1_message(token, message)},
+                    headers={"Authorization": f"Bearer {access_token}"}
+                )
+            except Exception as e:
+                return PushResult(token, False, str(e) or type(e).__name__)
+        if response.status_code == 200:
+            return PushResult(token, True)
+        if response.status_code == 401:
+            # Jeton révoqué : forcer le renouvellement au prochain envoi
+            self._expires_at = 0.0
+        return PushResult(token, False, _fcm_v1_error(response))
+
+    async def send(self, tokens: List[str], message: Dict[str, Any]) -> List[PushResult]:
+        if not tokens:
+            return []
+        try:
+            access_token = await self._get_access_token()
+        except Exception as e:
+            logger.error(f"❌ Jeton OAuth FCM indisponible: {e}")
+            return [PushResult(token, False, f"oauth: {e}") for token in tokens]
+        return list(await asyncio.gather(*[self._send_one(token, message, access_token) for token in tokens]))
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+class AdminSdkTransport(PushTransport):
+    """Repli firebase_admin : send_each_for_multicast dans le pool de threads"""
+    name = "admin_sdk"
+
+    def __init__(self, messaging):
+        self._messaging = messaging
+
+    def _multicast(self, tokens: List[str], message: Dict[str, Any]):
+        messaging = self._messaging
+        notification = dict(message["webpush_notification"])
+        if notification.get("actions"):
+            notification["actions"] = [
+                messaging.WebpushNotificationAction(action["action"], action["title"])
+                for action in notification["actions"]
+            ]
+        webpush_config_args = {"notification": messaging.WebpushNotification(**notification)}
+        if message.get("link"):
+            webpush_config_args["fcm_options"] = messaging.WebpushFCMOptions(link=message["link"])
+        return messaging.MulticastMessage(
+            notification=messaging.Notification(title=message["title"], body=message["body"]),
+            data=message["data"],
+            tokens=tokens,
+            webpush=messaging.WebpushConfig(**webpush_config_args)
+        )
+
+    async def send(self, tokens: List[str], message: Dict[str, Any]) -> List[PushResult]:
+        results = []
+        for chunk in chunks(tokens, FCM_MULTICAST_LIMIT):
+            try:
+                response = await asyncio.to_thread(self._messaging.send_each_for_multicast, self._multicast(chunk, message))
+            except Exception as e:
+                results.extend(PushResult(token, False, _admin_sdk_error(e)) for token in chunk)
+                continue
+            results.extend(
+                PushResult(token, resp.success, None if resp.success else _admin_sdk_error(resp.exception))
+                for token, resp in zip(chunk, response.responses)
+            )
+        return results
+
+
+class FakePushTransport(PushTransport):
+    """
+    N'envoie rien : enregistre les messages (tests, tests de charge locaux).
+    latency_ms simule la durée d'un aller-retour FCM, failing_tokens des tokens rejetés
+    (ensemble -> UNREGISTERED, ou dict token -> code d'erreur FCM).
+    """
+    name = "fake"
+
+    def __init__(self, latency_ms: float = None, failing_tokens: Iterable[str] = ()):
+        if latency_ms is None:
+            latency_ms = float(os.environ.get('PUSH_FAKE_LATENCY_MS', '0'))
+        self.latency = latency_ms / 1000
+        if not isinstance(failing_tokens, dict):
+            failing_tokens = dict.fromkeys(failing_tokens, "UNREGISTERED")
+        self.failing_tokens = failing_tokens
+        self.sent: List[tuple] = []
+        self.appels = 0
+        self.en_cours = 0
+        self.max_en_cours = 0
+
+    async def send(self, tokens: List[str], message: Dict[str, Any]) -> List[PushResult]:
+        self.appels += 1
+        self.en_cours += 1
+        self.max_en_cours = max(self.max_en_cours, self.en_cours)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.en_cours -= 1
+        results = []
+        for token in tokens:
+            self.sent.append((token, message))
+            if token in self.failing_tokens:
+                results.append(PushResult(token, False, self.failing_tokens[token]))
+            else:
+                results.append(PushResult(token, True))
+        return results
+
+
+_transport: Optional[PushTransport] = None
+
+
+def _admin_sdk_transport() -> Optional[PushTransport]:
+    import push_notifications
+    if push_notifications.initialize_firebase() is None:
+        return None
+    _, _, messaging = push_notifications._lazy_import_firebase()
+    return AdminSdkTransport(messaging)
+
+
+def _create_transport() -> Optional[PushTransport]:
+    choix = os.environ.get('PUSH_TRANSPORT', 'fcm_http').strip().lower()
+    if choix == "fake":
+        return FakePushTransport()
+    if choix != "admin_sdk":
+        info = load_service_account_info()
+        if info is None:
+            logger.warning("⚠️ Credentials Firebase absentes, notifications push désactivées")
+            return None
+        try:
+            transport = FcmHttpTransport.from_service_account_info(info)
+            print(f"✅ [PUSH] Transport FCM HTTP v1 (HTTP/2: {_http2_disponible()})")
+            return transport
+        except Exception as e:
+            print(f"⚠️ [PUSH] Transport HTTP v1 indisponible ({e}), repli sur firebase_admin")
+    return _admin_sdk_transport()
+
+
+def get_push_transport() -> Optional[PushTransport]:
+    """Transport partagé (créé au premier envoi), None si Firebase n'est pas configuré"""
+    global _transport
+    if _transport is None:
+        _transport = _create_transport()
+    return _transport
+
+
+def set_push_transport(transport: Optional[PushTransport]) -> None:
+    """Remplace le transport (tests, benchmarks)"""
+    global _transport
+    _transport = transport
+
+
+async def close_push_transport() -> None:
+    """Ferme le client HTTP partagé (arrêt du serveur)"""
+    global _transport
+    if _transport is not None:
+        await _transport.aclose()
+        _transport = None
@@ -0,0 +1,198 @@
+"""
+Compteurs de version par ressource et par centre, pour les GET conditionnels (ETag).
+
+Chaque écriture incrémente la version de la ressource modifiée (bump) :
+- planning : par centre (appelé par planning_changes.record_changes)
+- salles   : par centre
+- users, configuration : globales
+
+Les endpoints de lecture calculent un ETag fort à partir des versions dont
+dépend leur réponse et de la variante de la requête (centre actif, rôle,
+paramètres). Si If-None-Match correspond, ils répondent 304 avant toute
+requête MongoDB ou sérialisation pydantic.
+
+Clés : "<ressource>:<centre>", "<ressource>:*" (bump sans centre : écriture
+dont le centre n'est pas connu, ou données sans centre) et "<ressource>"
+(incrémentée par chaque bump : réponses tous centres confondus).
+bump_all() invalide tous les ETags ; les scripts qui écrivent hors du serveur
+(init_db.py, init_full.py, scripts/init_database_production.py) appellent
+invalidate_all(db) à la fin de leurs écritures.
+
+Stockage (RESOURCE_VERSION_STORE) :
+- memory (défaut) : compteurs du processus ; l'identifiant de démarrage fait
+  partie de l'ETag (un redémarrage invalide les ETags déjà émis)
+- mongo : collection resource_versions partagée entre processus ; les versions
+  lues sont gardées RESOURCE_VERSION_CACHE_TTL secondes (défaut 2) : un autre
+  worker peut répondre 304 pendant ce délai après une écriture. Seul stockage
+  visible des scripts : avec memory, redémarrer le serveur après un script d'init
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+PLANNING = "planning"
+USERS = "users"
+SALLES = "salles"
+CONFIGURATION = "configuration"
+
+TOUS = "*"
+
+RESOURCE_VERSION_CACHE_TTL = float(os.environ.get('RESOURCE_VERSION_CACHE_TTL', '2'))
+
+
+def version_key(resource: str, scope: Optional[str] = None) -> str:
+    return f"{resource}:{scope or TOUS}"
+
+
+def _dependency_keys(resource: str, scope: Optional[str]) -> List[str]:
+    if scope:
+        return [version_key(resource), version_key(resource, scope)]
+    return [resource]
+
+
+RESOURCE_VERSIONS_INDEXES = [
+    {"keys": [("id", 1)], "name": "resource_versions_id", "unique": True},
+]
+
+
+async def ensure_resource_versions_indexes(database) -> None:
+    for spec in RESOURCE_VERSIONS_INDEXES:
+        await database.resource_versions.create_index(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"})
+
+
+class MemoryVersionStore:
+    """Compteurs en mémoire (un seul processus)"""
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._versions: Dict[str, int] = {}
+        self._lock = Lock()
+
+    async def get_many(self, keys: List[str]) -> List[int]:
+        with self._lock:
+            return [self._versions.get(key, 0) for key in keys]
+
+    async def incr(self, keys: List[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+
+class MongoVersionStore:
+    """Compteurs partagés (collection resource_versions), lus avec un cache local court"""
+
+    epoch = "db"
+
+    def __init__(self, database, ttl_seconds: float = RESOURCE_VERSION_CACHE_TTL):
+        self.database = database
+        self.ttl_seconds = ttl_seconds
+        self._cache: Dict[str, Tuple[float, int]] = {}
+        self._lock = Lock()
+
+    async def get_many(self, keys: List[str]) -> List[int]:
+        now = time.monotonic()
+        with self._lock:
+            manquantes = [k for k in keys if k not in self._cache or self._cache[k][0] <= now]
+        if manquantes:
+            docs = await self.database.resource_versions.find(
+                {"id": {"$in": manquantes}}, {"_id": 0, "id": 1, "v": 1}
+            ).to_list(None)
+            lues = {d["id"]: d.get("v", 0) for d in docs}
+            with self._lock:
+                for key in manquantes:
+                    self._cache[key] = (now + self.ttl_seconds, lues.get(key, 0))
+        with self._lock:
+            return [self._cache[key][1] for key in keys]
+
+    async def incr(self, keys: List[str]) -> None:
+        from pymongo import UpdateOne
+
+        await self.database.resource_versions.bulk_write(
+            [UpdateOne({"id": key}, {"$inc": {"v": 1}}, upsert=True) for key in keys], ordered=False
+        )
+        with self._lock:
+            # Effet immédiat sur ce processus
+            for key in keys:
+                self._cache.pop(key, None)
+
+
+class ResourceVersions:
+    """Versions par (ressource, centre) et ETags dérivés"""
+
+    def __init__(self, store=None):
+        self.store = store or MemoryVersionStore()
+        self.hits = 0
+        self.misses = 0
+
+    async def bump(self, resource: str, *scopes: Optional[str]) -> None:
+        """Incrémente la version de la ressource pour chaque centre (sans centre : toute la ressource)"""
+        keys = [version_key(resource, scope) for scope in dict.fromkeys(scopes or (None,))]
+        await self.store.incr(list(dict.fromkeys(keys + [resource])))
+
+    async def bump_all(self) -> None:
+        """Écriture en masse (init, migration) : tous les ETags deviennent invalides"""
+        await self.store.incr([version_key(TOUS)])
+
+    async def etag(self, dependencies: Iterable[Tuple[str, Optional[str]]], variant: Any = None) -> str:
+        """
+        ETag fort d'une réponse : versions des (ressource, centre) dont elle dépend
+        (centre None : tous les centres), version globale et variante de la requête.
+        """
+        keys = [version_key(TOUS)]
+        for resource, scope in dependencies:
+            keys.extend(_dependency_keys(resource, scope))
+        keys = list(dict.fromkeys(keys))
+        versions = await self.store.get_many(keys)
+        empreinte = json.dumps([self.store.epoch, list(zip(keys, versions)), variant],
+                               sort_keys=True, default=str, separators=(",", ":"))
+        return '"' + hashlib.sha1(empreinte.encode("utf-8")).hexdigest()[:32] + '"'
+
+    def matches(self, if_none_match: Optional[str], etag: str) -> bool:
+        """If-None-Match (liste d'ETags ou *) contient l'ETag courant"""
+        if not if_none_match:
+            return False
+        candidats = [c.strip() for c in if_none_match.split(",")]
+        # Comparaison faible (RFC 9110) : un proxy peut avoir ajouté W/
+        found = "*" in candidats or etag in (c[2:] if c.startswith("W/") else c for c in candidats)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "store": type(self.store).__name__,
+            "not_modified": self.hits,
+            "modified": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+resource_versions = ResourceVersions()
+
+
+def _mongo_store_enabled() -> bool:
+    return os.environ.get('RESOURCE_VERSION_STORE', 'memory').lower() == 'mongo'
+
+
+def configure_store(database) -> None:
+    """Choisit le stockage des compteurs selon RESOURCE_VERSION_STORE (appelé au démarrage)"""
+    if _mongo_store_enabled():
+        resource_versions.store = MongoVersionStore(database)
+
+
+async def invalidate_all(database) -> bool:
+    """
+    Scripts hors du serveur (init, migrations) : invalide tous les ETags du stockage
+    partagé. Retourne False avec le stockage memory (compteurs propres au processus serveur).
+    """
+    if not _mongo_store_enabled():
+        return False
+    await ResourceVersions(MongoVersionStore(database)).bump_all()
+    return True
@@ -0,0 +1,116 @@
+"""
+Application des semaines types côté serveur (demandes de jours de travail).
+
+Une semaine type ("lundi": "MATIN", "mardi": "JOURNEE_COMPLETE", ...) est
+développée sur plusieurs semaines et plusieurs médecins en une seule passe :
+- une requête pour toutes les demandes existantes de la plage (tous médecins)
+- résolution des conflits MATIN / APRES_MIDI / JOURNEE_COMPLETE en mémoire
+  (mêmes règles que POST /api/demandes-travail)
+- un seul insert_many pour toutes les nouvelles demandes
+
+Un an de semaines types pour une douzaine de médecins = 2 requêtes (un find, un insert_many).
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+JOURS_SEMAINE = ['lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche']
+
+# Les demandes rejetées ou annulées ne bloquent pas une nouvelle demande
+STATUTS_INACTIFS = ["REJETE", "ANNULE"]
+
+
+def creneaux_en_conflit(creneau: str, creneau_existant: str) -> bool:
+    """Règles de conflit entre demandes d'un même médecin le même jour"""
+    # Doublon strict
+    if creneau == creneau_existant:
+        return True
+    # JOURNEE_COMPLETE vs MATIN/APRES_MIDI
+    if creneau == "JOURNEE_COMPLETE" and creneau_existant in ["MATIN", "APRES_MIDI"]:
+        return True
+    # MATIN/APRES_MIDI vs JOURNEE_COMPLETE
+    if creneau in ["MATIN", "APRES_MIDI"] and creneau_existant == "JOURNEE_COMPLETE":
+        return True
+    # MATIN + APRES_MIDI = OK (pas de conflit)
+    return False
+
+
+def lundi_de(date_str: str) -> date:
+    jour = datetime.strptime(date_str, '%Y-%m-%d').date()
+    return jour - timedelta(days=jour.weekday())
+
+
+def expand_semaine_type(semaine_type: Dict[str, Any], date_debut_semaine: str, nb_semaines: int = 1) -> List[Tuple[str, str]]:
+    """Liste des (date, créneau) travaillés, à partir du lundi de date_debut_semaine"""
+    lundi = lundi_de(date_debut_semaine)
+    jours = []
+    for semaine in range(nb_semaines):
+        for i, jour in enumerate(JOURS_SEMAINE):
+            creneau = semaine_type.get(jour)
+            if creneau and creneau != 'REPOS':
+                jours.append(((lundi + timedelta(days=7 * semaine + i)).strftime('%Y-%m-%d'), creneau))
+    return jours
+
+
+class DemandesOccupation:
+    """Créneaux déjà demandés par médecin et par date (chargés en une requête)"""
+
+    def __init__(self):
+        self._creneaux: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+
+    @classmethod
+    async def load(cls, database, medecin_ids: List[str], date_debut: str, date_fin: str) -> "DemandesOccupation":
+        occupation = cls()
+        existantes = await database.demandes_travail.find(
+            {
+                "medecin_id": {"$in": medecin_ids},
+                "date_demandee": {"$gte": date_debut, "$lte": date_fin},
+                "statut": {"$nin": STATUTS_INACTIFS}
+            },
+            {"_id": 0, "medecin_id": 1, "date_demandee": 1, "creneau": 1}
+        ).to_list(None)
+        for demande in existantes:
+            occupation.reserve(demande["medecin_id"], demande["date_demandee"], demande["creneau"])
+        return occupation
+
+    def conflit(self, medecin_id: str, date_str: str, creneau: str) -> bool:
+        return any(creneaux_en_conflit(creneau, existant) for existant in self._creneaux[(medecin_id, date_str)])
+
+    def reserve(self, medecin_id: str, date_str: str, creneau: str) -> None:
+        self._creneaux[(medecin_id, date_str)].add(creneau)
+
+
+async def apply_semaine_type(
+    database,
+    semaine_type: Dict[str, Any],
+    medecin_ids: Iterable[str],
+    date_debut_semaine: str,
+    nb_semaines: int,
+    build_demande: Callable[[str, str, str], Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Crée les demandes de travail d'une semaine type pour plusieurs médecins et semaines.
+    build_demande(medecin_id, date, creneau) construit le document à insérer.
+    Retourne {"demandes": [documents créés], "ignorees": [(medecin_id, date, creneau)]}.
+    """
+    medecin_ids = list(dict.fromkeys(medecin_ids))
+    jours = expand_semaine_type(semaine_type, date_debut_semaine, nb_semaines)
+    if not jours or not medecin_ids:
+        return {"demandes": [], "ignorees": []}
+
+    occupation = await DemandesOccupation.load(database, medecin_ids, jours[0][0], jours[-1][0])
+
+    demandes = []
+    ignorees = []
+    for medecin_id in medecin_ids:
+        for date_str, creneau in jours:
+            if occupation.conflit(medecin_id, date_str, creneau):
+                ignorees.append((medecin_id, date_str, creneau))
+                continue
+            occupation.reserve(medecin_id, date_str, creneau)
+            demandes.append(build_demande(medecin_id, date_str, creneau))
+
+    if demandes:
+        # insert_many ajoute _id aux documents : on insère des copies
+        await database.demandes_travail.insert_many([dict(d) for d in demandes], ordered=False)
+    return {"demandes": demandes, "ignorees": ignorees}
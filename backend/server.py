@@ -1,7 +1,7 @@
 print("🔧 [DEBUG] Début du chargement de server.py...")
 
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, BackgroundTasks, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, BackgroundTasks, UploadFile, File, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
@@ -13,6 +13,7 @@ from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
+import time
 from datetime import datetime, timezone, timedelta
 import jwt
 from passlib.context import CryptContext
@@ -20,6 +21,36 @@ import bcrypt
 from contextlib import asynccontextmanager
 import asyncio
 
+from user_loader import UserLoader
+import push_devices
+from push_transport import close_push_transport
+import notification_outbox
+from notification_outbox import enqueue, enqueue_push, outbox_stats
+from message_fanout import enqueue_message_fanout, register_fanout_handler
+from message_pagination import NEXT_CURSOR_HEADER, paginate_messages
+import conversations
+import live_events
+import planning_changes
+from resource_versions import (
+    CONFIGURATION, PLANNING, SALLES, USERS, configure_store, resource_versions
+)
+import index_registry
+import mongo_monitoring
+from mongo_monitoring import command_monitor, perf_registry, pool_monitor
+from loop_watchdog import LOOP_WATCHDOG, loop_watchdog
+from structured_logging import (
+    REQUEST_ID_HEADER, configure_logging, new_request_id, request_id_var, shutdown_logging
+)
+from metrics import METRICS_CONTENT_TYPE, metrics, render as render_metrics, start_loop_lag_monitor, stop_loop_lag_monitor
+from live_events import GENERAL_TOPIC, encode_event, format_sse, groupe_topic, planning_topic, stream_events, user_topic
+from semaine_type_expansion import apply_semaine_type
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from planning_conflicts import (
+    CONFLIT_SALLE, PlanningOccupancy, conflict_from_error, ensure_planning_unique_indexes,
+    insert_planning_slot, insert_planning_slots
+)
+
 # Scheduler - import lazy pour éviter de ralentir le démarrage
 scheduler = None
 AsyncIOScheduler = None
@@ -39,6 +70,10 @@ def get_scheduler():
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Logs JSON écrits par un thread dédié (LOG_FORMAT, LOG_LEVEL, LOG_LEVELS, LOG_DEBUG_SAMPLE)
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # MongoDB connection - LAZY: on crée le client mais on ne connecte pas encore
 mongo_url = os.environ.get('MONGO_URL', '')
 db_name = os.environ.get('DB_NAME', 'cabinet_medical')
@@ -57,7 +92,8 @@ def get_mongo_client():
             mongo_url, 
             serverSelectionTimeoutMS=5000,
             connectTimeoutMS=5000,
-            socketTimeoutMS=10000
+            socketTimeoutMS=10000,
+            event_listeners=[command_monitor, pool_monitor]
         )
     return _mongo_client
 
@@ -81,6 +117,7 @@ class LazyDB:
         return get_db()[name]
 
 db = LazyDB()
+configure_store(db)
 
 async def ensure_mongo_connected():
     """Vérifie et établit la connexion MongoDB si nécessaire"""
@@ -102,91 +139,20 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 security = HTTPBearer()
 
+# Cache des utilisateurs authentifiés et pool de hachage (importés après load_dotenv pour lire la config)
+from principal_cache import principal_cache
+from token_revocation import token_versions
+import password_hashing
+
 # Fonction de notification automatique à 7h
 async def send_morning_planning_notifications():
-    """Envoie les notifications de planning à 7h du matin à tous les employés qui travaillent aujourd'hui"""
-    from push_notifications import send_push_notification
-    
-    try:
-        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-        print(f"🔔 [CRON 7h] Envoi des notifications de planning pour {today}")
-        
-        # Récupérer tous les créneaux du jour
-        creneaux = await db.planning.find({"date": today, "est_repos": {"$ne": True}}).to_list(1000)
-        
-        # Grouper par employé
-        employees_planning = {}
-        for creneau in creneaux:
-            emp_id = creneau.get("employe_id")
-            if emp_id not in employees_planning:
-                employees_planning[emp_id] = []
-            employees_planning[emp_id].append(creneau)
-        
-        if not employees_planning:
-            print(f"ℹ️ [CRON 7h] Aucun créneau trouvé pour {today}")
-            return
-        
-        # OPTIMISATION N+1: Batch fetch tous les utilisateurs concernés
-        emp_ids = list(employees_planning.keys())
-        users = await db.users.find(
-            {"id": {"$in": emp_ids}, "actif": True},
-            {"_id": 0}
-        ).to_list(1000)
-        users_map = {u["id"]: u for u in users}
-        
-        # OPTIMISATION N+1: Batch fetch tous les centres
-        centre_ids = set()
-        for u in users:
-            cid = u.get("centre_id") or (u.get("centre_ids", [None])[0] if u.get("centre_ids") else None)
-            if cid:
-                centre_ids.add(cid)
-        
-        centres = await db.centres.find(
-            {"id": {"$in": list(centre_ids)}},
-            {"_id": 0, "id": 1, "nom": 1}
-        ).to_list(100) if centre_ids else []
-        centres_map = {c["id"]: c for c in centres}
-        
-        notifications_sent = 0
-        
-        for emp_id, emp_creneaux in employees_planning.items():
-            user = users_map.get(emp_id)
-            if not user:
-                continue
-            
-            # Construire le message
-            creneaux_text = []
-            for c in emp_creneaux:
-                salle = c.get("salle_nom") or c.get("salle_id") or "Non assigné"
-                creneau_type = "Matin" if c.get("creneau") == "MATIN" else "Après-midi"
-                creneaux_text.append(f"{creneau_type}: Salle {salle}")
-            
-            # Récupérer le centre (depuis le map)
-            centre_id = user.get("centre_id") or (user.get("centre_ids", [None])[0] if user.get("centre_ids") else None)
-            centre = centres_map.get(centre_id) if centre_id else None
-            centre_nom = centre.get("nom", "") if centre else ""
-            
-            message = f"Votre planning du jour:\n" + "\n".join(creneaux_text)
-            if centre_nom:
-                message = f"📍 {centre_nom}\n" + message
-            
-            # Envoyer la notification
-            fcm_token = user.get("fcm_token")
-            fcm_devices = user.get("fcm_devices", [])
-            
-            if fcm_token:
-                await send_push_notification(fcm_token, "📅 Votre planning du jour", message, {"type": "daily_planning"})
-                notifications_sent += 1
-            
-            for device in fcm_devices:
-                if device.get("token"):
-                    await send_push_notification(device["token"], "📅 Votre planning du jour", message, {"type": "daily_planning"})
-                    notifications_sent += 1
-        
-        print(f"✅ [CRON 7h] {notifications_sent} notifications envoyées à {len(employees_planning)} employés")
-        
-    except Exception as e:
-        print(f"❌ [CRON 7h] Erreur: {e}")
+    """
+    Envoie les notifications de planning à 7h du matin à tous les employés qui travaillent aujourd'hui.
+    Implémentation partagée avec services/scheduler_service.py (envoi groupé par lots de 500 tokens,
+    historique des exécutions dans job_runs).
+    """
+    from services.scheduler_service import run_morning_planning_notifications
+    return await run_morning_planning_notifications(db)
 
 # Lifecycle events - OPTIMISÉ pour démarrage rapide
 @asynccontextmanager
@@ -215,6 +181,25 @@ async def lifespan(app: FastAPI):
             print("✅ [BACKGROUND] MongoDB connecté!", flush=True)
         except Exception as e:
             print(f"⚠️ [BACKGROUND] MongoDB: {e} - sera reconnecté à la demande", flush=True)
+
+        if _mongo_connected:
+            # Étapes indépendantes : l'échec de l'une n'empêche pas les suivantes
+            etapes = [
+                ("index uniques du planning", ensure_planning_unique_indexes),
+                # Index déclarés dans index_registry : création des manquants, dérive signalée
+                ("réconciliation des index", index_registry.reconcile_indexes),
+                ("reconstruction des conversations", conversations.rebuild_conversations),
+                ("migration des appareils push", push_devices.migrate_embedded_devices),
+            ]
+            for nom, etape in etapes:
+                try:
+                    await etape(db)
+                    print(f"✅ [BACKGROUND] {nom} : OK", flush=True)
+                except Exception as e:
+                    print(f"⚠️ [BACKGROUND] {nom} : {e}", flush=True)
+        
+        # Workers de l'outbox des notifications
+        notification_outbox.start_outbox_worker(db)
         
         # Démarrer le scheduler en arrière-plan
         try:
@@ -235,6 +220,10 @@ async def lifespan(app: FastAPI):
     
     # Lancer en arrière-plan sans attendre
     asyncio.create_task(background_init())
+    # Retard de la boucle asyncio (GET /metrics)
+    start_loop_lag_monitor()
+    if LOOP_WATCHDOG:
+        loop_watchdog.start()
     
     print("✅ [LIFESPAN] Serveur prêt à recevoir des requêtes!", flush=True)
     
@@ -247,12 +236,48 @@ async def lifespan(app: FastAPI):
             scheduler.shutdown(wait=False)
     except:
         pass
+    stop_loop_lag_monitor()
+    loop_watchdog.stop()
+    shutdown_logging()
+    password_hashing.shutdown_hash_executor()
+    try:
+        await notification_outbox.stop_outbox_worker()
+        await close_push_transport()
+    except Exception:
+        pass
 
 print("🔧 [DEBUG] Création de l'app FastAPI...")
 # Create the main app with lifespan
 app = FastAPI(title="Gestion Personnel Médical", lifespan=lifespan)
 print("🔧 [DEBUG] App FastAPI créée")
 
+@app.middleware("http")
+async def mongo_perf_middleware(request: Request, call_next):
+    """
+    Identifiant de requête (X-Request-ID, champ request_id des logs), latence et statut
+    par route (GET /metrics), commandes MongoDB de la requête (GET /api/admin/perf)
+    """
+    request_id = new_request_id(request.headers.get(REQUEST_ID_HEADER))
+    request_id_token = request_id_var.set(request_id)
+    stats, token = mongo_monitoring.begin_request()
+    debut = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        duree = time.perf_counter() - debut
+        route = request.scope.get("route")
+        # Gabarit de la route (/api/planning/{planning_id}) plutôt que le chemin concret
+        nom_route = getattr(route, "path", None) or "non routé"
+        metrics.observe_request(request.method, nom_route, status_code, duree)
+        timing = mongo_monitoring.end_request(stats, token, f"{request.method} {nom_route}", duree * 1000)
+        request_id_var.reset(request_id_token)
+    response.headers[REQUEST_ID_HEADER] = request_id
+    if timing:
+        response.headers["Server-Timing"] = timing
+    return response
+
 # ===== ENDPOINTS DE SANTÉ - RÉPONDENT IMMÉDIATEMENT =====
 # Ces endpoints sont montés AVANT tout pour garantir un cold start rapide
 
@@ -314,9 +339,38 @@ async def status_check():
             "mongodb": "connected" if mongo_ok else "disconnected",
             "scheduler": "running" if (scheduler and scheduler.running) else "stopped"
         },
+        "principal_cache": principal_cache.stats(),
+        "indexes": index_registry.report_summary(),
         "uptime_seconds": (datetime.now(timezone.utc) - _startup_time).total_seconds()
     }
 
+@app.get("/metrics")
+@app.get("/api/metrics")
+async def prometheus_metrics(request: Request):
+    """
+    Métriques au format texte Prometheus. Si METRICS_TOKEN est défini,
+    le scrape doit envoyer Authorization: Bearer <METRICS_TOKEN>.
+    """
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if metrics_token and request.headers.get("Authorization") != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=401, detail="Token de métriques invalide")
+    outbox = None
+    try:
+        outbox = await asyncio.wait_for(notification_outbox.outbox_stats(db), timeout=2)
+    except Exception:
+        pass  # MongoDB indisponible : les autres métriques restent servies
+    versions = resource_versions.stats()
+    caches = {
+        "principal": principal_cache.stats(),
+        "etag": {"hits": versions["not_modified"], "misses": versions["modified"], "hit_ratio": versions["hit_ratio"]},
+    }
+    texte = render_metrics(
+        pool=pool_monitor.stats(), perf=perf_registry.command_histograms(), outbox=outbox,
+        caches=caches, live=live_events.broker.stats(),
+        blocking=loop_watchdog.offenders()
+    )
+    return Response(content=texte, media_type=METRICS_CONTENT_TYPE)
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -932,6 +986,14 @@ class DemandeMensuelleCreate(BaseModel):
     jours_avec_creneaux: Optional[List[dict]] = None  # Nouveau : [{date: "2025-01-15", creneau: "MATIN"}]
     motif: Optional[str] = None
 
+class ApplicationSemaineTypeRequest(BaseModel):
+    semaine_type_id: str
+    medecin_ids: List[str] = []  # Ignoré pour un médecin (appliqué à lui-même)
+    date_debut_semaine: str  # YYYY-MM-DD (ramené au lundi de la semaine)
+    nb_semaines: int = Field(default=1, ge=1, le=53)
+    centre_id: Optional[str] = None
+    motif: Optional[str] = None
+
 class ApprobationJourTravailRequest(BaseModel):
     approuve: bool
     commentaire: str = ""
@@ -1000,6 +1062,14 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password):
+    """Version non bloquante de verify_password (pool de threads dédié)"""
+    return await password_hashing.verify_password_async(pwd_context, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """Version non bloquante de get_password_hash (pool de threads dédié)"""
+    return await password_hashing.hash_password_async(pwd_context, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -1010,36 +1080,116 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    credentials_exception = HTTPException(
+# Champs dont la modification révoque les tokens existants (claim de rôle signé, statut du compte).
+# Les permissions fines (manager_permissions, vue_planning_complete...) sont relues en base :
+# invalider le cache des principals suffit.
+TOKEN_SENSITIVE_FIELDS = {"role", "actif"}
+
+def build_token_claims(user: dict) -> dict:
+    """Claims signés du token : rôle, centre actif et version de permissions"""
+    return {
+        "sub": user["id"],
+        "role": user.get("role"),
+        "centre_id": user.get("centre_actif_id") or user.get("centre_id"),
+        "ver": user.get("token_version", 0)
+    }
+
+class TokenPrincipal(BaseModel):
+    """Identité extraite du token signé, sans lecture de l'utilisateur en base"""
+    id: str
+    role: Optional[str] = None  # None pour les anciens tokens (sans claims)
+    centre_actif_id: Optional[str] = None
+    token_version: Optional[int] = None
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Impossible de valider les informations d'identification",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+async def decode_access_token(token: str) -> TokenPrincipal:
+    """Décode le JWT et vérifie sa version contre la table de révocation (en cache)"""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
-            raise credentials_exception
+            raise _credentials_exception()
     except jwt.PyJWTError:
-        raise credentials_exception
+        raise _credentials_exception()
     
-    user = await db.users.find_one({"id": user_id})
+    token_version = payload.get("ver")
+    if token_version is not None and not await token_versions.is_current(db, user_id, token_version):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Session expirée, veuillez vous reconnecter",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return TokenPrincipal(
+        id=user_id,
+        role=payload.get("role"),
+        centre_actif_id=payload.get("centre_id"),
+        token_version=token_version
+    )
+
+async def get_token_principal(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenPrincipal:
+    return await decode_access_token(credentials.credentials)
+
+async def load_current_user(user_id: str) -> User:
+    """Charge l'utilisateur complet (cache principal, sinon MongoDB)"""
+    cached_user = principal_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+    
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     if user is None:
-        raise credentials_exception
-    return User(**user)
+        raise _credentials_exception()
+    principal = User(**user)
+    principal_cache.set(user_id, principal)
+    return principal
+
+async def get_current_user(token: TokenPrincipal = Depends(get_token_principal)):
+    return await load_current_user(token.id)
+
+def _check_role(role: Optional[str], allowed_roles: List[str]):
+    if role not in allowed_roles:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permissions insuffisantes pour cette action"
+        )
 
 def require_role(allowed_roles: List[str]):
-    def role_checker(current_user: User = Depends(get_current_user)):
-        if current_user.role not in allowed_roles:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Permissions insuffisantes pour cette action"
-            )
+    async def role_checker(token: TokenPrincipal = Depends(get_token_principal)):
+        # Refus immédiat à partir du claim signé, sans lire l'utilisateur
+        if token.role is not None:
+            _check_role(token.role, allowed_roles)
+        current_user = await load_current_user(token.id)
+        _check_role(current_user.role, allowed_roles)
         return current_user
     return role_checker
 
+def require_role_claims(allowed_roles: List[str]):
+    """Comme require_role, mais sans aucun accès à la base quand le token porte ses claims.
+    
+    À utiliser pour les endpoints qui n'ont besoin que de l'id / du rôle de l'appelant."""
+    async def claims_checker(token: TokenPrincipal = Depends(get_token_principal)):
+        if token.role is None:
+            # Ancien token sans claims : on se rabat sur l'utilisateur complet
+            current_user = await load_current_user(token.id)
+            token = token.model_copy(update={"role": current_user.role, "centre_actif_id": current_user.centre_actif_id})
+        _check_role(token.role, allowed_roles)
+        return token
+    return claims_checker
+
+async def revoke_user_tokens(user_id: str):
+    """Révoque les tokens existants d'un utilisateur (rôle, statut ou mot de passe modifiés)"""
+    await token_versions.bump(db, user_id)
+    principal_cache.invalidate(user_id)
+
+def get_user_loader() -> UserLoader:
+    """Chargeur d'utilisateurs groupé, une instance par requête (évite les N+1)"""
+    return UserLoader(db)
+
 # ===== SYSTÈME DE NOTIFICATIONS =====
 
 class NotificationSubscription(BaseModel):
@@ -1061,40 +1211,20 @@ async def send_notification_to_user(user_id: str, title: str, body: str, data: O
     """Envoie une notification push à un utilisateur spécifique (push uniquement, pas de stockage in-app)"""
     try:
         push_sent = False
-        user = await db.users.find_one({"id": user_id}, {"fcm_token": 1, "fcm_devices": 1})
         
-        # Récupérer tous les tokens FCM de l'utilisateur
-        fcm_tokens = []
-        
-        if user:
-            # Nouveau format: tableau de devices
-            if user.get("fcm_devices"):
-                for device in user["fcm_devices"]:
-                    token = device.get("fcm_token")
-                    if token and not token.startswith("local_"):
-                        fcm_tokens.append(token)
-            
-            # Ancien format: un seul token
-            elif user.get("fcm_token") and not user["fcm_token"].startswith("local_"):
-                fcm_tokens.append(user["fcm_token"])
+        # Récupérer tous les tokens FCM de l'utilisateur (collection push_devices)
+        fcm_tokens = await push_devices.tokens_for_users(db, [user_id])
         
         if fcm_tokens:
             try:
-                from push_notifications import send_push_notification
-                
-                for fcm_token in fcm_tokens:
-                    print(f"📱 [PUSH] Envoi à token: {fcm_token[:40]}...")
-                    push_result = await send_push_notification(
-                        fcm_token=fcm_token,
-                        title=title,
-                        body=body,
-                        data=data or {}
-                    )
-                    if push_result:
-                        push_sent = True
-                        print(f"✅ [PUSH] Notification envoyée à {user_id}")
+                from push_notifications import send_push_to_multiple
                 
-                if not push_sent:
+                # Tous les appareils de l'utilisateur en un seul envoi (non bloquant)
+                sent = await send_push_to_multiple(fcm_tokens, title, body, data or {}, database=db)
+                push_sent = sent > 0
+                if push_sent:
+                    print(f"✅ [PUSH] Notification envoyée à {user_id} ({sent}/{len(fcm_tokens)} appareils)")
+                else:
                     print(f"⚠️ [PUSH] Échec pour {user_id}")
                     
             except Exception as push_error:
@@ -1108,84 +1238,91 @@ async def send_notification_to_user(user_id: str, title: str, body: str, data: O
         print(f"❌ Erreur notification: {e}")
         return False
 
+async def send_notification_to_users(user_ids, title: str, body: str, data: Optional[Dict] = None) -> int:
+    """
+    Envoie la même notification push à plusieurs utilisateurs :
+    une seule requête push_devices pour tous les tokens, un seul envoi multicast.
+    Retourne le nombre de notifications envoyées.
+    """
+    user_ids = list(dict.fromkeys(u for u in user_ids if u))
+    if not user_ids:
+        return 0
+    try:
+        fcm_tokens = await push_devices.tokens_for_users(db, user_ids)
+        if not fcm_tokens:
+            print(f"⚠️ [PUSH] Aucun token FCM pour {len(user_ids)} utilisateur(s)")
+            return 0
+        
+        from push_notifications import send_push_to_multiple
+        sent = await send_push_to_multiple(fcm_tokens, title, body, data or {}, database=db)
+        print(f"📱 [PUSH] {sent}/{len(fcm_tokens)} notifications envoyées ({len(user_ids)} utilisateurs)")
+        return sent
+    except Exception as e:
+        print(f"❌ Erreur notification groupée: {e}")
+        return 0
+
 async def notify_director_new_request(type_request: str, user_name: str, details: str):
-    """Notifie le directeur d'une nouvelle demande"""
+    """Notifie le directeur d'une nouvelle demande (push via un job push_users de l'outbox)"""
     # Trouver le directeur
     director = await db.users.find_one({"role": ROLES["DIRECTEUR"], "actif": True})
     if director:
         title = f"🆕 Nouvelle {type_request}"
         body = f"{user_name} a fait une {type_request.lower()}: {details}"
-        await send_notification_to_user(
-            director["id"], 
+        await enqueue_push(
+            db,
+            [director["id"]], 
             title, 
             body, 
             {"type": "new_request", "request_type": type_request}
         )
 
 async def notify_user_request_status(user_id: str, type_request: str, status: str, details: str):
-    """Notifie un utilisateur du changement de statut de sa demande"""
+    """Notifie un utilisateur du changement de statut de sa demande (job push_users de l'outbox)"""
     status_emoji = "✅" if status == "APPROUVE" else "❌"
     status_text = "approuvée" if status == "APPROUVE" else "refusée"
     
     title = f"{status_emoji} {type_request} {status_text}"
     body = f"Votre {type_request.lower()} du {details} a été {status_text}"
     
-    await send_notification_to_user(
-        user_id, 
+    await enqueue_push(
+        db,
+        [user_id], 
         title, 
         body, 
         {"type": "status_change", "status": status, "request_type": type_request}
     )
 
 async def notify_colleagues_about_leave(user_name: str, date_debut: str, date_fin: str, creneau: str, user_id: str):
-    """Notifie les collègues qui travaillent pendant les jours de congé"""
-    from datetime import datetime, timedelta
+    """
+    Notifie les collègues qui travaillent pendant les jours de congé.
+    Les erreurs ne sont pas interceptées : le job outbox est réessayé ou passe en ECHEC.
+    """
+    # Trouver qui travaille sur la période : une seule requête distinct, sans limite par jour
+    query = {
+        "date": {"$gte": date_debut, "$lte": date_fin},
+        "employe_id": {"$ne": user_id}
+    }
     
-    try:
-        # Convertir les dates
-        debut = datetime.strptime(date_debut, '%Y-%m-%d')
-        fin = datetime.strptime(date_fin, '%Y-%m-%d')
-        
-        # Pour chaque jour du congé
-        current_date = debut
-        colleagues_notified = set()
-        
-        while current_date <= fin:
-            date_str = current_date.strftime('%Y-%m-%d')
-            
-            # Trouver qui travaille ce jour-là
-            query = {"date": date_str, "employe_id": {"$ne": user_id}}
-            
-            # Filtrer par créneau si ce n'est pas une journée complète
-            if creneau and creneau != "JOURNEE_COMPLETE":
-                query["creneau"] = creneau
-            
-            working_colleagues = await db.planning.find(query).to_list(100)
-            
-            for colleague_slot in working_colleagues:
-                colleague_id = colleague_slot["employe_id"]
-                if colleague_id not in colleagues_notified:
-                    colleagues_notified.add(colleague_id)
-            
-            current_date += timedelta(days=1)
-        
-        # Envoyer une notification à chaque collègue concerné
-        if colleagues_notified:
-            creneau_text = "toute la journée" if creneau == "JOURNEE_COMPLETE" else creneau.lower()
-            dates_text = date_debut if date_debut == date_fin else f"{date_debut} au {date_fin}"
-            
-            for colleague_id in colleagues_notified:
-                await send_notification_to_user(
-                    colleague_id,
-                    f"🏖️ Congé d'un collègue",
-                    f"{user_name} sera en congé le {dates_text} ({creneau_text})",
-                    {"type": "colleague_leave", "date_debut": date_debut, "date_fin": date_fin}
-                )
-        
-        print(f"📤 {len(colleagues_notified)} collègues notifiés du congé de {user_name}")
+    # Filtrer par créneau si ce n'est pas une journée complète
+    if creneau and creneau != "JOURNEE_COMPLETE":
+        query["creneau"] = creneau
+    
+    colleagues_notified = [c for c in await db.planning.distinct("employe_id", query) if c]
+    
+    # Même message pour tous les collègues : un seul job push_users (réessayé par l'outbox)
+    if colleagues_notified:
+        creneau_text = "toute la journée" if creneau == "JOURNEE_COMPLETE" else creneau.lower()
+        dates_text = date_debut if date_debut == date_fin else f"{date_debut} au {date_fin}"
         
-    except Exception as e:
-        print(f"❌ Erreur notification collègues congé: {e}")
+        await enqueue_push(
+            db,
+            colleagues_notified,
+            f"🏖️ Congé d'un collègue",
+            f"{user_name} sera en congé le {dates_text} ({creneau_text})",
+            {"type": "colleague_leave", "date_debut": date_debut, "date_fin": date_fin}
+        )
+    
+    print(f"📤 {len(colleagues_notified)} collègues notifiés du congé de {user_name}")
 
 
 async def handle_assistant_slots_for_leave(user_id: str, date_debut: str, date_fin: str, creneau: str, approve: bool):
@@ -1200,115 +1337,121 @@ async def handle_assistant_slots_for_leave(user_id: str, date_debut: str, date_f
         date_fin: Date de fin du congé (YYYY-MM-DD)
         creneau: Type de créneau ("MATIN", "APRES_MIDI", "JOURNEE_COMPLETE")
         approve: True si le congé est approuvé, False si refusé
-    """
-    from datetime import datetime, timedelta
     
+    Exécutée par l'outbox : une erreur est propagée (job réessayé ou ECHEC avec derniere_erreur).
+    """
     if not approve:
         return  # Rien à faire si le congé est refusé
     
-    try:
-        # Vérifier si l'utilisateur est un médecin
-        user = await db.users.find_one({"id": user_id})
-        if not user or user.get("role") != ROLES["MEDECIN"]:
-            return  # Cette logique ne s'applique qu'aux médecins
-        
-        medecin_name = f"Dr. {user['prenom']} {user['nom']}"
+    # Vérifier si l'utilisateur est un médecin
+    user = await db.users.find_one({"id": user_id})
+    if not user or user.get("role") != ROLES["MEDECIN"]:
+        return  # Cette logique ne s'applique qu'aux médecins
+    
+    medecin_name = f"Dr. {user['prenom']} {user['nom']}"
+    
+    # Déterminer les créneaux à traiter
+    creneaux_a_traiter = []
+    if creneau == "JOURNEE_COMPLETE":
+        creneaux_a_traiter = ["MATIN", "APRES_MIDI"]
+    else:
+        creneaux_a_traiter = [creneau]
+    
+    # Tous les créneaux d'assistants de la période en une seule requête
+    # Un assistant peut être assigné via medecin_attribue_id ou dans la liste medecin_ids
+    assistant_creneaux = await db.planning.find(
+        {
+            "date": {"$gte": date_debut, "$lte": date_fin},
+            "creneau": {"$in": creneaux_a_traiter},
+            "employe_role": ROLES["ASSISTANT"],
+            "$or": [
+                {"medecin_attribue_id": user_id},
+                {"medecin_ids": user_id}
+            ]
+        },
+        {"_id": 0, "id": 1, "employe_id": 1, "medecin_ids": 1, "notes": 1, "centre_id": 1, "date": 1}
+    ).to_list(None)
+    
+    assistants_notifies = set()
+    creneaux_supprimes = 0
+    operations = []
+    
+    for creneau_assistant in assistant_creneaux:
+        assistant_id = creneau_assistant["employe_id"]
         
-        # Convertir les dates
-        debut = datetime.strptime(date_debut, '%Y-%m-%d')
-        fin = datetime.strptime(date_fin, '%Y-%m-%d')
+        # Vérifier si l'assistant a d'autres médecins assignés pour ce créneau
+        autres_medecins = [m for m in creneau_assistant.get("medecin_ids", []) if m != user_id]
         
-        # Déterminer les créneaux à traiter
-        creneaux_a_traiter = []
-        if creneau == "JOURNEE_COMPLETE":
-            creneaux_a_traiter = ["MATIN", "APRES_MIDI"]
+        if autres_medecins:
+            # L'assistant a d'autres médecins - juste retirer ce médecin de la liste
+            operations.append(UpdateOne(
+                {"id": creneau_assistant["id"]},
+                {
+                    "$pull": {"medecin_ids": user_id},
+                    "$set": {
+                        "medecin_attribue_id": autres_medecins[0],
+                        "notes": (creneau_assistant.get("notes") or "") + f"\n⚠️ Dr. {user['nom']} en congé - réassigné"
+                    }
+                }
+            ))
         else:
-            creneaux_a_traiter = [creneau]
-        
-        assistants_notifies = set()
-        creneaux_supprimes = 0
-        
-        # Pour chaque jour du congé
-        current_date = debut
-        while current_date <= fin:
-            date_str = current_date.strftime('%Y-%m-%d')
-            
-            for creneau_type in creneaux_a_traiter:
-                # Trouver les créneaux des assistants assignés à ce médecin pour ce jour/créneau
-                # Un assistant peut être assigné via medecin_attribue_id ou dans la liste medecin_ids
-                assistant_creneaux = await db.planning.find({
-                    "date": date_str,
-                    "creneau": creneau_type,
-                    "employe_role": ROLES["ASSISTANT"],
-                    "$or": [
-                        {"medecin_attribue_id": user_id},
-                        {"medecin_ids": user_id}
-                    ]
-                }).to_list(100)
-                
-                for creneau_assistant in assistant_creneaux:
-                    assistant_id = creneau_assistant["employe_id"]
-                    
-                    # Vérifier si l'assistant a d'autres médecins assignés pour ce créneau
-                    autres_medecins = [m for m in creneau_assistant.get("medecin_ids", []) if m != user_id]
-                    
-                    if autres_medecins:
-                        # L'assistant a d'autres médecins - juste retirer ce médecin de la liste
-                        await db.planning.update_one(
-                            {"id": creneau_assistant["id"]},
-                            {
-                                "$pull": {"medecin_ids": user_id},
-                                "$set": {
-                                    "medecin_attribue_id": autres_medecins[0] if autres_medecins else None,
-                                    "notes": (creneau_assistant.get("notes") or "") + f"\n⚠️ Dr. {user['nom']} en congé - réassigné"
-                                }
-                            }
-                        )
-                        print(f"📝 Créneau assistant {assistant_id} mis à jour - médecin {user_id} retiré")
-                    else:
-                        # L'assistant n'a plus de médecin - supprimer le créneau ou le marquer comme à réassigner
-                        await db.planning.update_one(
-                            {"id": creneau_assistant["id"]},
-                            {
-                                "$set": {
-                                    "medecin_attribue_id": None,
-                                    "medecin_ids": [],
-                                    "notes": (creneau_assistant.get("notes") or "") + f"\n⚠️ {medecin_name} en congé - À RÉASSIGNER",
-                                    "est_repos": True  # Marquer comme repos temporairement
-                                }
-                            }
-                        )
-                        creneaux_supprimes += 1
-                        print(f"⚠️ Créneau assistant {assistant_id} marqué à réassigner - médecin {user_id} en congé")
-                    
-                    # Ajouter l'assistant à la liste pour notification
-                    if assistant_id not in assistants_notifies:
-                        assistants_notifies.add(assistant_id)
-            
-            current_date += timedelta(days=1)
-        
-        # Notifier les assistants concernés
-        for assistant_id in assistants_notifies:
-            dates_text = date_debut if date_debut == date_fin else f"{date_debut} au {date_fin}"
-            creneau_text = "toute la journée" if creneau == "JOURNEE_COMPLETE" else creneau.lower()
-            
-            await send_notification_to_user(
-                assistant_id,
-                "⚠️ Modification de planning",
-                f"{medecin_name} sera en congé le {dates_text} ({creneau_text}). Votre planning a été mis à jour.",
+            # L'assistant n'a plus de médecin - marquer le créneau comme à réassigner
+            operations.append(UpdateOne(
+                {"id": creneau_assistant["id"]},
                 {
-                    "type": "planning_update",
-                    "reason": "medecin_leave",
-                    "medecin_id": user_id,
-                    "date_debut": date_debut,
-                    "date_fin": date_fin
+                    "$set": {
+                        "medecin_attribue_id": None,
+                        "medecin_ids": [],
+                        "notes": (creneau_assistant.get("notes") or "") + f"\n⚠️ {medecin_name} en congé - À RÉASSIGNER",
+                        "est_repos": True  # Marquer comme repos temporairement
+                    }
                 }
-            )
-        
-        print(f"✅ Gestion des créneaux assistants terminée: {creneaux_supprimes} créneaux modifiés, {len(assistants_notifies)} assistants notifiés")
+            ))
+            creneaux_supprimes += 1
+        
+        # Ajouter l'assistant à la liste pour notification
+        assistants_notifies.add(assistant_id)
+    
+    # Toutes les mises à jour en un seul aller-retour
+    if operations:
+        await db.planning.bulk_write(operations, ordered=False)
+        await planning_changes.record_changes(db, assistant_creneaux, planning_changes.UPSERT)
+        live_events.publish(
+            [planning_topic(c.get("centre_id")) for c in assistant_creneaux],
+            "planning",
+            {"action": "update", "date_debut": date_debut, "date_fin": date_fin,
+             "creneau_ids": [c["id"] for c in assistant_creneaux]}
+        )
+    
+    # Notifier les assistants concernés (même message pour tous : un seul job push_users)
+    if assistants_notifies:
+        dates_text = date_debut if date_debut == date_fin else f"{date_debut} au {date_fin}"
+        creneau_text = "toute la journée" if creneau == "JOURNEE_COMPLETE" else creneau.lower()
         
-    except Exception as e:
-        print(f"❌ Erreur lors de la gestion des créneaux assistants: {e}")
+        await enqueue_push(
+            db,
+            sorted(assistants_notifies),
+            "⚠️ Modification de planning",
+            f"{medecin_name} sera en congé le {dates_text} ({creneau_text}). Votre planning a été mis à jour.",
+            {
+                "type": "planning_update",
+                "reason": "medecin_leave",
+                "medecin_id": user_id,
+                "date_debut": date_debut,
+                "date_fin": date_fin
+            }
+        )
+    
+    print(f"✅ Gestion des créneaux assistants terminée: {creneaux_supprimes} créneaux modifiés, {len(assistants_notifies)} assistants notifiés")
+
+
+
+# Tâches exécutées par les workers de l'outbox (payload = arguments nommés)
+notification_outbox.register_handler("notify_director_new_request", notify_director_new_request)
+notification_outbox.register_handler("notify_user_request_status", notify_user_request_status)
+notification_outbox.register_handler("notify_colleagues_about_leave", notify_colleagues_about_leave)
+notification_outbox.register_handler("handle_assistant_slots_for_leave", handle_assistant_slots_for_leave)
+register_fanout_handler(db)
 
 
 async def send_daily_planning_notifications():
@@ -1424,15 +1567,16 @@ async def build_daily_planning_message(user, planning_slots, date):
 
 # Firebase Status Endpoint - MUST be before generic /notifications endpoint
 @api_router.get("/notifications/firebase-status")
-async def get_firebase_status_endpoint(current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))):
+async def get_firebase_status_endpoint(current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))):
     """Vérifie le statut de Firebase pour les notifications push (Directeur uniquement)"""
     try:
-        from push_notifications import get_firebase_status
+        from push_notifications import get_firebase_status, get_push_counters
         status = get_firebase_status()
         
         # Compter les utilisateurs avec token FCM
-        users_with_fcm = await db.users.count_documents({"fcm_token": {"$exists": True, "$ne": ""}})
-        status["users_with_fcm_token"] = users_with_fcm
+        users_with_fcm = await db.push_devices.distinct("user_id", {"actif": True, **push_devices.TOKENS_ENVOYABLES})
+        status["users_with_fcm_token"] = len(users_with_fcm)
+        status["compteurs"] = get_push_counters()
         
         return status
     except Exception as e:
@@ -1446,16 +1590,24 @@ async def get_firebase_status_endpoint(current_user: User = Depends(require_role
 @api_router.post("/notifications/send-daily-planning")
 async def trigger_daily_planning(
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
 ):
     """Déclenche manuellement l'envoi du planning quotidien (TEST)"""
     background_tasks.add_task(send_morning_planning_notifications)
     return {"message": "Envoi du planning quotidien programmé"}
 
 
+@api_router.get("/notifications/outbox-status")
+async def get_outbox_status(
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
+):
+    """Profondeur et retard de la file des notifications (outbox)"""
+    return await outbox_stats(db)
+
+
 @api_router.get("/notifications/scheduler-status")
 async def get_scheduler_status(
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
 ):
     """Récupère le statut du scheduler de notifications"""
     jobs = scheduler.get_jobs()
@@ -1480,7 +1632,7 @@ async def get_scheduler_status(
 
 @api_router.post("/notifications/test-scheduler")
 async def test_scheduler_notification(
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
 ):
     """Exécute immédiatement la tâche de notification pour tester"""
     await send_morning_planning_notifications()
@@ -1498,7 +1650,7 @@ class NotificationTestRequest(BaseModel):
 async def send_test_notifications(
     request: NotificationTestRequest,
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Envoie des notifications de test personnalisées à des employés spécifiques (Directeur uniquement)"""
     if not request.user_ids:
@@ -1532,18 +1684,20 @@ async def send_test_notifications(
 
 @api_router.get("/notifications/employees-for-test")
 async def get_employees_for_notification_test(
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Récupère la liste des employés avec leur statut de notification push pour l'interface d'envoi de test"""
     users = await db.users.find(
         {"actif": True},
-        {"_id": 0, "id": 1, "prenom": 1, "nom": 1, "role": 1, "email": 1, "fcm_token": 1, "fcm_devices": 1}
+        {"_id": 0, "id": 1, "prenom": 1, "nom": 1, "role": 1, "email": 1}
     ).to_list(1000)
+    # Appareils de tous les employés en une requête
+    tokens_par_user = await push_devices.tokens_by_user(db, [u["id"] for u in users])
     
     employees = []
     for user in users:
-        has_push = bool(user.get("fcm_token")) or bool(user.get("fcm_devices"))
-        devices_count = len(user.get("fcm_devices", [])) if user.get("fcm_devices") else (1 if user.get("fcm_token") else 0)
+        devices_count = len(tokens_par_user.get(user["id"], []))
+        has_push = devices_count > 0
         
         employees.append({
             "id": user["id"],
@@ -1595,7 +1749,14 @@ async def quick_reply_to_message(
         type_message=original_message.get("type_message", "PRIVE")
     )
     
-    await db.messages.insert_one(nouveau_message.dict())
+    message_doc = nouveau_message.dict()
+    await db.messages.insert_one(message_doc)
+    if message_doc["type_message"] == "GROUPE":
+        groupe = await db.groupes_chat.find_one({"id": message_doc["groupe_id"]}, {"_id": 0, "nom": 1, "membres": 1}) or {}
+        await conversations.record_message(db, message_doc, groupe.get("membres", []), groupe.get("nom"))
+    else:
+        await conversations.record_message(db, message_doc)
+    live_events.publish(message_topics(message_doc), "message", message_doc)
     
     # Envoyer une notification au destinataire
     expediteur_name = f"{current_user.prenom} {current_user.nom}"
@@ -1636,54 +1797,11 @@ async def subscribe_to_notifications(
         if not fcm_token:
             raise HTTPException(status_code=400, detail="Token FCM manquant")
         
-        # Générer un ID unique pour cet appareil
-        import hashlib
-        device_id = hashlib.md5(fcm_token.encode()).hexdigest()[:12]
-        
-        # Construire les infos appareil avec le centre
-        device_data = {
-            "device_id": device_id,
-            "fcm_token": fcm_token,
-            "user_agent": device_info.get("userAgent", "Inconnu"),
-            "platform": device_info.get("platform", "Inconnu"),
-            "device_name": device_info.get("deviceName", "Appareil inconnu"),
-            "browser": device_info.get("browser", "Inconnu"),
-            "os": device_info.get("os", "Inconnu"),
-            "centre_id": centre_id,
-            "registered_at": datetime.now(timezone.utc).isoformat(),
-            "last_used": datetime.now(timezone.utc).isoformat()
-        }
-        
-        # Récupérer l'utilisateur actuel
-        user = await db.users.find_one({"id": current_user.id})
-        existing_devices = user.get("fcm_devices", []) if user else []
-        
-        # Vérifier si cet appareil existe déjà (même token)
-        device_exists = False
-        for i, dev in enumerate(existing_devices):
-            if dev.get("fcm_token") == fcm_token:
-                # Mettre à jour l'appareil existant
-                existing_devices[i] = device_data
-                device_exists = True
-                break
-        
-        if not device_exists:
-            # Ajouter le nouvel appareil (max 5 appareils)
-            existing_devices.append(device_data)
-            if len(existing_devices) > 5:
-                # Supprimer le plus ancien
-                existing_devices = existing_devices[-5:]
-        
-        # Mettre à jour l'utilisateur
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$set": {
-                "fcm_devices": existing_devices,
-                "fcm_token": fcm_token,  # Garder le dernier token pour compatibilité
-                "fcm_updated_at": datetime.now(timezone.utc),
-                "device_info": device_data  # Garder pour compatibilité
-            }}
+        # Un document par appareil (upsert atomique sur le hash du token)
+        enregistrement = await push_devices.register_device(
+            db, current_user.id, fcm_token, device_info, centre_id=centre_id, actif=current_user.actif
         )
+        device_data = enregistrement["device"]
         
         print(f"✅ Token FCM enregistré pour {current_user.prenom} {current_user.nom} - Appareil: {device_data['device_name']} ({device_data['browser']})")
         
@@ -1691,7 +1809,7 @@ async def subscribe_to_notifications(
             "message": "Token FCM enregistré avec succès", 
             "user_id": current_user.id,
             "device_info": device_data,
-            "total_devices": len(existing_devices)
+            "total_devices": enregistrement["total_devices"]
         }
         
     except HTTPException:
@@ -1704,20 +1822,7 @@ async def subscribe_to_notifications(
 async def get_user_devices(current_user: User = Depends(get_current_user)):
     """Récupère la liste des appareils enregistrés pour les notifications"""
     try:
-        user = await db.users.find_one({"id": current_user.id}, {"fcm_devices": 1, "device_info": 1, "fcm_token": 1})
-        
-        if not user:
-            return {"devices": []}
-        
-        # Support ancien format (un seul appareil)
-        devices = user.get("fcm_devices", [])
-        if not devices and user.get("fcm_token"):
-            # Migration: convertir ancien format en nouveau
-            old_device = user.get("device_info", {})
-            old_device["fcm_token"] = user.get("fcm_token")
-            old_device["device_id"] = "legacy"
-            devices = [old_device]
-        
+        devices = await push_devices.list_user_devices(db, current_user.id)
         return {"devices": devices}
     except Exception as e:
         print(f"Erreur: {e}")
@@ -1727,33 +1832,12 @@ async def get_user_devices(current_user: User = Depends(get_current_user)):
 async def remove_device(device_id: str, current_user: User = Depends(get_current_user)):
     """Supprime un appareil de la liste des notifications"""
     try:
-        user = await db.users.find_one({"id": current_user.id})
-        if not user:
-            raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
-        
-        devices = user.get("fcm_devices", [])
-        new_devices = [d for d in devices if d.get("device_id") != device_id]
-        
-        if len(new_devices) == len(devices):
+        # Suppression atomique, limitée aux appareils de l'utilisateur
+        if not await push_devices.remove_device(db, current_user.id, device_id):
             raise HTTPException(status_code=404, detail="Appareil non trouvé")
         
-        # Mettre à jour
-        update_data = {"fcm_devices": new_devices}
-        
-        # Si on supprime le dernier appareil, supprimer aussi fcm_token
-        if len(new_devices) == 0:
-            update_data["fcm_token"] = None
-            update_data["device_info"] = None
-        else:
-            # Mettre à jour fcm_token avec le dernier appareil
-            update_data["fcm_token"] = new_devices[-1].get("fcm_token")
-        
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$set": update_data}
-        )
-        
-        return {"message": "Appareil supprimé", "remaining_devices": len(new_devices)}
+        remaining = await db.push_devices.count_documents({"user_id": current_user.id})
+        return {"message": "Appareil supprimé", "remaining_devices": remaining}
     except HTTPException:
         raise
     except Exception as e:
@@ -1847,6 +1931,7 @@ async def init_admin_simple():
         
         # Insérer le directeur
         await db.users.insert_one(director_data)
+        await resource_versions.bump(USERS)
         
         # Créer aussi la configuration de base
         config_data = {
@@ -1862,6 +1947,7 @@ async def init_admin_simple():
             "derniere_modification": datetime.now(timezone.utc)
         }
         await db.configuration.insert_one(config_data)
+        await resource_versions.bump(CONFIGURATION)
         
         return {
             "status": "success",
@@ -1920,6 +2006,7 @@ async def init_admin():
         
         # Insérer le directeur
         await db.users.insert_one(director_data)
+        await resource_versions.bump(USERS)
         
         # Créer aussi la configuration de base
         config_data = {
@@ -1935,6 +2022,7 @@ async def init_admin():
             "derniere_modification": datetime.now(timezone.utc)
         }
         await db.configuration.insert_one(config_data)
+        await resource_versions.bump(CONFIGURATION)
         
         return {
             "message": "✅ Compte administrateur créé avec succès !",
@@ -1973,7 +2061,7 @@ async def register_user(user_data: UserCreate):
         )
     
     # Create user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     user_dict = user_data.dict()
     del user_dict['password']
     user_obj = User(**user_dict)
@@ -1981,12 +2069,13 @@ async def register_user(user_data: UserCreate):
     user_with_password['password_hash'] = hashed_password
     
     await db.users.insert_one(user_with_password)
+    await resource_versions.bump(USERS)
     return user_obj
 
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_login: UserLogin):
     user = await db.users.find_one({"email": user_login.email})
-    if not user or not verify_password(user_login.password, user.get('password_hash')):
+    if not user or not await verify_password_async(user_login.password, user.get('password_hash')):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email ou mot de passe incorrect"
@@ -2064,11 +2153,13 @@ async def login(user_login: UserLogin):
         update_data["centre_actif_id"] = selected_centre
     
     await db.users.update_one({"id": user['id']}, {"$set": update_data})
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(user['id'])
     
     # Recharger l'utilisateur pour avoir les données à jour
     user = await db.users.find_one({"id": user['id']}, {"_id": 0, "password_hash": 0})
     
-    access_token = create_access_token(data={"sub": user['id']})
+    access_token = create_access_token(data=build_token_claims(user))
     user_obj = User(**user)
     
     return Token(
@@ -2082,8 +2173,13 @@ async def login(user_login: UserLogin):
 
 def require_super_admin():
     """Vérifie que l'utilisateur est Super-Admin"""
-    async def checker(current_user: User = Depends(get_current_user)):
-        if current_user.role not in [ROLES["SUPER_ADMIN"], ROLES["DIRECTEUR"]]:
+    async def checker(token: TokenPrincipal = Depends(get_token_principal)):
+        super_admin_roles = [ROLES["SUPER_ADMIN"], ROLES["DIRECTEUR"]]
+        # Refus immédiat à partir du claim signé, sans lire l'utilisateur
+        if token.role is not None and token.role not in super_admin_roles:
+            raise HTTPException(status_code=403, detail="Accès réservé au Super-Admin")
+        current_user = await load_current_user(token.id)
+        if current_user.role not in super_admin_roles:
             raise HTTPException(status_code=403, detail="Accès réservé au Super-Admin")
         return current_user
     return Depends(checker)
@@ -2195,8 +2291,19 @@ async def switch_centre(
         {"id": current_user.id},
         {"$set": {"centre_actif_id": centre_id}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(current_user.id)
     
-    return {"message": f"Vous êtes maintenant sur le centre: {centre['nom']}", "centre": {"id": centre["id"], "nom": centre["nom"]}}
+    # Nouveau token avec le claim de centre à jour
+    updated_user = await db.users.find_one({"id": current_user.id}, {"_id": 0, "password_hash": 0})
+    access_token = create_access_token(data=build_token_claims(updated_user))
+    
+    return {
+        "message": f"Vous êtes maintenant sur le centre: {centre['nom']}",
+        "centre": {"id": centre["id"], "nom": centre["nom"]},
+        "access_token": access_token,
+        "token_type": "bearer"
+    }
 
 
 # ===== GESTION AVANCÉE DES CENTRES =====
@@ -2319,7 +2426,7 @@ async def create_manager(
         "telephone": user_data.get("telephone"),
         "role": ROLES["MANAGER"],
         "centre_id": centre_id,
-        "password_hash": get_password_hash(user_data.get("password", "manager123")),
+        "password_hash": await get_password_hash_async(user_data.get("password", "manager123")),
         "actif": True,
         "date_creation": datetime.now(timezone.utc),
         "manager_permissions": user_data.get("permissions", MANAGER_PERMISSIONS),
@@ -2328,6 +2435,7 @@ async def create_manager(
     }
     
     await db.users.insert_one(new_manager)
+    await resource_versions.bump(USERS)
     
     # Retourner sans le password_hash
     del new_manager["password_hash"]
@@ -2353,6 +2461,8 @@ async def update_manager_permissions(
         {"id": manager_id},
         {"$set": {"manager_permissions": permissions}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(manager_id)
     
     return {"message": "Permissions du manager mises à jour"}
 
@@ -2394,6 +2504,8 @@ async def update_employee_visibility(
         {"id": employee_id},
         {"$set": {"visibility_config": visibility.dict()}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(employee_id)
     
     return {"message": "Configuration de visibilité mise à jour"}
 
@@ -2431,6 +2543,8 @@ async def change_employee_centre(
             "centre_id": current_centres[0] if current_centres else None  # Garder compatibilité
         }}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(employee_id)
     
     return {"message": f"Centre {new_centre['nom']} ajouté à l'employé", "centre_ids": current_centres}
 
@@ -2469,6 +2583,8 @@ async def update_employee_centres(
             "centre_id": centre_ids[0]  # Premier centre comme centre principal
         }}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(employee_id)
     
     centres_names = [c["nom"] for c in valid_centres]
     return {"message": f"Centres mis à jour: {', '.join(centres_names)}", "centre_ids": centre_ids}
@@ -2507,6 +2623,8 @@ async def remove_employee_from_centre(
             "centre_id": current_centres[0]  # Nouveau centre principal
         }}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(employee_id)
     
     return {"message": "Employé retiré du centre", "centre_ids": current_centres}
 
@@ -2622,7 +2740,7 @@ async def approve_inscription(
         "telephone": inscription.get("telephone"),
         "role": inscription["role_souhaite"],
         "centre_id": inscription["centre_id"],
-        "password_hash": get_password_hash(password),
+        "password_hash": await get_password_hash_async(password),
         "actif": True,
         "date_creation": datetime.now(timezone.utc),
         "vue_planning_complete": False,
@@ -2630,6 +2748,7 @@ async def approve_inscription(
     }
     
     await db.users.insert_one(user_data)
+    await resource_versions.bump(USERS)
     
     # Mettre à jour l'inscription
     await db.inscriptions.update_one(
@@ -2704,18 +2823,23 @@ async def migrate_to_multicentre(current_user: User = Depends(get_current_user))
         {"centre_id": {"$exists": False}},
         {"$set": {"centre_id": centre_id}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.clear()
     
     # Le Super-Admin n'a pas de centre_id (il gère tous les centres)
     await db.users.update_one(
         {"id": current_user.id},
         {"$unset": {"centre_id": ""}, "$set": {"role": ROLES["SUPER_ADMIN"]}}
     )
+    await resource_versions.bump(USERS)
+    await revoke_user_tokens(current_user.id)
     
     # Migrer le planning
     result_planning = await db.planning.update_many(
         {"centre_id": {"$exists": False}},
         {"$set": {"centre_id": centre_id}}
     )
+    await resource_versions.bump(PLANNING)
     
     # Migrer les salles
     result_rooms = await db.rooms.update_many(
@@ -2747,9 +2871,23 @@ async def migrate_to_multicentre(current_user: User = Depends(get_current_user))
         }
     }
 
+async def not_modified(request: Request, response: Response, dependencies, variant=None) -> Optional[Response]:
+    """
+    GET conditionnel : ETag calculé à partir des compteurs de version (sans requête MongoDB).
+    Retourne une réponse 304 si If-None-Match correspond, sinon ajoute l'ETag à la réponse.
+    """
+    etag = await resource_versions.etag(dependencies, variant)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if resource_versions.matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 # User management routes
 @api_router.get("/users", response_model=List[User])
 async def get_users(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     all_centres: bool = False  # Paramètre pour permettre au Directeur de voir tous les centres
 ):
@@ -2787,6 +2925,11 @@ async def get_users(
                 {"centre_ids": centre_actif}
             ]
     
+    # La requête détermine entièrement la réponse : elle sert de variante de l'ETag
+    inchange = await not_modified(request, response, [(USERS, None)], query)
+    if inchange:
+        return inchange
+    
     # Optimisation sécurité: exclure password_hash et _id
     users = await db.users.find(query, {"_id": 0, "password_hash": 0}).to_list(1000)
     return [User(**user) for user in users]
@@ -2851,6 +2994,8 @@ async def update_my_email(
         {"id": current_user.id},
         {"$set": {"email": new_email}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(current_user.id)
     
     return {"message": "Email mis à jour avec succès", "email": new_email}
 
@@ -2873,15 +3018,17 @@ async def update_my_password(
     user = await db.users.find_one({"id": current_user.id})
     
     # Vérifier le mot de passe actuel
-    if not verify_password(current_password, user.get('password_hash')):
+    if not await verify_password_async(current_password, user.get('password_hash')):
         raise HTTPException(status_code=400, detail="Mot de passe actuel incorrect")
     
     # Hasher et mettre à jour le nouveau mot de passe
-    new_password_hash = get_password_hash(new_password)
+    new_password_hash = await get_password_hash_async(new_password)
     await db.users.update_one(
         {"id": current_user.id},
         {"$set": {"password_hash": new_password_hash}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(current_user.id)
     
     return {"message": "Mot de passe mis à jour avec succès"}
 
@@ -2905,6 +3052,8 @@ async def update_my_profile(
         {"id": current_user.id},
         {"$set": {"prenom": prenom, "nom": nom}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(current_user.id)
     
     return {"message": "Profil mis à jour avec succès", "prenom": prenom, "nom": nom}
 
@@ -2939,6 +3088,8 @@ async def set_centre_favori(
         {"id": current_user.id},
         {"$set": {"centre_favori_id": centre_id}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(current_user.id)
     
     return {"message": "Centre favori défini avec succès", "centre_favori_id": centre_id, "centre_nom": centre.get("nom")}
 
@@ -3008,6 +3159,8 @@ async def migrate_data_to_centre(
                 }
             }
         )
+        await resource_versions.bump(USERS)
+        principal_cache.clear()
     
     results["users"] = {
         "label": "Employés sans centre",
@@ -3067,15 +3220,29 @@ async def migrate_data_to_centre(
 async def update_user(
     user_id: str,
     user_update: UserUpdate,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     update_data = {k: v for k, v in user_update.dict().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="Aucune donnée à mettre à jour")
     
-    result = await db.users.update_one({"id": user_id}, {"$set": update_data})
-    if result.matched_count == 0:
+    existing = await db.users.find_one({"id": user_id})
+    if not existing:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    # Le formulaire renvoie toujours role/actif : on ne révoque que si la valeur change
+    changed_sensitive = {
+        field for field in TOKEN_SENSITIVE_FIELDS & update_data.keys()
+        if existing.get(field) != update_data[field]
+    }
+    
+    await db.users.update_one({"id": user_id}, {"$set": update_data})
+    await resource_versions.bump(USERS)
+    if changed_sensitive:
+        await revoke_user_tokens(user_id)
+    else:
+        principal_cache.invalidate(user_id)
+    if "actif" in changed_sensitive:
+        await push_devices.set_user_devices_active(db, user_id, update_data["actif"])
     
     updated_user = await db.users.find_one({"id": user_id})
     return User(**updated_user)
@@ -3085,7 +3252,7 @@ async def update_user(
 async def create_assignation(
     medecin_id: str,
     assistant_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Verify users exist and have correct roles
     medecin = await db.users.find_one({"id": medecin_id, "role": ROLES["MEDECIN"]})
@@ -3137,7 +3304,6 @@ async def get_assignations(current_user: User = Depends(get_current_user)):
 @api_router.post("/conges", response_model=DemandeConge)
 async def create_demande_conge(
     demande_data: DemandeCongeCreate,
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user)
 ):
     # Si un utilisateur_id est fourni et que l'utilisateur actuel est Directeur, l'utiliser
@@ -3183,22 +3349,20 @@ async def create_demande_conge(
         creneau_text = "Journée complète" if demande.creneau == "JOURNEE_COMPLETE" else demande.creneau.lower()
         details = f"{dates} ({creneau_text})"
         
-        background_tasks.add_task(
-            notify_director_new_request, 
-            "demande de congé", 
-            user_name, 
-            details
-        )
+        await enqueue(db, "notify_director_new_request", {
+            "type_request": "demande de congé",
+            "user_name": user_name,
+            "details": details
+        })
         
         # 2. Notifier les collègues qui travaillent pendant ces jours
-        background_tasks.add_task(
-            notify_colleagues_about_leave,
-            user_name,
-            demande.date_debut,
-            demande.date_fin,
-            demande.creneau,
-            utilisateur_id
-        )
+        await enqueue(db, "notify_colleagues_about_leave", {
+            "user_name": user_name,
+            "date_debut": demande.date_debut,
+            "date_fin": demande.date_fin,
+            "creneau": demande.creneau,
+            "user_id": utilisateur_id
+        })
     
     return demande
 
@@ -3255,7 +3419,7 @@ async def create_conge_direct(
     return {"message": "Congé créé et approuvé", "id": demande.id, "centre_id": centre_id}
 
 @api_router.get("/conges", response_model=List[Dict[str, Any]])
-async def get_demandes_conges(current_user: User = Depends(get_current_user)):
+async def get_demandes_conges(current_user: User = Depends(get_current_user), user_loader: UserLoader = Depends(get_user_loader)):
     # Déterminer le centre actif de l'utilisateur
     centre_actif = getattr(current_user, 'centre_actif_id', None)
     if not centre_actif:
@@ -3264,30 +3428,22 @@ async def get_demandes_conges(current_user: User = Depends(get_current_user)):
             user_centres.append(current_user.centre_id)
         centre_actif = user_centres[0] if user_centres else None
     
-    print(f"[DEBUG CONGES] User: {current_user.email}, Role: {current_user.role}, Centre actif: {centre_actif}")
-    
     if current_user.role in [ROLES["DIRECTEUR"], "Super-Admin"]:
         # Le directeur voit les congés du centre actif uniquement
         if centre_actif:
             demandes = await db.demandes_conges.find({"centre_id": centre_actif}).to_list(1000)
-            print(f"[DEBUG CONGES] Directeur - Congés du centre: {len(demandes)}")
         else:
             demandes = []
-            print("[DEBUG CONGES] Pas de centre actif - retourne []")
     else:
         # Les employés voient seulement leurs propres congés
         demandes = await db.demandes_conges.find({"utilisateur_id": current_user.id}).to_list(1000)
-        print(f"[DEBUG CONGES] Employé - Ses congés: {len(demandes)}")
+    logger.debug("conges: %d demandes", len(demandes),
+                 extra={"user_id": current_user.id, "role": current_user.role, "centre_id": centre_actif})
     
     # Optimisation: Batch fetch all users at once
     all_user_ids = set(demande["utilisateur_id"] for demande in demandes if "utilisateur_id" in demande)
     
-    users = await db.users.find(
-        {"id": {"$in": list(all_user_ids)}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(1000)
-    
-    users_map = {user["id"]: User(**user) for user in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(all_user_ids)).items()}
     
     enriched_demandes = []
     for demande in demandes:
@@ -3304,8 +3460,7 @@ async def get_demandes_conges(current_user: User = Depends(get_current_user)):
 async def approuver_demande_conge(
     demande_id: str,
     request: ApprobationRequest,
-    background_tasks: BackgroundTasks,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Récupérer la demande pour avoir les infos utilisateur
     demande = await db.demandes_conges.find_one({"id": demande_id})
@@ -3324,17 +3479,25 @@ async def approuver_demande_conge(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Demande non trouvée")
     
+    # Temps réel : l'employé, et le planning du centre si le congé est approuvé
+    live_topics = [user_topic(demande["utilisateur_id"])]
+    if request.approuve and demande.get("centre_id"):
+        live_topics.append(planning_topic(demande["centre_id"]))
+    live_events.publish(live_topics, "conge", {
+        "action": statut.lower(), "demande_id": demande_id, "utilisateur_id": demande["utilisateur_id"],
+        "date_debut": demande["date_debut"], "date_fin": demande["date_fin"]
+    })
+    
     # 📤 NOTIFICATION : Statut de la demande de congé
     dates = f"{demande['date_debut']} au {demande['date_fin']}"
     
     # 1. Notifier l'employé du statut de sa demande
-    background_tasks.add_task(
-        notify_user_request_status,
-        demande["utilisateur_id"],
-        "Demande de congé",
-        statut,
-        dates
-    )
+    await enqueue(db, "notify_user_request_status", {
+        "user_id": demande["utilisateur_id"],
+        "type_request": "Demande de congé",
+        "status": statut,
+        "details": dates
+    })
     
     # 2. Si approuvé, notifier aussi les collègues qui travaillent pendant ces jours
     if request.approuve:
@@ -3345,31 +3508,29 @@ async def approuver_demande_conge(
             if user['role'] == ROLES["MEDECIN"]:
                 user_name = f"Dr. {user_name}"
             
-            background_tasks.add_task(
-                notify_colleagues_about_leave,
-                user_name,
-                demande['date_debut'],
-                demande['date_fin'],
-                demande.get('creneau', 'JOURNEE_COMPLETE'),
-                demande["utilisateur_id"]
-            )
+            await enqueue(db, "notify_colleagues_about_leave", {
+                "user_name": user_name,
+                "date_debut": demande['date_debut'],
+                "date_fin": demande['date_fin'],
+                "creneau": demande.get('creneau', 'JOURNEE_COMPLETE'),
+                "user_id": demande["utilisateur_id"]
+            })
         
         # 3. NOUVEAU: Gérer les créneaux des assistants assignés au médecin en congé
-        background_tasks.add_task(
-            handle_assistant_slots_for_leave,
-            demande["utilisateur_id"],
-            demande['date_debut'],
-            demande['date_fin'],
-            demande.get('creneau', 'JOURNEE_COMPLETE'),
-            True  # approve=True
-        )
+        await enqueue(db, "handle_assistant_slots_for_leave", {
+            "user_id": demande["utilisateur_id"],
+            "date_debut": demande['date_debut'],
+            "date_fin": demande['date_fin'],
+            "creneau": demande.get('creneau', 'JOURNEE_COMPLETE'),
+            "approve": True
+        })
     
     return {"message": f"Demande {statut.lower()}e avec succès"}
 
 @api_router.put("/conges/{demande_id}/annuler")
 async def annuler_conge(
     demande_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Annuler un congé approuvé (Directeur uniquement)"""
     demande = await db.demandes_conges.find_one({"id": demande_id})
@@ -3392,7 +3553,7 @@ async def annuler_conge(
 @api_router.delete("/conges/{demande_id}")
 async def supprimer_conge(
     demande_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
 ):
     """Supprimer complètement un congé (Directeur/Super-Admin uniquement)"""
     demande = await db.demandes_conges.find_one({"id": demande_id})
@@ -3413,7 +3574,7 @@ class ModifierTypeCongeRequest(BaseModel):
 async def modifier_type_conge(
     demande_id: str,
     request: ModifierTypeCongeRequest,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
 ):
     """Modifier le type d'un congé (Directeur uniquement). 
     Types: CONGE_PAYE, RTT, MALADIE, ABSENT, REPOS, HEURES_A_RECUPERER, HEURES_RECUPEREES"""
@@ -3450,7 +3611,7 @@ class ScissionCongeRequest(BaseModel):
 async def scinder_conge(
     demande_id: str,
     request: ScissionCongeRequest,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"], ROLES["SUPER_ADMIN"]]))
 ):
     """
     Scinder un congé multi-jours pour modifier un jour spécifique.
@@ -3506,7 +3667,8 @@ async def scinder_conge(
                         "notes": "Converti depuis congé",
                         "date_creation": datetime.now(timezone.utc)
                     }
-                    await db.planning.insert_one(nouveau_creneau)
+                    if await insert_planning_slot(db, nouveau_creneau) is None:  # créneau déjà présent : conservé
+                        await planning_changes.record_changes(db, [nouveau_creneau], planning_changes.UPSERT)
                 
                 return {
                     "message": f"Congé modifié: maintenant seulement {creneau_a_garder}",
@@ -3534,7 +3696,8 @@ async def scinder_conge(
                             "notes": "Converti depuis congé",
                             "date_creation": datetime.now(timezone.utc)
                         }
-                        await db.planning.insert_one(nouveau_creneau)
+                        if await insert_planning_slot(db, nouveau_creneau) is None:  # créneau déjà présent : conservé
+                            await planning_changes.record_changes(db, [nouveau_creneau], planning_changes.UPSERT)
                 
                 return {"message": "Congé supprimé", "action": "deleted", "creneaux_crees": request.creer_creneau_travail}
         else:
@@ -3754,7 +3917,8 @@ async def scinder_conge(
                 "notes": "Converti depuis congé",
                 "date_creation": datetime.now(timezone.utc)
             }
-            await db.planning.insert_one(nouveau_creneau)
+            if await insert_planning_slot(db, nouveau_creneau) is None:  # créneau déjà présent : conservé
+                await planning_changes.record_changes(db, [nouveau_creneau], planning_changes.UPSERT)
         actions_effectuees.append(f"Créneau(x) de travail créé(s) pour {date_a_modifier}")
     
     return {
@@ -3821,6 +3985,30 @@ async def get_reservations_salles(
     return enriched_reservations
 
 # Planning endpoints
+# Nombre maximum de créneaux acceptés par POST /planning/bulk
+PLANNING_BULK_MAX = 1000
+
+def get_default_centre_id(current_user) -> Optional[str]:
+    """Centre par défaut des créneaux créés : centre actif, sinon premier centre de l'utilisateur"""
+    centre_actif = getattr(current_user, 'centre_actif_id', None)
+    if centre_actif:
+        return centre_actif
+    user_centres = current_user.centre_ids if hasattr(current_user, 'centre_ids') and current_user.centre_ids else []
+    if current_user.centre_id and current_user.centre_id not in user_centres:
+        user_centres.append(current_user.centre_id)
+    return user_centres[0] if user_centres else None
+
+def expand_creneau(creneau: str) -> List[str]:
+    """JOURNEE_COMPLETE est stocké en 2 créneaux séparés (MATIN + APRES_MIDI)"""
+    if creneau == "JOURNEE_COMPLETE":
+        return ["MATIN", "APRES_MIDI"]
+    return [creneau]
+
+def planning_conflict_detail(conflit: str, creneau_type: str) -> str:
+    if conflit == CONFLIT_SALLE:
+        return f"La salle est déjà occupée le {creneau_type.lower()}"
+    return f"L'employé a déjà un créneau programmé le {creneau_type.lower()}"
+
 @api_router.post("/planning", response_model=CreneauPlanning)
 async def create_creneau_planning(
     creneau_data: CreneauPlanningCreate,
@@ -3832,47 +4020,10 @@ async def create_creneau_planning(
         raise HTTPException(status_code=404, detail="Employé non trouvé")
     
     # Déterminer le centre_id
-    centre_id = creneau_data.centre_id
-    if not centre_id:
-        centre_actif = getattr(current_user, 'centre_actif_id', None)
-        if centre_actif:
-            centre_id = centre_actif
-        else:
-            user_centres = current_user.centre_ids if hasattr(current_user, 'centre_ids') and current_user.centre_ids else []
-            if current_user.centre_id and current_user.centre_id not in user_centres:
-                user_centres.append(current_user.centre_id)
-            centre_id = user_centres[0] if user_centres else None
-    
-    # Si JOURNEE_COMPLETE, créer 2 créneaux séparés (MATIN + APRES_MIDI)
-    creneaux_a_creer = []
-    if creneau_data.creneau == "JOURNEE_COMPLETE":
-        creneaux_a_creer = ["MATIN", "APRES_MIDI"]
-    else:
-        creneaux_a_creer = [creneau_data.creneau]
+    centre_id = creneau_data.centre_id or get_default_centre_id(current_user)
     
     created_creneaux = []
-    for creneau_type in creneaux_a_creer:
-        # Vérifier les conflits de planning
-        existing = await db.planning.find_one({
-            "date": creneau_data.date,
-            "creneau": creneau_type,
-            "employe_id": creneau_data.employe_id
-        })
-        
-        if existing:
-            raise HTTPException(status_code=400, detail=f"L'employé a déjà un créneau programmé le {creneau_type.lower()}")
-        
-        # Vérifier les conflits de salle
-        if creneau_data.salle_attribuee:
-            salle_occupee = await db.planning.find_one({
-                "date": creneau_data.date,
-                "creneau": creneau_type,
-                "salle_attribuee": creneau_data.salle_attribuee
-            })
-            
-            if salle_occupee:
-                raise HTTPException(status_code=400, detail=f"La salle est déjà occupée le {creneau_type.lower()}")
-        
+    for creneau_type in expand_creneau(creneau_data.creneau):
         # Créer le créneau avec le centre_id
         creneau_dict = creneau_data.dict()
         creneau_dict['creneau'] = creneau_type  # Remplacer JOURNEE_COMPLETE par MATIN ou APRES_MIDI
@@ -3884,17 +4035,127 @@ async def create_creneau_planning(
             employe_role=employe['role']
         )
         
-        await db.planning.insert_one(creneau.dict())
+        # Conflits employé/salle garantis par les index uniques (plus de find_one préalable)
+        conflit = await insert_planning_slot(db, creneau.dict())
+        if conflit:
+            # JOURNEE_COMPLETE : annuler la demi-journée déjà créée
+            if created_creneaux:
+                await db.planning.delete_many({"id": {"$in": [c.id for c in created_creneaux]}})
+                await resource_versions.bump(PLANNING, centre_id)
+            raise HTTPException(status_code=400, detail=planning_conflict_detail(conflit, creneau_type))
         created_creneaux.append(creneau)
     
+    await planning_changes.record_changes(db, [c.dict() for c in created_creneaux], planning_changes.UPSERT)
+    live_events.publish([planning_topic(centre_id)], "planning", {
+        "action": "create", "date": creneau_data.date, "creneau_ids": [c.id for c in created_creneaux]
+    })
+    
     # Retourner le premier créneau créé (pour compatibilité avec l'ancien code)
     return created_creneaux[0]
 
+@api_router.post("/planning/bulk")
+async def create_creneaux_planning_bulk(
+    creneaux_data: List[CreneauPlanningCreate],
+    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]])),
+    user_loader: UserLoader = Depends(get_user_loader)
+):
+    """
+    Création groupée de créneaux (ex: application d'une semaine entière).
+    Mêmes règles que POST /planning, mais en 3 requêtes quel que soit le nombre de créneaux :
+    employés ($in), occupation de la plage de dates, puis un seul insert_many.
+    Retourne un résultat par élément, dans l'ordre de la requête.
+    """
+    if len(creneaux_data) > PLANNING_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"Maximum {PLANNING_BULK_MAX} créneaux par requête")
+    
+    employes = await user_loader.load_many(c.employe_id for c in creneaux_data)
+    occupancy = await PlanningOccupancy.load(db, (c.date for c in creneaux_data))
+    default_centre_id = get_default_centre_id(current_user)
+    
+    results = []
+    a_inserer = []  # (position dans results, créneau)
+    for index, creneau_data in enumerate(creneaux_data):
+        employe = employes.get(creneau_data.employe_id)
+        if not employe:
+            results.append({"index": index, "status": "error", "detail": "Employé non trouvé"})
+            continue
+        
+        creneaux = []
+        for creneau_type in expand_creneau(creneau_data.creneau):
+            creneau_dict = creneau_data.dict()
+            creneau_dict['creneau'] = creneau_type
+            creneau_dict['centre_id'] = creneau_data.centre_id or default_centre_id
+            creneaux.append(CreneauPlanning(**creneau_dict, employe_role=employe['role']))
+        
+        # Conflits avec la base ET avec les éléments précédents de la même requête
+        conflit = None
+        for creneau in creneaux:
+            conflit = occupancy.conflict(creneau.dict())
+            if conflit:
+                results.append({
+                    "index": index, "status": "conflict",
+                    "detail": planning_conflict_detail(conflit, creneau.creneau)
+                })
+                break
+        if conflit:
+            continue
+        
+        for creneau in creneaux:
+            occupancy.reserve(creneau.dict())
+            a_inserer.append((len(results), creneau))
+        results.append({"index": index, "status": "created", "creneaux": creneaux})
+    
+    # Écriture concurrente entre la lecture et l'insertion : les index uniques tranchent
+    refuses = await insert_planning_slots(db, [creneau.dict() for _, creneau in a_inserer])
+    if refuses:
+        positions_refusees = {}
+        for slot_index, conflit in refuses.items():
+            position, creneau = a_inserer[slot_index]
+            positions_refusees.setdefault(position, (conflit, creneau.creneau))
+        # Un élément JOURNEE_COMPLETE est tout ou rien : retirer la demi-journée insérée
+        a_retirer = [
+            creneau.id for slot_index, (position, creneau) in enumerate(a_inserer)
+            if position in positions_refusees and slot_index not in refuses
+        ]
+        if a_retirer:
+            await db.planning.delete_many({"id": {"$in": a_retirer}})
+            await resource_versions.bump(PLANNING)
+        for position, (conflit, creneau_type) in positions_refusees.items():
+            results[position] = {
+                "index": results[position]["index"], "status": "conflict",
+                "detail": planning_conflict_detail(conflit, creneau_type)
+            }
+    
+    await planning_changes.record_changes(
+        db, [creneau.dict() for position, creneau in a_inserer if results[position]["status"] == "created"],
+        planning_changes.UPSERT
+    )
+    
+    # Un événement par centre concerné
+    par_centre = {}
+    for position, creneau in a_inserer:
+        if results[position]["status"] == "created":
+            par_centre.setdefault(creneau.centre_id, {"dates": set(), "creneau_ids": []})
+            par_centre[creneau.centre_id]["dates"].add(creneau.date)
+            par_centre[creneau.centre_id]["creneau_ids"].append(creneau.id)
+    for centre_id, changement in par_centre.items():
+        live_events.publish([planning_topic(centre_id)], "planning", {
+            "action": "create", "dates": sorted(changement["dates"]), "creneau_ids": changement["creneau_ids"]
+        })
+    
+    return {
+        "created": sum(1 for r in results if r["status"] == "created"),
+        "conflicts": sum(1 for r in results if r["status"] == "conflict"),
+        "errors": sum(1 for r in results if r["status"] == "error"),
+        "results": results
+    }
+
 @api_router.get("/planning", response_model=List[Dict[str, Any]])
 async def get_planning(
     date_debut: Optional[str] = None,
     date_fin: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     query = {}
     
@@ -3928,20 +4189,18 @@ async def get_planning(
     creneaux = await db.planning.find(query).sort("date", 1).to_list(1000)
     
     # Enrichir avec les données des employés
+    # OPTIMISATION N+1: tous les employés et médecins en une seule requête
+    for creneau in creneaux:
+        user_loader.prime([creneau["employe_id"], creneau.get("medecin_attribue_id")])
+    await user_loader.load_all()
+    
     enriched_creneaux = []
     for creneau in creneaux:
         if '_id' in creneau:
             del creneau['_id']
             
-        employe = await db.users.find_one({"id": creneau["employe_id"]})
-        if employe and '_id' in employe:
-            del employe['_id']
-            
-        medecin_attribue = None
-        if creneau.get("medecin_attribue_id"):
-            medecin_attribue = await db.users.find_one({"id": creneau["medecin_attribue_id"]})
-            if medecin_attribue and '_id' in medecin_attribue:
-                del medecin_attribue['_id']
+        employe = user_loader.get(creneau["employe_id"])
+        medecin_attribue = user_loader.get(creneau.get("medecin_attribue_id"))
         
         enriched_creneaux.append({
             **creneau,
@@ -3951,6 +4210,25 @@ async def get_planning(
     
     return enriched_creneaux
 
+# Synchronisation différentielle - DOIT être AVANT /planning/{date}
+@api_router.get("/planning/changes")
+async def get_planning_changes(
+    since: int = 0,
+    centre_id: Optional[str] = None,
+    limit: int = planning_changes.PLANNING_CHANGES_MAX_PAGE,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Créneaux créés / modifiés et identifiants supprimés depuis le numéro `since` (journal planning_changes).
+    Le client conserve `seq` et le renvoie au prochain appel ; reset=True : recharger GET /planning.
+    """
+    centre_id = centre_id or get_default_centre_id(current_user)
+    centres = set(current_user.centre_ids or [])
+    centres.update(c for c in (current_user.centre_id, current_user.centre_actif_id) if c)
+    if centre_id and centre_id not in centres and current_user.role not in LIVE_ALL_CENTRES_ROLES:
+        raise HTTPException(status_code=403, detail="Accès non autorisé à ce centre")
+    return await planning_changes.get_changes(db, centre_id, since, limit)
+
 # Notes journalières du planning - DOIT être AVANT /planning/{date}
 @api_router.get("/planning/notes")
 async def get_notes_planning(
@@ -4047,7 +4325,8 @@ async def save_note_planning(
 @api_router.get("/planning/{date}", response_model=List[Dict[str, Any]])
 async def get_planning_by_date(
     date: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     # Déterminer le centre actif de l'utilisateur
     centre_actif = getattr(current_user, 'centre_actif_id', None)
@@ -4085,20 +4364,18 @@ async def get_planning_by_date(
     
     creneaux = await db.planning.find(query).sort("creneau", 1).to_list(1000)
     
+    # OPTIMISATION N+1: tous les employés et médecins en une seule requête
+    for creneau in creneaux:
+        user_loader.prime([creneau["employe_id"], creneau.get("medecin_attribue_id")])
+    await user_loader.load_all()
+    
     enriched_creneaux = []
     for creneau in creneaux:
         if '_id' in creneau:
             del creneau['_id']
             
-        employe = await db.users.find_one({"id": creneau["employe_id"]})
-        if employe and '_id' in employe:
-            del employe['_id']
-            
-        medecin_attribue = None
-        if creneau.get("medecin_attribue_id"):
-            medecin_attribue = await db.users.find_one({"id": creneau["medecin_attribue_id"]})
-            if medecin_attribue and '_id' in medecin_attribue:
-                del medecin_attribue['_id']
+        employe = user_loader.get(creneau["employe_id"])
+        medecin_attribue = user_loader.get(creneau.get("medecin_attribue_id"))
         
         enriched_creneaux.append({
             **creneau,
@@ -4112,7 +4389,7 @@ async def get_planning_by_date(
 async def update_creneau_planning(
     creneau_id: str,
     creneau_data: CreneauPlanningUpdate,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Vérifier que le créneau existe
     existing_creneau = await db.planning.find_one({"id": creneau_id})
@@ -4130,16 +4407,31 @@ async def update_creneau_planning(
         update_data["medecin_ids"] = creneau_data.medecin_ids
     
     if update_data:
-        result = await db.planning.update_one({"id": creneau_id}, {"$set": update_data})
+        try:
+            result = await db.planning.update_one({"id": creneau_id}, {"$set": update_data})
+        except DuplicateKeyError as e:
+            creneau_type = update_data.get("creneau", existing_creneau["creneau"])
+            raise HTTPException(status_code=400, detail=planning_conflict_detail(conflict_from_error(e), creneau_type))
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Créneau non trouvé")
+        
+        await planning_changes.record_slot_update(
+            db, existing_creneau,
+            update_data.get("centre_id") or existing_creneau.get("centre_id"),
+            update_data.get("date", existing_creneau.get("date"))
+        )
+        live_events.publish(
+            {planning_topic(existing_creneau.get("centre_id")), planning_topic(update_data.get("centre_id") or existing_creneau.get("centre_id"))},
+            "planning",
+            {"action": "update", "date": update_data.get("date", existing_creneau.get("date")), "creneau_ids": [creneau_id]}
+        )
     
     return {"message": "Créneau mis à jour avec succès"}
 
 @api_router.delete("/planning/{creneau_id}")
 async def delete_creneau_planning(
     creneau_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Récupérer le créneau avant suppression pour trouver la demande associée
     creneau = await db.planning.find_one({"id": creneau_id})
@@ -4150,6 +4442,10 @@ async def delete_creneau_planning(
     result = await db.planning.delete_one({"id": creneau_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Créneau non trouvé")
+    await planning_changes.record_changes(db, [creneau], planning_changes.DELETE)
+    live_events.publish([planning_topic(creneau.get("centre_id"))], "planning", {
+        "action": "delete", "date": creneau.get("date"), "creneau_ids": [creneau_id]
+    })
     
     # CORRECTION BUG #4: Mettre à jour la demande de travail associée
     # Chercher la demande de travail qui a créé ce créneau
@@ -4178,15 +4474,14 @@ async def delete_creneau_planning(
                 }}
             )
             
-            # Notifier l'employé
-            user = await db.users.find_one({"id": creneau.get("utilisateur_id")})
-            if user:
-                await send_notification_to_user(
-                    user["id"],
-                    "⚠️ Créneau supprimé",
-                    f"Votre créneau du {creneau.get('date')} ({creneau.get('creneau')}) a été supprimé du planning par le Directeur.",
-                    {"type": "creneau_supprime", "date": creneau.get("date")}
-                )
+            # Notifier l'employé (via l'outbox)
+            await enqueue_push(
+                db,
+                [creneau.get("utilisateur_id")],
+                "⚠️ Créneau supprimé",
+                f"Votre créneau du {creneau.get('date')} ({creneau.get('creneau')}) a été supprimé du planning par le Directeur.",
+                {"type": "creneau_supprime", "date": creneau.get("date")}
+            )
     
     return {"message": "Créneau supprimé avec succès", "demande_mise_a_jour": demande_travail is not None}
 
@@ -4220,7 +4515,7 @@ async def create_groupe_chat(
     return groupe
 
 @api_router.get("/groupes-chat", response_model=List[Dict[str, Any]])
-async def get_groupes_chat(current_user: User = Depends(get_current_user)):
+async def get_groupes_chat(current_user: User = Depends(get_current_user), user_loader: UserLoader = Depends(get_user_loader)):
     # Récupérer tous les groupes où l'utilisateur est membre
     groupes = await db.groupes_chat.find({
         "actif": True,
@@ -4238,11 +4533,7 @@ async def get_groupes_chat(current_user: User = Depends(get_current_user)):
             all_user_ids.add(groupe["createur_id"])
     
     # Une seule requête pour tous les utilisateurs
-    users = await db.users.find(
-        {"id": {"$in": list(all_user_ids)}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(1000)
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(all_user_ids)).items()}
     
     # Enrichir avec les détails des membres
     enriched_groupes = []
@@ -4287,14 +4578,182 @@ async def update_membres_groupe(
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Groupe non trouvé")
+    await conversations.set_group_participants(db, groupe_id, nouveaux_membres)
     
     return {"message": "Membres mis à jour avec succès"}
 
+@api_router.get("/conversations", response_model=List[Dict[str, Any]])
+async def get_conversations(
+    limit: int = 50,
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
+):
+    """Conversations de l'utilisateur (privées et groupes) avec dernier message et nombre de non lus"""
+    liste = await conversations.list_conversations(db, current_user.id, max(1, min(limit, 200)))
+    
+    # Interlocuteurs des conversations privées en une requête
+    autres_ids = {p for c in liste if c["type"] == "PRIVE" for p in c["participants"] if p != current_user.id}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(autres_ids)).items()}
+    
+    for conversation in liste:
+        if conversation["type"] == "PRIVE":
+            autre = next((p for p in conversation["participants"] if p != current_user.id), None)
+            conversation["interlocuteur"] = users_map.get(autre)
+        conversation.pop("participants", None)
+    return liste
+
+@api_router.post("/conversations/{conversation_id}/read")
+async def mark_conversation_read(
+    conversation_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Marque une conversation comme lue (compteur remis à zéro atomiquement)"""
+    non_lus = await conversations.mark_read(db, conversation_id, current_user.id)
+    if non_lus is None:
+        raise HTTPException(status_code=404, detail="Conversation non trouvée")
+    return {"conversation_id": conversation_id, "messages_lus": non_lus}
+
+# ===== TEMPS RÉEL (/api/live) =====
+# Rôles pouvant suivre le planning de n'importe quel centre (un directeur reste limité à ses centres)
+LIVE_ALL_CENTRES_ROLES = {ROLES["SUPER_ADMIN"]}
+
+async def live_topics_for(user: User, requested: Optional[str] = None) -> List[str]:
+    """
+    Topics autorisés : son planning de centre, ses messages privés, ses groupes et le fil général.
+    `requested` (topics séparés par des virgules) restreint la liste.
+    """
+    centres = set(user.centre_ids or [])
+    centres.update(c for c in (user.centre_id, user.centre_actif_id) if c)
+    groupes = await db.groupes_chat.distinct("id", {"actif": True, "membres": user.id})
+    autorises = {user_topic(user.id), GENERAL_TOPIC}
+    autorises.update(planning_topic(c) for c in centres)
+    autorises.update(groupe_topic(g) for g in groupes)
+    if not requested:
+        return sorted(autorises)
+    demandes = {t.strip() for t in requested.split(",") if t.strip()}
+    if user.role in LIVE_ALL_CENTRES_ROLES:
+        autorises.update(t for t in demandes if t.startswith("planning:"))
+    return sorted(demandes & autorises)
+
+async def _live_user(token: Optional[str]) -> User:
+    if not token:
+        raise _credentials_exception()
+    principal = await decode_access_token(token)
+    return await load_current_user(principal.id)
+
+def _live_hello(subscription) -> dict:
+    return {"type": "hello", "cursor": live_events.broker.cursor, "topics": sorted(subscription.topics)}
+
+@api_router.websocket("/live")
+async def live_websocket(
+    websocket: WebSocket,
+    token: Optional[str] = None,
+    cursor: Optional[str] = None,
+    topics: Optional[str] = None
+):
+    """
+    Canal temps réel (messages, planning, congés).
+    Authentification par ?token=<JWT> (les navigateurs n'envoient pas d'en-tête sur un WebSocket).
+    ?cursor=<id du dernier événement reçu> rejoue les événements manqués après une reconnexion.
+    """
+    # Accepter avant de fermer : un close avant accept() devient un refus HTTP 403
+    # et le navigateur ne voit que le code 1006, jamais 4401
+    await websocket.accept()
+    try:
+        user = await _live_user(token)
+    except HTTPException:
+        await websocket.close(code=4401)
+        return
+    
+    abonnement = live_events.broker.subscribe(await live_topics_for(user, topics), cursor)
+    try:
+        await websocket.send_text(encode_event(_live_hello(abonnement)))
+        async for event in stream_events(abonnement):
+            await websocket.send_text(encode_event(event or {"type": "ping"}))
+        # Client trop lent (file pleine) : il se reconnecte avec son curseur
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_events.broker.unsubscribe(abonnement)
+
+@api_router.get("/live/sse")
+async def live_sse(
+    request: Request,
+    token: Optional[str] = None,
+    cursor: Optional[str] = None,
+    topics: Optional[str] = None
+):
+    """
+    Repli Server-Sent Events de /api/live (proxys sans WebSocket).
+    Token par ?token= ou en-tête Authorization ; reprise par Last-Event-ID (EventSource) ou ?cursor=.
+    """
+    if token is None:
+        authorization = request.headers.get("authorization", "")
+        token = authorization[7:] if authorization.lower().startswith("bearer ") else None
+    user = await _live_user(token)
+    abonnement = live_events.broker.subscribe(
+        await live_topics_for(user, topics), cursor or request.headers.get("last-event-id")
+    )
+    
+    async def flux():
+        try:
+            yield "retry: 3000\n\n"
+            yield format_sse(_live_hello(abonnement))
+            async for event in stream_events(abonnement):
+                if await request.is_disconnected():
+                    break
+                yield format_sse(event) if event else ": ping\n\n"
+        finally:
+            live_events.broker.unsubscribe(abonnement)
+    
+    return StreamingResponse(
+        flux(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/admin/perf")
+async def admin_perf(reset: bool = False,
+                     current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))):
+    """Commandes MongoDB par route et par collection : nombre, documents, histogrammes de latence"""
+    snapshot = perf_registry.snapshot()
+    if reset:
+        perf_registry.reset()
+    return snapshot
+
+@api_router.get("/admin/loop-blocking")
+async def admin_loop_blocking(reset: bool = False,
+                              current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))):
+    """Blocages de la boucle asyncio par emplacement du code (LOOP_WATCHDOG=1), avec la dernière pile capturée"""
+    stats = loop_watchdog.stats()
+    if reset:
+        loop_watchdog.reset()
+    return stats
+
+@api_router.get("/live/status")
+async def live_status(current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))):
+    """Connexions temps réel ouvertes, événements publiés / livrés, abonnés en débordement"""
+    return live_events.broker.stats()
+
 # Chat endpoints
+def message_topics(message: dict) -> List[str]:
+    """Topics temps réel d'un message : les deux participants, le groupe ou le fil général"""
+    if message.get("type_message") == "GROUPE":
+        return [groupe_topic(message["groupe_id"])]
+    if message.get("type_message") == "PRIVE":
+        return [user_topic(message["expediteur_id"]), user_topic(message["destinataire_id"])]
+    return [GENERAL_TOPIC]
+
+async def _paginate_messages_or_400(query: dict, limit: int, before: Optional[str], after: Optional[str]):
+    try:
+        return await paginate_messages(db, query, limit, before=before, after=after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+
 @api_router.post("/messages", response_model=Message)
 async def send_message(
     message_data: MessageCreate,
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user)
 ):
     # Validation selon le type de message
@@ -4319,66 +4778,58 @@ async def send_message(
         type_message=message_data.type_message
     )
     
-    await db.messages.insert_one(message.dict())
+    message_doc = message.dict()
+    await db.messages.insert_one(message_doc)
+    # Liste des conversations : dernier message et non lus ($inc), un update_one
+    if message_data.type_message == "GROUPE":
+        await conversations.record_message(db, message_doc, groupe.get("membres", []), groupe.get("nom"))
+    else:
+        await conversations.record_message(db, message_doc)
     
     # 📤 NOTIFICATION : Nouveau message
+    # Un seul job dans l'outbox : destinataires et tokens sont résolus par le worker
     sender_name = f"{current_user.prenom} {current_user.nom}"
     if current_user.role == ROLES["MEDECIN"]:
         sender_name = f"Dr. {sender_name}"
     
-    # Tronquer le message si trop long
-    preview = message_data.contenu[:100] + "..." if len(message_data.contenu) > 100 else message_data.contenu
-    
     if message_data.type_message == "PRIVE":
-        # Notification au destinataire uniquement
-        background_tasks.add_task(
-            send_notification_to_user,
-            message_data.destinataire_id,
-            f"💬 Message de {sender_name}",
-            preview,
-            {"type": "new_message", "message_type": "PRIVE", "sender_id": current_user.id}
-        )
-    
+        await enqueue_message_fanout(db, message_doc, sender_name, membres=[message_data.destinataire_id])
     elif message_data.type_message == "GROUPE":
-        # Notification à tous les membres du groupe sauf l'expéditeur
-        groupe = await db.groupes_chat.find_one({"id": message_data.groupe_id})
-        if groupe:
-            groupe_name = groupe.get("nom", "Groupe")
-            for membre_id in groupe.get("membres", []):
-                if membre_id != current_user.id:  # Ne pas notifier l'expéditeur
-                    background_tasks.add_task(
-                        send_notification_to_user,
-                        membre_id,
-                        f"💬 {sender_name} dans {groupe_name}",
-                        preview,
-                        {"type": "new_message", "message_type": "GROUPE", "groupe_id": message_data.groupe_id}
-                    )
-    
+        # Membres déjà lus pour la vérification d'appartenance
+        await enqueue_message_fanout(
+            db, message_doc, sender_name, membres=groupe.get("membres", []), groupe_nom=groupe.get("nom", "Groupe")
+        )
     elif message_data.type_message == "GENERAL":
-        # Notification à tous les employés actifs sauf l'expéditeur
-        all_users = await db.users.find({"actif": True, "id": {"$ne": current_user.id}}).to_list(1000)
-        for user in all_users:
-            background_tasks.add_task(
-                send_notification_to_user,
-                user["id"],
-                f"📢 Message général de {sender_name}",
-                preview,
-                {"type": "new_message", "message_type": "GENERAL"}
-            )
+        await enqueue_message_fanout(db, message_doc, sender_name)
+    
+    # Temps réel : clients connectés à /api/live
+    live_events.publish(message_topics(message_doc), "message", message_doc)
     
     return message
 
 @api_router.get("/messages", response_model=List[Dict[str, Any]])
 async def get_messages(
+    response: Response,
     type_message: str = "GENERAL",
     groupe_id: Optional[str] = None,
     limit: int = 50,
-    current_user: User = Depends(get_current_user)
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
+    """
+    Messages du plus récent au plus ancien, par pages de `limit`.
+    `before` / `after` : curseur (en-tête X-Next-Cursor de la page précédente).
+    """
     query = {"type_message": type_message}
     
-    if type_message == "PRIVE":
-        # Messages privés pour l'utilisateur courant
+    if type_message == "GENERAL":
+        # groupe_id null : préfixe complet de messages_type_groupe_date, l'index fournit l'ordre
+        query["groupe_id"] = None
+    elif type_message == "PRIVE":
+        # Messages privés pour l'utilisateur courant (une branche par index : messages_expediteur_type_date,
+        # messages_destinataire_date)
         query = {
             "$or": [
                 {"expediteur_id": current_user.id, "type_message": "PRIVE"},
@@ -4396,7 +4847,9 @@ async def get_messages(
         if not groupe or current_user.id not in groupe.get("membres", []):
             raise HTTPException(status_code=403, detail="Vous n'êtes pas membre de ce groupe")
     
-    messages = await db.messages.find(query).sort("date_envoi", -1).limit(limit).to_list(limit)
+    messages, next_cursor = await _paginate_messages_or_400(query, limit, before, after)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     if not messages:
         return []
@@ -4409,11 +4862,7 @@ async def get_messages(
             all_user_ids.add(msg["destinataire_id"])
     
     # Une seule requête pour tous les utilisateurs
-    users = await db.users.find(
-        {"id": {"$in": list(all_user_ids)}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(all_user_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(all_user_ids)).items()}
     
     enriched_messages = []
     for message in messages:
@@ -4433,9 +4882,17 @@ async def get_messages(
 @api_router.get("/messages/conversation/{user_id}", response_model=List[Dict[str, Any]])
 async def get_conversation(
     user_id: str,
+    response: Response,
     limit: int = 100,
-    current_user: User = Depends(get_current_user)
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
+    """
+    Derniers messages d'une conversation privée, dans l'ordre chronologique.
+    `before` : remonter l'historique, `after` : nouveaux messages (curseur X-Next-Cursor).
+    """
     query = {
         "$or": [
             {"expediteur_id": current_user.id, "destinataire_id": user_id},
@@ -4444,13 +4901,11 @@ async def get_conversation(
         "type_message": "PRIVE"
     }
     
-    messages = await db.messages.find(query).sort("date_envoi", 1).limit(limit).to_list(limit)
-    
-    # Marquer les messages comme lus
-    await db.messages.update_many(
-        {"expediteur_id": user_id, "destinataire_id": current_user.id, "lu": False},
-        {"$set": {"lu": True}}
-    )
+    messages, next_cursor = await _paginate_messages_or_400(query, limit, before, after)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    # Affichage chronologique (lecture : POST /conversations/{id}/read)
+    messages.reverse()
     
     if not messages:
         return []
@@ -4463,11 +4918,7 @@ async def get_conversation(
             all_user_ids.add(msg["destinataire_id"])
     
     # Une seule requête pour tous les utilisateurs
-    users = await db.users.find(
-        {"id": {"$in": list(all_user_ids)}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(all_user_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(all_user_ids)).items()}
     
     enriched_messages = []
     for message in messages:
@@ -4483,14 +4934,12 @@ async def get_conversation(
         })
     
     return enriched_messages
-    
-    return enriched_messages
 
 # Notifications endpoints
 @api_router.post("/notifications/generate/{date}")
 async def generate_daily_notifications(
     date: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Générer les notifications pour tous les employés pour une date donnée
     creneaux = await db.planning.find({"date": date}).to_list(1000)
@@ -4567,7 +5016,8 @@ async def generate_daily_notifications(
 @api_router.get("/notifications/{date}")
 async def get_notifications_by_date(
     date: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     if current_user.role == ROLES["DIRECTEUR"]:
         # Le directeur voit toutes les notifications
@@ -4584,11 +5034,7 @@ async def get_notifications_by_date(
     
     # OPTIMISATION N+1: Récupérer tous les employés en une seule requête
     employe_ids = list(set(n["employe_id"] for n in notifications))
-    users = await db.users.find(
-        {"id": {"$in": employe_ids}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(employe_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(employe_ids)).items()}
     
     enriched_notifications = []
     for notif in notifications:
@@ -4620,7 +5066,7 @@ async def get_my_today_notification(current_user: User = Depends(get_current_use
 @api_router.post("/admin/send-notification")
 async def send_custom_notification(
     request: dict,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Envoyer une notification personnalisée à un utilisateur"""
     user_id = request.get("user_id")
@@ -4670,10 +5116,13 @@ async def create_salle(
     salle_dict['centre_id'] = centre_id
     salle = Salle(**salle_dict)
     await db.salles.insert_one(salle.dict())
+    await resource_versions.bump(SALLES, centre_id)
     return salle
 
 @api_router.get("/salles", response_model=List[Salle])
 async def get_salles(
+    request: Request,
+    response: Response,
     actif_seulement: bool = True,
     current_user: User = Depends(get_current_user)
 ):
@@ -4694,6 +5143,10 @@ async def get_salles(
     if actif_seulement:
         query["actif"] = True
     
+    inchange = await not_modified(request, response, [(SALLES, centre_actif)], query)
+    if inchange:
+        return inchange
+    
     salles = await db.salles.find(query).sort("nom", 1).to_list(1000)
     
     cleaned_salles = []
@@ -4708,13 +5161,14 @@ async def get_salles(
 async def update_salle(
     salle_id: str,
     salle_data: SalleUpdate,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     update_data = {k: v for k, v in salle_data.dict().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="Aucune donnée à mettre à jour")
     
     result = await db.salles.update_one({"id": salle_id}, {"$set": update_data})
+    await resource_versions.bump(SALLES)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Salle non trouvée")
     
@@ -4726,10 +5180,11 @@ async def update_salle(
 @api_router.delete("/salles/{salle_id}")
 async def delete_salle(
     salle_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Soft delete - marquer comme inactif
     result = await db.salles.update_one({"id": salle_id}, {"$set": {"actif": False}})
+    await resource_versions.bump(SALLES)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Salle non trouvée")
     
@@ -4737,13 +5192,22 @@ async def delete_salle(
 
 # Configuration du cabinet
 @api_router.get("/configuration", response_model=ConfigurationCabinet)
-async def get_configuration(current_user: User = Depends(get_current_user)):
+async def get_configuration(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    inchange = await not_modified(request, response, [(CONFIGURATION, None)])
+    if inchange:
+        return inchange
+    
     config = await db.configuration.find_one()
     
     if not config:
         # Créer une configuration par défaut
         default_config = ConfigurationCabinet()
         await db.configuration.insert_one(default_config.dict())
+        await resource_versions.bump(CONFIGURATION)
         return default_config
     
     if '_id' in config:
@@ -4753,7 +5217,7 @@ async def get_configuration(current_user: User = Depends(get_current_user)):
 @api_router.put("/configuration", response_model=ConfigurationCabinet)
 async def update_configuration(
     config_data: ConfigurationCabinetUpdate,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     update_data = {k: v for k, v in config_data.dict().items() if v is not None}
     update_data['date_modification'] = datetime.now(timezone.utc)
@@ -4762,11 +5226,13 @@ async def update_configuration(
     
     if existing_config:
         result = await db.configuration.update_one({"id": existing_config["id"]}, {"$set": update_data})
+        await resource_versions.bump(CONFIGURATION)
         updated_config = await db.configuration.find_one({"id": existing_config["id"]})
     else:
         # Créer nouvelle configuration
         new_config = ConfigurationCabinet(**update_data)
         await db.configuration.insert_one(new_config.dict())
+        await resource_versions.bump(CONFIGURATION)
         updated_config = new_config.dict()
     
     if '_id' in updated_config:
@@ -4820,7 +5286,7 @@ async def get_semaines_types(current_user: User = Depends(get_current_user)):
 
 @api_router.post("/semaines-types/init")
 async def init_semaines_types(
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Vérifier si des semaines types existent déjà
     existing = await db.semaines_types.count_documents({"actif": True})
@@ -4917,55 +5383,18 @@ async def create_demande_jour_travail(
         if not semaine_type:
             raise HTTPException(status_code=404, detail="Semaine type non trouvée")
         
-        # Calculer les dates de la semaine
-        from datetime import datetime, timedelta
-        date_debut = datetime.strptime(demande_data.date_debut_semaine, '%Y-%m-%d')
-        
-        jours_semaine = ['lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche']
-        
-        for i, jour in enumerate(jours_semaine):
-            creneau = semaine_type.get(jour)
-            if creneau and creneau != 'REPOS':
-                date_jour = (date_debut + timedelta(days=i)).strftime('%Y-%m-%d')
-                
-                # Vérification intelligente des conflits (même logique que demande individuelle)
-                demandes_existantes = await db.demandes_travail.find({
-                    "medecin_id": medecin_id,
-                    "date_demandee": date_jour,
-                    "statut": {"$nin": ["REJETE", "ANNULE"]}
-                }).to_list(length=None)
-                
-                conflit = False
-                for demande_existante in demandes_existantes:
-                    creneau_existant = demande_existante["creneau"]
-                    
-                    # Doublon strict
-                    if creneau == creneau_existant:
-                        conflit = True
-                        break
-                    
-                    # JOURNEE_COMPLETE vs MATIN/APRES_MIDI
-                    if creneau == "JOURNEE_COMPLETE" and creneau_existant in ["MATIN", "APRES_MIDI"]:
-                        conflit = True
-                        break
-                    
-                    # MATIN/APRES_MIDI vs JOURNEE_COMPLETE
-                    if creneau in ["MATIN", "APRES_MIDI"] and creneau_existant == "JOURNEE_COMPLETE":
-                        conflit = True
-                        break
-                    
-                    # MATIN + APRES_MIDI = OK (pas de conflit)
-                
-                if not conflit:
-                    demande = DemandeJourTravail(
-                        medecin_id=medecin_id,
-                        centre_id=centre_id,
-                        date_demandee=date_jour,
-                        creneau=creneau,
-                        motif=f"Semaine type: {semaine_type['nom']}"
-                    )
-                    await db.demandes_travail.insert_one(demande.dict())
-                    demandes_creees.append(demande)
+        # Conflits résolus en mémoire (une requête pour la semaine, un insert_many)
+        resultat = await apply_semaine_type(
+            db, semaine_type, [medecin_id], demande_data.date_debut_semaine, 1,
+            lambda medecin, date_jour, creneau: DemandeJourTravail(
+                medecin_id=medecin,
+                centre_id=centre_id,
+                date_demandee=date_jour,
+                creneau=creneau,
+                motif=f"Semaine type: {semaine_type['nom']}"
+            ).dict()
+        )
+        demandes_creees = [DemandeJourTravail(**d) for d in resultat["demandes"]]
         
         # 📤 NOTIFICATION : Nouvelle demande de semaine type (si créé par médecin)
         if current_user.role == ROLES["MEDECIN"] and demandes_creees:
@@ -5054,7 +5483,8 @@ async def create_demande_jour_travail(
 async def get_demandes_jour_travail(
     date_debut: Optional[str] = None,
     date_fin: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     query = {}
     
@@ -5098,11 +5528,7 @@ async def get_demandes_jour_travail(
     
     # OPTIMISATION N+1: Récupérer tous les médecins en une seule requête
     medecin_ids = list(set(d["medecin_id"] for d in demandes))
-    users = await db.users.find(
-        {"id": {"$in": medecin_ids}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(medecin_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(medecin_ids)).items()}
     
     # Enrichir avec les données des médecins
     enriched_demandes = []
@@ -5163,8 +5589,8 @@ async def create_demande_mensuelle(
             if not semaine_type:
                 raise HTTPException(status_code=404, detail="Semaine type non trouvée")
         
-        # Créer les demandes jour par jour
-        demandes_creees = []
+        # Construire la liste (date, créneau) demandée
+        jours_demandes = []
         
         # Si jours_avec_creneaux est fourni, utiliser cette liste directement
         if demande_data.jours_avec_creneaux:
@@ -5174,23 +5600,7 @@ async def create_demande_mensuelle(
                 
                 if not date_str or not creneau:
                     continue
-                
-                # Vérifier qu'il n'y a pas déjà une demande pour ce jour
-                existing = await db.demandes_travail.find_one({
-                    "medecin_id": medecin_id,
-                    "date_demandee": date_str,
-                    "statut": {"$in": ["EN_ATTENTE", "APPROUVE"]}
-                })
-                
-                if not existing:
-                    demande = DemandeJourTravail(
-                        medecin_id=medecin_id,
-                        date_demandee=date_str,
-                        creneau=creneau,
-                        motif=demande_data.motif or f"Demande mensuelle {date_debut.strftime('%B %Y')}"
-                    )
-                    await db.demandes_travail.insert_one(demande.dict())
-                    demandes_creees.append(date_str)
+                jours_demandes.append((date_str, creneau))
         else:
             # Mode legacy : utiliser semaine type ou défaut (rétrocompatibilité)
             current_date = date_debut
@@ -5218,25 +5628,42 @@ async def create_demande_mensuelle(
                 
                 # Ne créer une demande que si ce n'est pas un jour de repos
                 if creneau and creneau != 'REPOS':
-                    # Vérifier qu'il n'y a pas déjà une demande pour ce jour
-                    existing = await db.demandes_travail.find_one({
-                        "medecin_id": medecin_id,
-                        "date_demandee": date_str,
-                        "statut": {"$in": ["EN_ATTENTE", "APPROUVE"]}
-                    })
-                    
-                    if not existing:
-                        demande = DemandeJourTravail(
-                            medecin_id=medecin_id,
-                            date_demandee=date_str,
-                            creneau=creneau,
-                            motif=demande_data.motif or f"Demande mensuelle {date_debut.strftime('%B %Y')}"
-                        )
-                        await db.demandes_travail.insert_one(demande.dict())
-                        demandes_creees.append(date_str)
+                    jours_demandes.append((date_str, creneau))
                 
                 current_date += timedelta(days=1)
         
+        # Jours ayant déjà une demande en attente ou approuvée : une seule requête pour la période
+        jours_pris = set()
+        if jours_demandes:
+            dates = [d for d, _ in jours_demandes]
+            existantes = await db.demandes_travail.find(
+                {
+                    "medecin_id": medecin_id,
+                    "date_demandee": {"$gte": min(dates), "$lte": max(dates)},
+                    "statut": {"$in": ["EN_ATTENTE", "APPROUVE"]}
+                },
+                {"_id": 0, "date_demandee": 1}
+            ).to_list(None)
+            jours_pris = {d["date_demandee"] for d in existantes}
+        
+        demandes_creees = []
+        nouvelles_demandes = []
+        for date_str, creneau in jours_demandes:
+            if date_str in jours_pris:
+                continue
+            jours_pris.add(date_str)
+            demande = DemandeJourTravail(
+                medecin_id=medecin_id,
+                date_demandee=date_str,
+                creneau=creneau,
+                motif=demande_data.motif or f"Demande mensuelle {date_debut.strftime('%B %Y')}"
+            )
+            nouvelles_demandes.append(demande.dict())
+            demandes_creees.append(date_str)
+        
+        if nouvelles_demandes:
+            await db.demandes_travail.insert_many(nouvelles_demandes, ordered=False)
+        
         # 📤 NOTIFICATION : Notifier le directeur (seulement si c'est le médecin qui fait la demande)
         if demandes_creees and current_user.role == ROLES["MEDECIN"]:
             user_name = f"Dr. {current_user.prenom} {current_user.nom}"
@@ -5260,6 +5687,73 @@ async def create_demande_mensuelle(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/demandes-travail/semaine-type", response_model=dict)
+async def appliquer_semaine_type(
+    request: ApplicationSemaineTypeRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Applique une semaine type à plusieurs médecins sur plusieurs semaines.
+    Toutes les demandes existantes de la période sont lues en une requête,
+    les conflits sont résolus en mémoire et les demandes insérées en un seul insert_many.
+    """
+    if current_user.role in [ROLES["DIRECTEUR"], "Super-Admin"]:
+        if not request.medecin_ids:
+            raise HTTPException(status_code=400, detail="Le médecin doit être spécifié")
+        medecin_ids = list(dict.fromkeys(request.medecin_ids))
+        medecins = await db.users.find(
+            {"id": {"$in": medecin_ids}, "role": ROLES["MEDECIN"]},
+            {"_id": 0, "id": 1}
+        ).to_list(None)
+        if len(medecins) != len(medecin_ids):
+            raise HTTPException(status_code=404, detail="Médecin non trouvé")
+    elif current_user.role == ROLES["MEDECIN"]:
+        medecin_ids = [current_user.id]
+    else:
+        raise HTTPException(status_code=403, detail="Vous n'avez pas l'autorisation")
+    
+    semaine_type = await db.semaines_types.find_one({"id": request.semaine_type_id})
+    if not semaine_type:
+        raise HTTPException(status_code=404, detail="Semaine type non trouvée")
+    
+    centre_id = request.centre_id or get_default_centre_id(current_user)
+    motif = request.motif or f"Semaine type: {semaine_type['nom']}"
+    
+    try:
+        resultat = await apply_semaine_type(
+            db, semaine_type, medecin_ids, request.date_debut_semaine, request.nb_semaines,
+            lambda medecin_id, date_jour, creneau: DemandeJourTravail(
+                medecin_id=medecin_id,
+                centre_id=centre_id,
+                date_demandee=date_jour,
+                creneau=creneau,
+                motif=motif
+            ).dict()
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Format de date invalide")
+    
+    demandes_creees = resultat["demandes"]
+    
+    # 📤 NOTIFICATION : une seule notification au directeur (si créé par médecin)
+    if current_user.role == ROLES["MEDECIN"] and demandes_creees:
+        user_name = f"Dr. {current_user.prenom} {current_user.nom}"
+        details = f"Semaine type '{semaine_type['nom']}' sur {request.nb_semaines} semaine(s) à partir du {request.date_debut_semaine}"
+        background_tasks.add_task(
+            notify_director_new_request,
+            "demande de semaine type",
+            user_name,
+            details
+        )
+    
+    return {
+        "message": f"{len(demandes_creees)} demandes créées avec succès",
+        "demandes_creees": len(demandes_creees),
+        "demandes_ignorees": len(resultat["ignorees"]),
+        "demandes": [DemandeJourTravail(**d) for d in demandes_creees]
+    }
+
 @api_router.put("/demandes-travail/{demande_id}/approuver")
 async def approuver_demande_jour_travail(
     demande_id: str,
@@ -5446,43 +5940,38 @@ async def approuver_demande_jour_travail(
             creneaux_a_creer = [demande["creneau"]]
         
         for creneau_type in creneaux_a_creer:
-            # Vérifier si un créneau n'existe pas déjà pour cet employé à cette date/heure
-            existing_creneau = await db.planning.find_one({
-                "date": demande["date_demandee"],
-                "creneau": creneau_type,
-                "employe_id": demande["medecin_id"]
-            })
+            # Déterminer les horaires selon le rôle et le créneau
+            horaire_debut = None
+            horaire_fin = None
+            horaire_pause_debut = None
+            horaire_pause_fin = None
             
-            if not existing_creneau:
-                # Déterminer les horaires selon le rôle et le créneau
-                horaire_debut = None
-                horaire_fin = None
-                horaire_pause_debut = None
-                horaire_pause_fin = None
-                
-                if employe["role"] == "Secrétaire":
-                    if creneau_type == "MATIN":
-                        horaire_debut = employe.get("horaire_matin_debut")
-                        horaire_fin = employe.get("horaire_matin_fin")
-                    else:  # APRES_MIDI
-                        horaire_debut = employe.get("horaire_apres_midi_debut")
-                        horaire_fin = employe.get("horaire_apres_midi_fin")
-                
-                # Créer le créneau avec les horaires
-                creneau_planning = CreneauPlanning(
-                    date=demande["date_demandee"],
-                    creneau=creneau_type,
-                    employe_id=demande["medecin_id"],
-                    employe_role=employe["role"],
-                    horaire_debut=horaire_debut,
-                    horaire_fin=horaire_fin,
-                    horaire_pause_debut=horaire_pause_debut,
-                    horaire_pause_fin=horaire_pause_fin,
-                    salle_attribuee=None,
-                    salle_attente=None,
-                    notes=None
-                )
-                await db.planning.insert_one(creneau_planning.dict())
+            if employe["role"] == "Secrétaire":
+                if creneau_type == "MATIN":
+                    horaire_debut = employe.get("horaire_matin_debut")
+                    horaire_fin = employe.get("horaire_matin_fin")
+                else:  # APRES_MIDI
+                    horaire_debut = employe.get("horaire_apres_midi_debut")
+                    horaire_fin = employe.get("horaire_apres_midi_fin")
+            
+            # Créer le créneau avec les horaires
+            creneau_planning = CreneauPlanning(
+                date=demande["date_demandee"],
+                creneau=creneau_type,
+                employe_id=demande["medecin_id"],
+                employe_role=employe["role"],
+                centre_id=demande.get("centre_id"),
+                horaire_debut=horaire_debut,
+                horaire_fin=horaire_fin,
+                horaire_pause_debut=horaire_pause_debut,
+                horaire_pause_fin=horaire_pause_fin,
+                salle_attribuee=None,
+                salle_attente=None,
+                notes=None
+            )
+            # Déjà programmé à cette date/heure (index unique) : le créneau existant est conservé
+            if await insert_planning_slot(db, creneau_planning.dict()) is None:
+                await planning_changes.record_changes(db, [creneau_planning.dict()], planning_changes.UPSERT)
     
     return {"message": f"Demande {statut.lower()}e avec succès" + (" et créneau(x) créé(s) dans le planning" if request.approuve else "")}
 
@@ -5544,7 +6033,7 @@ async def approuver_annulation_demande_travail(
     demande_id: str,
     request: ApprobationJourTravailRequest,
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Directeur approuve ou rejette une demande d'annulation"""
     # Récupérer la demande
@@ -5578,11 +6067,12 @@ async def approuver_annulation_demande_travail(
             creneaux_a_supprimer = [demande["creneau"]]
         
         for creneau_type in creneaux_a_supprimer:
-            await db.planning.delete_one({
+            supprime = await db.planning.find_one_and_delete({
                 "date": demande["date_demandee"],
                 "creneau": creneau_type,
                 "employe_id": demande["medecin_id"]
-            })
+            }, projection={"_id": 0, "id": 1, "centre_id": 1, "date": 1})
+            await planning_changes.record_changes(db, [supprime], planning_changes.DELETE)
         
         statut_message = "approuvée"
     else:
@@ -5616,7 +6106,7 @@ async def annuler_directement_demande_travail(
     demande_id: str,
     request: AnnulationDirecteRequest,
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Directeur annule directement une demande de créneau approuvée"""
     # Récupérer la demande
@@ -5655,11 +6145,12 @@ async def annuler_directement_demande_travail(
         
         # Ne supprimer le créneau que s'il n'y a pas d'autre demande approuvée
         if autres_demandes == 0:
-            await db.planning.delete_one({
+            supprime = await db.planning.find_one_and_delete({
                 "date": demande["date_demandee"],
                 "creneau": creneau_type,
                 "employe_id": demande["medecin_id"]
-            })
+            }, projection={"_id": 0, "id": 1, "centre_id": 1, "date": 1})
+            await planning_changes.record_changes(db, [supprime], planning_changes.DELETE)
         else:
             print(f"Créneau {creneau_type} du {demande['date_demandee']} conservé car {autres_demandes} autre(s) demande(s) approuvée(s)")
     
@@ -5704,7 +6195,10 @@ async def annuler_directement_demande_travail(
 @api_router.get("/planning/semaine/{date_debut}")
 async def get_planning_semaine(
     date_debut: str,  # Date du lundi (YYYY-MM-DD)
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     from datetime import datetime, timedelta
     
@@ -5718,6 +6212,13 @@ async def get_planning_semaine(
     
     is_admin = current_user.role in ['Directeur', 'Super-Admin']
     
+    # Créneaux du centre (et sans centre) enrichis avec les employés
+    inchange = await not_modified(
+        request, response, [(PLANNING, centre_actif), (USERS, None)], ["semaine", date_debut, centre_actif, is_admin]
+    )
+    if inchange:
+        return inchange
+    
     # Calculer les 7 jours de la semaine
     date_start = datetime.strptime(date_debut, '%Y-%m-%d')
     dates_semaine = [(date_start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
@@ -5764,11 +6265,7 @@ async def get_planning_semaine(
             all_user_ids.add(creneau["medecin_attribue_id"])
     
     # Une seule requête pour tous les utilisateurs
-    users = await db.users.find(
-        {"id": {"$in": list(all_user_ids)}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(all_user_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(all_user_ids)).items()}
     
     # Organiser par jour
     planning_par_jour = {date: {"MATIN": [], "APRES_MIDI": []} for date in dates_semaine}
@@ -5800,6 +6297,8 @@ async def get_planning_semaine(
 @api_router.get("/planning/mois/{mois}")
 async def get_planning_mois(
     mois: str,  # Format YYYY-MM
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
     from datetime import datetime
@@ -5815,6 +6314,12 @@ async def get_planning_mois(
     
     is_admin = current_user.role in ['Directeur', 'Super-Admin']
     
+    inchange = await not_modified(
+        request, response, [(PLANNING, centre_actif), (USERS, None)], ["mois", mois, centre_actif, is_admin]
+    )
+    if inchange:
+        return inchange
+    
     # Parser le mois
     year, month = map(int, mois.split('-'))
     last_day = calendar.monthrange(year, month)[1]
@@ -5876,7 +6381,8 @@ async def get_planning_mois(
 async def get_plan_cabinet(
     date: str,
     creneau: str = "MATIN",  # ou "APRES_MIDI"
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     # Déterminer le centre actif de l'utilisateur
     centre_actif = getattr(current_user, 'centre_actif_id', None)
@@ -5886,8 +6392,6 @@ async def get_plan_cabinet(
             user_centres.append(current_user.centre_id)
         centre_actif = user_centres[0] if user_centres else None
     
-    print(f"[DEBUG cabinet/plan] centre_actif: {centre_actif}, user: {current_user.email}")
-    
     # TOUJOURS filtrer par centre actif - même pour les admins
     # Si pas de centre actif, retourner une liste vide
     if not centre_actif:
@@ -5902,7 +6406,7 @@ async def get_plan_cabinet(
     }
     
     salles = await db.salles.find(salles_query).to_list(1000)
-    print(f"[DEBUG cabinet/plan] Salles trouvées pour centre {centre_actif}: {len(salles)}")
+    logger.debug("cabinet/plan: %d salles", len(salles), extra={"centre_id": centre_actif, "date": date, "creneau": creneau})
     
     # Récupérer le planning pour cette date/créneau - filtré par centre
     planning_query = {
@@ -5931,11 +6435,7 @@ async def get_plan_cabinet(
             all_user_ids.add(creneau_planning["medecin_attribue_id"])
     
     # Une seule requête pour tous les utilisateurs
-    users = await db.users.find(
-        {"id": {"$in": list(all_user_ids)}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(all_user_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(all_user_ids)).items()}
     
     # Créer un mapping salle -> employé
     occupation_salles = {}
@@ -5992,7 +6492,7 @@ async def create_note_generale(
     return note
 
 @api_router.get("/notes", response_model=List[Dict[str, Any]])
-async def get_notes_generales(current_user: User = Depends(get_current_user)):
+async def get_notes_generales(current_user: User = Depends(get_current_user), user_loader: UserLoader = Depends(get_user_loader)):
     # Déterminer le centre actif de l'utilisateur
     centre_actif = getattr(current_user, 'centre_actif_id', None)
     if not centre_actif:
@@ -6018,11 +6518,7 @@ async def get_notes_generales(current_user: User = Depends(get_current_user)):
     
     # OPTIMISATION N+1: Récupérer tous les auteurs en une seule requête
     auteur_ids = list(set(n["auteur_id"] for n in notes if n.get("auteur_id")))
-    users = await db.users.find(
-        {"id": {"$in": auteur_ids}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(auteur_ids)) if auteur_ids else []
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(auteur_ids)).items()}
     
     # Enrich with author details
     enriched_notes = []
@@ -6040,7 +6536,7 @@ async def get_notes_generales(current_user: User = Depends(get_current_user)):
 @api_router.post("/quotas", response_model=QuotaEmploye)
 async def create_quota_employe(
     quota_data: QuotaEmployeCreate,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Vérifier si un quota existe déjà pour cette semaine
     existing = await db.quotas_employes.find_one({
@@ -6067,7 +6563,8 @@ async def create_quota_employe(
 @api_router.get("/quotas/{semaine_debut}", response_model=List[Dict[str, Any]])
 async def get_quotas_semaine(
     semaine_debut: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]])),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     quotas = await db.quotas_employes.find({"semaine_debut": semaine_debut}).to_list(1000)
     
@@ -6076,11 +6573,7 @@ async def get_quotas_semaine(
     
     # OPTIMISATION N+1: Récupérer tous les employés en une seule requête
     employe_ids = list(set(q["employe_id"] for q in quotas))
-    users = await db.users.find(
-        {"id": {"$in": employe_ids}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(employe_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(employe_ids)).items()}
     
     # Enrichir avec les données des employés
     enriched_quotas = []
@@ -6099,7 +6592,7 @@ async def get_quotas_semaine(
 @api_router.put("/quotas/{quota_id}/increment")
 async def increment_attribution(
     quota_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     quota = await db.quotas_employes.find_one({"id": quota_id})
     if not quota:
@@ -6122,7 +6615,7 @@ async def increment_attribution(
 @api_router.put("/quotas/{quota_id}/decrement")
 async def decrement_attribution(
     quota_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     quota = await db.quotas_employes.find_one({"id": quota_id})
     if not quota:
@@ -6148,25 +6641,6 @@ async def create_attribution_complete(
     notes: str = "",
     current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
 ):
-    # Vérifier les conflits
-    existing = await db.planning.find_one({
-        "employe_id": employe_id,
-        "date": date,
-        "creneau": creneau
-    })
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="Employé déjà attribué à ce créneau")
-    
-    salle_occupee = await db.planning.find_one({
-        "salle_attribuee": salle_attribuee,
-        "date": date,
-        "creneau": creneau
-    })
-    
-    if salle_occupee:
-        raise HTTPException(status_code=400, detail="Salle déjà occupée")
-    
     # Récupérer l'employé pour son rôle
     employe = await db.users.find_one({"id": employe_id})
     if not employe:
@@ -6179,7 +6653,9 @@ async def create_attribution_complete(
         "employe_id": employe_id,
         "salle_attribuee": salle_attribuee,
         "notes": notes,
-        "employe_role": employe["role"]
+        "employe_role": employe["role"],
+        # Centre actif lu sur le document utilisateur, comme les autres créations de créneaux
+        "centre_id": get_default_centre_id(current_user)
     }
     
     # Si c'est un assistant, associer aux médecins
@@ -6187,7 +6663,13 @@ async def create_attribution_complete(
         attribution_data["medecin_attribue_id"] = medecin_ids[0]  # Premier médecin principal
     
     creneau_planning = CreneauPlanning(**attribution_data)
-    await db.planning.insert_one(creneau_planning.dict())
+    # Conflits employé/salle garantis par les index uniques (plus de find_one préalable)
+    conflit = await insert_planning_slot(db, creneau_planning.dict())
+    if conflit == CONFLIT_SALLE:
+        raise HTTPException(status_code=400, detail="Salle déjà occupée")
+    if conflit:
+        raise HTTPException(status_code=400, detail="Employé déjà attribué à ce créneau")
+    await planning_changes.record_changes(db, [creneau_planning.dict()], planning_changes.UPSERT)
     
     # Mettre à jour le quota
     semaine_debut = get_monday_of_week(date)
@@ -6243,7 +6725,8 @@ async def create_permission_document(
 @api_router.get("/documents/permissions/{proprietaire_id}", response_model=List[Dict[str, Any]])
 async def get_permissions_document(
     proprietaire_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     # Vérifier les permissions
     if current_user.role != ROLES["DIRECTEUR"] and current_user.id != proprietaire_id:
@@ -6259,11 +6742,7 @@ async def get_permissions_document(
     
     # OPTIMISATION N+1: Récupérer tous les utilisateurs autorisés en une seule requête
     user_ids = list(set(p["utilisateur_autorise_id"] for p in permissions))
-    users = await db.users.find(
-        {"id": {"$in": user_ids}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(user_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(user_ids)).items()}
     
     enriched_permissions = []
     for perm in permissions:
@@ -6295,7 +6774,8 @@ async def upload_document_personnel(
 @api_router.get("/documents", response_model=List[Dict[str, Any]])
 async def get_documents_personnels(
     proprietaire_id: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     documents = []
     
@@ -6337,11 +6817,7 @@ async def get_documents_personnels(
     
     # OPTIMISATION N+1: Récupérer tous les propriétaires en une seule requête
     proprietaire_ids = list(set(d["proprietaire_id"] for d in documents))
-    users = await db.users.find(
-        {"id": {"$in": proprietaire_ids}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(len(proprietaire_ids))
-    users_map = {u["id"]: User(**u) for u in users}
+    users_map = {uid: User(**u) for uid, u in (await user_loader.load_many(proprietaire_ids)).items()}
     
     enriched_documents = []
     for doc in documents:
@@ -6403,7 +6879,7 @@ async def delete_document_personnel(
 # Initialisation du cabinet
 @api_router.post("/cabinet/initialiser")
 async def initialiser_cabinet(
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Vérifier si des salles existent déjà
     existing_salles = await db.salles.count_documents({"actif": True})
@@ -6445,6 +6921,7 @@ async def initialiser_cabinet(
     for salle_data in salles_par_defaut:
         salle = Salle(**salle_data)
         await db.salles.insert_one(salle.dict())
+        await resource_versions.bump(SALLES)
         salles_creees += 1
     
     # Créer configuration par défaut
@@ -6455,6 +6932,7 @@ async def initialiser_cabinet(
             max_assistants_par_jour=3  # Selon le nombre de salles assistants
         )
         await db.configuration.insert_one(config_defaut.dict())
+        await resource_versions.bump(CONFIGURATION)
     
     return {
         "message": f"Cabinet initialisé avec succès",
@@ -6663,7 +7141,7 @@ async def delete_article_stock(
 
 # Administration des comptes (Directeur uniquement)
 @api_router.get("/admin/users", response_model=List[Dict])
-async def get_all_users_for_admin(current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))):
+async def get_all_users_for_admin(current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))):
     users = await db.users.find({}).to_list(length=None)
     for user in users:
         if '_id' in user:
@@ -6674,7 +7152,7 @@ async def get_all_users_for_admin(current_user: User = Depends(require_role([ROL
     return users
 
 @api_router.post("/admin/impersonate/{user_id}")
-async def impersonate_user(user_id: str, current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))):
+async def impersonate_user(user_id: str, current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))):
     # Vérifier que l'utilisateur cible existe
     target_user = await db.users.find_one({"id": user_id})
     if not target_user:
@@ -6686,7 +7164,7 @@ async def impersonate_user(user_id: str, current_user: User = Depends(require_ro
     # Créer un token pour l'utilisateur cible
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": target_user["id"]}, expires_delta=access_token_expires
+        data=build_token_claims(target_user), expires_delta=access_token_expires
     )
     
     return {
@@ -6699,17 +7177,19 @@ async def impersonate_user(user_id: str, current_user: User = Depends(require_ro
 async def reset_user_password(
     user_id: str,
     new_password: Dict[str, str],
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     if "password" not in new_password:
         raise HTTPException(status_code=400, detail="Mot de passe requis")
     
-    hashed_password = get_password_hash(new_password["password"])
+    hashed_password = await get_password_hash_async(new_password["password"])
     
     result = await db.users.update_one(
         {"id": user_id}, 
         {"$set": {"password_hash": hashed_password}}
     )
+    await resource_versions.bump(USERS)
+    await revoke_user_tokens(user_id)
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
@@ -6719,7 +7199,7 @@ async def reset_user_password(
 @api_router.put("/admin/users/{user_id}/toggle-active")
 async def toggle_user_active(
     user_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     user = await db.users.find_one({"id": user_id})
     if not user:
@@ -6735,13 +7215,16 @@ async def toggle_user_active(
         {"id": user_id}, 
         {"$set": {"actif": new_status}}
     )
+    await resource_versions.bump(USERS)
+    await revoke_user_tokens(user_id)
+    await push_devices.set_user_devices_active(db, user_id, new_status)
     
     return {"message": "Statut mis à jour", "actif": new_status}
 
 @api_router.put("/admin/users/{user_id}/toggle-vue-planning")
 async def toggle_vue_planning_complete(
     user_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Toggle l'accès à la vue planning complète (lecture seule) pour un utilisateur"""
     user = await db.users.find_one({"id": user_id})
@@ -6758,6 +7241,8 @@ async def toggle_vue_planning_complete(
         {"id": user_id}, 
         {"$set": {"vue_planning_complete": new_status}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(user_id)
     
     return {
         "message": f"Vue planning {'activée' if new_status else 'désactivée'}", 
@@ -6769,7 +7254,7 @@ async def toggle_vue_planning_complete(
 @api_router.put("/admin/users/{user_id}/toggle-modifier-planning")
 async def toggle_modifier_planning(
     user_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Toggle la permission de modifier le planning pour un utilisateur"""
     user = await db.users.find_one({"id": user_id})
@@ -6786,6 +7271,8 @@ async def toggle_modifier_planning(
         {"id": user_id}, 
         {"$set": {"peut_modifier_planning": new_status}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(user_id)
     
     return {
         "message": f"Modification planning {'activée' if new_status else 'désactivée'}", 
@@ -6835,7 +7322,7 @@ async def export_all_data(
 
 @api_router.get("/export/users")
 async def export_users(
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """Exporter tous les utilisateurs (sans les mots de passe)"""
     users = await db.users.find({}).to_list(length=None)
@@ -6856,7 +7343,8 @@ async def export_users(
 async def export_planning(
     date_debut: Optional[str] = None,
     date_fin: Optional[str] = None,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]])),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     """Exporter le planning (optionnellement filtré par dates)"""
     query = {}
@@ -6870,13 +7358,14 @@ async def export_planning(
     
     planning = await db.planning.find(query).to_list(length=None)
     
-    # Enrichir avec les noms des employés
+    # Enrichir avec les noms des employés (une seule requête pour tous)
+    await user_loader.load_many(p.get("employe_id") for p in planning)
     enriched_planning = []
     for p in planning:
         if '_id' in p:
             del p['_id']
         # Ajouter le nom de l'employé
-        user = await db.users.find_one({"id": p.get("employe_id")})
+        user = user_loader.get(p.get("employe_id"))
         if user:
             p["employe_nom"] = f"{user.get('prenom', '')} {user.get('nom', '')}"
             p["employe_email"] = user.get('email', '')
@@ -6890,16 +7379,18 @@ async def export_planning(
 
 @api_router.get("/export/conges")
 async def export_conges(
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]])),
+    user_loader: UserLoader = Depends(get_user_loader)
 ):
     """Exporter tous les congés"""
     conges = await db.demandes_conges.find({}).to_list(length=None)
     
+    await user_loader.load_many(c.get("utilisateur_id") for c in conges)
     enriched_conges = []
     for c in conges:
         if '_id' in c:
             del c['_id']
-        user = await db.users.find_one({"id": c.get("utilisateur_id")})
+        user = user_loader.get(c.get("utilisateur_id"))
         if user:
             c["utilisateur_nom"] = f"{user.get('prenom', '')} {user.get('nom', '')}"
         enriched_conges.append(c)
@@ -6914,7 +7405,7 @@ async def export_conges(
 async def update_user_email(
     user_id: str,
     email_data: Dict[str, str],
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     if "email" not in email_data:
         raise HTTPException(status_code=400, detail="Email requis")
@@ -6942,6 +7433,8 @@ async def update_user_email(
         {"id": user_id}, 
         {"$set": {"email": new_email}}
     )
+    await resource_versions.bump(USERS)
+    principal_cache.invalidate(user_id)
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
@@ -6955,7 +7448,7 @@ async def update_user_email(
 @api_router.delete("/admin/users/{user_id}/delete-permanently")
 async def delete_user_permanently(
     user_id: str,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     # Vérifier que l'utilisateur cible existe
     target_user = await db.users.find_one({"id": user_id})
@@ -6974,12 +7467,20 @@ async def delete_user_permanently(
     try:
         # Supprimer l'utilisateur principal
         await db.users.delete_one({"id": user_id})
+        await resource_versions.bump(USERS)
+        principal_cache.invalidate(user_id)
+        token_versions.invalidate(user_id)
+        await push_devices.remove_user_devices(db, user_id)
         
         # Supprimer les données associées
         await db.assignations.delete_many({"medecin_id": user_id})
         await db.assignations.delete_many({"assistant_id": user_id})
         await db.demandes_conges.delete_many({"utilisateur_id": user_id})
+        creneaux_utilisateur = await db.planning.find(
+            {"employe_id": user_id}, {"_id": 0, "id": 1, "centre_id": 1, "date": 1}
+        ).to_list(None)
         await db.planning.delete_many({"employe_id": user_id})
+        await planning_changes.record_changes(db, creneaux_utilisateur, planning_changes.DELETE)
         await db.quotas_employes.delete_many({"employe_id": user_id})
         await db.messages.delete_many({"expediteur_id": user_id})
         await db.messages.delete_many({"destinataire_id": user_id})
@@ -7004,7 +7505,7 @@ async def delete_user_permanently(
 
 @api_router.post("/admin/init-bulk-accounts")
 async def init_bulk_accounts(
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     """
     Créer tous les comptes utilisateurs en masse (uniquement pour le Directeur)
@@ -7045,7 +7546,7 @@ async def init_bulk_accounts(
     
     # Mot de passe pour tous les comptes
     password = "azerty"
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await get_password_hash_async(password)
     
     created_count = 0
     skipped_count = 0
@@ -7077,6 +7578,7 @@ async def init_bulk_accounts(
             }
             
             await db.users.insert_one(user_data)
+            await resource_versions.bump(USERS)
             created_count += 1
         except Exception as e:
             errors.append(f"{account['prenom']} {account['nom']}: {str(e)}")
@@ -7091,7 +7593,7 @@ async def init_bulk_accounts(
     }
 
 @api_router.get("/stocks/permissions", response_model=List[Dict])
-async def get_permissions_stock(current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))):
+async def get_permissions_stock(current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))):
     # Récupérer permissions avec informations utilisateur
     pipeline = [
         {
@@ -7122,7 +7624,7 @@ async def get_permissions_stock(current_user: User = Depends(require_role([ROLES
 @api_router.post("/stocks/permissions", response_model=PermissionStock)
 async def create_permission_stock(
     permission: PermissionStockCreate,
-    current_user: User = Depends(require_role([ROLES["DIRECTEUR"]]))
+    current_user: TokenPrincipal = Depends(require_role_claims([ROLES["DIRECTEUR"]]))
 ):
     permission_dict = permission.dict()
     permission_dict['id'] = str(uuid.uuid4())
@@ -7256,6 +7758,7 @@ async def initialize_database(request: InitDatabaseRequest):
         ]
         
         await db.users.insert_many(users)
+        await resource_versions.bump(USERS)
         
         # Créer les salles
         salles = [
@@ -7312,6 +7815,7 @@ async def initialize_database(request: InitDatabaseRequest):
         ]
         
         await db.salles.insert_many(salles)
+        await resource_versions.bump(SALLES)
         
         # Créer la configuration
         configuration = {
@@ -7331,6 +7835,7 @@ async def initialize_database(request: InitDatabaseRequest):
         }
         
         await db.configuration.insert_one(configuration)
+        await resource_versions.bump(CONFIGURATION)
         
         # Compter les éléments créés
         user_count = await db.users.count_documents({})
@@ -7428,6 +7933,7 @@ async def add_super_admin(request: InitDatabaseRequest):
         }
         
         await db.users.insert_one(super_admin)
+        await resource_versions.bump(USERS)
         
         # Créer aussi les salles si elles n'existent pas
         salle_count = await db.salles.count_documents({})
@@ -7485,6 +7991,7 @@ async def add_super_admin(request: InitDatabaseRequest):
                 }
             ]
             await db.salles.insert_many(salles)
+            await resource_versions.bump(SALLES)
         
         # Créer la configuration si elle n'existe pas
         config_count = await db.configuration.count_documents({})
@@ -7505,6 +8012,7 @@ async def add_super_admin(request: InitDatabaseRequest):
                 "actif": True
             }
             await db.configuration.insert_one(configuration)
+            await resource_versions.bump(CONFIGURATION)
         
         return {
             "message": "✅ Super admin ajouté avec succès ! Utilisateurs existants préservés.",
@@ -7547,11 +8055,13 @@ async def reset_user_password_with_token(request: dict):
             raise HTTPException(status_code=404, detail=f"Utilisateur {email} non trouvé")
         
         # Mettre à jour le mot de passe
-        new_hash = get_password_hash(new_password)
+        new_hash = await get_password_hash_async(new_password)
         result = await db.users.update_one(
             {"email": email},
             {"$set": {"password_hash": new_hash}}
         )
+        await resource_versions.bump(USERS)
+        principal_cache.invalidate(user['id'])
         
         if result.modified_count == 0:
             raise HTTPException(status_code=500, detail="Échec de la mise à jour")
@@ -7597,10 +8107,10 @@ async def save_fcm_token(
         raise HTTPException(status_code=400, detail="Token FCM requis")
     
     try:
-        # Mettre à jour le token FCM de l'utilisateur
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$set": {"fcm_token": fcm_token}}
+        # Enregistrer l'appareil de l'utilisateur
+        await push_devices.register_device(
+            db, current_user.id, fcm_token, request.get("device_info"),
+            centre_id=current_user.centre_actif_id or current_user.centre_id, actif=current_user.actif
         )
         
         return {"message": "Token FCM enregistré avec succès"}
@@ -7611,10 +8121,7 @@ async def save_fcm_token(
 async def delete_fcm_token(current_user: User = Depends(get_current_user)):
     """Supprime le token FCM de l'utilisateur (désactivation des notifications)"""
     try:
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$unset": {"fcm_token": "", "device_info": ""}}
-        )
+        await push_devices.remove_user_devices(db, current_user.id)
         
         return {"message": "Token FCM et appareil supprimés avec succès"}
     except Exception as e:
@@ -7624,23 +8131,24 @@ async def delete_fcm_token(current_user: User = Depends(get_current_user)):
 async def get_device_info(current_user: User = Depends(get_current_user)):
     """Récupère les informations de l'appareil relié pour les notifications push"""
     try:
-        user = await db.users.find_one({"id": current_user.id}, {"fcm_token": 1, "device_info": 1, "fcm_updated_at": 1})
+        # Appareil le plus récemment utilisé
+        devices = await push_devices.list_user_devices(db, current_user.id)
         
-        if not user or not user.get("fcm_token"):
+        if not devices:
             return {
                 "has_device": False,
                 "message": "Aucun appareil relié pour les notifications push"
             }
         
-        device_info = user.get("device_info", {})
+        device_info = devices[0]
         return {
             "has_device": True,
             "device_name": device_info.get("device_name", "Appareil inconnu"),
             "browser": device_info.get("browser", "Inconnu"),
             "platform": device_info.get("platform", "Inconnu"),
             "os": device_info.get("os", "Inconnu"),
-            "registered_at": device_info.get("registered_at") or user.get("fcm_updated_at"),
-            "fcm_token_preview": user.get("fcm_token", "")[:20] + "..." if user.get("fcm_token") else None
+            "registered_at": device_info.get("registered_at"),
+            "fcm_token_preview": device_info["fcm_token"][:20] + "..."
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur: {str(e)}")
@@ -7648,12 +8156,11 @@ async def get_device_info(current_user: User = Depends(get_current_user)):
 # ==================== ACTUALITÉS ====================
 
 @api_router.get("/actualites")
-async def get_actualites(current_user: User = Depends(get_current_user)):
+async def get_actualites(current_user: User = Depends(get_current_user), user_loader: UserLoader = Depends(get_user_loader)):
     """Récupérer les actualités du centre actif"""
     try:
         # Déterminer le centre actif de l'utilisateur
         centre_actif = getattr(current_user, 'centre_actif_id', None)
-        print(f"[DEBUG ACTU] User: {current_user.email}, centre_actif_id attr: {centre_actif}")
         
         if not centre_actif:
             # Utiliser le premier centre de l'utilisateur
@@ -7661,7 +8168,6 @@ async def get_actualites(current_user: User = Depends(get_current_user)):
             if current_user.centre_id and current_user.centre_id not in user_centres:
                 user_centres.append(current_user.centre_id)
             centre_actif = user_centres[0] if user_centres else None
-            print(f"[DEBUG ACTU] Fallback centre_actif: {centre_actif}, user_centres: {user_centres}")
         
         # Construire la requête - filtrer STRICTEMENT par centre actif
         query = {"actif": True}
@@ -7669,18 +8175,18 @@ async def get_actualites(current_user: User = Depends(get_current_user)):
             query["centre_id"] = centre_actif
         else:
             # Si pas de centre actif, retourner une liste vide
-            print("[DEBUG ACTU] Pas de centre actif - retourne []")
+            logger.debug("actualites: pas de centre actif", extra={"user_id": current_user.id})
             return []
         
-        print(f"[DEBUG ACTU] Query: {query}")
         actualites = await db.actualites.find(query).sort("priorite", -1).to_list(100)
-        print(f"[DEBUG ACTU] Actualités trouvées: {len(actualites)}")
+        logger.debug("actualites: %d trouvées", len(actualites), extra={"user_id": current_user.id, "centre_id": centre_actif})
         
-        # Enrichir avec les informations de l'auteur
+        # Enrichir avec les informations de l'auteur (une seule requête pour tous)
+        await user_loader.load_many(actu.get("auteur_id") for actu in actualites)
         for actu in actualites:
             if '_id' in actu:
                 del actu['_id']
-            auteur = await db.users.find_one({"id": actu.get("auteur_id")})
+            auteur = user_loader.get(actu.get("auteur_id"))
             if auteur:
                 actu['auteur'] = {
                     "id": auteur.get("id"),
@@ -7691,9 +8197,7 @@ async def get_actualites(current_user: User = Depends(get_current_user)):
         
         return actualites
     except Exception as e:
-        print(f"[ERROR ACTU] Exception: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("actualites: erreur")
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @api_router.post("/actualites")
@@ -7897,10 +8401,8 @@ async def get_anniversaires(current_user: User = Depends(get_current_user)):
             user_centres.append(current_user.centre_id)
         centre_actif = user_centres[0] if user_centres else None
     
-    print(f"[DEBUG ANNIV] User: {current_user.email}, Role: {current_user.role}, Centre actif: {centre_actif}")
-    
     if not centre_actif:
-        print("[DEBUG ANNIV] Pas de centre actif - retourne []")
+        logger.debug("anniversaires: pas de centre actif", extra={"user_id": current_user.id})
         return []
     
     # Filtrage strict : employés assignés à ce centre uniquement
@@ -7913,10 +8415,8 @@ async def get_anniversaires(current_user: User = Depends(get_current_user)):
         ]
     }
     
-    print(f"[DEBUG ANNIV] Query: {query}")
-    
     users = await db.users.find(query).to_list(1000)
-    print(f"[DEBUG ANNIV] Employés du centre avec date_naissance: {len(users)}")
+    logger.debug("anniversaires: %d employés avec date de naissance", len(users), extra={"centre_id": centre_actif})
     
     today = datetime.now()
     anniversaires = []
@@ -7942,7 +8442,7 @@ async def get_anniversaires(current_user: User = Depends(get_current_user)):
                     continue
             
             if not dn:
-                print(f"[DEBUG ANNIV] Format non reconnu pour {user.get('prenom')}: '{date_str}'")
+                logger.debug("anniversaires: format de date non reconnu", extra={"user_id": user.get("id")})
                 continue
             
             # Calculer le prochain anniversaire
@@ -7967,11 +8467,10 @@ async def get_anniversaires(current_user: User = Depends(get_current_user)):
                 "age": age
             })
         except Exception as e:
-            print(f"[DEBUG ANNIV] Erreur pour {user.get('prenom')}: {e}")
+            logger.debug("anniversaires: date de naissance invalide", extra={"user_id": user.get("id"), "erreur": str(e)})
             continue
     
     anniversaires.sort(key=lambda x: x["jours_restants"])
-    print(f"[DEBUG ANNIV] Total anniversaires: {len(anniversaires)}")
     return anniversaires[:10]
 
 # --- NOUVEAU BLOC FIREBASE SANS ERREUR DE PERMISSION ---
@@ -8032,6 +8531,8 @@ async def upload_photo(file: UploadFile = File(...), current_user: User = Depend
                 "photo_storage_path": result["storage_path"]
             }}
         )
+        await resource_versions.bump(USERS)
+        principal_cache.invalidate(current_user.id)
         
         # Supprimer l'ancienne photo de Firebase Storage
         if old_photo_storage_path:
@@ -8133,6 +8634,7 @@ app.add_middleware(
     allow_origins=["*"] if cors_allow_all else CORS_ORIGINS_DEFAULT,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Server-Timing", REQUEST_ID_HEADER],
 )
 print(f"🔧 [DEBUG] CORS configuré - Origins: {'*' if cors_allow_all else CORS_ORIGINS_DEFAULT}")
 
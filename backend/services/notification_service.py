@@ -5,6 +5,7 @@ from typing import Optional, Dict, List
 
 from database import db
 from config import ROLES
+from push_devices import tokens_by_user, tokens_for_users
 
 
 async def send_notification_to_user(user_id: str, title: str, body: str, data: Optional[Dict] = None):
@@ -24,41 +25,20 @@ async def send_notification_to_user(user_id: str, title: str, body: str, data: O
 
         # 2. Envoyer notification push si l'utilisateur a un token FCM
         push_sent = False
-        user = await db.users.find_one({"id": user_id}, {"fcm_token": 1, "fcm_devices": 1, "device_info": 1})
 
-        # Récupérer tous les tokens FCM de l'utilisateur
-        fcm_tokens = []
-
-        if user:
-            # Nouveau format: tableau de devices
-            if user.get("fcm_devices"):
-                for device in user["fcm_devices"]:
-                    token = device.get("fcm_token")
-                    if token and not token.startswith("local_"):
-                        fcm_tokens.append(token)
-
-            # Ancien format: un seul token
-            elif user.get("fcm_token") and not user["fcm_token"].startswith("local_"):
-                fcm_tokens.append(user["fcm_token"])
+        # Récupérer tous les tokens FCM de l'utilisateur (collection push_devices)
+        fcm_tokens = await tokens_for_users(db, [user_id])
 
         if fcm_tokens:
             try:
-                from push_notifications import send_push_notification
-
-                # Envoyer à tous les appareils de l'utilisateur
-                for fcm_token in fcm_tokens:
-                    print(f"📱 [PUSH] Tentative d'envoi à token: {fcm_token[:40]}...")
-                    push_result = await send_push_notification(
-                        fcm_token=fcm_token,
-                        title=title,
-                        body=body,
-                        data=data or {}
-                    )
-                    if push_result:
-                        push_sent = True
-                        print(f"✅ [PUSH] Notification envoyée avec succès à {user_id}")
+                from push_notifications import send_push_to_multiple
+
+                # Tous les appareils de l'utilisateur en un seul envoi (non bloquant)
+                sent = await send_push_to_multiple(fcm_tokens, title, body, data or {}, database=db)
+                push_sent = sent > 0
 
                 if push_sent:
+                    print(f"✅ [PUSH] Notification envoyée avec succès à {user_id} ({sent}/{len(fcm_tokens)} appareils)")
                     notification["push_status"] = "sent"
                     notification["push_sent_at"] = datetime.now(timezone.utc)
                 else:
@@ -114,31 +94,56 @@ async def notify_user_request_status(user_id: str, type_request: str, status: st
 
 async def notify_colleagues_about_leave(user_name: str, date_debut: str, date_fin: str, creneau: str, user_id: str):
     """Notifie les collègues d'un congé approuvé"""
-    # Trouver les créneaux de planning pendant les dates de congé
-    planning_slots = await db.planning.find({
+    # Employés qui travaillent pendant les dates de congé (une seule requête distinct)
+    query = {
         "date": {"$gte": date_debut, "$lte": date_fin},
         "employe_id": {"$ne": user_id}
-    }).to_list(1000)
-
-    # Grouper par employé
-    employees_to_notify = set()
-    for slot in planning_slots:
-        employees_to_notify.add(slot["employe_id"])
-
-    # Envoyer les notifications
-    for emp_id in employees_to_notify:
-        creneau_text = "matin" if creneau == "MATIN" else ("après-midi" if creneau == "APRES_MIDI" else "la journée")
-        await send_notification_to_user(
-            emp_id,
-            f"🏖️ Absence d'un collègue",
-            f"{user_name} sera absent(e) du {date_debut} au {date_fin} ({creneau_text})",
-            {"type": "colleague_leave", "user_id": user_id}
-        )
+    }
+    if creneau and creneau != "JOURNEE_COMPLETE":
+        query["creneau"] = creneau
+    employees_to_notify = [e for e in await db.planning.distinct("employe_id", query) if e]
+    if not employees_to_notify:
+        return
+
+    creneau_text = "matin" if creneau == "MATIN" else ("après-midi" if creneau == "APRES_MIDI" else "la journée")
+    title = f"🏖️ Absence d'un collègue"
+    body = f"{user_name} sera absent(e) du {date_debut} au {date_fin} ({creneau_text})"
+    data = {"type": "colleague_leave", "user_id": user_id}
+
+    # Même message pour tous : tokens en une requête, un seul envoi multicast
+    push_status = "no_token"
+    fcm_tokens = await tokens_for_users(db, employees_to_notify)
+    if fcm_tokens:
+        try:
+            from push_notifications import send_push_to_multiple
+
+            sent = await send_push_to_multiple(fcm_tokens, title, body, data, database=db)
+            push_status = "sent" if sent > 0 else "failed"
+            print(f"📱 [PUSH] {sent}/{len(fcm_tokens)} notifications envoyées ({len(employees_to_notify)} collègues)")
+        except Exception as push_error:
+            push_status = "failed"
+            print(f"❌ [PUSH] Erreur notification collègues: {push_error}")
+
+    # Notifications in-app : un seul insert_many
+    now = datetime.now(timezone.utc)
+    await db.notifications.insert_many([
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": emp_id,
+            "title": title,
+            "body": body,
+            "data": data,
+            "sent_at": now,
+            "read": False,
+            "push_status": push_status
+        }
+        for emp_id in employees_to_notify
+    ])
 
 
 async def send_daily_planning_notifications():
     """Envoie les notifications de planning quotidien à tous les employés"""
-    from push_notifications import send_push_notification
+    from push_notifications import send_push_to_multiple
 
     try:
         today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
@@ -156,6 +161,8 @@ async def send_daily_planning_notifications():
             employees_planning[emp_id].append(slot)
 
         notifications_sent = 0
+        # Tokens de tous les employés du jour en une requête
+        tokens_par_employe = await tokens_by_user(db, list(employees_planning))
 
         for emp_id, emp_slots in employees_planning.items():
             user = await db.users.find_one({"id": emp_id, "actif": True})
@@ -165,18 +172,12 @@ async def send_daily_planning_notifications():
             # Construire le message
             message = await build_daily_planning_message(user, emp_slots, today)
 
-            # Envoyer la notification
-            fcm_token = user.get("fcm_token")
-            fcm_devices = user.get("fcm_devices", [])
-
-            if fcm_token:
-                await send_push_notification(fcm_token, "📅 Votre planning du jour", message, {"type": "daily_planning"})
-                notifications_sent += 1
-
-            for device in fcm_devices:
-                if device.get("token"):
-                    await send_push_notification(device["token"], "📅 Votre planning du jour", message, {"type": "daily_planning"})
-                    notifications_sent += 1
+            # Envoyer la notification (tous les appareils en un envoi)
+            fcm_tokens = tokens_par_employe.get(emp_id, [])
+            if fcm_tokens:
+                notifications_sent += await send_push_to_multiple(
+                    fcm_tokens, "📅 Votre planning du jour", message, {"type": "daily_planning"}, database=db
+                )
 
             # Sauvegarder aussi en in-app
             await send_notification_to_user(
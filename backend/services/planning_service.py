@@ -5,6 +5,7 @@ import uuid
 
 from database import db
 from config import ROLES
+from user_loader import UserLoader
 
 
 async def handle_assistant_slots_for_leave(user_id: str, date_debut: str, date_fin: str, creneau: str, approve: bool):
@@ -47,14 +48,17 @@ async def get_planning_for_date(date: str, centre_id: Optional[str] = None) -> L
 
     planning = await db.planning.find(query).to_list(1000)
 
-    # Enrichir avec les informations des employés
+    # Enrichir avec les informations des employés (une seule requête pour tous)
+    users = UserLoader(db)
+    await users.load_many(slot.get("employe_id") for slot in planning)
+
     enriched = []
     for slot in planning:
         if '_id' in slot:
             del slot['_id']
 
         # Ajouter les infos de l'employé
-        user = await db.users.find_one({"id": slot.get("employe_id")})
+        user = users.get(slot.get("employe_id"))
         if user:
             slot["employe_nom"] = f"{user.get('prenom', '')} {user.get('nom', '')}"
             slot["employe_role"] = user.get("role")
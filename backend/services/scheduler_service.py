@@ -1,6 +1,10 @@
 """Service de gestion des tâches planifiées (scheduler)"""
+import time
+import uuid
 from datetime import datetime, timezone
 
+from metrics import metrics
+
 # Scheduler - import lazy pour éviter de ralentir le démarrage
 _scheduler = None
 _AsyncIOScheduler = None
@@ -27,68 +31,130 @@ def get_cron_trigger():
     return _CronTrigger
 
 
-async def send_morning_planning_notifications():
-    """Envoie les notifications de planning à 7h du matin"""
-    from push_notifications import send_push_notification
-    from database import db
+MORNING_JOB_ID = "daily_planning_notification"
+MORNING_TITLE = "📅 Votre planning du jour"
+
+
+def build_morning_message(creneaux, centre_nom: str = "") -> str:
+    """Message de planning du jour d'un employé (matin avant après-midi)"""
+    creneaux_text = []
+    for c in sorted(creneaux, key=lambda c: c.get("creneau") != "MATIN"):
+        salle = c.get("salle_nom") or c.get("salle_id") or "Non assigné"
+        creneau_type = "Matin" if c.get("creneau") == "MATIN" else "Après-midi"
+        creneaux_text.append(f"{creneau_type}: Salle {salle}")
+
+    message = f"Votre planning du jour:\n" + "\n".join(creneaux_text)
+    if centre_nom:
+        message = f"📍 {centre_nom}\n" + message
+    return message
+
+
+async def run_morning_planning_notifications(database) -> dict:
+    """
+    Notifications de planning de 7h pour tous les centres.
+    4 requêtes (planning, users, push_devices, centres), puis un envoi groupé : les messages
+    identiques sont regroupés et envoyés par lots de 500 tokens avec une
+    concurrence bornée (push_notifications.send_push_batch).
+    Les employés inactifs sont écartés par un distinct sur users (actif: True) : la copie
+    push_devices.actif n'est pas tenue à jour par les scripts d'initialisation.
+    Chaque exécution est enregistrée dans la collection job_runs.
+    """
+    from push_devices import tokens_by_user
+    from push_notifications import send_push_batch
+
+    debut = time.perf_counter()
+    started_at = datetime.now(timezone.utc)
+    today = started_at.strftime('%Y-%m-%d')
+    run = {
+        "id": str(uuid.uuid4()),
+        "job": MORNING_JOB_ID,
+        "date": today,
+        "started_at": started_at,
+        "employes": 0,
+        "sans_token": 0,
+        "messages": 0,
+        "tokens": 0,
+        "batches": 0,
+        "success": 0,
+        "failure": 0,
+        "invalid": 0,
+        "pruned": 0,
+        "statut": "ok"
+    }
+    print(f"🔔 [CRON 7h] Envoi des notifications de planning pour {today}")
 
     try:
-        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-        print(f"🔔 [CRON 7h] Envoi des notifications de planning pour {today}")
-
-        # Récupérer tous les créneaux du jour
-        creneaux = await db.planning.find({"date": today, "est_repos": {"$ne": True}}).to_list(1000)
+        # Récupérer tous les créneaux du jour (tous centres)
+        creneaux = await database.planning.find(
+            {"date": today, "est_repos": {"$ne": True}},
+            {"_id": 0, "employe_id": 1, "centre_id": 1, "creneau": 1, "salle_nom": 1, "salle_id": 1}
+        ).to_list(None)
 
         # Grouper par employé
         employees_planning = {}
         for creneau in creneaux:
-            emp_id = creneau.get("employe_id")
-            if emp_id not in employees_planning:
-                employees_planning[emp_id] = []
-            employees_planning[emp_id].append(creneau)
-
-        notifications_sent = 0
-
-        for emp_id, emp_creneaux in employees_planning.items():
-            # Récupérer l'utilisateur
-            user = await db.users.find_one({"id": emp_id, "actif": True})
-            if not user:
-                continue
-
-            # Construire le message
-            creneaux_text = []
-            for c in emp_creneaux:
-                salle = c.get("salle_nom") or c.get("salle_id") or "Non assigné"
-                creneau_type = "Matin" if c.get("creneau") == "MATIN" else "Après-midi"
-                creneaux_text.append(f"{creneau_type}: Salle {salle}")
-
-            # Récupérer le centre
-            centre_id = user.get("centre_id") or (user.get("centre_ids", [None])[0])
-            centre = await db.centres.find_one({"id": centre_id}) if centre_id else None
-            centre_nom = centre.get("nom", "") if centre else ""
-
-            message = f"Votre planning du jour:\n" + "\n".join(creneaux_text)
-            if centre_nom:
-                message = f"📍 {centre_nom}\n" + message
-
-            # Envoyer la notification
-            fcm_token = user.get("fcm_token")
-            fcm_devices = user.get("fcm_devices", [])
-
-            if fcm_token:
-                await send_push_notification(fcm_token, "📅 Votre planning du jour", message, {"type": "daily_planning"})
-                notifications_sent += 1
-
-            for device in fcm_devices:
-                if device.get("token"):
-                    await send_push_notification(device["token"], "📅 Votre planning du jour", message, {"type": "daily_planning"})
-                    notifications_sent += 1
-
-        print(f"✅ [CRON 7h] {notifications_sent} notifications envoyées à {len(employees_planning)} employés")
+            employees_planning.setdefault(creneau.get("employe_id"), []).append(creneau)
+        employees_planning.pop(None, None)
+
+        if employees_planning:
+            # Employés actifs (un distinct), leurs tokens (index user_id de push_devices) et centres des créneaux
+            actifs = set(await database.users.distinct(
+                "id", {"id": {"$in": list(employees_planning)}, "actif": True}
+            ))
+            tokens_par_employe = await tokens_by_user(database, [e for e in employees_planning if e in actifs])
+
+            def centre_de(slots):
+                return next((s["centre_id"] for s in slots if s.get("centre_id")), None)
+
+            centre_ids = list({centre_de(s) for s in employees_planning.values() if centre_de(s)})
+            centres = await database.centres.find(
+                {"id": {"$in": centre_ids}},
+                {"_id": 0, "id": 1, "nom": 1}
+            ).to_list(None) if centre_ids else []
+            centres_map = {c["id"]: c.get("nom", "") for c in centres}
+
+            payloads = []
+            for emp_id, slots in employees_planning.items():
+                run["employes"] += 1
+                tokens = tokens_par_employe.get(emp_id)
+                if not tokens:
+                    run["sans_token"] += 1
+                    continue
+                message = build_morning_message(slots, centres_map.get(centre_de(slots), ""))
+                payloads.append({"tokens": tokens, "title": MORNING_TITLE, "body": message, "data": {"type": "daily_planning"}})
+
+            stats = await send_push_batch(payloads, database=database)
+            stats.pop("retry_tokens", None)
+            run.update(stats)
+        else:
+            print(f"ℹ️ [CRON 7h] Aucun créneau trouvé pour {today}")
 
     except Exception as e:
+        run["statut"] = "erreur"
+        run["erreur"] = str(e)
         print(f"❌ [CRON 7h] Erreur: {e}")
 
+    duree = time.perf_counter() - debut
+    run["duree_ms"] = round(duree * 1000, 1)
+    metrics.observe_job(MORNING_JOB_ID, duree, run["statut"])
+    print(
+        f"✅ [CRON 7h] {run['success']}/{run['tokens']} notifications envoyées à {run['employes']} employés "
+        f"({run['messages']} messages, {run['batches']} lots, {run['failure']} échecs, "
+        f"{run['invalid']} tokens invalides) en {run['duree_ms']} ms"
+    )
+
+    try:
+        await database.job_runs.insert_one(dict(run))
+    except Exception as e:
+        print(f"⚠️ [CRON 7h] Historique non enregistré: {e}")
+    return run
+
+
+async def send_morning_planning_notifications():
+    """Envoie les notifications de planning à 7h du matin"""
+    from database import db
+    return await run_morning_planning_notifications(db)
+
 
 def setup_scheduled_jobs():
     """Configure les jobs planifiés"""
@@ -99,7 +165,7 @@ def setup_scheduled_jobs():
     scheduler.add_job(
         send_morning_planning_notifications,
         CronTrigger(hour=7, minute=0, timezone="Europe/Paris"),
-        id="daily_planning_notification",
+        id=MORNING_JOB_ID,
         replace_existing=True
     )
 
@@ -0,0 +1,164 @@
+"""
+Journalisation structurée hors de la boucle asyncio.
+
+configure_logging() (appelé au chargement de server.py) remplace les handlers
+du logger racine par un QueueHandler : l'appel logger.debug/info ne fait que
+poser l'enregistrement dans une file ; le formatage (JSON) et l'écriture sur
+stdout sont faits par le thread du QueueListener.
+
+- LOG_FORMAT : json (défaut) ou text
+- LOG_LEVEL : niveau par défaut (INFO)
+- LOG_LEVELS : niveaux par module, ex. "server=DEBUG,push_notifications=WARNING,pymongo=WARNING"
+- LOG_DEBUG_SAMPLE : un événement DEBUG sur N est gardé par (logger, message) ;
+  les lignes gardées portent "sampled": N (défaut 1 : tout est gardé)
+
+Chaque ligne JSON porte le request_id de la requête HTTP en cours (contextvar
+posée par le middleware de server.py, en-tête X-Request-ID) et les champs
+passés en extra={...}. Les arguments du message sont formatés dans le thread
+du listener : ne pas passer d'objets modifiés juste après l'appel.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, Optional
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Attributs standard d'un LogRecord : tout le reste vient de extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def new_request_id(header_value: Optional[str] = None) -> str:
+    """Identifiant de requête : celui du client / proxy s'il est raisonnable, sinon un nouveau"""
+    if header_value and len(header_value) <= 64 and header_value.isprintable():
+        return header_value
+    return uuid.uuid4().hex[:16]
+
+
+class RequestIdFilter(logging.Filter):
+    """Copie le request_id de la contextvar dans l'enregistrement (thread appelant)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Garde un enregistrement DEBUG sur `rate` par (logger, gabarit du message)"""
+
+    def __init__(self, rate: int = 1):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._counts: Dict[tuple, int] = {}
+        self._lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate == 1 or record.levelno > logging.DEBUG:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            if len(self._counts) > 10000:
+                self._counts.clear()  # messages déjà formatés (f-strings) : gabarits non bornés
+            n = self._counts.get(key, 0)
+            self._counts[key] = n + 1
+        if n % self.rate:
+            return False
+        record.sampled = self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entree = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entree["request_id"] = record.request_id
+        for cle, valeur in vars(record).items():
+            if cle not in _RECORD_ATTRS and not cle.startswith("_"):
+                entree[cle] = valeur
+        if record.exc_info:
+            entree["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entree, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui laisse le formatage au thread du listener (file en mémoire : pas de copie)"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """"server=DEBUG,pymongo=WARNING" -> {"server": 10, "pymongo": 30} (entrées invalides ignorées)"""
+    niveaux = {}
+    for entree in (spec or "").split(","):
+        nom, _, niveau = entree.partition("=")
+        niveau = logging.getLevelName(niveau.strip().upper())
+        if nom.strip() and isinstance(niveau, int):
+            niveaux[nom.strip()] = niveau
+    return niveaux
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(stream=None, log_format: str = None, level: str = None,
+                      levels: str = None, debug_sample: int = None) -> logging.handlers.QueueListener:
+    """Installe QueueHandler -> QueueListener(stdout) sur le logger racine ; idempotent"""
+    global _listener
+    shutdown_logging()
+    log_format = (log_format or os.environ.get('LOG_FORMAT', 'json')).lower()
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    levels = levels if levels is not None else os.environ.get('LOG_LEVELS', '')
+    debug_sample = debug_sample or int(os.environ.get('LOG_DEBUG_SAMPLE', '1'))
+
+    sortie = logging.StreamHandler(stream or sys.stdout)
+    if log_format == "json":
+        sortie.setFormatter(JsonFormatter())
+    else:
+        sortie.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    file_logs: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(file_logs)
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(DebugSampler(debug_sample))
+
+    # Champs non utilisés par les formats : évite leur calcul à chaque enregistrement
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    racine = logging.getLogger()
+    for ancien in list(racine.handlers):
+        racine.removeHandler(ancien)
+    racine.addHandler(handler)
+    niveau = logging.getLevelName(level.upper())
+    racine.setLevel(niveau if isinstance(niveau, int) else logging.INFO)
+    for nom, niveau in parse_levels(levels).items():
+        logging.getLogger(nom).setLevel(niveau)
+
+    _listener = logging.handlers.QueueListener(file_logs, sortie, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """Vide la file et arrête le thread d'écriture (arrêt du serveur)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
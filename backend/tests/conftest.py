@@ -0,0 +1,340 @@
+"""
+Outils partagés pour les tests unitaires du backend.
+
+Fournit une base MongoDB en mémoire (sous-ensemble de l'API Motor) qui compte
+les requêtes envoyées par collection : elle permet de vérifier le nombre de
+round-trips d'un endpoint sans serveur MongoDB.
+"""
+import copy
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _get_field(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list) and part.isdigit():
+            # Position dans un tableau ("fcm_devices.0")
+            if int(part) >= len(value):
+                return None, False
+            value = value[int(part)]
+            continue
+        if isinstance(value, list):
+            # Chemin dans un tableau de sous-documents ("fcm_devices.fcm_token")
+            value = [v[part] for v in value if isinstance(v, dict) and part in v]
+            if not value:
+                return None, False
+            continue
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _set_field(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _match_value(value, exists, condition):
+    if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+        for op, arg in condition.items():
+            if op == "$in":
+                if isinstance(value, list):
+                    if not any(v in arg for v in value):
+                        return False
+                elif value not in arg:
+                    return False
+            elif op == "$nin":
+                if value in arg:
+                    return False
+            elif op == "$ne":
+                if value == arg:
+                    return False
+            elif op == "$exists":
+                if exists != bool(arg):
+                    return False
+            elif op == "$gte":
+                if value is None or value < arg:
+                    return False
+            elif op == "$lte":
+                if value is None or value > arg:
+                    return False
+            elif op == "$gt":
+                if value is None or value <= arg:
+                    return False
+            elif op == "$lt":
+                if value is None or value >= arg:
+                    return False
+            else:
+                raise NotImplementedError(op)
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        else:
+            value, exists = _get_field(doc, key)
+            if not _match_value(value, exists, condition):
+                return False
+    return True
+
+
+def project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        projete = {}
+        for key in included:
+            # Chemins pointés ("unread.u1") : seul ce sous-champ est retourné
+            value, exists = _get_field(doc, key)
+            if exists:
+                _set_field(projete, key, value)
+        return projete
+    for key, value in projection.items():
+        if not value:
+            doc.pop(key, None)
+    return doc
+
+
+class UpdateResult:
+    def __init__(self, matched_count, modified_count):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+
+
+class DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+def apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for key, value in fields.items():
+            if op == "$set":
+                _set_field(doc, key, value)
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set_field(doc, key, value)
+            elif op == "$inc":
+                _set_field(doc, key, (_get_field(doc, key)[0] or 0) + value)
+            elif op == "$unset":
+                doc.pop(key, None)
+            elif op == "$push":
+                doc.setdefault(key, []).append(value)
+            elif op == "$pull":
+                doc[key] = [v for v in doc.get(key, []) if not (
+                    matches(v, value) if isinstance(value, dict) and isinstance(v, dict) else v == value
+                )]
+            else:
+                raise NotImplementedError(op)
+
+
+def _upsert_doc(query, update):
+    """Document créé par un upsert : égalités de la requête + opérateurs de mise à jour"""
+    doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+    apply_update(doc, update, inserting=True)
+    return doc
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        # Clé unique ou liste [(champ, sens), ...] : tris stables du dernier au premier champ
+        for champ, sens in reversed(key if isinstance(key, list) else [(key, direction)]):
+            self._docs.sort(key=lambda d: (d.get(champ) is None, d.get(champ)), reverse=sens < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    async def to_list(self, length=None):
+        return self._docs if length is None else self._docs[:length]
+
+
+class FakeCollection:
+    def __init__(self, name, counter):
+        self.name = name
+        self.docs = []
+        self.index_specs = {}
+        self._counter = counter
+
+    def _count(self):
+        self._counter[self.name] = self._counter.get(self.name, 0) + 1
+
+    async def create_index(self, keys, **options):
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = options.pop("name", None) or "_".join(f"{k}_{d}" for k, d in keys)
+        self.index_specs[name] = {"key": keys, **options}
+        return name
+
+    async def index_information(self):
+        return {"_id_": {"key": [("_id", 1)]}, **copy.deepcopy(self.index_specs)}
+
+    def find(self, query=None, projection=None):
+        self._count()
+        return FakeCursor([project(d, projection) for d in self.docs if matches(d, query)])
+
+    def aggregate(self, pipeline):
+        """$match et $group (_id: None, accumulateur $addToSet) uniquement"""
+        self._count()
+        docs = list(self.docs)
+        for stage in pipeline:
+            if "$match" in stage:
+                docs = [d for d in docs if matches(d, stage["$match"])]
+            elif "$group" in stage:
+                groupe = {"_id": None}
+                for champ, accumulateur in stage["$group"].items():
+                    if champ == "_id":
+                        continue
+                    chemin = accumulateur["$addToSet"].lstrip("$")
+                    groupe[champ] = list(dict.fromkeys(_get_field(d, chemin)[0] for d in docs))
+                docs = [groupe] if docs else []
+            else:
+                raise NotImplementedError(stage)
+        return FakeCursor(docs)
+
+    async def distinct(self, key, query=None):
+        self._count()
+        values = []
+        for doc in self.docs:
+            if matches(doc, query):
+                value, exists = _get_field(doc, key)
+                for v in (value if isinstance(value, list) else [value]):
+                    if exists and v not in values:
+                        values.append(v)
+        return values
+
+    async def find_one(self, query=None, projection=None):
+        self._count()
+        for doc in self.docs:
+            if matches(doc, query):
+                return project(doc, projection)
+        return None
+
+    async def count_documents(self, query=None):
+        self._count()
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+    async def find_one_and_update(self, query, update, sort=None, projection=None, return_document=False, upsert=False):
+        self._count()
+        candidats = [doc for doc in self.docs if matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            candidats.sort(key=lambda d: (d.get(key) is None, d.get(key)), reverse=direction < 0)
+        if not candidats:
+            if upsert:
+                self.docs.append(_upsert_doc(query, update))
+                return project(self.docs[-1], projection) if return_document else None
+            return None
+        avant = project(candidats[0], projection)
+        apply_update(candidats[0], update)
+        return project(candidats[0], projection) if return_document else avant
+
+    async def insert_one(self, doc):
+        self._count()
+        self.docs.append(dict(doc))
+
+    async def insert_many(self, docs, ordered=True):
+        self._count()
+        self.docs.extend(dict(d) for d in docs)
+
+    async def update_one(self, query, update, upsert=False):
+        self._count()
+        for doc in self.docs:
+            if matches(doc, query):
+                apply_update(doc, update)
+                return UpdateResult(1, 1)
+        if upsert:
+            self.docs.append(_upsert_doc(query, update))
+        return UpdateResult(0, 0)
+
+    async def update_many(self, query, update, upsert=False):
+        self._count()
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        for doc in matched:
+            apply_update(doc, update)
+        return UpdateResult(len(matched), len(matched))
+
+    async def bulk_write(self, requests, ordered=True):
+        """Opérations pymongo UpdateOne (attributs _filter / _doc / _upsert)"""
+        self._count()
+        for request in requests:
+            for doc in self.docs:
+                if matches(doc, request._filter):
+                    apply_update(doc, request._doc)
+                    break
+            else:
+                if getattr(request, "_upsert", False):
+                    self.docs.append(_upsert_doc(request._filter, request._doc))
+
+    async def delete_one(self, query):
+        self._count()
+        for index, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[index]
+                return DeleteResult(1)
+        return DeleteResult(0)
+
+    async def find_one_and_delete(self, query, projection=None):
+        self._count()
+        for index, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[index]
+                return project(doc, projection)
+        return None
+
+    async def delete_many(self, query):
+        self._count()
+        kept = [doc for doc in self.docs if not matches(doc, query)]
+        deleted = len(self.docs) - len(kept)
+        self.docs = kept
+        return DeleteResult(deleted)
+
+
+class CountingDB:
+    """Base en mémoire qui compte les requêtes par collection"""
+
+    def __init__(self):
+        self.queries = {}
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self.queries)
+        return self._collections[name]
+
+    def reset_counts(self):
+        self.queries.clear()
+
+
+@pytest.fixture
+def counting_db():
+    return CountingDB()
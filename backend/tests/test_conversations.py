@@ -0,0 +1,58 @@
+"""
+Tests de la liste matérialisée des conversations (conversations)
+Features tested:
+- Un message = un update_one (upsert) : dernier message et non lus incrémentés par $inc
+- Liste d'un utilisateur en une requête, avec son propre compteur
+- Lecture : compteur remis à zéro, champ lu des messages privés mis à jour seulement s'il y avait des non lus
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import conversations
+
+
+def _message(i, expediteur, destinataire=None, groupe_id=None):
+    return {
+        "id": f"m{i}", "expediteur_id": expediteur, "destinataire_id": destinataire, "groupe_id": groupe_id,
+        "type_message": "GROUPE" if groupe_id else "PRIVE", "contenu": f"Message {i}", "lu": False,
+        "date_envoi": datetime(2025, 3, 1, tzinfo=timezone.utc) + timedelta(minutes=i)
+    }
+
+
+def test_messages_update_counters_and_list(counting_db):
+    async def scenario():
+        await conversations.record_message(counting_db, _message(1, "alice", "bob"))
+        await conversations.record_message(counting_db, _message(2, "alice", "bob"))
+        await conversations.record_message(counting_db, _message(3, "carol", groupe_id="g1"), ["alice", "bob", "carol"], "Équipe")
+        await conversations.record_message(counting_db, _message(4, "bob", "alice"))
+        assert counting_db.queries == {"conversations": 4}
+        counting_db.reset_counts()
+        return await conversations.list_conversations(counting_db, "bob")
+
+    liste = asyncio.run(scenario())
+    assert counting_db.queries == {"conversations": 1}
+    assert [c["id"] for c in liste] == ["prive:alice:bob", "groupe:g1"]
+    prive, groupe = liste
+    assert prive["last_message"]["id"] == "m4" and prive["unread"] == 2
+    assert groupe["unread"] == 1 and groupe["groupe_nom"] == "Équipe"
+    assert asyncio.run(conversations.list_conversations(counting_db, "alice"))[0]["unread"] == 1
+    assert asyncio.run(conversations.list_conversations(counting_db, "carol"))[0]["unread"] == 0
+
+
+def test_mark_read_resets_counter(counting_db):
+    counting_db.messages.docs = [_message(1, "alice", "bob"), _message(2, "alice", "bob")]
+
+    async def scenario():
+        for message in counting_db.messages.docs:
+            await conversations.record_message(counting_db, message)
+        counting_db.reset_counts()
+        premiere = await conversations.mark_read(counting_db, "prive:alice:bob", "bob")
+        seconde = await conversations.mark_read(counting_db, "prive:alice:bob", "bob")
+        intrus = await conversations.mark_read(counting_db, "prive:alice:bob", "mallory")
+        return premiere, seconde, intrus
+
+    assert asyncio.run(scenario()) == (2, 0, None)
+    # Le champ lu n'est mis à jour qu'à la première lecture
+    assert counting_db.queries == {"conversations": 3, "messages": 1}
+    assert all(m["lu"] for m in counting_db.messages.docs)
+    assert counting_db.conversations.docs[0]["unread"] == {"bob": 0}
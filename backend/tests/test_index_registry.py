@@ -0,0 +1,132 @@
+"""
+Tests du registre des index (index_registry)
+Features tested:
+- Les formes de requête demandées sont couvertes par un index déclaré
+- reconcile_indexes crée les index manquants, signale la dérive sans rien supprimer, idempotent
+- Pages de l'historique du chat : chaque branche fixe le préfixe d'un index terminé par (date_envoi, id)
+- explain() sur chaque requête fréquente : aucun COLLSCAN, aucun SORT pour les pages du chat
+  (MongoDB réel via MONGO_TEST_URL)
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from index_registry import HOT_QUERY_SHAPES, INDEXES, index_name, reconcile_indexes
+
+
+def _keys(collection):
+    return [[champ for champ, _ in spec["keys"]] for spec in INDEXES[collection]]
+
+
+def test_registry_covers_hot_collections():
+    assert ["id"] in _keys("users") and ["id"] in _keys("planning") and ["id"] in _keys("centres")
+    assert ["centre_id", "date"] in _keys("planning")
+    assert ["medecin_id", "date_demandee", "statut"] in _keys("demandes_travail")
+    assert ["centre_id", "actif", "priorite"] in _keys("actualites")
+    assert any(keys[0] == "membres" for keys in _keys("groupes_chat"))
+    assert _keys("notes_planning") and _keys("messages")
+    # Noms uniques par collection, chaque requête fréquente vise une collection déclarée
+    for collection, specs in INDEXES.items():
+        assert len({spec["name"] for spec in specs}) == len(specs), collection
+    assert {shape["collection"] for shape in HOT_QUERY_SHAPES} <= set(INDEXES)
+
+
+def test_reconcile_creates_missing_and_reports_drift(counting_db):
+    # Index créé autrefois sans unique, et un index ajouté à la main
+    counting_db.users.index_specs = {
+        "email_1": {"key": [("email", 1)]},
+        "nom_1": {"key": [("nom", 1)]},
+    }
+
+    async def scenario():
+        premier = await reconcile_indexes(counting_db)
+        second = await reconcile_indexes(counting_db)
+        return premier, second
+
+    premier, second = asyncio.run(scenario())
+    total = sum(len(specs) for specs in INDEXES.values())
+    assert len(premier["crees"]) == total - 1
+    assert premier["differents"] == [{"collection": "users", "name": "email_1", "differences": ["unique"]}]
+    assert premier["non_declares"] == [{"collection": "users", "name": "nom_1"}]
+    assert "nom_1" in counting_db.users.index_specs  # rien n'est supprimé
+    assert second["crees"] == [] and second["differents"] == premier["differents"]
+    assert counting_db.planning_changes.index_specs["planning_changes_ttl_at"]["expireAfterSeconds"] > 0
+
+
+def test_reconcile_dry_run_lists_missing(counting_db):
+    rapport = asyncio.run(reconcile_indexes(counting_db, create=False))
+    assert {"collection": "centres", "name": index_name([("id", 1)])} in rapport["manquants"]
+    assert rapport["crees"] == [] and counting_db.centres.index_specs == {}
+
+
+def _egalites(filtre):
+    """Champs fixés par égalité dans un filtre (en traversant les $and)"""
+    champs = set()
+    for cle, valeur in filtre.items():
+        if cle == "$and":
+            for sous_filtre in valeur:
+                champs |= _egalites(sous_filtre)
+        elif not cle.startswith("$") and not (isinstance(valeur, dict) and any(k.startswith("$") for k in valeur)):
+            champs.add(cle)
+    return champs
+
+
+@pytest.mark.parametrize("shape", [s for s in HOT_QUERY_SHAPES if s.get("paginated")],
+                         ids=[s["endpoint"] for s in HOT_QUERY_SHAPES if s.get("paginated")])
+def test_message_pages_sorted_by_index(shape):
+    branches = shape["filter"]["$or"] if "$or" in shape["filter"] else [shape["filter"]]
+    reste = {k: v for k, v in shape["filter"].items() if k != "$or"}
+    for branche in branches:
+        fixes = _egalites(branche) | _egalites(reste)
+        assert any(
+            keys[-2:] == ["date_envoi", "id"] and set(keys[:-2]) <= fixes for keys in _keys("messages")
+        ), f"{shape['endpoint']}: aucun index ne fournit l'ordre pour {sorted(fixes)}"
+
+
+def _stages(plan):
+    """Toutes les étapes d'un plan d'exécution (inputStage, inputStages, queryPlan)"""
+    yield plan.get("stage")
+    for cle in ("inputStage", "queryPlan"):
+        if cle in plan:
+            yield from _stages(plan[cle])
+    for enfant in plan.get("inputStages", []):
+        yield from _stages(enfant)
+
+
+@pytest.fixture(scope="module")
+def mongo_db():
+    """Base MongoDB temporaire avec les index du registre (MONGO_TEST_URL, sinon test ignoré)"""
+    url = os.environ.get("MONGO_TEST_URL")
+    if not url:
+        pytest.skip("MONGO_TEST_URL non défini")
+    pymongo = pytest.importorskip("pymongo")
+    client = pymongo.MongoClient(url, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except Exception as e:
+        pytest.skip(f"MongoDB indisponible: {e}")
+    nom = f"test_index_registry_{uuid.uuid4().hex[:8]}"
+    database = client[nom]
+    for collection, specs in INDEXES.items():
+        database.create_collection(collection)
+        for spec in specs:
+            database[collection].create_index(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"})
+    yield database
+    client.drop_database(nom)
+    client.close()
+
+
+@pytest.mark.parametrize("shape", HOT_QUERY_SHAPES, ids=[s["endpoint"] for s in HOT_QUERY_SHAPES])
+def test_hot_queries_use_an_index(mongo_db, shape):
+    curseur = mongo_db[shape["collection"]].find(shape["filter"])
+    if shape.get("sort"):
+        curseur = curseur.sort(shape["sort"])
+    if shape.get("paginated"):
+        curseur = curseur.limit(51)
+    etapes = set(_stages(curseur.explain()["queryPlanner"]["winningPlan"]))
+    assert "COLLSCAN" not in etapes, f"{shape['endpoint']}: COLLSCAN sur {shape['collection']}"
+    if shape.get("paginated"):
+        # Pagination à coût constant : l'ordre vient de l'index, pas d'un tri en mémoire
+        assert "SORT" not in etapes, f"{shape['endpoint']}: SORT en mémoire sur {shape['collection']}"
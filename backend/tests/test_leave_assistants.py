@@ -0,0 +1,126 @@
+"""
+Tests des traitements d'un congé approuvé (handle_assistant_slots_for_leave, notify_colleagues_about_leave)
+Features tested:
+- Une requête planning sur toute la plage + un seul bulk_write
+- Médecin retiré des créneaux partagés, créneaux orphelins marqués à réassigner
+- Une seule notification groupée pour tous les assistants (un job push_users de l'outbox)
+- Collègues résolus par un seul distinct sur la plage (filtre créneau respecté)
+- services.notification_service : un seul envoi multicast et un insert_many in-app
+- Erreur propagée au worker : le job passe en ECHEC avec derniere_erreur
+"""
+import asyncio
+
+import pytest
+
+server = pytest.importorskip("server")
+import notification_outbox
+
+
+@pytest.fixture
+def leave_db(counting_db, monkeypatch):
+    monkeypatch.setattr(server, "db", counting_db)
+    counting_db.users.docs = [
+        {"id": "med-1", "nom": "Martin", "prenom": "Paul", "role": "Médecin"},
+        {"id": "ast-1", "nom": "A", "prenom": "Un", "role": "Assistant"},
+        {"id": "ast-2", "nom": "B", "prenom": "Deux", "role": "Assistant"},
+    ]
+    slots = []
+    for jour in range(1, 31):
+        date = f"2025-04-{jour:02d}"
+        for creneau in ("MATIN", "APRES_MIDI"):
+            slots.append({"id": f"ast-1-{date}-{creneau}", "date": date, "creneau": creneau, "employe_id": "ast-1",
+                          "employe_role": "Assistant", "medecin_attribue_id": "med-1", "medecin_ids": ["med-1"]})
+            slots.append({"id": f"ast-2-{date}-{creneau}", "date": date, "creneau": creneau, "employe_id": "ast-2",
+                          "employe_role": "Assistant", "medecin_attribue_id": "med-1",
+                          "medecin_ids": ["med-1", "med-2"]})
+    counting_db.planning.docs = slots
+    counting_db.reset_counts()
+    return counting_db
+
+
+def _push_jobs(db):
+    """Destinataires des jobs push_users enregistrés dans l'outbox"""
+    return [job["payload"]["user_ids"] for job in db.outbox.docs if job["kind"] == notification_outbox.PUSH_USERS]
+
+
+def test_thirty_day_leave_batched(leave_db):
+    db = leave_db
+    asyncio.run(server.handle_assistant_slots_for_leave("med-1", "2025-04-01", "2025-04-30", "JOURNEE_COMPLETE", True))
+
+    assert db.queries["planning"] == 2  # 1 find sur la plage + 1 bulk_write
+    assert db.queries["users"] == 1     # médecin
+    assert _push_jobs(db) == [["ast-1", "ast-2"]]
+
+    orphelins = [s for s in db.planning.docs if s["employe_id"] == "ast-1"]
+    assert all(s["est_repos"] and s["medecin_ids"] == [] for s in orphelins)
+    partages = [s for s in db.planning.docs if s["employe_id"] == "ast-2"]
+    assert all(s["medecin_ids"] == ["med-2"] and s["medecin_attribue_id"] == "med-2" for s in partages)
+    print("✅ Congé de 30 jours traité en 3 requêtes + 1 job push")
+
+
+def test_half_day_leave_only_touches_that_creneau(leave_db):
+    db = leave_db
+    asyncio.run(server.handle_assistant_slots_for_leave("med-1", "2025-04-10", "2025-04-10", "MATIN", True))
+
+    modifies = [s for s in db.planning.docs if s.get("notes")]
+    assert {(s["date"], s["creneau"]) for s in modifies} == {("2025-04-10", "MATIN")}
+
+
+def test_colleagues_single_distinct_and_one_push(leave_db):
+    db = leave_db
+    db.users.docs.append({"id": "sec-1", "role": "Secrétaire"})
+    db.planning.docs.append({"id": "sec", "date": "2025-04-20", "creneau": "APRES_MIDI", "employe_id": "sec-1"})
+    db.planning.docs.append({"id": "med", "date": "2025-04-20", "creneau": "MATIN", "employe_id": "med-1"})
+    db.reset_counts()
+
+    asyncio.run(server.notify_colleagues_about_leave("Dr. Paul Martin", "2025-04-01", "2025-04-30", "APRES_MIDI", "med-1"))
+
+    assert db.queries["planning"] == 1  # un seul distinct pour les 30 jours
+    assert sorted(_push_jobs(db)[0]) == ["ast-1", "ast-2", "sec-1"] and len(_push_jobs(db)) == 1
+    print("✅ Collègues résolus en une requête, un seul job push")
+
+
+def test_slot_failure_marks_job_failed(leave_db, monkeypatch):
+    db = leave_db
+
+    async def bulk_write_en_panne(operations, ordered=True):
+        raise RuntimeError("planning indisponible")
+
+    monkeypatch.setattr(db.planning, "bulk_write", bulk_write_en_panne)
+
+    async def scenario():
+        await notification_outbox.enqueue(db, "handle_assistant_slots_for_leave", {
+            "user_id": "med-1", "date_debut": "2025-04-01", "date_fin": "2025-04-02",
+            "creneau": "MATIN", "approve": True
+        })
+        job = await notification_outbox.claim_job(db, "w1")
+        return await notification_outbox.process_jobs(db, [job])
+
+    assert asyncio.run(scenario())["echecs"] == 1
+    job = db.outbox.docs[0]
+    assert job["statut"] == notification_outbox.ECHEC
+    assert "planning indisponible" in job["derniere_erreur"]
+    assert _push_jobs(db) == []
+
+
+def test_service_colleagues_one_push_and_one_insert(leave_db, monkeypatch):
+    notification_service = pytest.importorskip("services.notification_service")
+    import push_notifications
+
+    db = leave_db
+    monkeypatch.setattr(notification_service, "db", db)
+    db.push_devices.docs = [{"user_id": f"ast-{i}", "fcm_token": f"tok-{i}", "actif": True} for i in (1, 2)]
+    envois = []
+
+    async def fake_multicast(tokens, title, body, data=None, database=None):
+        envois.append(sorted(tokens))
+        return len(tokens)
+
+    monkeypatch.setattr(push_notifications, "send_push_to_multiple", fake_multicast)
+
+    asyncio.run(notification_service.notify_colleagues_about_leave("Dr. Paul Martin", "2025-04-01", "2025-04-30",
+                                                                   "JOURNEE_COMPLETE", "med-1"))
+
+    assert envois == [["tok-1", "tok-2"]]
+    assert db.queries["push_devices"] == 1 and db.queries["notifications"] == 1
+    assert {n["user_id"] for n in db.notifications.docs} == {"ast-1", "ast-2"}
@@ -0,0 +1,106 @@
+"""
+Tests du canal temps réel (live_events)
+Features tested:
+- Un événement n'est livré qu'aux abonnés de ses topics
+- Reconnexion : événements manqués rejoués depuis le curseur, resync si le curseur est inconnu ou trop ancien
+- Backpressure : publish ne bloque pas, un abonné trop lent reçoit resync et son flux s'arrête
+- Heartbeat : None quand aucun événement n'arrive
+"""
+import asyncio
+
+import pytest
+
+from live_events import RESYNC, LiveBroker, format_sse, planning_topic, stream_events, user_topic
+
+
+def _drain(subscription):
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait())
+    return events
+
+
+def test_events_routed_by_topic():
+    async def scenario():
+        broker = LiveBroker()
+        planning = broker.subscribe([planning_topic("c1")])
+        alice = broker.subscribe([user_topic("alice"), planning_topic("c2")])
+        broker.publish([planning_topic("c1")], "planning", {"action": "create"})
+        broker.publish([user_topic("alice"), user_topic("bob")], "message", {"_id": "oid", "id": "m1"})
+        broker.publish([planning_topic(None)], "planning", {})
+        return _drain(planning), _drain(alice), broker
+
+    planning, alice, broker = asyncio.run(scenario())
+    assert [e["type"] for e in planning] == ["planning"]
+    assert [e["data"] for e in alice] == [{"id": "m1"}]
+    assert broker.stats()["publies"] == 3 and broker.stats()["livres"] == 2
+
+
+def test_reconnect_replays_missed_events():
+    async def scenario():
+        broker = LiveBroker(buffer_size=3)
+        for i in range(2):
+            broker.publish([user_topic("alice")], "message", {"i": i})
+        curseur = broker.cursor
+        broker.publish([user_topic("bob")], "message", {"i": "bob"})
+        broker.publish([user_topic("alice")], "message", {"i": 2})
+        reprise = _drain(broker.subscribe([user_topic("alice")], curseur))
+        inconnu = _drain(broker.subscribe([user_topic("alice")], "autre-processus-1"))
+        for i in range(3, 6):
+            broker.publish([user_topic("alice")], "message", {"i": i})
+        trop_ancien = _drain(broker.subscribe([user_topic("alice")], curseur))
+        return reprise, inconnu, trop_ancien
+
+    reprise, inconnu, trop_ancien = asyncio.run(scenario())
+    assert [e["data"]["i"] for e in reprise] == [2]
+    assert [e["type"] for e in inconnu] == [RESYNC]
+    assert [e["type"] for e in trop_ancien] == [RESYNC]
+
+
+def test_slow_subscriber_gets_resync_without_blocking_publish():
+    async def scenario():
+        broker = LiveBroker(queue_size=2)
+        lent = broker.subscribe([user_topic("alice")])
+        for i in range(5):
+            broker.publish([user_topic("alice")], "message", {"i": i})
+        recus = [event async for event in stream_events(lent, heartbeat=0.01)]
+        return recus, broker.stats()
+
+    recus, stats = asyncio.run(scenario())
+    assert [e["type"] for e in recus] == ["message", "message", RESYNC]
+    assert stats["debordements"] == 1 and stats["livres"] == 2
+
+
+def test_heartbeat_and_sse_format():
+    async def scenario():
+        broker = LiveBroker()
+        abonnement = broker.subscribe([user_topic("alice")])
+        flux = stream_events(abonnement, heartbeat=0.01)
+        premier = await flux.__anext__()
+        event = broker.publish([user_topic("alice")], "message", {"contenu": "été"})
+        return premier, await flux.__anext__(), event
+
+    premier, second, event = asyncio.run(scenario())
+    assert premier is None and second is event
+    sse = format_sse(event)
+    assert sse.startswith(f"id: {event['id']}\nevent: message\ndata: ") and sse.endswith("\n\n") and "été" in sse
+
+
+def test_topics_limited_to_user_scope(counting_db, monkeypatch):
+    server = pytest.importorskip("server")
+    monkeypatch.setattr(server, "db", counting_db)
+    counting_db.groupes_chat.docs = [{"id": "g1", "actif": True, "membres": ["alice"]},
+                                     {"id": "g2", "actif": True, "membres": ["bob"]}]
+    alice = server.User(id="alice", email="a@x.fr", nom="A", prenom="Alice", role="Assistant",
+                        centre_id="c1", centre_ids=["c1"])
+
+    topics = asyncio.run(server.live_topics_for(alice))
+    assert topics == sorted(["user:alice", "general", "planning:c1", "groupe:g1"])
+    demandes = asyncio.run(server.live_topics_for(alice, "planning:c1,planning:c2,groupe:g2"))
+    assert demandes == ["planning:c1"]
+
+    # Un directeur ne suit pas le planning d'un autre centre, le Super-Admin si
+    directeur = alice.model_copy(update={"id": "dir", "role": "Directeur"})
+    assert asyncio.run(server.live_topics_for(directeur, "planning:c1,planning:c2")) == ["planning:c1"]
+    admin = alice.model_copy(update={"id": "admin", "role": "Super-Admin", "centre_id": None, "centre_ids": []})
+    assert asyncio.run(server.live_topics_for(admin, "planning:c2")) == ["planning:c2"]
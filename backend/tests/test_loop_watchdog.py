@@ -0,0 +1,57 @@
+"""
+Tests du détecteur de blocages de la boucle asyncio (loop_watchdog)
+Features tested:
+- Un appel synchrone dans une coroutine est détecté, avec son emplacement et sa pile
+- Les blocages répétés au même endroit sont agrégés ; await asyncio.sleep ne déclenche rien
+- Garde de non-régression : pbkdf2 (password_hashing) ne bloque pas la boucle
+"""
+import asyncio
+import time
+
+from loop_watchdog import LoopWatchdog
+from metrics import render
+
+
+def appel_bloquant(secondes):
+    time.sleep(secondes)
+
+
+def test_blocking_call_detected_with_location():
+    async def handler():
+        for _ in range(2):
+            appel_bloquant(0.2)
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.2)  # attente non bloquante : ignorée
+
+    async def scenario():
+        async with LoopWatchdog(threshold=0.05).watch() as watchdog:
+            await asyncio.create_task(handler(), name="handler-test")
+        return watchdog
+
+    watchdog = asyncio.run(scenario())
+    offenders = watchdog.offenders()
+    assert len(offenders) == 1, offenders
+    entree = offenders[0]
+    assert entree["location"].startswith("tests/test_loop_watchdog.py:") and entree["location"].endswith("appel_bloquant")
+    assert entree["count"] == 2 and 300 <= entree["total_ms"] < 1000
+    assert entree["last_task"] == "handler-test"
+    assert any("in handler" in cadre for cadre in entree["last_stack"])
+    assert 'event_loop_blocked_total{location="tests/test_loop_watchdog.py:' in render(blocking=offenders)
+
+
+def test_password_hashing_does_not_block_loop():
+    import hashlib
+
+    import password_hashing
+
+    async def scenario():
+        async with LoopWatchdog(threshold=0.05).watch() as watchdog:
+            hashes = await asyncio.gather(*[
+                password_hashing.run_in_hash_pool(hashlib.pbkdf2_hmac, "sha256", f"mdp-{i}".encode(), b"sel", 200000)
+                for i in range(4)
+            ])
+        return watchdog, hashes
+
+    watchdog, hashes = asyncio.run(scenario())
+    assert len(hashes) == 4
+    assert watchdog.offenders() == []
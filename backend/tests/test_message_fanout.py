@@ -0,0 +1,90 @@
+"""
+Tests de la diffusion des messages du chat (message_fanout)
+Features tested:
+- Un message GENERAL = un seul job, sans lecture des utilisateurs au moment de l'envoi
+- Worker : destinataires et tokens résolus en une agrégation, expéditeur et appareils inactifs exclus
+- GROUPE : seuls les membres du groupe reçoivent la notification
+- Nouvel essai limité aux tokens en échec transitoire
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import message_fanout
+import notification_outbox
+import push_transport
+from notification_outbox import OutboxWorker
+
+
+@pytest.fixture
+def fake_push(monkeypatch):
+    transport = push_transport.FakePushTransport()
+    monkeypatch.setattr(push_transport, "_transport", transport)
+    return transport
+
+
+@pytest.fixture
+def fanout_db(counting_db):
+    counting_db.push_devices.docs = [
+        {"user_id": f"u{i}", "fcm_token": f"tok-{i}", "actif": True} for i in range(500)
+    ] + [
+        {"user_id": "u1", "fcm_token": "tok-1-b", "actif": True},
+        {"user_id": "ancien", "fcm_token": "tok-ancien", "actif": False},
+        {"user_id": "u2", "fcm_token": "local_dev", "local": True, "actif": True},
+    ]
+    message_fanout.register_fanout_handler(counting_db)
+    return counting_db
+
+
+def _message(type_message="GENERAL", **extra):
+    return {"id": "m1", "expediteur_id": "u0", "contenu": "Réunion à 14h " * 10, "type_message": type_message, **extra}
+
+
+def test_general_message_single_job_and_aggregation(fanout_db, fake_push):
+    async def scenario():
+        await message_fanout.enqueue_message_fanout(fanout_db, _message(), "Dr. Paul Martin")
+        assert fanout_db.queries == {"outbox": 1}
+        fanout_db.reset_counts()
+        await OutboxWorker(fanout_db).run_once("w1")
+
+    asyncio.run(scenario())
+    assert fanout_db.queries["push_devices"] == 2  # tokens, puis last_used des appareils livrés
+    assert "users" not in fanout_db.queries
+    tokens = [token for token, _ in fake_push.sent]
+    assert len(tokens) == 500 and "tok-0" not in tokens and "tok-1-b" in tokens
+    assert fake_push.appels == 1  # un seul lot multicast de 500 tokens
+    titre, corps = fake_push.sent[0][1]["title"], fake_push.sent[0][1]["body"]
+    assert titre == "📢 Message général de Dr. Paul Martin" and corps.endswith("...")
+    assert fanout_db.outbox.docs[0]["statut"] == notification_outbox.ENVOYE
+
+
+def test_group_message_only_members(fanout_db, fake_push):
+    message = _message("GROUPE", groupe_id="g1")
+
+    async def scenario():
+        await message_fanout.enqueue_message_fanout(fanout_db, message, "Paul", membres=["u0", "u3", "u4"], groupe_nom="Équipe")
+        await OutboxWorker(fanout_db).run_once("w1")
+
+    asyncio.run(scenario())
+    assert sorted(token for token, _ in fake_push.sent) == ["tok-3", "tok-4"]
+    assert fake_push.sent[0][1]["data"]["groupe_id"] == "g1"
+
+
+def test_retry_only_transient_tokens(fanout_db, fake_push):
+    fake_push.failing_tokens = {"tok-7": "UNAVAILABLE"}
+    worker = OutboxWorker(fanout_db)
+
+    async def scenario():
+        await message_fanout.enqueue_message_fanout(fanout_db, _message(), "Paul")
+        await worker.run_once("w1")
+        job = fanout_db.outbox.docs[0]
+        assert job["statut"] == notification_outbox.EN_ATTENTE and job["payload"]["tokens"] == ["tok-7"]
+        fake_push.sent.clear()
+        fake_push.failing_tokens = {}
+        job["prochain_essai"] = datetime.now(timezone.utc)
+        await worker.run_once("w1")
+
+    asyncio.run(scenario())
+    assert [token for token, _ in fake_push.sent] == ["tok-7"]
+    assert fanout_db.outbox.docs[0]["statut"] == notification_outbox.ENVOYE
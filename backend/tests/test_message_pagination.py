@@ -0,0 +1,83 @@
+"""
+Tests de la pagination par curseur du chat (message_pagination)
+Features tested:
+- Parcours complet de l'historique avec before, sans doublon ni message sauté (dates identiques)
+- after : nouveaux messages depuis un curseur
+- Requête $or (messages privés) : le curseur est appliqué à chaque branche
+- Curseur invalide ou before + after refusés
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from message_pagination import decode_cursor, encode_cursor, page_query, paginate_messages
+
+
+@pytest.fixture
+def chat_db(counting_db):
+    debut = datetime(2025, 3, 1, 8, 0)
+    counting_db.messages.docs = [
+        # Deux messages par seconde : l'ordre dépend aussi de l'id
+        {"id": f"m{i:03d}", "type_message": "GENERAL", "contenu": str(i), "date_envoi": debut + timedelta(seconds=i // 2)}
+        for i in range(45)
+    ] + [{"id": "g1", "type_message": "GROUPE", "groupe_id": "g", "date_envoi": debut}]
+    return counting_db
+
+
+def test_before_walks_whole_history(chat_db):
+    async def parcourir():
+        ids, curseur, pages = [], None, 0
+        while True:
+            # groupe_id null : anciens messages sans le champ compris (comme dans MongoDB)
+            page, curseur = await paginate_messages(chat_db, {"type_message": "GENERAL", "groupe_id": None}, 10,
+                                                    before=curseur)
+            ids.extend(m["id"] for m in page)
+            pages += 1
+            if not curseur:
+                return ids, pages
+
+    ids, pages = asyncio.run(parcourir())
+    assert ids == [f"m{i:03d}" for i in reversed(range(45))]
+    assert pages == 5 and chat_db.queries["messages"] == 5
+
+
+def test_after_returns_newer_messages_newest_first(chat_db):
+    curseur = encode_cursor(chat_db.messages.docs[39])
+    page, suivant = asyncio.run(paginate_messages(chat_db, {"type_message": "GENERAL"}, 3, after=curseur))
+    assert [m["id"] for m in page] == ["m042", "m041", "m040"]
+    assert decode_cursor(suivant)[1] == "m042"
+    page, suivant = asyncio.run(paginate_messages(chat_db, {"type_message": "GENERAL"}, 3, after=suivant))
+    assert [m["id"] for m in page] == ["m044", "m043"] and suivant is None
+
+
+def test_or_query_walks_both_directions_of_private_messages(chat_db):
+    debut = datetime(2025, 3, 2, 8, 0)
+    chat_db.messages.docs = [
+        {"id": f"p{i:02d}", "type_message": "PRIVE", "expediteur_id": "u1" if i % 2 else "u2",
+         "destinataire_id": "u2" if i % 2 else "u1", "date_envoi": debut + timedelta(seconds=i // 3)}
+        for i in range(12)
+    ] + [{"id": "autre", "type_message": "PRIVE", "expediteur_id": "u3", "destinataire_id": "u4", "date_envoi": debut}]
+    query = {"$or": [{"expediteur_id": "u1", "type_message": "PRIVE"},
+                     {"destinataire_id": "u1", "type_message": "PRIVE"}]}
+
+    filtre, _ = page_query(query, before=encode_cursor(chat_db.messages.docs[6]))
+    assert len(filtre["$or"]) == 2 and all("$and" in branche for branche in filtre["$or"])
+
+    async def parcourir():
+        ids, curseur = [], None
+        while True:
+            page, curseur = await paginate_messages(chat_db, query, 5, before=curseur)
+            ids.extend(m["id"] for m in page)
+            if not curseur:
+                return ids
+
+    assert asyncio.run(parcourir()) == [f"p{i:02d}" for i in reversed(range(12))]
+
+
+def test_invalid_cursor_rejected(chat_db):
+    with pytest.raises(ValueError):
+        asyncio.run(paginate_messages(chat_db, {}, 10, before="pas-un-curseur"))
+    curseur = encode_cursor(chat_db.messages.docs[0])
+    with pytest.raises(ValueError):
+        asyncio.run(paginate_messages(chat_db, {}, 10, before=curseur, after=curseur))
@@ -0,0 +1,141 @@
+"""
+Tests des métriques Prometheus (metrics)
+Features tested:
+- Format texte : HELP / TYPE une fois par métrique, échantillons d'une famille contigus,
+  histogrammes cumulés, labels échappés
+- Envois push comptés par code d'erreur borné (FCM, HTTP_<statut>, RESEAU), y compris
+  les exceptions du transport
+- Pool MongoDB suivi par PoolMonitor, retard de la boucle asyncio mesuré
+- GET /metrics : texte Prometheus, METRICS_TOKEN
+"""
+import asyncio
+import re
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import push_notifications
+import push_transport
+from metrics import MetricsRegistry, push_error_code, render, sample_loop_lag
+from mongo_monitoring import Histogram, PoolMonitor
+
+# nom{labels} valeur
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]+="([^"\\]|\\.)*",?)*\})? [-+0-9.eInf]+$')
+
+
+def _samples(texte):
+    return [ligne for ligne in texte.splitlines() if not ligne.startswith("#")]
+
+
+def test_render_text_format():
+    registry = MetricsRegistry()
+    for duree in (0.003, 0.02, 0.2):
+        registry.observe_request("GET", "/api/planning/{date}", 200, duree)
+    registry.observe_request("GET", "/api/planning/{date}", 404, 0.001)
+    registry.observe_request("POST", 'route "bizarre"', 500, 1)
+    registry.observe_job("daily_planning_notification", 2.5, "ok")
+    perf = {("planning", "find"): Histogram()}
+    perf[("planning", "find")].observe(3)
+
+    texte = render(registry, pool={"max_size": 100, "connections": 3, "checked_out": 1, "waiting": 0,
+                                   "cleared": 0, "checkout_failures": {}},
+                   perf=perf, outbox={"en_attente": 4, "en_cours": 1, "echecs": 0, "retard_secondes": 1.5},
+                   caches={"principal": {"hits": 9, "misses": 1, "hit_ratio": 0.9},
+                           "users": {"hits": 1, "misses": 1, "hit_ratio": 0.5}},
+                   blocking=[{"location": "server.py:10", "count": 2, "total_ms": 300},
+                             {"location": "auth.py:5", "count": 1, "total_ms": 120}])
+
+    assert all(SAMPLE.match(ligne) for ligne in _samples(texte)), texte
+    assert texte.count("# TYPE http_request_duration_seconds histogram") == 1
+    # Une famille n'apparaît qu'en un seul bloc d'échantillons
+    familles = [re.sub(r"_(bucket|sum|count)$", "", ligne.split("{")[0].split(" ")[0]) for ligne in _samples(texte)]
+    blocs = [f for i, f in enumerate(familles) if i == 0 or familles[i - 1] != f]
+    assert len(blocs) == len(set(blocs)), blocs
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/planning/{date}",le="0.025"} 3' in texte
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/planning/{date}",le="+Inf"} 4' in texte
+    assert 'http_requests_total{method="GET",route="/api/planning/{date}",status="404"} 1' in texte
+    assert 'route="route \\"bizarre\\""' in texte
+    assert 'scheduler_job_runs_total{job="daily_planning_notification",status="ok"} 1' in texte
+    # Commandes MongoDB : millisecondes converties en secondes
+    assert 'mongo_command_duration_seconds_bucket{collection="planning",op="find",le="0.005"} 1' in texte
+    assert 'outbox_jobs{status="en_attente"} 4' in texte and "mongo_pool_checked_out 1" in texte
+    assert 'cache_hit_ratio{cache="principal"} 0.9' in texte
+
+
+def test_push_results_counted_by_error_code(monkeypatch):
+    assert push_error_code("UNREGISTERED") == "UNREGISTERED"
+    assert push_error_code("HTTP 503") == "HTTP_503"
+    assert push_error_code("oauth: connexion refusée") == "RESEAU"
+
+    registry = MetricsRegistry()
+    monkeypatch.setattr(push_notifications, "metrics", registry)
+    monkeypatch.setattr(push_transport, "_transport", push_transport.FakePushTransport(
+        failing_tokens={"t1": "UNREGISTERED", "t2": "UNAVAILABLE"}
+    ))
+    asyncio.run(push_notifications.send_push_batch([{"tokens": ["t0", "t1", "t2", "t3"], "title": "t", "body": "b"}]))
+    assert registry.push == {("succes", ""): 2, ("echec", "UNREGISTERED"): 1, ("echec", "UNAVAILABLE"): 1}
+
+
+def test_single_push_transport_error_counted(monkeypatch):
+    class TransportEnPanne(push_transport.FakePushTransport):
+        async def send(self, tokens, message):
+            raise ConnectionError("FCM injoignable")
+
+    registry = MetricsRegistry()
+    monkeypatch.setattr(push_notifications, "metrics", registry)
+    monkeypatch.setattr(push_transport, "_transport", TransportEnPanne())
+    avant = push_notifications.get_push_counters()
+
+    assert asyncio.run(push_notifications.send_push_notification("t0", "t", "b")) is False
+    apres = push_notifications.get_push_counters()
+    assert apres["envois_echoues"] == avant["envois_echoues"] + 1
+    assert registry.push == {("echec", "RESEAU"): 1}
+
+
+def test_pool_monitor_tracks_checkouts():
+    pool = PoolMonitor()
+    adresse = ("localhost", 27017)
+    pool.pool_created(SimpleNamespace(address=adresse, options={"maxPoolSize": 50}))
+    for _ in range(3):
+        pool.connection_created(SimpleNamespace(address=adresse))
+        pool.connection_check_out_started(SimpleNamespace(address=adresse))
+        pool.connection_checked_out(SimpleNamespace(address=adresse))
+    pool.connection_checked_in(SimpleNamespace(address=adresse))
+    pool.connection_check_out_started(SimpleNamespace(address=adresse))
+    pool.connection_check_out_failed(SimpleNamespace(address=adresse, reason="timeout"))
+
+    assert pool.stats() == {"max_size": 50, "connections": 3, "checked_out": 2, "waiting": 0,
+                            "cleared": 0, "checkout_failures": {"timeout": 1}}
+
+
+def test_loop_lag_detects_blocking_call():
+    registry = MetricsRegistry()
+
+    async def scenario():
+        echantillonneur = asyncio.create_task(sample_loop_lag(registry, interval=0.01))
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)  # appel bloquant dans la boucle
+        await asyncio.sleep(0.03)
+        echantillonneur.cancel()
+
+    asyncio.run(scenario())
+    assert registry.loop_lag.count >= 2
+    assert registry.loop_lag_max >= 0.05
+
+
+def test_metrics_endpoint(monkeypatch, counting_db):
+    server = pytest.importorskip("server")
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(server, "db", counting_db)
+    client = TestClient(server.app)
+    client.get("/api/ping")
+    reponse = client.get("/metrics")
+    assert reponse.status_code == 200 and reponse.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/api/ping",status="200"}' in reponse.text
+    assert all(SAMPLE.match(ligne) for ligne in _samples(reponse.text))
+
+    monkeypatch.setenv("METRICS_TOKEN", "secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
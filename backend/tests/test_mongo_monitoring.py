@@ -0,0 +1,93 @@
+"""
+Tests du suivi des commandes MongoDB (mongo_monitoring)
+Features tested:
+- Chaque commande est attribuée à la requête en cours (contextvar) et à sa route
+- Histogrammes de latence cumulés, documents retournés (find / getMore / findAndModify)
+- Commandes hors requête : route "arriere-plan" ; commandes de service ignorées
+- Avertissement N+1 au-delà du seuil sur une même collection
+- GET /api/admin/perf réservé aux administrateurs
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from mongo_monitoring import (
+    BACKGROUND_ROUTE, CommandMonitor, Histogram, NPlusOneWarning, PerfRegistry,
+    begin_request, check_n_plus_one, end_request, server_timing
+)
+
+
+def _command(monitor, name, command, reply=None, micros=3000, request_id=[0]):
+    request_id[0] += 1
+    event = SimpleNamespace(command_name=name, command=command, connection_id=("localhost", 27017),
+                            request_id=request_id[0], duration_micros=micros, reply=reply or {})
+    monitor.started(event)
+    monitor.succeeded(event)
+
+
+def test_commands_attributed_to_current_request():
+    registry = PerfRegistry()
+    monitor = CommandMonitor(registry)
+
+    async def requete():
+        stats, token = begin_request()
+        _command(monitor, "find", {"find": "planning"}, {"cursor": {"firstBatch": [{}, {}, {}]}})
+        _command(monitor, "getMore", {"getMore": 1, "collection": "planning"}, {"cursor": {"nextBatch": [{}]}})
+        _command(monitor, "findAndModify", {"findAndModify": "users"}, {"value": {"id": "u1"}}, micros=40000)
+        _command(monitor, "hello", {"hello": 1})
+        end_request(stats, token, "GET /api/planning/semaine/{date_debut}", 55.0, registry=registry)
+        return stats
+
+    stats = asyncio.run(requete())
+    _command(monitor, "update", {"update": "outbox"})
+
+    assert stats.commands == 3 and stats.par_collection == {"planning": 2, "users": 1}
+    assert server_timing(stats) == 'mongo;dur=46.0;desc="3 commande(s)"'
+    snapshot = registry.snapshot()
+    route = snapshot["routes"]["GET /api/planning/semaine/{date_debut}"]
+    assert route["requests"] == 1 and route["commands"] == 3 and route["docs"] == 5
+    assert route["mongo_ms"]["buckets"]["50"] == 1
+    assert snapshot["commands"]["planning.find"]["docs"] == 3
+    assert snapshot["commands"]["users.findAndModify"]["latency_ms"]["buckets"]["25"] == 0
+    assert snapshot["routes"][BACKGROUND_ROUTE]["commands"] == 1
+    assert "admin.hello" not in snapshot["commands"] and "(base).hello" not in snapshot["commands"]
+
+
+def test_histogram_cumulative_buckets():
+    histogramme = Histogram(buckets=(1, 10, 100))
+    for valeur in (0.5, 5, 7, 50, 5000):
+        histogramme.observe(valeur)
+    assert histogramme.cumulative() == [("1", 1), ("10", 3), ("100", 4), ("+Inf", 5)]
+    assert histogramme.quantile(0.5) == 10.0 and histogramme.quantile(1) == float("inf")
+    assert histogramme.to_dict()["sum_ms"] == 5062.5
+
+
+def test_n_plus_one_warning():
+    registry = PerfRegistry()
+    stats, token = begin_request()
+    for _ in range(4):
+        stats.add("users", "find", 1.0, 1)
+    stats.add("planning", "find", 1.0, 10)
+    end_request(stats, token, "GET /api/conges", 5.0, registry=registry)
+
+    with pytest.warns(NPlusOneWarning, match="4 commandes sur users"):
+        assert check_n_plus_one("GET /api/conges", stats, threshold=3, registry=registry) == ["users"]
+    assert check_n_plus_one("GET /api/conges", stats, threshold=4, registry=registry) == []
+    assert registry.snapshot()["n_plus_one"] == 1
+
+
+def test_admin_perf_requires_admin(monkeypatch):
+    server = pytest.importorskip("server")
+    from fastapi.testclient import TestClient
+
+    principal = server.TokenPrincipal(id="m1", role=server.ROLES["MEDECIN"], centre_actif_id="centre-1")
+    server.app.dependency_overrides[server.get_token_principal] = lambda: principal
+    try:
+        client = TestClient(server.app)
+        assert client.get("/api/admin/perf").status_code == 403
+        principal.role = server.ROLES["DIRECTEUR"]
+        reponse = client.get("/api/admin/perf")
+        assert reponse.status_code == 200 and "routes" in reponse.json()
+    finally:
+        server.app.dependency_overrides.clear()
@@ -0,0 +1,122 @@
+"""
+Tests de l'outbox des notifications (notification_outbox)
+Features tested:
+- Un message à un groupe de 40 membres = un seul job, une requête push_devices, un envoi groupé
+- Erreur transitoire : nouvel essai différé (backoff), ECHEC après le nombre maximal de tentatives
+- Tâche interrompue par une coupure MongoDB (AutoReconnect) : réessayée avec backoff
+- Tâches enregistrées (register_handler) et job abandonné par un worker arrêté
+- Profondeur de la file et retard
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import notification_outbox
+import push_transport
+from notification_outbox import OutboxWorker, enqueue, enqueue_push, outbox_stats
+
+
+@pytest.fixture
+def fake_push(monkeypatch):
+    transport = push_transport.FakePushTransport()
+    monkeypatch.setattr(push_transport, "_transport", transport)
+    return transport
+
+
+@pytest.fixture
+def outbox_db(counting_db):
+    counting_db.push_devices.docs = [{"user_id": f"u{i}", "fcm_token": f"tok-{i}", "actif": True} for i in range(40)]
+    return counting_db
+
+
+def test_group_message_is_one_job_and_one_batch(outbox_db, fake_push):
+    async def scenario():
+        await enqueue_push(outbox_db, [f"u{i}" for i in range(40)] + ["u0"], "💬 Groupe", "Bonjour", {"type": "new_message"})
+        outbox_db.reset_counts()
+        return await OutboxWorker(outbox_db).run_once("w1")
+
+    assert asyncio.run(scenario()) == 1
+    # Lecture des tokens + rafraîchissement de last_used, sans document utilisateur
+    assert outbox_db.queries["push_devices"] == 2 and "users" not in outbox_db.queries
+    assert len(fake_push.sent) == 40
+    job = outbox_db.outbox.docs[0]
+    assert job["statut"] == notification_outbox.ENVOYE and job["tentatives"] == 1
+
+
+def test_transient_failure_backs_off_then_fails(outbox_db, fake_push, monkeypatch):
+    monkeypatch.setattr(notification_outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    fake_push.failing_tokens = {"tok-1": "UNAVAILABLE"}
+    worker = OutboxWorker(outbox_db)
+
+    async def scenario():
+        await enqueue_push(outbox_db, ["u1"], "t", "b")
+        await worker.run_once("w1")
+        job = dict(outbox_db.outbox.docs[0])
+        # Rien à faire avant l'échéance du backoff
+        assert await worker.run_once("w1") == 0
+        outbox_db.outbox.docs[0]["prochain_essai"] = datetime.now(timezone.utc)
+        await worker.run_once("w1")
+        return job
+
+    premier_essai = asyncio.run(scenario())
+    assert premier_essai["statut"] == notification_outbox.EN_ATTENTE
+    assert premier_essai["prochain_essai"] > datetime.now(timezone.utc)
+    assert outbox_db.outbox.docs[0]["statut"] == notification_outbox.ECHEC
+    assert worker.compteurs == {"envoyes": 0, "reessais": 1, "echecs": 1}
+
+
+def test_task_retried_on_mongo_outage(outbox_db):
+    errors = pytest.importorskip("pymongo.errors")
+
+    async def tache_en_panne():
+        raise errors.AutoReconnect("primaire injoignable")
+
+    notification_outbox.register_handler("test_mongo_coupe", tache_en_panne)
+
+    async def scenario():
+        await enqueue(outbox_db, "test_mongo_coupe", {})
+        return await OutboxWorker(outbox_db).run_once("w1")
+
+    assert asyncio.run(scenario()) == 1
+    job = outbox_db.outbox.docs[0]
+    assert job["statut"] == notification_outbox.EN_ATTENTE
+    assert job["prochain_essai"] > datetime.now(timezone.utc)
+    assert job["derniere_erreur"].startswith("AutoReconnect")
+
+
+def test_registered_task_and_stale_claim(outbox_db, fake_push):
+    appels = []
+
+    async def tache(user_id, approve):
+        appels.append((user_id, approve))
+
+    notification_outbox.register_handler("test_tache", tache)
+
+    async def scenario():
+        await enqueue(outbox_db, "test_tache", {"user_id": "u1", "approve": True})
+        await enqueue(outbox_db, "type_inconnu", {})
+        # Job réservé par un worker arrêté il y a longtemps
+        await enqueue(outbox_db, "test_tache", {"user_id": "u2", "approve": False})
+        outbox_db.outbox.docs[2].update({
+            "statut": notification_outbox.EN_COURS,
+            "claimed_at": datetime.now(timezone.utc) - timedelta(hours=1)
+        })
+        await OutboxWorker(outbox_db).run_once("w1")
+
+    asyncio.run(scenario())
+    assert sorted(appels) == [("u1", True), ("u2", False)]
+    statuts = [job["statut"] for job in outbox_db.outbox.docs]
+    assert statuts == [notification_outbox.ENVOYE, notification_outbox.ECHEC, notification_outbox.ENVOYE]
+
+
+def test_stats_report_depth_and_lag(outbox_db):
+    async def scenario():
+        await enqueue_push(outbox_db, ["u1"], "t", "b")
+        await enqueue_push(outbox_db, ["u2"], "t", "b")
+        outbox_db.outbox.docs[0]["prochain_essai"] = datetime.now(timezone.utc) - timedelta(seconds=30)
+        return await outbox_stats(outbox_db)
+
+    stats = asyncio.run(scenario())
+    assert stats["profondeur"] == 2 and stats["echecs"] == 0
+    assert 29 <= stats["retard_secondes"] < 60
@@ -0,0 +1,66 @@
+"""
+Tests du hachage de mots de passe hors boucle (password_hashing)
+Features tested:
+- verify/hash exécutés dans le pool de threads dédié
+- La boucle d'événements reste réactive pendant des hachages lents
+"""
+import asyncio
+import threading
+import time
+
+import password_hashing
+
+
+class SlowContext:
+    """Simule passlib : chaque opération bloque le thread appelant"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.threads = set()
+
+    def hash(self, password):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        return f"hash:{password}"
+
+    def verify(self, password, hashed):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        return hashed == f"hash:{password}"
+
+
+def test_runs_in_dedicated_pool():
+    context = SlowContext(delay=0)
+
+    async def scenario():
+        hashed = await password_hashing.hash_password_async(context, "azerty")
+        assert await password_hashing.verify_password_async(context, "azerty", hashed)
+        assert not await password_hashing.verify_password_async(context, "autre", hashed)
+        assert not await password_hashing.verify_password_async(context, "azerty", None)
+
+    asyncio.run(scenario())
+    assert all(name.startswith("password-hash") for name in context.threads)
+    print("✅ Hachage exécuté dans le pool password-hash")
+
+
+def test_event_loop_not_blocked():
+    context = SlowContext(delay=0.05)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        await asyncio.gather(*[password_hashing.hash_password_async(context, str(i)) for i in range(8)])
+        task.cancel()
+        return ticks
+
+    ticks = asyncio.run(scenario())
+    # 8 hachages de 50 ms : la boucle doit avoir continué à tourner pendant ce temps
+    assert ticks >= 10, f"Boucle bloquée pendant le hachage ({ticks} ticks)"
+    print(f"✅ Boucle réactive pendant le hachage ({ticks} ticks)")
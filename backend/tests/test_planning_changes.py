@@ -0,0 +1,133 @@
+"""
+Tests du journal des modifications du planning (planning_changes)
+Features tested:
+- seq monotone par centre, un lot = une réservation de numéros et un insert_many
+- get_changes retourne l'état actuel des créneaux modifiés et les suppressions
+- reset quand le journal a expiré (TTL) ou que le curseur est inconnu
+- Lecture arrêtée au premier trou de seq (écriture concurrente en cours), trou ancien sauté
+- Un créneau changé de centre est supprimé du journal de l'ancien centre
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from planning_changes import (
+    DELETE, PLANNING_CHANGES_GAP_GRACE_S, PLANNING_CHANGES_GAP_RETRY_MS, UPSERT,
+    get_changes, record_changes, record_slot_update
+)
+
+
+def _slot(slot_id, centre_id="c1", date="2026-03-02"):
+    return {"id": slot_id, "centre_id": centre_id, "date": date, "creneau": "MATIN"}
+
+
+def test_seq_monotonic_per_centre(counting_db):
+    async def scenario():
+        premiers = await record_changes(counting_db, [_slot("a"), _slot("b"), _slot("x", "c2")], UPSERT)
+        counting_db.reset_counts()
+        seconds = await record_changes(counting_db, [_slot("a")], DELETE)
+        return premiers, seconds
+
+    premiers, seconds = asyncio.run(scenario())
+    assert premiers == {"c1": 2, "c2": 1} and seconds == {"c1": 3}
+    assert counting_db.queries == {"counters": 1, "planning_changes": 1}
+    seqs = [(e["centre_id"], e["seq"]) for e in counting_db.planning_changes.docs]
+    assert seqs == [("c1", 1), ("c1", 2), ("c2", 1), ("c1", 3)]
+
+
+def test_get_changes_returns_current_state_and_deletions(counting_db):
+    counting_db.planning.docs = [_slot("a"), {**_slot("b"), "notes": "modifié"}]
+
+    async def scenario():
+        await record_changes(counting_db, [_slot("a"), _slot("b"), _slot("c")], UPSERT)
+        await record_changes(counting_db, [_slot("c")], DELETE)
+        await record_changes(counting_db, [_slot("b")], UPSERT)
+        tout = await get_changes(counting_db, "c1", 0)
+        page = await get_changes(counting_db, "c1", 0, limit=2)
+        suite = await get_changes(counting_db, "c1", 4)
+        a_jour = await get_changes(counting_db, "c1", 5)
+        return tout, page, suite, a_jour
+
+    tout, page, suite, a_jour = asyncio.run(scenario())
+    assert tout["seq"] == 5 and not tout["reset"] and not tout["has_more"]
+    assert sorted(c["id"] for c in tout["creneaux"]) == ["a", "b"] and tout["supprimes"] == ["c"]
+    assert page["seq"] == 2 and page["has_more"]
+    assert [c.get("notes") for c in suite["creneaux"]] == ["modifié"]
+    assert a_jour == {"centre_id": "c1", "since": 5, "seq": 5, "reset": False,
+                      "has_more": False, "retry_after_ms": None, "creneaux": [], "supprimes": []}
+
+
+def test_stops_at_first_gap_until_filled(counting_db):
+    counting_db.planning.docs = [_slot("a"), _slot("b"), _slot("c")]
+
+    async def scenario():
+        await record_changes(counting_db, [_slot("a"), _slot("b"), _slot("c")], UPSERT)
+        # Écrivain de seq 2 entre la réservation et l'insert_many ; seq 3 déjà publié
+        manquante = next(e for e in counting_db.planning_changes.docs if e["seq"] == 2)
+        counting_db.planning_changes.docs.remove(manquante)
+        avant = await get_changes(counting_db, "c1", 0)
+        bloque = await get_changes(counting_db, "c1", 1)
+        counting_db.planning_changes.docs.append(manquante)
+        apres = await get_changes(counting_db, "c1", avant["seq"])
+        return avant, bloque, apres
+
+    avant, bloque, apres = asyncio.run(scenario())
+    assert avant["seq"] == 1 and [c["id"] for c in avant["creneaux"]] == ["a"]
+    assert avant["has_more"] and avant["retry_after_ms"] == PLANNING_CHANGES_GAP_RETRY_MS
+    assert not bloque["reset"] and bloque["seq"] == 1 and bloque["creneaux"] == [] and bloque["has_more"]
+    assert apres["seq"] == 3 and sorted(c["id"] for c in apres["creneaux"]) == ["b", "c"]
+    assert not apres["has_more"] and apres["retry_after_ms"] is None
+
+
+def test_skips_gap_older_than_grace(counting_db):
+    counting_db.planning.docs = [_slot("a"), _slot("c")]
+
+    async def scenario():
+        await record_changes(counting_db, [_slot("a"), _slot("b"), _slot("c")], UPSERT)
+        # Réservation abandonnée (écrivain interrompu) : seq 2 ne sera jamais inséré
+        ancien = datetime.now(timezone.utc) - timedelta(seconds=PLANNING_CHANGES_GAP_GRACE_S + 1)
+        counting_db.planning_changes.docs = [
+            {**e, "at": ancien.replace(tzinfo=None)} for e in counting_db.planning_changes.docs if e["seq"] != 2
+        ]
+        return await get_changes(counting_db, "c1", 0)
+
+    resultat = asyncio.run(scenario())
+    assert resultat["seq"] == 3 and not resultat["has_more"] and resultat["retry_after_ms"] is None
+    assert sorted(c["id"] for c in resultat["creneaux"]) == ["a", "c"]
+
+
+def test_reset_when_log_expired_or_cursor_unknown(counting_db):
+    async def scenario():
+        await record_changes(counting_db, [_slot("a"), _slot("b"), _slot("c")], UPSERT)
+        # Entrées 1 et 2 supprimées par l'index TTL
+        counting_db.planning_changes.docs = [e for e in counting_db.planning_changes.docs if e["seq"] == 3]
+        return (await get_changes(counting_db, "c1", 0), await get_changes(counting_db, "c1", 2),
+                await get_changes(counting_db, "c1", 9))
+
+    expire, contigu, inconnu = asyncio.run(scenario())
+    assert expire["reset"] and expire["seq"] == 3
+    assert not contigu["reset"] and contigu["seq"] == 3
+    assert inconnu["reset"] and inconnu["seq"] == 3
+
+
+def test_slot_moved_to_other_centre(counting_db):
+    async def scenario():
+        await record_slot_update(counting_db, _slot("a", "c1"), "c2", "2026-03-03")
+        return [(e["centre_id"], e["action"]) for e in counting_db.planning_changes.docs]
+
+    assert asyncio.run(scenario()) == [("c1", DELETE), ("c2", UPSERT)]
+
+
+def test_delete_endpoint_records_change(counting_db, monkeypatch):
+    server = pytest.importorskip("server")
+    monkeypatch.setattr(server, "db", counting_db)
+    counting_db.planning.docs = [_slot("a")]
+    directeur = server.TokenPrincipal(id="d1", role="Directeur")
+
+    async def scenario():
+        await server.delete_creneau_planning("a", current_user=directeur)
+        return await get_changes(counting_db, "c1", 0)
+
+    changements = asyncio.run(scenario())
+    assert changements["supprimes"] == ["a"] and changements["seq"] == 1
@@ -0,0 +1,224 @@
+"""
+Tests du contrôle atomique des conflits de planning (planning_conflicts)
+Features tested:
+- Création des index uniques partiels au démarrage
+- Insertion directe : DuplicateKeyError traduite en conflit employé/salle
+- Plus de find_one préalable quand les index sont actifs
+- Créneaux legacy sans centre : vérification par requête conservée
+- Index absents au démarrage : échec signalé, puis revérification paresseuse à l'écriture
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("pymongo")
+from pymongo.errors import DuplicateKeyError
+
+import planning_conflicts
+from conftest import matches
+from planning_conflicts import CONFLIT_EMPLOYE, CONFLIT_SALLE, insert_planning_slot
+
+
+def _install_unique_planning(db):
+    """Ajoute à la collection planning en mémoire le support des index uniques partiels"""
+    planning = db.planning
+    planning.indexes = []
+
+    async def create_index(keys, name=None, unique=False, partialFilterExpression=None):
+        planning.indexes.append((name, [k for k, _ in keys], partialFilterExpression))
+        planning.index_specs[name] = {"key": list(keys), "unique": unique}
+
+    def _partial_ok(doc, partial):
+        for field, condition in partial.items():
+            value = doc.get(field)
+            if "$type" in condition and not isinstance(value, str):
+                return False
+            if "$gt" in condition and not (isinstance(value, str) and value > condition["$gt"]):
+                return False
+        return True
+
+    async def insert_one(doc):
+        planning._count()
+        for name, fields, partial in planning.indexes:
+            if not _partial_ok(doc, partial):
+                continue
+            key = {f: doc.get(f) for f in fields}
+            if any(matches(d, key) and _partial_ok(d, partial) for d in planning.docs):
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error index: {name}",
+                    11000,
+                    {"keyPattern": {f: 1 for f in fields}},
+                )
+        planning.docs.append(dict(doc))
+
+    planning.create_index = create_index
+    planning.insert_one = insert_one
+
+
+@pytest.fixture
+def planning_db(counting_db, monkeypatch):
+    monkeypatch.setattr(planning_conflicts, "_indexes_ready", False)
+    _install_unique_planning(counting_db)
+    assert asyncio.run(planning_conflicts.ensure_planning_unique_indexes(counting_db))
+    counting_db.reset_counts()
+    return counting_db
+
+
+def _slot(**overrides):
+    slot = {"id": "s", "centre_id": "centre-1", "date": "2025-01-06", "creneau": "MATIN",
+            "employe_id": "emp-1", "salle_attribuee": "Salle 1"}
+    slot.update(overrides)
+    return slot
+
+
+def test_indexes_created(planning_db):
+    names = [name for name, _, _ in planning_db.planning.indexes]
+    assert names == ["uniq_planning_employe_creneau", "uniq_planning_salle_creneau"]
+
+
+def test_conflicts_mapped_without_precheck(planning_db):
+    async def scenario():
+        assert await insert_planning_slot(planning_db, _slot(id="a")) is None
+        assert await insert_planning_slot(planning_db, _slot(id="b", salle_attribuee="Salle 2")) == CONFLIT_EMPLOYE
+        assert await insert_planning_slot(planning_db, _slot(id="c", employe_id="emp-2")) == CONFLIT_SALLE
+        # Autre centre : pas de conflit
+        assert await insert_planning_slot(planning_db, _slot(id="d", centre_id="centre-2")) is None
+
+    asyncio.run(scenario())
+    # Une seule requête par insertion, aucune lecture préalable
+    assert planning_db.queries["planning"] == 4
+    assert [d["id"] for d in planning_db.planning.docs] == ["a", "d"]
+    print("✅ Conflits détectés par l'index unique, sans find_one")
+
+
+def test_slots_without_room_never_conflict_on_room(planning_db):
+    async def scenario():
+        assert await insert_planning_slot(planning_db, _slot(id="a", salle_attribuee=None)) is None
+        assert await insert_planning_slot(planning_db, _slot(id="b", employe_id="emp-2", salle_attribuee="")) is None
+
+    asyncio.run(scenario())
+
+
+def test_legacy_slot_without_centre_uses_query(planning_db):
+    planning_db.planning.docs.append(_slot(id="legacy", centre_id=None))
+
+    conflit = asyncio.run(insert_planning_slot(planning_db, _slot(id="new", centre_id=None, salle_attribuee=None)))
+    assert conflit == CONFLIT_EMPLOYE
+    assert planning_db.queries["planning"] == 1  # find_one uniquement, pas d'insertion
+    print("✅ Créneaux legacy : vérification par requête conservée")
+
+
+def test_startup_failure_then_lazy_check(counting_db, monkeypatch):
+    monkeypatch.setattr(planning_conflicts, "_indexes_ready", False)
+    monkeypatch.setattr(planning_conflicts, "_next_check", 0.0)
+    _install_unique_planning(counting_db)
+    creer = counting_db.planning.create_index
+
+    async def doublons(*args, **kwargs):
+        raise DuplicateKeyError("E11000 duplicate key error", 11000)
+
+    # Doublons historiques : l'échec remonte (journal du démarrage), find_one conservé
+    counting_db.planning.create_index = doublons
+    with pytest.raises(RuntimeError):
+        asyncio.run(planning_conflicts.ensure_planning_unique_indexes(counting_db))
+    assert not planning_conflicts.indexes_ready()
+
+    async def scenario():
+        # Index toujours impossibles : une seule tentative par PLANNING_INDEX_RETRY_SECONDS
+        assert await insert_planning_slot(counting_db, _slot(id="a")) is None
+        counting_db.reset_counts()
+        assert await insert_planning_slot(counting_db, _slot(id="b", employe_id="emp-2", salle_attribuee="")) is None
+        assert counting_db.queries["planning"] == 2  # find_one + insertion
+        assert not planning_conflicts.indexes_ready()
+        # Doublons nettoyés, index créés hors du processus : constatés à la revérification suivante
+        counting_db.planning.create_index = creer
+        for spec in planning_conflicts.PLANNING_UNIQUE_INDEXES:
+            await creer(spec["keys"], name=spec["name"], unique=True,
+                        partialFilterExpression=spec["partialFilterExpression"])
+        planning_conflicts._next_check = 0.0
+        counting_db.reset_counts()
+        assert await insert_planning_slot(counting_db, _slot(id="c", employe_id="emp-3", salle_attribuee="")) is None
+        assert counting_db.queries["planning"] == 1  # insertion directe
+        assert planning_conflicts.indexes_ready()
+
+    asyncio.run(scenario())
+
+
+def test_occupancy_in_memory(planning_db):
+    from planning_conflicts import PlanningOccupancy
+
+    planning_db.planning.docs = [
+        _slot(id="a"),
+        _slot(id="b", date="2025-03-01", employe_id="emp-9", salle_attribuee=None),
+    ]
+    occupancy = asyncio.run(PlanningOccupancy.load(planning_db, ["2025-01-06", "2025-01-10"]))
+    assert planning_db.queries["planning"] == 1
+
+    assert occupancy.conflict(_slot(id="c")) == CONFLIT_EMPLOYE
+    assert occupancy.conflict(_slot(id="c", employe_id="emp-2")) == CONFLIT_SALLE
+    assert occupancy.conflict(_slot(id="c", centre_id="centre-2")) is None
+    # Hors de la plage chargée
+    assert occupancy.conflict(_slot(id="c", date="2025-03-01", employe_id="emp-9")) is None
+
+    nouveau = _slot(id="d", employe_id="emp-3", salle_attribuee="Salle 3")
+    assert occupancy.conflict(nouveau) is None
+    occupancy.reserve(nouveau)
+    assert occupancy.conflict(_slot(id="e", employe_id="emp-3", salle_attribuee=None)) == CONFLIT_EMPLOYE
+    print("✅ Occupation chargée en une requête, conflits détectés en mémoire")
+
+
+@pytest.fixture
+def bulk_api(planning_db, monkeypatch):
+    server = pytest.importorskip("server")
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(server, "db", planning_db)
+    planning_db.users.docs = [
+        {"id": f"emp-{i}", "email": f"emp{i}@cabinet.fr", "nom": f"Nom{i}", "prenom": "P",
+         "role": "Assistant", "centre_id": "centre-1"}
+        for i in range(10)
+    ]
+    planning_db.planning.docs = [_slot(id="existant", employe_id="emp-0", salle_attribuee="Salle 1")]
+    # require_role relit l'appelant en base (load_current_user) : il doit exister dans users
+    directeur = {"id": "directeur-1", "email": "directeur@cabinet.fr", "nom": "Test", "prenom": "Directeur",
+                 "role": server.ROLES["DIRECTEUR"], "centre_actif_id": "centre-1", "actif": True}
+    planning_db.users.docs.append(directeur)
+    server.principal_cache.invalidate(directeur["id"])
+    server.app.dependency_overrides[server.get_token_principal] = lambda: server.TokenPrincipal(
+        id=directeur["id"], role=directeur["role"], centre_actif_id=directeur["centre_actif_id"]
+    )
+    planning_db.reset_counts()
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+    server.principal_cache.invalidate(directeur["id"])
+
+
+def test_bulk_endpoint(bulk_api, planning_db):
+    semaine = ["2025-01-06", "2025-01-07", "2025-01-08", "2025-01-09", "2025-01-10"]
+    items = [
+        {"employe_id": f"emp-{i}", "date": date, "creneau": "JOURNEE_COMPLETE"}
+        for i in range(1, 10) for date in semaine
+    ]
+    items += [
+        {"employe_id": "emp-0", "date": "2025-01-06", "creneau": "MATIN"},                              # déjà en base
+        {"employe_id": "emp-0", "date": "2025-01-06", "creneau": "APRES_MIDI", "salle_attribuee": "S2"},
+        {"employe_id": "emp-0", "date": "2025-01-07", "creneau": "JOURNEE_COMPLETE"},
+        {"employe_id": "emp-1", "date": "2025-01-07", "creneau": "APRES_MIDI"},                         # doublon de la requête
+        {"employe_id": "inconnu", "date": "2025-01-06", "creneau": "MATIN"},
+    ]
+
+    response = bulk_api.post("/api/planning/bulk", json=items)
+    assert response.status_code == 200, response.text
+    data = response.json()
+
+    assert [r["index"] for r in data["results"]] == list(range(len(items)))
+    assert data["created"] == 9 * 5 + 2
+    assert data["conflicts"] == 2
+    assert data["errors"] == 1
+    assert data["results"][-2]["detail"] == "L'employé a déjà un créneau programmé le apres_midi"
+    assert len(planning_db.planning.docs) == 1 + 9 * 5 * 2 + 1 + 2
+
+    # 1 lecture de l'occupation + 1 insert_many ; 1 lecture de l'appelant (require_role) + 1 lecture des employés
+    assert planning_db.queries["planning"] == 2
+    assert planning_db.queries["users"] == 2
+    print(f"✅ {len(items)} éléments traités en {sum(planning_db.queries.values())} requêtes")
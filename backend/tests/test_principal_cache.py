@@ -0,0 +1,84 @@
+"""
+Tests du cache des utilisateurs authentifiés (principal_cache.PrincipalCache)
+Features tested:
+- Hits / misses et expiration (TTL)
+- Éviction LRU quand la taille maximale est atteinte
+- Invalidation explicite après modification d'un utilisateur
+- Les copies retournées ne modifient pas l'entrée en cache
+"""
+import copy
+import time
+
+from principal_cache import PrincipalCache
+
+
+class FakePrincipal:
+    """Remplace un modèle Pydantic : seul model_copy est utilisé par le cache"""
+
+    def __init__(self, user_id, centre_ids=None):
+        self.id = user_id
+        self.centre_ids = centre_ids or []
+
+    def model_copy(self, deep=False):
+        return copy.deepcopy(self) if deep else copy.copy(self)
+
+
+class TestPrincipalCache:
+
+    def test_hit_and_miss_counters(self):
+        cache = PrincipalCache(ttl_seconds=30, max_size=10)
+        assert cache.get("u1") is None
+        cache.set("u1", FakePrincipal("u1"))
+        assert cache.get("u1").id == "u1"
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_ratio"] == 0.5
+        print("✅ Compteurs hits/misses corrects")
+
+    def test_ttl_expiration(self):
+        cache = PrincipalCache(ttl_seconds=0.01, max_size=10)
+        cache.set("u1", FakePrincipal("u1"))
+        time.sleep(0.02)
+        assert cache.get("u1") is None
+        assert cache.stats()["size"] == 0
+        print("✅ Les entrées expirent après le TTL")
+
+    def test_lru_eviction(self):
+        cache = PrincipalCache(ttl_seconds=30, max_size=2)
+        cache.set("u1", FakePrincipal("u1"))
+        cache.set("u2", FakePrincipal("u2"))
+        cache.get("u1")  # u1 devient le plus récent
+        cache.set("u3", FakePrincipal("u3"))
+        assert cache.get("u2") is None
+        assert cache.get("u1") is not None
+        assert cache.stats()["evictions"] == 1
+        print("✅ Éviction LRU de l'entrée la moins récente")
+
+    def test_invalidate(self):
+        cache = PrincipalCache(ttl_seconds=30, max_size=10)
+        cache.set("u1", FakePrincipal("u1"))
+        cache.set("u2", FakePrincipal("u2"))
+        cache.invalidate("u1", None, "inconnu")
+        assert cache.get("u1") is None
+        assert cache.get("u2") is not None
+        cache.clear()
+        assert cache.get("u2") is None
+        assert cache.stats()["invalidations"] == 2
+        print("✅ Invalidation explicite et vidage complet")
+
+    def test_returned_copy_is_isolated(self):
+        cache = PrincipalCache(ttl_seconds=30, max_size=10)
+        principal = FakePrincipal("u1", ["c1"])
+        cache.set("u1", principal)
+        principal.centre_ids.append("c2")
+        first = cache.get("u1")
+        first.centre_ids.append("c3")
+        assert cache.get("u1").centre_ids == ["c1"]
+        print("✅ Les modifications de current_user ne polluent pas le cache")
+
+    def test_disabled_with_zero_ttl(self):
+        cache = PrincipalCache(ttl_seconds=0, max_size=10)
+        cache.set("u1", FakePrincipal("u1"))
+        assert cache.get("u1") is None
+        assert cache.stats()["size"] == 0
@@ -0,0 +1,74 @@
+"""
+Tests de l'envoi push groupé (push_notifications.send_push_batch) et du job de 7h
+Features tested:
+- Payloads identiques regroupés, tokens dédoublonnés
+- Découpage en lots de 500 tokens, concurrence bornée
+- Job de 7h : 4 requêtes (planning, users, push_devices, centres), un envoi groupé, exécution enregistrée
+  (employés désactivés écartés même si leur appareil est encore marqué actif)
+"""
+import asyncio
+
+import pytest
+
+import push_notifications
+import push_transport
+
+
+@pytest.fixture
+def fake_fcm(monkeypatch):
+    # Un token rejeté dans chaque lot de 500 du premier message
+    transport = push_transport.FakePushTransport(failing_tokens={"tok-0-b", "tok-250", "tok-500", "autre"})
+    monkeypatch.setattr(push_transport, "_transport", transport)
+    return transport
+
+
+def test_identical_payloads_grouped_and_chunked(fake_fcm):
+    payloads = [
+        {"tokens": [f"tok-{i}", f"tok-{i}-b"], "title": "Planning", "body": "Matin: Salle 1", "data": {"type": "daily_planning"}}
+        for i in range(600)
+    ]
+    payloads.append({"tokens": ["tok-0", "autre"], "title": "Planning", "body": "Matin: Salle 2", "data": {"type": "daily_planning"}})
+
+    stats = asyncio.run(push_notifications.send_push_batch(payloads, concurrency=2))
+
+    assert stats["messages"] == 2
+    assert stats["tokens"] == 1202
+    assert stats["batches"] == 4  # 1200 tokens -> 500 + 500 + 200, plus 1 lot de 2
+    assert len(fake_fcm.sent) == 1202
+    assert stats["success"] == 1198 and stats["failure"] == 4
+    assert fake_fcm.max_en_cours <= 2
+
+
+def test_empty_payloads_send_nothing(fake_fcm):
+    stats = asyncio.run(push_notifications.send_push_batch([{"tokens": [], "title": "t", "body": "b"}]))
+    assert stats["batches"] == 0 and fake_fcm.sent == []
+
+
+def test_morning_job_batches_and_records_run(counting_db, fake_fcm):
+    scheduler_service = pytest.importorskip("services.scheduler_service")
+    today = scheduler_service.datetime.now(scheduler_service.timezone.utc).strftime('%Y-%m-%d')
+
+    counting_db.centres.docs = [{"id": "c1", "nom": "Centre Nord"}]
+    counting_db.users.docs = [{"id": f"u{i}", "actif": True} for i in range(3)] + [{"id": "u-inactif", "actif": False}]
+    counting_db.push_devices.docs = [{"user_id": f"u{i}", "fcm_token": f"tok-{i}", "actif": True} for i in range(3)]
+    # Désactivé directement en base : push_devices.actif n'a pas été recopié
+    counting_db.push_devices.docs.append({"user_id": "u-inactif", "fcm_token": "tok-inactif", "actif": True})
+    counting_db.planning.docs = [
+        {"date": today, "employe_id": uid, "centre_id": "c1", "creneau": creneau, "salle_nom": "1"}
+        for uid in ("u0", "u1", "u-sans") for creneau in ("APRES_MIDI", "MATIN")
+    ] + [{"date": today, "employe_id": uid, "centre_id": "c1", "creneau": "MATIN", "salle_nom": "2"}
+         for uid in ("u2", "u-inactif")]
+
+    run = asyncio.run(scheduler_service.run_morning_planning_notifications(counting_db))
+
+    # push_devices : lecture des tokens + rafraîchissement de last_used des appareils livrés
+    assert counting_db.queries == {"planning": 1, "users": 1, "push_devices": 2, "centres": 1, "job_runs": 1}
+    assert run["employes"] == 5 and run["sans_token"] == 2
+    assert "tok-inactif" not in {token for token, _ in fake_fcm.sent}
+    assert run["messages"] == 2 and run["batches"] == 2
+    corps = {}
+    for token, message in fake_fcm.sent:
+        corps.setdefault(message["body"], []).append(token)
+    assert corps["📍 Centre Nord\nVotre planning du jour:\nMatin: Salle 1\nAprès-midi: Salle 1"] == ["tok-0", "tok-1"]
+    assert counting_db.job_runs.docs[0]["statut"] == "ok"
+    assert "duree_ms" in counting_db.job_runs.docs[0]
@@ -0,0 +1,96 @@
+"""
+Tests de la collection push_devices (un document par token FCM)
+Features tested:
+- Enregistrement par upsert sur le hash du token, réattribution d'un token à un autre utilisateur
+- Au plus MAX_DEVICES_PER_USER appareils, les moins récemment utilisés sont retirés
+- Tokens de plusieurs utilisateurs en une requête (utilisateurs désactivés et tokens locaux exclus)
+- last_used rafraîchi après livraison, au plus une fois par LAST_USED_REFRESH_HOURS
+- Migration des anciens users.fcm_devices / fcm_token, exécutée une seule fois
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import push_devices
+
+
+def test_register_upserts_on_token_hash(counting_db):
+    async def scenario():
+        await push_devices.register_device(counting_db, "u1", "tok-a", {"deviceName": "iPhone"}, centre_id="c1")
+        await push_devices.register_device(counting_db, "u1", "tok-a", {"deviceName": "iPhone"}, centre_id="c1")
+        # Téléphone partagé : le token passe à un autre utilisateur
+        return await push_devices.register_device(counting_db, "u2", "tok-a")
+
+    resultat = asyncio.run(scenario())
+    assert len(counting_db.push_devices.docs) == 1
+    device = counting_db.push_devices.docs[0]
+    assert device["user_id"] == "u2" and device["token_hash"] == push_devices.token_hash("tok-a")
+    assert device["device_id"] == push_devices.device_id_for("tok-a") and "registered_at" in device
+    assert resultat["total_devices"] == 1
+
+
+def test_oldest_devices_trimmed(counting_db):
+    async def scenario():
+        for i in range(push_devices.MAX_DEVICES_PER_USER + 2):
+            resultat = await push_devices.register_device(counting_db, "u1", f"tok-{i}")
+        return resultat
+
+    assert asyncio.run(scenario())["total_devices"] == push_devices.MAX_DEVICES_PER_USER
+    restants = {d["fcm_token"] for d in counting_db.push_devices.docs}
+    assert restants == {f"tok-{i}" for i in range(2, push_devices.MAX_DEVICES_PER_USER + 2)}
+
+
+def test_tokens_by_user_single_query(counting_db):
+    counting_db.push_devices.docs = [
+        {"user_id": "u1", "fcm_token": "t1", "actif": True},
+        {"user_id": "u1", "fcm_token": "t1-b", "actif": True},
+        {"user_id": "u2", "fcm_token": "local_dev", "local": True, "actif": True},
+        {"user_id": "u3", "fcm_token": "t3", "actif": False},
+        {"user_id": "u4", "fcm_token": "t4", "actif": True},
+    ]
+
+    tokens = asyncio.run(push_devices.tokens_by_user(counting_db, ["u1", "u2", "u3", "u4"]))
+
+    assert counting_db.queries == {"push_devices": 1}
+    assert tokens == {"u1": ["t1", "t1-b"], "u4": ["t4"]}
+
+
+def test_touch_tokens_refreshes_stale_devices(counting_db):
+    now = datetime.now(timezone.utc)
+    ancien, recent = now - timedelta(days=90), now - timedelta(hours=1)
+    counting_db.push_devices.docs = [
+        {"user_id": "u1", "fcm_token": "t1", "token_hash": push_devices.token_hash("t1"), "last_used": ancien},
+        {"user_id": "u2", "fcm_token": "t2", "token_hash": push_devices.token_hash("t2"), "last_used": recent},
+        {"user_id": "u3", "fcm_token": "t3", "token_hash": push_devices.token_hash("t3"), "last_used": ancien},
+    ]
+
+    assert asyncio.run(push_devices.touch_tokens(counting_db, ["t1", "t2", "t1"])) == 1
+    devices = {d["fcm_token"]: d for d in counting_db.push_devices.docs}
+    assert devices["t1"]["last_used"] > recent
+    assert devices["t2"]["last_used"] == recent and devices["t3"]["last_used"] == ancien
+    assert counting_db.queries == {"push_devices": 1}
+
+
+def test_migration_from_embedded_arrays(counting_db):
+    pytest.importorskip("pymongo")
+    counting_db.users.docs = [
+        {"id": "u1", "actif": True, "centre_id": "c1",
+         "fcm_devices": [{"fcm_token": "t1", "device_id": "ancien-id", "device_name": "Pixel"}, {"fcm_token": "t2"}]},
+        {"id": "u2", "actif": False, "fcm_token": "t3", "device_info": {"browser": "Safari"},
+         "fcm_updated_at": "2024-01-15T08:00:00+00:00"},
+        {"id": "u3", "actif": True},
+    ]
+
+    async def scenario():
+        repris = await push_devices.migrate_embedded_devices(counting_db)
+        return repris, await push_devices.migrate_embedded_devices(counting_db)
+
+    assert asyncio.run(scenario()) == (3, 0)
+    devices = {d["fcm_token"]: d for d in counting_db.push_devices.docs}
+    assert set(devices) == {"t1", "t2", "t3"}
+    assert devices["t1"]["device_id"] == "ancien-id" and devices["t1"]["centre_id"] == "c1"
+    assert devices["t3"]["actif"] is False and devices["t3"]["browser"] == "Safari"
+    # Appareil enregistré il y a longtemps : last_used = date de migration (pas de purge TTL immédiate)
+    assert devices["t3"]["registered_at"] == datetime(2024, 1, 15, 8, tzinfo=timezone.utc)
+    assert devices["t3"]["last_used"] > datetime.now(timezone.utc) - timedelta(minutes=1)
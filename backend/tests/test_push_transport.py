@@ -0,0 +1,91 @@
+"""
+Tests du transport push (push_transport)
+Features tested:
+- Message indépendant du transport (title/body dans data, actions de réponse rapide)
+- Corps HTTP v1 (champs webpush en camelCase, lien HTTPS)
+- Transport HTTP v1 : jeton OAuth mis en cache, concurrence bornée, erreurs FCM par token
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import push_transport
+from push_transport import FcmHttpTransport, build_push_message, fcm_v1_message
+
+
+def test_chat_message_has_reply_actions(monkeypatch):
+    monkeypatch.setenv("FRONTEND_URL", "https://app.example.fr")
+    message = build_push_message("💬 Dr. Martin", "Bonjour", {"type": "chat_message", "requires_reply": "true"})
+
+    assert message["data"]["title"] == "💬 Dr. Martin" and message["data"]["body"] == "Bonjour"
+    assert [a["action"] for a in message["webpush_notification"]["actions"]] == ["reply", "open"]
+
+    corps = fcm_v1_message("tok-1", message)
+    assert corps["token"] == "tok-1"
+    assert corps["webpush"]["notification"]["requireInteraction"] is True
+    assert corps["webpush"]["fcm_options"] == {"link": "https://app.example.fr"}
+
+
+def test_plain_message_without_https_link(monkeypatch):
+    monkeypatch.setenv("FRONTEND_URL", "http://localhost:3000")
+    message = build_push_message("Titre", "Corps", {"type": "daily_planning", "count": 3})
+
+    assert message["data"]["count"] == "3"
+    assert "actions" not in message["webpush_notification"]
+    assert "fcm_options" not in fcm_v1_message("tok", message)["webpush"]
+
+
+def test_fake_transport_reports_failures():
+    transport = push_transport.FakePushTransport(failing_tokens={"mort"})
+    results = asyncio.run(transport.send(["ok", "mort"], build_push_message("t", "b")))
+    assert [(r.token, r.success, r.error) for r in results] == [("ok", True, None), ("mort", False, "UNREGISTERED")]
+
+
+class FakeCredentials:
+    def __init__(self):
+        self.refreshes = 0
+        self.token = None
+        self.expiry = None
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f"jeton-{self.refreshes}"
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+def test_http_transport_caches_token_and_bounds_concurrency():
+    httpx = pytest.importorskip("httpx")
+    etat = {"en_cours": 0, "max": 0, "auth": set()}
+
+    async def handler(request):
+        etat["en_cours"] += 1
+        etat["max"] = max(etat["max"], etat["en_cours"])
+        await asyncio.sleep(0.001)
+        etat["en_cours"] -= 1
+        etat["auth"].add(request.headers["Authorization"])
+        body = httpx.Response(200, content=request.content).json()
+        if body["message"]["token"] == "mort":
+            return httpx.Response(404, json={"error": {"status": "NOT_FOUND", "details": [
+                {"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError", "errorCode": "UNREGISTERED"}
+            ]}})
+        return httpx.Response(200, json={"name": "projects/p/messages/1"})
+
+    async def scenario():
+        credentials = FakeCredentials()
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        transport = FcmHttpTransport("p", credentials, client=client, concurrency=3, auth_request=object())
+        message = build_push_message("t", "b")
+        premier = await transport.send([f"tok-{i}" for i in range(20)] + ["mort"], message)
+        second = await transport.send(["tok-x"], message)
+        await transport.aclose()
+        return credentials, premier, second
+
+    credentials, premier, second = asyncio.run(scenario())
+
+    assert credentials.refreshes == 1
+    assert etat["auth"] == {"Bearer jeton-1"}
+    assert etat["max"] <= 3
+    assert sum(r.success for r in premier) == 20
+    assert premier[-1].error == "UNREGISTERED"
+    assert second[0].success
@@ -0,0 +1,144 @@
+"""
+Tests des compteurs de version et des GET conditionnels (ETag / If-None-Match)
+Features tested:
+- L'ETag ne change qu'après une écriture de la ressource (et du centre) dont dépend la réponse
+- If-None-Match : liste d'ETags, préfixe W/, *
+- Stockage partagé (MongoDB) : versions lues une fois puis gardées en cache local
+- Scripts d'init (invalidate_all) : tous les ETags du stockage partagé deviennent invalides
+- GET /api/salles et /api/planning/semaine : 304 sans aucune requête MongoDB
+"""
+import asyncio
+
+import pytest
+
+from planning_changes import UPSERT, record_changes
+from resource_versions import (
+    PLANNING, SALLES, USERS, MemoryVersionStore, MongoVersionStore, ResourceVersions, invalidate_all
+)
+
+
+def test_etag_changes_only_with_dependencies():
+    async def scenario():
+        versions = ResourceVersions(MemoryVersionStore())
+        c1 = [(PLANNING, "c1"), (USERS, None)]
+        etags = {"initial": await versions.etag(c1, "semaine")}
+        etags["variante"] = await versions.etag(c1, "mois")
+        await versions.bump(PLANNING, "c2")
+        etags["autre_centre"] = await versions.etag(c1, "semaine")
+        etags["tous_centres"] = await versions.etag([(PLANNING, None)], "semaine")
+        await versions.bump(PLANNING, "c1")
+        etags["meme_centre"] = await versions.etag(c1, "semaine")
+        await versions.bump(PLANNING)
+        etags["sans_centre"] = await versions.etag(c1, "semaine")
+        await versions.bump(USERS)
+        etags["users"] = await versions.etag(c1, "semaine")
+        await versions.bump_all()
+        etags["global"] = await versions.etag(c1, "semaine")
+        return etags, await versions.etag(c1, "semaine")
+
+    etags, repete = asyncio.run(scenario())
+    assert etags["autre_centre"] == etags["initial"]
+    # Toutes les autres valeurs sont distinctes
+    assert len(set(etags.values())) == len(etags) - 1
+    assert repete == etags["global"] and repete.startswith('"') and repete.endswith('"')
+
+
+def test_if_none_match_parsing():
+    versions = ResourceVersions(MemoryVersionStore())
+    etag = '"abc"'
+    assert versions.matches('"zzz", "abc"', etag)
+    assert versions.matches('W/"abc"', etag)
+    assert versions.matches("*", etag)
+    assert not versions.matches('"zzz"', etag) and not versions.matches(None, etag)
+    assert versions.stats()["not_modified"] == 3
+
+
+def test_shared_store_caches_reads(counting_db):
+    async def scenario():
+        store = MongoVersionStore(counting_db, ttl_seconds=60)
+        versions = ResourceVersions(store)
+        avant = await versions.etag([(SALLES, "c1")])
+        await versions.etag([(SALLES, "c1")])
+        lectures = counting_db.queries.get("resource_versions", 0)
+        await versions.bump(SALLES, "c1")
+        apres = await versions.etag([(SALLES, "c1")])
+        # Un autre processus voit la même version une fois son cache expiré
+        autre = await ResourceVersions(MongoVersionStore(counting_db)).etag([(SALLES, "c1")])
+        return avant, apres, autre, lectures
+
+    avant, apres, autre, lectures = asyncio.run(scenario())
+    assert lectures == 1
+    assert avant != apres == autre
+
+
+def test_init_scripts_invalidate_shared_etags(monkeypatch, counting_db):
+    pytest.importorskip("pymongo")
+
+    async def scenario():
+        serveur = ResourceVersions(MongoVersionStore(counting_db, ttl_seconds=0))
+        avant = await serveur.etag([(USERS, None), (SALLES, "c1")])
+        monkeypatch.setenv("RESOURCE_VERSION_STORE", "memory")
+        sans_effet = await invalidate_all(counting_db)
+        monkeypatch.setenv("RESOURCE_VERSION_STORE", "mongo")
+        invalide = await invalidate_all(counting_db)
+        return avant, sans_effet, invalide, await serveur.etag([(USERS, None), (SALLES, "c1")])
+
+    avant, sans_effet, invalide, apres = asyncio.run(scenario())
+    assert not sans_effet and invalide
+    assert avant != apres
+
+
+def test_planning_changes_bump_planning_version(monkeypatch, counting_db):
+    import resource_versions
+
+    versions = ResourceVersions(MemoryVersionStore())
+    monkeypatch.setattr(resource_versions.resource_versions, "store", versions.store)
+
+    async def scenario():
+        avant = await versions.etag([(PLANNING, "c1")])
+        await record_changes(counting_db, [{"id": "a", "centre_id": "c2", "date": "2026-03-02"}], UPSERT)
+        inchange = await versions.etag([(PLANNING, "c1")])
+        await record_changes(counting_db, [{"id": "b", "centre_id": "c1", "date": "2026-03-02"}], UPSERT)
+        return avant, inchange, await versions.etag([(PLANNING, "c1")])
+
+    avant, inchange, apres = asyncio.run(scenario())
+    assert avant == inchange != apres
+
+
+@pytest.fixture
+def api(counting_db, monkeypatch):
+    server = pytest.importorskip("server")
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(server, "db", counting_db)
+    monkeypatch.setattr(server.resource_versions, "store", MemoryVersionStore())
+    directeur = server.User(
+        id="directeur-1", email="directeur@cabinet.fr", nom="Test", prenom="Directeur",
+        role=server.ROLES["DIRECTEUR"], centre_actif_id="centre-1"
+    )
+    server.app.dependency_overrides[server.get_current_user] = lambda: directeur
+    server.app.dependency_overrides[server.get_token_principal] = lambda: server.TokenPrincipal(
+        id=directeur.id, role=directeur.role, centre_actif_id=directeur.centre_actif_id
+    )
+    counting_db.salles.docs = [{"id": "s1", "nom": "Salle 1", "type_salle": "MEDECIN", "actif": True,
+                                "centre_id": "centre-1", "position_x": 0, "position_y": 0}]
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("path", ["/api/salles", "/api/planning/semaine/2025-01-06"])
+def test_not_modified_without_queries(api, counting_db, path):
+    premiere = api.get(path)
+    assert premiere.status_code == 200 and premiere.headers["ETag"]
+    counting_db.reset_counts()
+
+    seconde = api.get(path, headers={"If-None-Match": premiere.headers["ETag"]})
+    assert seconde.status_code == 304 and seconde.content == b""
+    assert counting_db.queries == {}
+
+
+def test_write_invalidates_etag(api, counting_db):
+    etag = api.get("/api/salles").headers["ETag"]
+    assert api.delete("/api/salles/s1").status_code == 200
+    reponse = api.get("/api/salles", headers={"If-None-Match": etag})
+    assert reponse.status_code == 200 and reponse.headers["ETag"] != etag
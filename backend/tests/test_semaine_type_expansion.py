@@ -0,0 +1,85 @@
+"""
+Tests de l'application des semaines types (semaine_type_expansion)
+Features tested:
+- Développement d'une semaine type sur plusieurs semaines (à partir du lundi)
+- Conflits MATIN / APRES_MIDI / JOURNEE_COMPLETE résolus en mémoire
+- Un an pour 12 médecins : 1 lecture + 1 insert_many, en moins d'une seconde
+"""
+import asyncio
+import time
+
+from semaine_type_expansion import apply_semaine_type, creneaux_en_conflit, expand_semaine_type
+
+SEMAINE = {
+    "nom": "Temps plein",
+    "lundi": "JOURNEE_COMPLETE",
+    "mardi": "MATIN",
+    "mercredi": "APRES_MIDI",
+    "jeudi": "JOURNEE_COMPLETE",
+    "vendredi": "JOURNEE_COMPLETE",
+    "samedi": "REPOS",
+    "dimanche": None,
+}
+
+
+def _build(medecin_id, date, creneau):
+    return {"id": f"{medecin_id}-{date}", "medecin_id": medecin_id, "date_demandee": date,
+            "creneau": creneau, "statut": "EN_ATTENTE"}
+
+
+def test_conflict_rules():
+    assert creneaux_en_conflit("MATIN", "MATIN")
+    assert creneaux_en_conflit("JOURNEE_COMPLETE", "APRES_MIDI")
+    assert creneaux_en_conflit("MATIN", "JOURNEE_COMPLETE")
+    assert not creneaux_en_conflit("MATIN", "APRES_MIDI")
+
+
+def test_expand_from_monday():
+    # Mercredi 8 janvier 2025 -> semaine du lundi 6
+    jours = expand_semaine_type(SEMAINE, "2025-01-08", nb_semaines=2)
+    assert len(jours) == 10
+    assert jours[0] == ("2025-01-06", "JOURNEE_COMPLETE")
+    assert jours[1] == ("2025-01-07", "MATIN")
+    assert jours[-1] == ("2025-01-17", "JOURNEE_COMPLETE")
+
+
+def test_existing_requests_respected(counting_db):
+    counting_db.demandes_travail.docs = [
+        # Lundi : APRES_MIDI déjà demandé -> JOURNEE_COMPLETE refusée
+        {"medecin_id": "med-1", "date_demandee": "2025-01-06", "creneau": "APRES_MIDI", "statut": "EN_ATTENTE"},
+        # Mardi : APRES_MIDI existant -> MATIN accepté
+        {"medecin_id": "med-1", "date_demandee": "2025-01-07", "creneau": "APRES_MIDI", "statut": "APPROUVE"},
+        # Jeudi : demande annulée -> ne bloque pas
+        {"medecin_id": "med-1", "date_demandee": "2025-01-09", "creneau": "MATIN", "statut": "ANNULE"},
+        # Autre médecin : sans effet sur med-1
+        {"medecin_id": "med-2", "date_demandee": "2025-01-10", "creneau": "JOURNEE_COMPLETE", "statut": "APPROUVE"},
+    ]
+
+    resultat = asyncio.run(apply_semaine_type(counting_db, SEMAINE, ["med-1", "med-2"], "2025-01-06", 1, _build))
+
+    crees = {(d["medecin_id"], d["date_demandee"]) for d in resultat["demandes"]}
+    assert ("med-1", "2025-01-06") not in crees
+    assert ("med-1", "2025-01-07") in crees
+    assert ("med-1", "2025-01-09") in crees
+    assert ("med-2", "2025-01-10") not in crees
+    assert len(resultat["ignorees"]) == 2
+    assert counting_db.queries["demandes_travail"] == 2  # 1 find + 1 insert_many
+    assert all("_id" not in d for d in resultat["demandes"])
+
+
+def test_year_for_twelve_doctors_under_a_second(counting_db):
+    medecins = [f"med-{i}" for i in range(12)]
+    # Quelques demandes existantes réparties sur l'année
+    counting_db.demandes_travail.docs = [
+        {"medecin_id": m, "date_demandee": f"2025-{mois:02d}-15", "creneau": "MATIN", "statut": "APPROUVE"}
+        for m in medecins for mois in range(1, 13)
+    ]
+
+    debut = time.perf_counter()
+    resultat = asyncio.run(apply_semaine_type(counting_db, SEMAINE, medecins, "2025-01-06", 52, _build))
+    duree = time.perf_counter() - debut
+
+    assert len(resultat["demandes"]) + len(resultat["ignorees"]) == 12 * 52 * 5
+    assert counting_db.queries["demandes_travail"] == 2
+    assert duree < 1.0, f"{duree:.3f}s pour un an x 12 médecins"
+    print(f"✅ {len(resultat['demandes'])} demandes créées en {duree * 1000:.0f} ms (2 requêtes)")
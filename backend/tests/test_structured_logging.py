@@ -0,0 +1,95 @@
+"""
+Tests de la journalisation structurée (structured_logging)
+Features tested:
+- Une ligne JSON par événement, avec request_id (contextvar) et champs extra
+- Formatage et écriture dans le thread du listener, pas dans le thread appelant
+- Niveaux par module (LOG_LEVELS) et échantillonnage des événements DEBUG
+"""
+import io
+import json
+import logging
+import threading
+
+import pytest
+
+from structured_logging import (
+    JsonFormatter, configure_logging, parse_levels, request_id_var, shutdown_logging
+)
+
+
+@pytest.fixture
+def logs():
+    racine = logging.getLogger()
+    handlers, niveau = list(racine.handlers), racine.level
+    sortie = io.StringIO()
+    yield sortie
+    shutdown_logging()
+    for handler in list(racine.handlers):
+        racine.removeHandler(handler)
+    for handler in handlers:
+        racine.addHandler(handler)
+    racine.setLevel(niveau)
+    for nom in ("bench.bavard", "bench.calme"):
+        logging.getLogger(nom).setLevel(logging.NOTSET)
+
+
+def _lignes(sortie):
+    shutdown_logging()  # vide la file
+    return [json.loads(ligne) for ligne in sortie.getvalue().splitlines()]
+
+
+def test_json_lines_with_request_id_and_fields(logs):
+    configure_logging(stream=logs, log_format="json", level="INFO", levels="")
+    logger = logging.getLogger("bench.conges")
+    token = request_id_var.set("req-42")
+    try:
+        logger.info("conges: %d demandes", 3, extra={"centre_id": "c1"})
+    finally:
+        request_id_var.reset(token)
+    logger.debug("écarté (niveau INFO)")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("erreur")
+
+    lignes = _lignes(logs)
+    assert len(lignes) == 2
+    assert lignes[0]["msg"] == "conges: 3 demandes" and lignes[0]["level"] == "INFO"
+    assert lignes[0]["request_id"] == "req-42" and lignes[0]["centre_id"] == "c1"
+    assert lignes[0]["logger"] == "bench.conges"
+    assert "request_id" not in lignes[1] and "ValueError: boom" in lignes[1]["exc"]
+
+
+def test_formatting_happens_in_listener_thread(logs, monkeypatch):
+    threads = []
+    format_origine = JsonFormatter.format
+
+    def format_espion(self, record):
+        threads.append(threading.current_thread().name)
+        return format_origine(self, record)
+
+    monkeypatch.setattr(JsonFormatter, "format", format_espion)
+    configure_logging(stream=logs, log_format="json", level="INFO", levels="")
+    logging.getLogger("bench").info("hors de la boucle")
+    assert len(_lignes(logs)) == 1
+    assert threads and threading.current_thread().name not in threads
+
+
+def test_per_module_levels_and_debug_sampling(logs):
+    assert parse_levels("bench.bavard=DEBUG, bench.calme=warning,invalide=NIVEAU,=INFO") == {
+        "bench.bavard": logging.DEBUG, "bench.calme": logging.WARNING
+    }
+    configure_logging(stream=logs, log_format="json", level="INFO",
+                      levels="bench.bavard=DEBUG,bench.calme=WARNING", debug_sample=5)
+    for i in range(12):
+        logging.getLogger("bench.bavard").debug("événement fréquent %d", i)
+    logging.getLogger("bench.bavard").debug("événement rare")
+    logging.getLogger("bench.calme").info("écarté")
+    logging.getLogger("bench.calme").warning("gardé")
+
+    lignes = _lignes(logs)
+    frequents = [l for l in lignes if l["msg"].startswith("événement fréquent")]
+    assert [l["msg"] for l in frequents] == ["événement fréquent 0", "événement fréquent 5", "événement fréquent 10"]
+    assert all(l["sampled"] == 5 for l in frequents)
+    assert any(l["msg"] == "événement rare" for l in lignes)
+    assert [l["msg"] for l in lignes if l["logger"] == "bench.calme"] == ["gardé"]
@@ -0,0 +1,98 @@
+"""
+Tests du classement des erreurs FCM et de la suppression des tokens morts
+Features tested:
+- UNREGISTERED / SENDER_ID_MISMATCH supprimés, UNAVAILABLE à réessayer
+- INVALID_ARGUMENT supprimé seulement si le même message a été accepté ailleurs
+- Suppression des appareils en un delete_many sur push_devices
+- Outbox : un nouvel essai ne renvoie qu'aux tokens en échec transitoire
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import notification_outbox
+import push_notifications
+import push_transport
+from push_devices import token_hash
+from push_transport import CONFIGURATION, TOKEN_INVALIDE, TRANSITOIRE, PushResult, classify_results
+
+
+def test_classification():
+    categories = classify_results([
+        PushResult("ok", True),
+        PushResult("mort", False, "UNREGISTERED"),
+        PushResult("autre-projet", False, "SENDER_ID_MISMATCH"),
+        PushResult("mal-forme", False, "INVALID_ARGUMENT"),
+        PushResult("quota", False, "QUOTA_EXCEEDED"),
+        PushResult("reseau", False, "ConnectTimeout"),
+    ])
+    assert categories[TOKEN_INVALIDE] == ["mort", "autre-projet", "mal-forme"]
+    assert categories[TRANSITOIRE] == ["quota", "reseau"]
+
+    # Message refusé pour tous les tokens : payload suspect, aucun token supprimé
+    seul = classify_results([PushResult("a", False, "INVALID_ARGUMENT"), PushResult("b", False, "INVALID_ARGUMENT")])
+    assert seul[TOKEN_INVALIDE] == [] and seul[CONFIGURATION] == ["a", "b"]
+
+
+def _devices(*pairs):
+    return [{"user_id": uid, "fcm_token": tok, "token_hash": token_hash(tok), "actif": True} for uid, tok in pairs]
+
+
+@pytest.fixture
+def fake_push(monkeypatch):
+    transport = push_transport.FakePushTransport(failing_tokens={"mort-1": "UNREGISTERED", "mort-2": "UNREGISTERED",
+                                                                 "lent": "UNAVAILABLE"})
+    monkeypatch.setattr(push_transport, "_transport", transport)
+    return transport
+
+
+def test_dead_tokens_pruned_in_bulk(counting_db, fake_push):
+    counting_db.push_devices.docs = _devices(("u1", "vivant"), ("u1", "mort-1"), ("u2", "mort-2"), ("u3", "lent"))
+    avant = push_notifications.get_push_counters()
+
+    stats = asyncio.run(push_notifications.send_push_batch(
+        [{"tokens": ["vivant", "mort-1", "mort-2", "lent"], "title": "t", "body": "b"}], database=counting_db
+    ))
+
+    assert counting_db.queries["push_devices"] == 2  # un delete_many + un update_many (last_used)
+    assert stats["invalid"] == 2 and stats["pruned"] == 2 and stats["retry_tokens"] == ["lent"]
+    assert [d["fcm_token"] for d in counting_db.push_devices.docs] == ["vivant", "lent"]
+
+    apres = push_notifications.get_push_counters()
+    assert apres["tokens_supprimes"] - avant["tokens_supprimes"] == 2
+    assert apres["a_reessayer"] - avant["a_reessayer"] == 1
+    assert apres["envois_reussis"] - avant["envois_reussis"] == 1
+
+
+def test_pruned_counter_uses_deleted_count(counting_db):
+    # mort-2 déjà retiré (autre worker, TTL) : seul l'appareil réellement supprimé est compté
+    counting_db.push_devices.docs = _devices(("u1", "vivant"), ("u1", "mort-1"))
+    avant = push_notifications.get_push_counters()
+
+    supprimes = asyncio.run(push_notifications.prune_invalid_tokens(counting_db, ["mort-1", "mort-2", "mort-1"]))
+
+    assert supprimes == 1
+    assert push_notifications.get_push_counters()["tokens_supprimes"] - avant["tokens_supprimes"] == 1
+    assert [d["fcm_token"] for d in counting_db.push_devices.docs] == ["vivant"]
+
+
+def test_outbox_retry_only_resends_transient_tokens(counting_db, fake_push):
+    counting_db.push_devices.docs = _devices(("u1", "vivant"), ("u1", "mort-1"), ("u3", "lent"))
+    worker = notification_outbox.OutboxWorker(counting_db)
+
+    async def scenario():
+        await notification_outbox.enqueue_push(counting_db, ["u1", "u3"], "t", "b")
+        await worker.run_once("w1")
+        job = counting_db.outbox.docs[0]
+        assert job["statut"] == notification_outbox.EN_ATTENTE
+        assert job["payload"]["tokens"] == ["lent"]
+        fake_push.sent.clear()
+        fake_push.failing_tokens = {}
+        job["prochain_essai"] = datetime.now(timezone.utc)
+        await worker.run_once("w1")
+
+    asyncio.run(scenario())
+    assert [token for token, _ in fake_push.sent] == ["lent"]
+    assert counting_db.outbox.docs[0]["statut"] == notification_outbox.ENVOYE
+    assert [d["fcm_token"] for d in counting_db.push_devices.docs] == ["vivant", "lent"]
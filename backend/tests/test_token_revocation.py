@@ -0,0 +1,57 @@
+"""
+Tests de la table de révocation des tokens (token_revocation.TokenVersionTable)
+Features tested:
+- Version lue une seule fois puis servie depuis le cache
+- bump() révoque immédiatement les tokens existants
+- Utilisateur désactivé ou supprimé : plus aucun token valide
+"""
+import asyncio
+
+from token_revocation import REVOKED, TokenVersionTable
+
+
+def _seed(db):
+    db.users.docs = [
+        {"id": "u1", "email": "a@cabinet.fr", "role": "Médecin", "actif": True},
+        {"id": "u2", "email": "b@cabinet.fr", "role": "Assistant", "actif": False, "token_version": 3},
+    ]
+
+
+def test_version_cached(counting_db):
+    _seed(counting_db)
+    table = TokenVersionTable(ttl_seconds=30)
+
+    async def scenario():
+        for _ in range(5):
+            assert await table.is_current(counting_db, "u1", 0)
+
+    asyncio.run(scenario())
+    assert counting_db.queries["users"] == 1
+    print("✅ Une seule lecture de la version pour 5 vérifications")
+
+
+def test_bump_revokes_existing_tokens(counting_db):
+    _seed(counting_db)
+    table = TokenVersionTable(ttl_seconds=30)
+
+    async def scenario():
+        assert await table.is_current(counting_db, "u1", 0)
+        await table.bump(counting_db, "u1")
+        assert not await table.is_current(counting_db, "u1", 0)
+        assert await table.is_current(counting_db, "u1", 1)
+
+    asyncio.run(scenario())
+    print("✅ bump() invalide les anciens tokens")
+
+
+def test_inactive_or_deleted_user_revoked(counting_db):
+    _seed(counting_db)
+    table = TokenVersionTable(ttl_seconds=30)
+
+    async def scenario():
+        assert await table.get_version(counting_db, "u2") == REVOKED
+        assert await table.get_version(counting_db, "inconnu") == REVOKED
+        assert not await table.is_current(counting_db, "u2", 3)
+
+    asyncio.run(scenario())
+    print("✅ Compte désactivé ou supprimé : tokens refusés")
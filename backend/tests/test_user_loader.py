@@ -0,0 +1,136 @@
+"""
+Tests du chargeur d'utilisateurs groupé (user_loader.UserLoader)
+Features tested:
+- Résolution de plusieurs IDs en une seule requête $in
+- Projection résumé (pas de password_hash ni de données d'appareils)
+- Régression N+1 : nombre de requêtes sur la collection users par endpoint
+"""
+import asyncio
+
+import pytest
+
+from user_loader import UserLoader
+
+
+def _seed_users(db, count=5):
+    db.users.docs = [
+        {
+            "id": f"user-{i}",
+            "email": f"user{i}@cabinet.fr",
+            "nom": f"Nom{i}",
+            "prenom": f"Prenom{i}",
+            "role": "Médecin" if i % 2 else "Assistant",
+            "centre_id": "centre-1",
+            "password_hash": "secret",
+            "fcm_devices": [{"fcm_token": "tok"}],
+        }
+        for i in range(count)
+    ]
+
+
+class TestUserLoader:
+    """Comportement du loader isolé"""
+
+    def test_load_many_single_query(self, counting_db):
+        """Plusieurs IDs (avec doublons et None) sont résolus en une requête"""
+        _seed_users(counting_db)
+        loader = UserLoader(counting_db)
+        users = asyncio.run(loader.load_many(["user-1", "user-2", "user-1", None, "inconnu"]))
+        assert set(users) == {"user-1", "user-2"}
+        assert counting_db.queries["users"] == 1
+        assert loader.query_count == 1
+        print("✅ load_many résout tous les IDs en une requête")
+
+    def test_cache_and_pending(self, counting_db):
+        """Les IDs déjà chargés ne sont pas redemandés"""
+        _seed_users(counting_db)
+        loader = UserLoader(counting_db)
+        loader.prime(["user-0", "user-3"])
+        asyncio.run(loader.load_all())
+        assert loader.get("user-3")["nom"] == "Nom3"
+        asyncio.run(loader.load("user-0"))
+        assert asyncio.run(loader.load("inconnu")) is None
+        asyncio.run(loader.load("inconnu"))
+        assert counting_db.queries["users"] == 2
+        print("✅ Le cache de requête évite les lectures répétées")
+
+    def test_summary_projection(self, counting_db):
+        """Le hash du mot de passe et les appareils ne sont jamais chargés"""
+        _seed_users(counting_db)
+        user = asyncio.run(UserLoader(counting_db).load("user-1"))
+        assert "password_hash" not in user
+        assert "fcm_devices" not in user
+        assert "_id" not in user
+        print("✅ Projection résumé appliquée")
+
+    def test_no_query_without_ids(self, counting_db):
+        """Aucune requête si aucun ID n'est demandé"""
+        assert asyncio.run(UserLoader(counting_db).load_many([])) == {}
+        assert counting_db.queries.get("users", 0) == 0
+
+
+@pytest.fixture
+def api(counting_db, monkeypatch):
+    """Client HTTP sur l'application réelle, branché sur la base en mémoire"""
+    server = pytest.importorskip("server")
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(server, "db", counting_db)
+    _seed_users(counting_db, count=6)
+    directeur = server.User(
+        id="directeur-1", email="directeur@cabinet.fr", nom="Test", prenom="Directeur",
+        role=server.ROLES["DIRECTEUR"], centre_actif_id="centre-1"
+    )
+    server.app.dependency_overrides[server.get_current_user] = lambda: directeur
+    server.app.dependency_overrides[server.get_token_principal] = lambda: server.TokenPrincipal(
+        id=directeur.id, role=directeur.role, centre_actif_id=directeur.centre_actif_id
+    )
+
+    date = "2025-01-06"
+    counting_db.planning.docs = [
+        {
+            "id": f"slot-{i}", "date": date, "creneau": "MATIN" if i % 2 else "APRES_MIDI",
+            "employe_id": f"user-{i % 6}", "employe_role": "Assistant", "centre_id": "centre-1",
+            "medecin_attribue_id": f"user-{(i + 1) % 6}",
+        }
+        for i in range(30)
+    ]
+    counting_db.demandes_conges.docs = [
+        {"id": f"conge-{i}", "utilisateur_id": f"user-{i % 6}", "centre_id": "centre-1",
+         "date_debut": date, "date_fin": date, "statut": "EN_ATTENTE"}
+        for i in range(12)
+    ]
+    counting_db.actualites.docs = [
+        {"id": f"actu-{i}", "titre": "Info", "contenu": "...", "actif": True,
+         "centre_id": "centre-1", "auteur_id": f"user-{i % 6}", "priorite": i}
+        for i in range(8)
+    ]
+    counting_db.quotas_employes.docs = [
+        {"id": f"quota-{i}", "employe_id": f"user-{i}", "semaine_debut": date,
+         "demi_journees_requises": 6, "demi_journees_attribuees": 2}
+        for i in range(6)
+    ]
+    counting_db.reset_counts()
+
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("path", [
+    "/api/planning?date_debut=2025-01-01&date_fin=2025-01-31",
+    "/api/planning/2025-01-06",
+    "/api/planning/semaine/2025-01-06",
+    "/api/conges",
+    "/api/quotas/2025-01-06",
+    "/api/actualites",
+    "/api/export/planning",
+    "/api/export/conges",
+])
+def test_endpoint_users_query_count(api, counting_db, path):
+    """Chaque endpoint enrichi ne lit la collection users qu'une seule fois"""
+    response = api.get(path)
+    assert response.status_code == 200, response.text
+    assert counting_db.queries.get("users", 0) == 1, (
+        f"{path}: {counting_db.queries.get('users', 0)} requêtes users (attendu: 1)"
+    )
+    print(f"✅ {path}: 1 requête users")
@@ -0,0 +1,84 @@
+"""
+Table de révocation des tokens JWT (compteur token_version par utilisateur).
+
+Les tokens d'accès portent les claims signés `role`, `centre_id` et `ver`
+(= token_version de l'utilisateur au moment de l'émission). Les vérifications
+de rôle se font à partir de ces claims, sans relire l'utilisateur.
+
+Pour qu'un changement de rôle, de permissions ou une désactivation prenne
+effet rapidement, chaque modification sensible incrémente `token_version`
+(voir `bump`). Un token dont `ver` ne correspond plus est refusé.
+
+La version courante est mise en cache en mémoire pendant TOKEN_VERSION_CACHE_TTL
+secondes (défaut 15) : au pire un token révoqué reste valide ce délai sur
+les autres workers ; sur le worker qui fait la modification, l'effet est immédiat.
+"""
+import os
+import time
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+# Valeur utilisée pour un utilisateur supprimé ou désactivé : aucun token ne correspond
+REVOKED = -1
+
+
+class TokenVersionTable:
+    """Cache des token_version courants, indexé par user id"""
+
+    def __init__(self, ttl_seconds: float = 15, max_size: int = 5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._versions: Dict[str, Tuple[float, int]] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get_version(self, database, user_id: str) -> int:
+        """Version courante des tokens de l'utilisateur (REVOKED si supprimé/désactivé)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._versions.get(user_id)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = await database.users.find_one(
+            {"id": user_id},
+            {"_id": 0, "token_version": 1, "actif": 1}
+        )
+        if not user or not user.get("actif", True):
+            version = REVOKED
+        else:
+            version = user.get("token_version", 0)
+
+        with self._lock:
+            if len(self._versions) >= self.max_size:
+                # Purge simple : on retire les entrées expirées, sinon tout
+                self._versions = {k: v for k, v in self._versions.items() if v[0] > now}
+                if len(self._versions) >= self.max_size:
+                    self._versions.clear()
+            self._versions[user_id] = (now + self.ttl_seconds, version)
+        return version
+
+    async def is_current(self, database, user_id: str, token_version: int) -> bool:
+        return await self.get_version(database, user_id) == token_version
+
+    def invalidate(self, *user_ids: Optional[str]) -> None:
+        with self._lock:
+            for user_id in user_ids:
+                if user_id:
+                    self._versions.pop(user_id, None)
+
+    async def bump(self, database, user_id: str) -> None:
+        """Révoque tous les tokens existants de l'utilisateur"""
+        await database.users.update_one({"id": user_id}, {"$inc": {"token_version": 1}})
+        self.invalidate(user_id)
+
+    def stats(self) -> Dict[str, float]:
+        return {"size": len(self._versions), "hits": self.hits, "misses": self.misses}
+
+
+token_versions = TokenVersionTable(
+    ttl_seconds=float(os.environ.get("TOKEN_VERSION_CACHE_TTL", "15"))
+)
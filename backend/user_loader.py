@@ -0,0 +1,86 @@
+"""
+Chargeur d'utilisateurs groupé (style DataLoader) lié à une requête HTTP.
+
+Les endpoints qui enrichissent des documents (planning, congés, messages...)
+avec les informations des employés collectent d'abord tous les IDs
+nécessaires, puis les résolvent en UNE seule requête `$in` au lieu d'un
+`find_one` par document (problème N+1).
+
+Usage dans un endpoint :
+    users = UserLoader(db)
+    users.prime(c["employe_id"] for c in creneaux)
+    await users.load_all()
+    employe = users.get(creneau["employe_id"])
+"""
+from typing import Any, Dict, Iterable, Optional
+
+# Projection "résumé" : tout ce qu'il faut pour construire un User,
+# sans le hash du mot de passe ni les données d'appareils (potentiellement lourdes)
+USER_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "password_hash": 0,
+    "fcm_token": 0,
+    "fcm_devices": 0,
+    "fcm_updated_at": 0,
+    "device_info": 0,
+}
+
+
+class UserLoader:
+    """Résout des utilisateurs par ID en regroupant les lectures MongoDB.
+
+    Une instance par requête : le cache interne ne survit pas à la requête,
+    il n'y a donc pas de problème d'invalidation.
+    """
+
+    def __init__(self, database, projection: Optional[Dict[str, int]] = None):
+        self._db = database
+        self._projection = projection or USER_SUMMARY_PROJECTION
+        self._cache: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._pending: set = set()
+        self.query_count = 0  # Nombre de requêtes envoyées à MongoDB
+
+    def prime(self, user_ids: Iterable[Optional[str]]) -> "UserLoader":
+        """Enregistre des IDs à charger lors du prochain load_all()"""
+        for user_id in user_ids:
+            if user_id and user_id not in self._cache:
+                self._pending.add(user_id)
+        return self
+
+    async def load_all(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Charge tous les IDs en attente en une seule requête $in"""
+        if self._pending:
+            ids = list(self._pending)
+            self._pending.clear()
+            self.query_count += 1
+            users = await self._db.users.find(
+                {"id": {"$in": ids}},
+                self._projection
+            ).to_list(len(ids))
+            for user_id in ids:
+                self._cache[user_id] = None
+            for user in users:
+                user.pop("_id", None)
+                self._cache[user["id"]] = user
+        return self._cache
+
+    async def load_many(self, user_ids: Iterable[Optional[str]]) -> Dict[str, Dict[str, Any]]:
+        """Charge plusieurs utilisateurs et retourne un dict {id: document}"""
+        user_ids = [uid for uid in user_ids if uid]
+        self.prime(user_ids)
+        await self.load_all()
+        return {uid: self._cache[uid] for uid in user_ids if self._cache.get(uid)}
+
+    async def load(self, user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Charge un seul utilisateur (regroupé avec les IDs déjà en attente)"""
+        if not user_id:
+            return None
+        self.prime([user_id])
+        await self.load_all()
+        return self._cache.get(user_id)
+
+    def get(self, user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Retourne un utilisateur déjà chargé (None si absent ou non chargé)"""
+        if not user_id:
+            return None
+        return self._cache.get(user_id)
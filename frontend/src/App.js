@@ -796,6 +796,21 @@ const AuthProvider = ({ children }) => {
   const switchCentre = async (centreId) => {
     try {
       const response = await axios.post(`${API}/centres/${centreId}/switch`);
+      
+      // Le nouveau token porte le centre actif (claim centre_actif_id) : le conserver avant le rechargement
+      const { access_token } = response.data;
+      if (access_token) {
+        setToken(access_token);
+        localStorage.setItem('token', access_token);
+        axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+        if ('serviceWorker' in navigator && navigator.serviceWorker.controller) {
+          navigator.serviceWorker.controller.postMessage({
+            type: 'STORE_TOKEN',
+            token: access_token
+          });
+        }
+      }
+      
       const newCentre = centres.find(c => c.id === centreId);
       setCentreActif(newCentre);
       
@@ -5683,7 +5698,7 @@ const PlanningManager = () => {
       return 0;
     }
     
-    let created = 0;
+    const creneaux = [];
     const joursNoms = ['Dimanche', 'Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi'];
     
     for (const date of planningTableau.dates) {
@@ -5705,64 +5720,44 @@ const PlanningManager = () => {
         if (jourConfig && jourConfig.actif) {
           // Créer le créneau MATIN si il n'existe pas
           if (!creneauMatin && jourConfig.debut_matin && jourConfig.fin_matin) {
-            try {
-              await axios.post(`${API}/planning`, {
-                employe_id: employe.id,
-                date: date,
-                creneau: 'MATIN',
-                horaire_debut: jourConfig.debut_matin,
-                horaire_fin: jourConfig.fin_matin
-              });
-              created++;
-            } catch (err) {
-              console.error('Erreur création matin:', err);
-            }
+            creneaux.push({
+              employe_id: employe.id,
+              date: date,
+              creneau: 'MATIN',
+              horaire_debut: jourConfig.debut_matin,
+              horaire_fin: jourConfig.fin_matin
+            });
           }
           
           // Créer le créneau APRES_MIDI si il n'existe pas
           if (!creneauAM && jourConfig.debut_aprem && jourConfig.fin_aprem) {
-            try {
-              await axios.post(`${API}/planning`, {
-                employe_id: employe.id,
-                date: date,
-                creneau: 'APRES_MIDI',
-                horaire_debut: jourConfig.debut_aprem,
-                horaire_fin: jourConfig.fin_aprem
-              });
-              created++;
-            } catch (err) {
-              console.error('Erreur création AM:', err);
-            }
+            creneaux.push({
+              employe_id: employe.id,
+              date: date,
+              creneau: 'APRES_MIDI',
+              horaire_debut: jourConfig.debut_aprem,
+              horaire_fin: jourConfig.fin_aprem
+            });
           }
         } else if (!config && horaireOld) {
           // Fallback sur l'ancien système
           if (!creneauMatin && horaireOld.debut_matin && horaireOld.fin_matin) {
-            try {
-              await axios.post(`${API}/planning`, {
-                employe_id: employe.id,
-                date: date,
-                creneau: 'MATIN',
-                horaire_debut: horaireOld.debut_matin,
-                horaire_fin: horaireOld.fin_matin
-              });
-              created++;
-            } catch (err) {
-              console.error('Erreur création matin:', err);
-            }
+            creneaux.push({
+              employe_id: employe.id,
+              date: date,
+              creneau: 'MATIN',
+              horaire_debut: horaireOld.debut_matin,
+              horaire_fin: horaireOld.fin_matin
+            });
           }
           if (!creneauAM && horaireOld.debut_aprem && horaireOld.fin_aprem) {
-            try {
-              await axios.post(`${API}/planning`, {
-                employe_id: employe.id,
-                date: date,
-                creneau: 'APRES_MIDI',
-                horaire_debut: horaireOld.debut_aprem,
-                horaire_fin: horaireOld.fin_aprem
-              });
-              created++;
-            } catch (err) {
-              console.error('Erreur création AM:', err);
-            }
+            creneaux.push({
+              employe_id: employe.id,
+              date: date,
+              creneau: 'APRES_MIDI',
+              horaire_debut: horaireOld.debut_aprem,
+              horaire_fin: horaireOld.fin_aprem
+            });
           }
         }
       } else {
@@ -5770,68 +5765,60 @@ const PlanningManager = () => {
         if (jourConfig) {
           // Créer le créneau MATIN si prévu et n'existe pas
           if (!creneauMatin && jourConfig.matin) {
-            try {
-              await axios.post(`${API}/planning`, {
-                employe_id: employe.id,
-                date: date,
-                creneau: 'MATIN',
-                notes: 'Présence'
-              });
-              created++;
-            } catch (err) {
-              console.error('Erreur création matin:', err);
-            }
+            creneaux.push({
+              employe_id: employe.id,
+              date: date,
+              creneau: 'MATIN',
+              notes: 'Présence'
+            });
           }
           
           // Créer le créneau APRES_MIDI si prévu et n'existe pas
           if (!creneauAM && jourConfig.apres_midi) {
-            try {
-              await axios.post(`${API}/planning`, {
-                employe_id: employe.id,
-                date: date,
-                creneau: 'APRES_MIDI',
-                notes: 'Présence'
-              });
-              created++;
-            } catch (err) {
-              console.error('Erreur création AM:', err);
-            }
+            creneaux.push({
+              employe_id: employe.id,
+              date: date,
+              creneau: 'APRES_MIDI',
+              notes: 'Présence'
+            });
           }
         } else if (!config) {
           // Pas de config, créer les deux demi-journées par défaut (sauf dimanche et samedi)
           if (jourSemaine >= 1 && jourSemaine <= 5) {
             if (!creneauMatin) {
-              try {
-                await axios.post(`${API}/planning`, {
-                  employe_id: employe.id,
-                  date: date,
-                  creneau: 'MATIN',
-                  notes: 'Présence'
-                });
-                created++;
-              } catch (err) {
-                console.error('Erreur création matin:', err);
-              }
+              creneaux.push({
+                employe_id: employe.id,
+                date: date,
+                creneau: 'MATIN',
+                notes: 'Présence'
+              });
             }
             if (!creneauAM) {
-              try {
-                await axios.post(`${API}/planning`, {
-                  employe_id: employe.id,
-                  date: date,
-                  creneau: 'APRES_MIDI',
-                  notes: 'Présence'
-                });
-                created++;
-              } catch (err) {
-                console.error('Erreur création AM:', err);
-              }
+              creneaux.push({
+                employe_id: employe.id,
+                date: date,
+                creneau: 'APRES_MIDI',
+                notes: 'Présence'
+              });
             }
           }
         }
       }
     }
     
-    return created;
+    if (creneaux.length === 0) return 0;
+    
+    // Un seul appel pour toute la semaine (conflits vérifiés côté serveur)
+    try {
+      const response = await axios.post(`${API}/planning/bulk`, creneaux);
+      response.data.results
+        .filter(r => r.status !== 'created')
+        .forEach(r => console.error('Erreur création créneau:', creneaux[r.index], r.detail));
+      return response.data.created;
+    } catch (err) {
+      console.error('Erreur création semaine:', err);
+      return 0;
+    }
   };
 
   // Appliquer la semaine A ou B à toute une section
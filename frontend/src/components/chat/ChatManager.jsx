@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { MessageSquare, Plus, Send } from 'lucide-react';
@@ -7,6 +7,7 @@ import { Input } from '../ui/input';
 import { Label } from '../ui/label';
 import { Textarea } from '../ui/textarea';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from '../ui/dialog';
+import { useLiveChannel } from '../../hooks/useLiveChannel';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || (
   window.location.hostname.includes('test') 
@@ -45,10 +46,19 @@ const ChatManager = ({ user }) => {
     fetchGroupes();
   }, []);
 
+  // Temps réel : recharger la conversation affichée quand un message la concerne
+  const fetchMessagesRef = useRef(() => {});
+  const { connected: liveConnected } = useLiveChannel((event) => {
+    if (event.type === 'resync' || event.type === 'message') {
+      fetchMessagesRef.current();
+    }
+  });
+
   useEffect(() => {
     fetchMessages();
     
-    // Polling intelligent pour les messages (10 secondes, pause si onglet caché)
+    // Polling de secours uniquement si le canal temps réel est indisponible
+    if (liveConnected) return undefined;
     const interval = setInterval(() => {
       if (document.visibilityState === 'visible') {
         fetchMessages();
@@ -56,7 +66,7 @@ const ChatManager = ({ user }) => {
     }, 10000);
     
     return () => clearInterval(interval);
-  }, [chatType, selectedGroupe, selectedUser]);
+  }, [chatType, selectedGroupe, selectedUser, liveConnected]);
 
   const fetchUsers = async () => {
     try {
@@ -97,13 +107,22 @@ const ChatManager = ({ user }) => {
       
       const response = await axios.get(url);
       setMessages(response.data.reverse());
+      
+      // Conversation ouverte : remettre son compteur de non lus à zéro
+      const conversationId = chatType === 'PRIVE'
+        ? `prive:${[user?.id, selectedUser.id].sort().join(':')}`
+        : chatType === 'GROUPE' ? `groupe:${selectedGroupe.id}` : null;
+      if (conversationId) {
+        axios.post(`${API}/conversations/${conversationId}/read`).catch(() => {});
+      }
     } catch (error) {
       console.error('Erreur lors du chargement des messages');
       setMessages([]);
     } finally {
       setLoading(false);
     }
-  }, [chatType, selectedUser, selectedGroupe]);
+  }, [chatType, selectedUser, selectedGroupe, user]);
+  fetchMessagesRef.current = fetchMessages;
 
   const sendMessage = async (e) => {
     e.preventDefault();
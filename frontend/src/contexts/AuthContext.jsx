@@ -147,6 +147,15 @@ export const AuthProvider = ({ children }) => {
   const switchCentre = async (centreId) => {
     try {
       const response = await axios.post(`${API}/centres/${centreId}/switch`);
+      
+      // Le nouveau token porte le centre actif (claim centre_actif_id) : le conserver avant le rechargement
+      const { access_token } = response.data;
+      if (access_token) {
+        setToken(access_token);
+        localStorage.setItem('token', access_token);
+        axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+      }
+      
       const newCentre = centres.find(c => c.id === centreId);
       setCentreActif(newCentre);
       
@@ -0,0 +1,105 @@
+// Canal temps réel (/api/live) : WebSocket, repli SSE, reprise par curseur
+
+import { useEffect, useRef, useState } from 'react';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || '';
+const RECONNECT_MAX_DELAY = 30000;
+
+const liveUrl = (path, params) => {
+  const base = BACKEND_URL || window.location.origin;
+  const url = new URL(`${base}/api${path}`);
+  Object.entries(params).forEach(([key, value]) => {
+    if (value) url.searchParams.set(key, value);
+  });
+  return url;
+};
+
+/**
+ * S'abonne aux événements temps réel (messages, planning, congés).
+ * onEvent(event) est appelé pour chaque événement ; un événement "resync"
+ * signifie que des événements ont été perdus : recharger les données.
+ * Retourne { connected } : tant que le canal est connecté, le polling peut être suspendu.
+ */
+export const useLiveChannel = (onEvent, { enabled = true, topics = null } = {}) => {
+  const [connected, setConnected] = useState(false);
+  const onEventRef = useRef(onEvent);
+  onEventRef.current = onEvent;
+
+  useEffect(() => {
+    const token = localStorage.getItem('token');
+    if (!enabled || !token) return undefined;
+
+    let cursor = null;
+    let socket = null;
+    let source = null;
+    let retryTimer = null;
+    let attempts = 0;
+    let stopped = false;
+    let useSse = typeof WebSocket === 'undefined';
+
+    const handle = (event) => {
+      if (event.type === 'hello') {
+        cursor = cursor || event.cursor;
+        attempts = 0;
+        setConnected(true);
+        return;
+      }
+      if (event.type === 'ping') return;
+      if (event.id) cursor = event.id;
+      onEventRef.current(event);
+    };
+
+    const scheduleReconnect = () => {
+      setConnected(false);
+      if (stopped) return;
+      const delay = Math.min(RECONNECT_MAX_DELAY, 1000 * 2 ** attempts);
+      attempts += 1;
+      retryTimer = setTimeout(connect, delay);
+    };
+
+    const connectSse = () => {
+      source = new EventSource(liveUrl('/live/sse', { token, cursor, topics }));
+      const listener = (e) => handle(JSON.parse(e.data));
+      ['hello', 'message', 'planning', 'conge', 'resync'].forEach((type) => source.addEventListener(type, listener));
+      source.onerror = () => {
+        source.close();
+        scheduleReconnect();
+      };
+    };
+
+    const connect = () => {
+      if (useSse) {
+        connectSse();
+        return;
+      }
+      const url = liveUrl('/live', { token, cursor, topics });
+      url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+      let opened = false;
+      socket = new WebSocket(url);
+      socket.onopen = () => { opened = true; };
+      socket.onmessage = (e) => handle(JSON.parse(e.data));
+      socket.onclose = (e) => {
+        if (e.code === 4401) {
+          stopped = true;
+          setConnected(false);
+          return;
+        }
+        // WebSocket bloqué (proxy) : repli SSE
+        if (!opened) useSse = true;
+        scheduleReconnect();
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (socket) socket.close();
+      if (source) source.close();
+    };
+  }, [enabled, topics]);
+
+  return { connected };
+};
+
+export default useLiveChannel;
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark des logs de GET /api/conges : print synchrones vs logging en file.
+
+Deux mesures :
+- --url : débit de GET /api/conges sur un serveur lancé (connexions concurrentes
+  pendant --seconds). Lancer une fois sur le commit précédent (print) et une
+  fois sur celui-ci, avec la même base, pour comparer les req/s.
+- --in-process (sans serveur) : coût, sur le thread appelant, des logs d'une
+  requête /api/conges. "print" reproduit les 2 print [DEBUG CONGES] d'avant sur
+  une sortie ligne par ligne (stdout d'un conteneur, PYTHONUNBUFFERED=1) ;
+  "logging" fait l'appel logger.debug actuel via structured_logging : en INFO
+  (défaut : événement écarté), en DEBUG (mise en file ; formatage JSON et
+  écriture dans le thread du listener) et en DEBUG échantillonné.
+
+Usage:
+    python scripts/bench_conges_logging.py --in-process --iterations 20000
+    python scripts/bench_conges_logging.py --url http://localhost:8001 \\
+        --email directeur@cabinet.fr --password admin123 --concurrency 20 --seconds 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+# ===== En processus =====
+
+class FakeUser:
+    id = "u-bench"
+    email = "directeur@cabinet.fr"
+    role = "Directeur"
+
+
+def logs_print(sortie, user, centre_actif, demandes):
+    """Les print de get_demandes_conges avant ce changement (cas directeur)"""
+    print(f"[DEBUG CONGES] User: {user.email}, Role: {user.role}, Centre actif: {centre_actif}", file=sortie)
+    print(f"[DEBUG CONGES] Directeur - Congés du centre: {len(demandes)}", file=sortie)
+
+
+def logs_logging(logger, user, centre_actif, demandes):
+    """L'appel actuel de get_demandes_conges"""
+    logger.debug("conges: %d demandes", len(demandes),
+                 extra={"user_id": user.id, "role": user.role, "centre_id": centre_actif})
+
+
+def mesurer(iterations, appel):
+    debut = time.perf_counter()
+    for _ in range(iterations):
+        appel()
+    return (time.perf_counter() - debut) / iterations * 1e6  # µs par requête
+
+
+def run_in_process(args):
+    from structured_logging import configure_logging, shutdown_logging
+
+    user, demandes = FakeUser(), [{}] * 42
+    resultats = {}
+    with tempfile.TemporaryDirectory() as dossier:
+        with open(os.path.join(dossier, "print.log"), "w", buffering=1) as sortie:
+            resultats["print (2 lignes, écriture synchrone)"] = mesurer(
+                args.iterations, lambda: logs_print(sortie, user, "c1", demandes)
+            )
+        logger = logging.getLogger("server")
+        for niveau, echantillon in (("INFO", 1), ("DEBUG", 1), ("DEBUG", 10)):
+            label = f"logging {niveau}" + (f" échantillon 1/{echantillon}" if echantillon > 1 else "")
+            with open(os.path.join(dossier, "logging.log"), "w", buffering=1) as sortie:
+                configure_logging(stream=sortie, log_format="json", level=niveau, levels="", debug_sample=echantillon)
+                resultats[label] = mesurer(args.iterations, lambda: logs_logging(logger, user, "c1", demandes))
+                shutdown_logging()  # vide la file avant de fermer le fichier
+
+    reference = resultats["print (2 lignes, écriture synchrone)"]
+    print(f"📊 Coût des logs par requête /api/conges ({args.iterations} itérations, thread appelant)")
+    for label, micro in resultats.items():
+        print(f"   {label:<40} {micro:8.2f} µs  (x{reference / micro:.1f} vs print)")
+
+
+# ===== Serveur lancé =====
+
+async def worker(client, headers, fin, latences, statuts):
+    while time.perf_counter() < fin:
+        debut = time.perf_counter()
+        response = await client.get("/api/conges", headers=headers)
+        latences.append((time.perf_counter() - debut) * 1000)
+        statuts[response.status_code] = statuts.get(response.status_code, 0) + 1
+
+
+async def run_http(args):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        login = await client.post("/api/auth/login", json={"email": args.email, "password": args.password})
+        login.raise_for_status()
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        await client.get("/api/conges", headers=headers)  # échauffement
+
+        latences, statuts = [], {}
+        debut = time.perf_counter()
+        fin = debut + args.seconds
+        await asyncio.gather(*[worker(client, headers, fin, latences, statuts) for _ in range(args.concurrency)])
+        duree = time.perf_counter() - debut
+
+    print(f"🚀 GET /api/conges : {len(latences) / duree:.1f} req/s sur {duree:.1f}s "
+          f"({args.concurrency} connexions, statuts {statuts})")
+    print(f"   p50={percentile(latences, 50):.1f}ms p99={percentile(latences, 99):.1f}ms "
+          f"moy={statistics.mean(latences) if latences else 0:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--in-process", action="store_true", help="Mesure sans serveur (coût des logs seuls)")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--url", default=os.environ.get("REACT_APP_BACKEND_URL", "http://localhost:8001"))
+    parser.add_argument("--email", default="directeur@cabinet.fr")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    if args.in_process:
+        run_in_process(args)
+    else:
+        asyncio.run(run_http(args))
+
+
+if __name__ == "__main__":
+    main()
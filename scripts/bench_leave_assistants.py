@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark de handle_assistant_slots_for_leave : congé d'un médecin sur 30 jours.
+
+Crée dans une base MongoDB de test un médecin, des assistants et leurs créneaux
+(MATIN + APRES_MIDI chaque jour) puis compare :
+- "avant" : l'ancienne boucle jour par jour (un find par date/créneau,
+  un update_one par créneau, une lecture de tokens par assistant)
+- "après" : server.handle_assistant_slots_for_leave (une requête sur la plage,
+  un bulk_write, un envoi groupé)
+
+Les envois push sont neutralisés : seuls les accès MongoDB sont mesurés.
+La base de test est supprimée à la fin.
+
+Usage:
+    python scripts/bench_leave_assistants.py --mongo-url mongodb://localhost:27017 \\
+        --days 30 --assistants 6
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Compte les commandes envoyées au serveur MongoDB"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in ("endSessions", "hello", "isMaster", "ping"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def seed(db, days, assistants, start):
+    medecin_id = str(uuid.uuid4())
+    autre_medecin_id = str(uuid.uuid4())
+    users = [{"id": medecin_id, "nom": "Bench", "prenom": "Medecin", "role": "Médecin", "actif": True}]
+    slots = []
+    for a in range(assistants):
+        assistant_id = str(uuid.uuid4())
+        users.append({"id": assistant_id, "nom": f"Assistant{a}", "prenom": "Bench", "role": "Assistant",
+                      "actif": True, "fcm_devices": [{"fcm_token": f"bench-token-{a}"}]})
+        for d in range(days):
+            date_str = (start + timedelta(days=d)).strftime('%Y-%m-%d')
+            for creneau in ("MATIN", "APRES_MIDI"):
+                # Un assistant sur deux travaille aussi avec un autre médecin
+                medecin_ids = [medecin_id, autre_medecin_id] if a % 2 else [medecin_id]
+                slots.append({"id": str(uuid.uuid4()), "date": date_str, "creneau": creneau,
+                              "employe_id": assistant_id, "employe_role": "Assistant", "centre_id": "bench",
+                              "medecin_attribue_id": medecin_id, "medecin_ids": medecin_ids, "notes": ""})
+    await db.users.delete_many({})
+    await db.planning.delete_many({})
+    await db.users.insert_many(users)
+    await db.planning.insert_many(slots)
+    await db.planning.create_index([("date", 1), ("creneau", 1)])
+    return medecin_id, len(slots)
+
+
+async def legacy_handle_assistant_slots_for_leave(db, user_id, date_debut, date_fin, creneau):
+    """Ancienne implémentation (boucle jour par jour), conservée pour comparaison"""
+    user = await db.users.find_one({"id": user_id})
+    medecin_name = f"Dr. {user['prenom']} {user['nom']}"
+    creneaux_a_traiter = ["MATIN", "APRES_MIDI"] if creneau == "JOURNEE_COMPLETE" else [creneau]
+    assistants_notifies = set()
+    current_date = datetime.strptime(date_debut, '%Y-%m-%d')
+    fin = datetime.strptime(date_fin, '%Y-%m-%d')
+    while current_date <= fin:
+        date_str = current_date.strftime('%Y-%m-%d')
+        for creneau_type in creneaux_a_traiter:
+            assistant_creneaux = await db.planning.find({
+                "date": date_str, "creneau": creneau_type, "employe_role": "Assistant",
+                "$or": [{"medecin_attribue_id": user_id}, {"medecin_ids": user_id}]
+            }).to_list(100)
+            for slot in assistant_creneaux:
+                autres = [m for m in slot.get("medecin_ids", []) if m != user_id]
+                if autres:
+                    await db.planning.update_one({"id": slot["id"]}, {
+                        "$pull": {"medecin_ids": user_id},
+                        "$set": {"medecin_attribue_id": autres[0], "notes": (slot.get("notes") or "") + "\n⚠️ réassigné"}
+                    })
+                else:
+                    await db.planning.update_one({"id": slot["id"]}, {"$set": {
+                        "medecin_attribue_id": None, "medecin_ids": [], "est_repos": True,
+                        "notes": (slot.get("notes") or "") + f"\n⚠️ {medecin_name} en congé - À RÉASSIGNER"
+                    }})
+                assistants_notifies.add(slot["employe_id"])
+        current_date += timedelta(days=1)
+    # Ancien envoi : une lecture des tokens par assistant
+    for assistant_id in assistants_notifies:
+        await db.users.find_one({"id": assistant_id}, {"fcm_token": 1, "fcm_devices": 1})
+
+
+async def run(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(args.mongo_url, event_listeners=[counter])
+    db = client[args.db_name]
+
+    os.environ.setdefault("MONGO_URL", args.mongo_url)
+    os.environ.setdefault("DB_NAME", args.db_name)
+    import push_notifications
+    import server
+
+    async def no_push(*_args, **_kwargs):
+        return 0
+
+    push_notifications.send_push_to_multiple = no_push
+    push_notifications.send_push_notification = no_push
+    server.db = db
+
+    start = datetime(2025, 3, 3)
+    date_debut = start.strftime('%Y-%m-%d')
+    date_fin = (start + timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+
+    try:
+        results = {}
+        for label in ("avant", "après"):
+            medecin_id, nb_slots = await seed(db, args.days, args.assistants, start)
+            counter.count = 0
+            t0 = time.perf_counter()
+            if label == "avant":
+                await legacy_handle_assistant_slots_for_leave(db, medecin_id, date_debut, date_fin, "JOURNEE_COMPLETE")
+            else:
+                await server.handle_assistant_slots_for_leave(medecin_id, date_debut, date_fin, "JOURNEE_COMPLETE", True)
+            results[label] = ((time.perf_counter() - t0) * 1000, counter.count)
+
+        print(f"\n📊 Congé de {args.days} jours, {args.assistants} assistants ({nb_slots} créneaux)")
+        for label, (duree, commandes) in results.items():
+            print(f"   {label:>5}: {duree:8.1f} ms  |  {commandes:4d} commandes MongoDB")
+    finally:
+        await client.drop_database(args.db_name)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="bench_leave_assistants")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--assistants", type=int, default=6)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
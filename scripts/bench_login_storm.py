@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark "tempête de connexions" : latence des endpoints non liés pendant
+un pic de logins (ex: début de service, tout le monde se connecte en même temps).
+
+Lance N logins concurrents (pbkdf2_sha256 côté serveur) et mesure pendant
+ce temps la latence de GET /api/ping (endpoint trivial). Si le hachage
+bloque la boucle d'événements, le p99 de /api/ping explose.
+
+Usage:
+    python scripts/bench_login_storm.py --url http://localhost:8001 \\
+        --email directeur@cabinet.fr --password admin123 --logins 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def probe_loop(client, stop_event, latencies):
+    """Appelle /api/ping en boucle et enregistre les latences (ms)"""
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        response = await client.get("/api/ping")
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        await asyncio.sleep(0.005)
+
+
+async def login(client, email, password, latencies):
+    start = time.perf_counter()
+    response = await client.post("/api/auth/login", json={"email": email, "password": password})
+    latencies.append((time.perf_counter() - start) * 1000)
+    return response.status_code
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.logins + args.probes + 5)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        # Ligne de base : latence de /api/ping sans charge
+        baseline = []
+        stop = asyncio.Event()
+        probes = [asyncio.create_task(probe_loop(client, stop, baseline)) for _ in range(args.probes)]
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        await asyncio.gather(*probes)
+
+        # Tempête de logins avec sondes en parallèle
+        under_load = []
+        login_latencies = []
+        stop = asyncio.Event()
+        probes = [asyncio.create_task(probe_loop(client, stop, under_load)) for _ in range(args.probes)]
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*[
+            login(client, args.email, args.password, login_latencies) for _ in range(args.logins)
+        ])
+        storm_duration = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*probes)
+
+    print(f"🔐 {args.logins} logins concurrents en {storm_duration:.2f}s "
+          f"(statuts: {sorted(set(statuses))})")
+    print(f"   login p50={percentile(login_latencies, 50):.0f}ms p99={percentile(login_latencies, 99):.0f}ms")
+    for label, values in (("Sans charge", baseline), ("Pendant la tempête", under_load)):
+        print(f"📊 {label:<20} /api/ping n={len(values):<5} "
+              f"p50={percentile(values, 50):.1f}ms p99={percentile(values, 99):.1f}ms "
+              f"max={max(values, default=0):.1f}ms moy={statistics.mean(values) if values else 0:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("REACT_APP_BACKEND_URL", "http://localhost:8001"))
+    parser.add_argument("--email", default="directeur@cabinet.fr")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--probes", type=int, default=2, help="Nombre de sondes /api/ping en parallèle")
+    parser.add_argument("--baseline-seconds", type=float, default=2.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark d'un message GENERAL envoyé à 500 utilisateurs actifs.
+
+Crée dans une base MongoDB de test les utilisateurs et leurs appareils (push_devices),
+puis compare :
+- "avant" : l'ancienne diffusion (users.find actifs, puis pour chaque destinataire
+  un find_one des tokens et un envoi push séquentiel)
+- "après" : message_fanout (un job outbox dans la requête, puis une agrégation
+  et des envois multicast par lots de 500 dans le worker)
+
+Les envois passent par FakePushTransport (latence simulée par appel, --latency-ms) :
+seuls les accès MongoDB et le nombre d'appels push sont réels.
+Pour "après", on mesure séparément le temps de réponse de l'endpoint (message + job
+enregistrés) et le temps de diffusion par le worker.
+La base de test est supprimée à la fin.
+
+Usage:
+    python scripts/bench_message_fanout.py --mongo-url mongodb://localhost:27017 \\
+        --users 500 --latency-ms 40
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Compte les commandes envoyées au serveur MongoDB"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in ("endSessions", "hello", "isMaster", "ping"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def seed(db, nb_users):
+    from push_devices import ensure_push_devices_indexes, token_hash
+
+    users, devices = [], []
+    for i in range(nb_users):
+        user_id = str(uuid.uuid4())
+        token = f"bench-token-{i}"
+        users.append({"id": user_id, "nom": f"User{i}", "prenom": "Bench", "role": "Assistant", "actif": True,
+                      "fcm_devices": [{"fcm_token": token}]})
+        devices.append({"user_id": user_id, "fcm_token": token, "token_hash": token_hash(token), "actif": True,
+                        "last_used": datetime.now(timezone.utc)})
+    for collection in ("users", "push_devices", "messages", "outbox"):
+        await db[collection].delete_many({})
+    await db.users.insert_many(users)
+    await db.push_devices.insert_many(devices)
+    await ensure_push_devices_indexes(db)
+    await db.users.create_index("actif")
+    return users[0]["id"]
+
+
+async def legacy_general_message(db, transport, sender_id, message):
+    """Ancienne implémentation : une tâche par destinataire, un find_one et un envoi chacun"""
+    from push_transport import build_push_message
+
+    await db.messages.insert_one(dict(message))
+    users = await db.users.find({"actif": True}).to_list(1000)
+    for user in users:
+        if user["id"] == sender_id:
+            continue
+        doc = await db.users.find_one({"id": user["id"]}, {"fcm_token": 1, "fcm_devices": 1})
+        for device in doc.get("fcm_devices", []):
+            await transport.send([device["fcm_token"]], build_push_message("📢 Message général", message["contenu"]))
+
+
+async def run(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    import message_fanout
+    import push_transport
+    from notification_outbox import OutboxWorker
+
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(args.mongo_url, event_listeners=[counter])
+    db = client[args.db_name]
+    message_fanout.register_fanout_handler(db)
+
+    try:
+        results = {}
+        for label in ("avant", "après"):
+            sender_id = await seed(db, args.users)
+            transport = push_transport.FakePushTransport(latency_ms=args.latency_ms)
+            push_transport.set_push_transport(transport)
+            message = {"id": str(uuid.uuid4()), "expediteur_id": sender_id, "contenu": "Réunion générale à 14h",
+                       "type_message": "GENERAL", "date_envoi": datetime.now(timezone.utc), "lu": False}
+            counter.count = 0
+            t0 = time.perf_counter()
+            if label == "avant":
+                await legacy_general_message(db, transport, sender_id, message)
+                reponse = diffusion = (time.perf_counter() - t0) * 1000
+            else:
+                await db.messages.insert_one(dict(message))
+                await message_fanout.enqueue_message_fanout(db, message, "Bench")
+                reponse = (time.perf_counter() - t0) * 1000
+                await OutboxWorker(db).run_once("bench")
+                diffusion = (time.perf_counter() - t0) * 1000
+            results[label] = (reponse, diffusion, counter.count, len(transport.sent), transport.appels)
+
+        print(f"\n📊 Message GENERAL à {args.users} utilisateurs actifs (latence push simulée {args.latency_ms} ms)")
+        for label, (reponse, diffusion, commandes, envois, appels) in results.items():
+            print(f"   {label:>5}: réponse {reponse:8.1f} ms | diffusion {diffusion:8.1f} ms | "
+                  f"{commandes:4d} commandes MongoDB | {envois} tokens en {appels} appels push")
+    finally:
+        await client.drop_database(args.db_name)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="bench_message_fanout")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
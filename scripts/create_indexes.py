@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Script pour créer les index MongoDB et améliorer les performances
-Optimise les requêtes fréquentes sur les champs actif, email, role, date, etc.
+Applique le registre backend/index_registry.py (également réconcilié au démarrage du serveur)
+et affiche les écarts entre la base et le registre.
 """
 import asyncio
 import sys
@@ -14,6 +15,9 @@ from dotenv import load_dotenv
 backend_path = Path(__file__).parent.parent / 'backend'
 env_path = backend_path / '.env'
 load_dotenv(env_path)
+sys.path.insert(0, str(backend_path))
+
+from index_registry import INDEXES, reconcile_indexes
 
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 DB_NAME = os.environ.get('DB_NAME', 'gestion_cabinet')
@@ -29,94 +33,29 @@ async def create_indexes():
     
     try:
         print("\n" + "="*60)
-        print("🚀 CRÉATION DES INDEX MONGODB")
+        print("🚀 CRÉATION DES INDEX MONGODB (registre backend/index_registry.py)")
         print("="*60)
         
-        # Index pour la collection users
-        print("\n📊 Collection: users")
-        await db.users.create_index("email", unique=True)
-        print("  ✅ Index créé: email (unique)")
-        
-        await db.users.create_index("actif")
-        print("  ✅ Index créé: actif")
-        
-        await db.users.create_index("role")
-        print("  ✅ Index créé: role")
-        
-        await db.users.create_index([("role", 1), ("actif", 1)])
-        print("  ✅ Index composé créé: role + actif")
-        
-        # Index pour la collection planning
-        print("\n📅 Collection: planning")
-        await db.planning.create_index("date")
-        print("  ✅ Index créé: date")
-        
-        await db.planning.create_index("employe_id")
-        print("  ✅ Index créé: employe_id")
-        
-        await db.planning.create_index([("date", 1), ("creneau", 1)])
-        print("  ✅ Index composé créé: date + creneau")
-        
-        await db.planning.create_index([("date", 1), ("creneau", 1), ("employe_id", 1)])
-        print("  ✅ Index composé créé: date + creneau + employe_id")
-        
-        # Index pour la collection demandes_conges
-        print("\n🏖️ Collection: demandes_conges")
-        await db.demandes_conges.create_index("utilisateur_id")
-        print("  ✅ Index créé: utilisateur_id")
-        
-        await db.demandes_conges.create_index("statut")
-        print("  ✅ Index créé: statut")
+        # Même réconciliation qu'au démarrage du serveur : création des index manquants
+        rapport = await reconcile_indexes(db)
         
-        await db.demandes_conges.create_index([("utilisateur_id", 1), ("statut", 1)])
-        print("  ✅ Index composé créé: utilisateur_id + statut")
-        
-        # Index pour la collection assignations
-        print("\n👥 Collection: assignations")
-        await db.assignations.create_index("actif")
-        print("  ✅ Index créé: actif")
-        
-        await db.assignations.create_index("medecin_id")
-        print("  ✅ Index créé: medecin_id")
-        
-        await db.assignations.create_index("assistant_id")
-        print("  ✅ Index créé: assistant_id")
-        
-        # Index pour la collection reservations_salles
-        print("\n🏥 Collection: reservations_salles")
-        await db.reservations_salles.create_index("date")
-        print("  ✅ Index créé: date")
-        
-        await db.reservations_salles.create_index("salle_id")
-        print("  ✅ Index créé: salle_id")
-        
-        await db.reservations_salles.create_index([("date", 1), ("creneau", 1), ("salle_id", 1)])
-        print("  ✅ Index composé créé: date + creneau + salle_id")
-        
-        # Index pour la collection notifications
-        print("\n🔔 Collection: notifications")
-        await db.notifications.create_index([("employe_id", 1), ("date", 1)])
-        print("  ✅ Index composé créé: employe_id + date")
-        
-        # Index pour la collection salles
-        print("\n🏢 Collection: salles")
-        await db.salles.create_index("actif")
-        print("  ✅ Index créé: actif")
-        
-        await db.salles.create_index("nom")
-        print("  ✅ Index créé: nom")
+        for entree in rapport["crees"]:
+            print(f"  ✅ {entree['collection']}: index créé {entree['name']}")
+        for entree in rapport["differents"]:
+            print(f"  ⚠️ {entree['collection']}: {entree['name']} diffère du registre ({', '.join(entree['differences'])})")
+        for entree in rapport["non_declares"]:
+            print(f"  ℹ️ {entree['collection']}: {entree['name']} absent du registre")
+        for entree in rapport["erreurs"]:
+            print(f"  ❌ {entree['collection']}: {entree['name']} - {entree['erreur']}")
         
         print("\n" + "="*60)
-        print("✅ TOUS LES INDEX ONT ÉTÉ CRÉÉS AVEC SUCCÈS !")
+        print("✅ INDEX DU REGISTRE APPLIQUÉS" if not rapport["erreurs"] else "⚠️ CERTAINS INDEX N'ONT PAS PU ÊTRE CRÉÉS")
         print("="*60)
         
         # Afficher les index créés
         print("\n📋 Récapitulatif des index par collection:")
         
-        collections = ['users', 'planning', 'demandes_conges', 'assignations', 
-                      'reservations_salles', 'notifications', 'salles']
-        
-        for collection_name in collections:
+        for collection_name in INDEXES:
             collection = db[collection_name]
             indexes = await collection.index_information()
             print(f"\n{collection_name}:")
@@ -140,7 +79,7 @@ async def create_indexes():
     finally:
         client.close()
     
-    return True
+    return not rapport["erreurs"]
 
 if __name__ == "__main__":
     print("╔" + "="*58 + "╗")
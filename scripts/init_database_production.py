@@ -17,6 +17,8 @@ from passlib.context import CryptContext
 import os
 from dotenv import load_dotenv
 
+from resource_versions import invalidate_all
+
 # Load environment variables
 env_path = backend_path / '.env'
 load_dotenv(env_path)
@@ -250,6 +252,10 @@ async def init_database():
         await db.configuration.insert_one(configuration)
         print("✅ Configuration créée")
         
+        # ETags émis avant l'init (RESOURCE_VERSION_STORE=mongo)
+        if await invalidate_all(db):
+            print("✅ ETags invalidés")
+        
         # Vérification finale
         print("\n" + "="*60)
         print("🎯 VÉRIFICATION FINALE")
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Migration des appareils push : users.fcm_devices / users.fcm_token -> collection push_devices
+Idempotente (upserts sur le hash du token). Usage: python scripts/migrate_push_devices.py [--force]
+"""
+import asyncio
+import sys
+from pathlib import Path
+from motor.motor_asyncio import AsyncIOMotorClient
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+backend_path = Path(__file__).parent.parent / 'backend'
+env_path = backend_path / '.env'
+load_dotenv(env_path)
+sys.path.insert(0, str(backend_path))
+
+from push_devices import ensure_push_devices_indexes, migrate_embedded_devices
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'gestion_cabinet')
+
+
+async def migrate(force: bool):
+    print(f"🔗 Connexion à MongoDB: {MONGO_URL}")
+    print(f"📦 Base de données: {DB_NAME}")
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+    try:
+        await ensure_push_devices_indexes(db)
+        repris = await migrate_embedded_devices(db, force=force)
+        total = await db.push_devices.count_documents({})
+        print(f"✅ {repris} appareil(s) repris, {total} appareil(s) dans push_devices")
+        return True
+    except Exception as e:
+        print(f"❌ Erreur lors de la migration: {e}")
+        return False
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    success = asyncio.run(migrate(force="--force" in sys.argv))
+    sys.exit(0 if success else 1)